@@ -0,0 +1,724 @@
+# Batch execution of many MPUs in lockstep
+#
+# Holds the registers of N machines as NumPy arrays, one element per
+# machine, and their memories as an N row array.  Each step fetches every
+# machine's opcode, groups the machines by opcode and executes each group
+# with array operations, so N machines running the same short code cost
+# little more than one.  Machines that diverge simply form more, smaller
+# groups.
+#
+# The opcodes the test vector and fuzzing workloads spend their time on are
+# vectorized: the eight accumulator instructions (ORA, AND, EOR, ADC, STA,
+# LDA, CMP, SBC) in all fifteen of their addressing modes, immediate LDX,
+# LDY, CPX and CPY, INX, INY, DEX, DEY, INC A and DEC A, the flag
+# instructions, NOP, the branches and JMP abs.  Everything else is run a
+# machine at a time by a real MPU on a view of that machine's row, so the
+# batch gives the same results as separate MPUs (in the default timing, not
+# the cycle accurate one).  An MPU subclass that overrides an instruction or
+# any of the MPU's helpers runs that instruction, or everything, through the
+# MPU as well.
+#
+# Each memory row is a direct mapped cache of size slots tagged with the
+# full address, an address that was never written reading as the default
+# (0 or a function of the row and address).  A machine that writes two
+# addresses sharing a slot is marked in conflict and its results can't be
+# trusted, the vector and fuzz runners below rerun such machines on a
+# scalar MPU.  A program that stays within size bytes never conflicts.
+#
+# From the py65 folder:
+#   python -m devices.vectors path/to/v1/*.json --batch 1000
+#   python -m devices.fuzz -n 1000000 --batch 1000
+#
+# NumPy is only needed by this module.
+
+from itertools import chain
+
+import numpy
+
+from devices.mpu65c816 import MPU
+from devices.fuzz import Fuzzer, RandomMemory
+from devices.vectors import Runner, REGISTERS
+
+CARRY = 0x01
+ZERO = 0x02
+DECIMAL = 0x08
+IRS = 0x10
+MS = 0x20
+OVERFLOW = 0x40
+NEGATIVE = 0x80
+
+ALU = ('ORA', 'AND', 'EOR', 'ADC', 'STA', 'LDA', 'CMP', 'SBC')
+
+MODES = ('imm', 'dpg', 'dpx', 'dix', 'dpi', 'dil', 'diy', 'dly', 'str',
+         'siy', 'abs', 'abx', 'aby', 'abl', 'alx')
+
+# operand bytes after the opcode, immediate depends on the register width
+LENGTHS = {'dpg': 1, 'dpx': 1, 'dix': 1, 'dpi': 1, 'dil': 1, 'diy': 1,
+           'dly': 1, 'str': 1, 'siy': 1, 'abs': 2, 'abx': 2, 'aby': 2,
+           'abl': 3, 'alx': 3}
+
+FLAGS = {'CLC': (CARRY, 0), 'SEC': (CARRY, CARRY), 'CLD': (DECIMAL, 0),
+         'SED': (DECIMAL, DECIMAL), 'CLV': (OVERFLOW, 0)}
+
+# branch: (flag, taken when set)
+BRANCHES = {'BPL': (NEGATIVE, False), 'BMI': (NEGATIVE, True),
+            'BVC': (OVERFLOW, False), 'BVS': (OVERFLOW, True),
+            'BCC': (CARRY, False), 'BCS': (CARRY, True),
+            'BNE': (ZERO, False), 'BEQ': (ZERO, True)}
+
+# the MPU attributes held per machine
+STATE = ('pc', 'pbr', 'dbr', 'dpr', 'a', 'b', 'x', 'y', 'p', 'sp', 'mode',
+         'waiting', 'stopped', 'processorCycles')
+
+
+class BatchMemory:
+    # the memories of count machines, size (a power of 2) tagged slots each
+    def __init__(self, count, size, default=None):
+        self.values = numpy.zeros((count, size), numpy.uint8)
+        self.tags = numpy.full((count, size), -1, numpy.int64)
+        self.conflict = numpy.zeros(count, bool)
+        self.mask = size - 1
+        self.default = default # (rows, addresses) -> values, None for 0
+        self.loaded = [] # [(rows, slots)] set up, cleared by clear()
+        self.writes = [] # [(rows, slots)] written by the steps
+
+    def clear(self):
+        # only the slots in use, the rows are too big to clear on every batch
+        for rows, index in self.loaded + self.writes:
+            self.tags[rows, index] = -1
+        self.loaded = []
+        self.writes = []
+        self.conflict.fill(False)
+
+    def missing(self, rows, addresses):
+        if self.default is None:
+            return numpy.zeros(len(rows), numpy.int64)
+        return self.default(rows, addresses)
+
+    def read(self, rows, addresses):
+        index = addresses & self.mask
+        values = self.values[rows, index].astype(numpy.int64)
+        hit = self.tags[rows, index] == addresses
+        if not hit.all():
+            miss = ~hit
+            values[miss] = self.missing(rows[miss], addresses[miss])
+        return values
+
+    def write(self, rows, addresses, values):
+        index = addresses & self.mask
+        tags = self.tags[rows, index]
+        self.conflict[rows[(tags != -1) & (tags != addresses)]] = True
+        self.tags[rows, index] = addresses
+        self.values[rows, index] = values
+        self.writes.append((rows, index))
+
+    def load(self, rows, addresses, values):
+        # initial contents, addresses sharing a slot are a conflict
+        index = addresses & self.mask
+        slots = rows * (self.mask + 1) + index
+        unique, counts = numpy.unique(slots, return_counts=True)
+        self.conflict[unique[counts > 1] // (self.mask + 1)] = True
+        self.tags[rows, index] = addresses
+        self.values[rows, index] = values
+        self.loaded.append((rows, index))
+
+    def written(self, count):
+        # [{address: value}] written to the first count rows by the steps
+        found = [{} for row in range(count)]
+        if self.writes:
+            rows = numpy.concatenate([rows for rows, index in self.writes])
+            index = numpy.concatenate([index for rows, index in self.writes])
+            for row, address, value in zip(rows.tolist(),
+                                           self.tags[rows, index].tolist(),
+                                           self.values[rows, index].tolist()):
+                if row < count:
+                    found[row][address] = value
+        return found
+
+
+class RowMemory:
+    # one machine's memory as the scalar MPU sees it
+    def __init__(self, memory, row):
+        self.memory = memory
+        self.row = row
+        self.rows = numpy.array([row])
+        self.values = memory.values[row]
+        self.tags = memory.tags[row]
+        self.mask = memory.mask
+
+    def __getitem__(self, address):
+        index = address & self.mask
+        if self.tags[index] == address:
+            return int(self.values[index])
+        return int(self.memory.missing(self.rows, numpy.array([address]))[0])
+
+    def __setitem__(self, address, value):
+        index = address & self.mask
+        if self.tags[index] != -1 and self.tags[index] != address:
+            self.memory.conflict[self.row] = True
+        self.tags[index] = address
+        self.values[index] = value
+        self.memory.writes.append((self.rows, numpy.array([index])))
+
+
+def _overridden(mpuClass):
+    # the names an MPU subclass redefines
+    names = set()
+    for cls in mpuClass.__mro__:
+        if cls is MPU:
+            break
+        names.update(name for name in cls.__dict__ if not name.startswith('__'))
+    return names
+
+
+def _flatten(rams):
+    # (rows, addresses, values) arrays from a list of [(address, value)]
+    counts = [len(ram) for ram in rams]
+    pairs = numpy.fromiter(chain.from_iterable(chain.from_iterable(rams)),
+                           numpy.int64, 2 * sum(counts))
+    return numpy.repeat(numpy.arange(len(rams)), counts), pairs[0::2], pairs[1::2]
+
+
+def _groups(keys):
+    # (key, selector) for each distinct key, a slice when there's only one
+    distinct = numpy.unique(keys)
+    if len(distinct) == 1:
+        yield int(distinct[0]), slice(None)
+        return
+    for key in distinct.tolist():
+        yield key, keys == key
+
+
+class Batch:
+    def __init__(self, count, size=0x10000, mpuClass=MPU, default=None):
+        self.count = count
+        self.memory = BatchMemory(count, size, default)
+        for name in STATE:
+            setattr(self, name, numpy.zeros(count, numpy.int64))
+        self.mpu = mpuClass() # runs the instructions that aren't vectorized
+        self.errors = {} # row: exception the MPU raised, the row stops
+        self.cycletime = numpy.array(self.mpu.cycletime, numpy.int64)
+        self.addcycles = numpy.array(self.mpu.extracycles, bool)
+        self.vectorize(mpuClass)
+
+    # setting up
+
+    def vectorize(self, mpuClass):
+        # sorts the opcodes into families run by one handler, family 0 is
+        # run by the MPU
+        self.handlers = [None]
+        self.families = numpy.zeros(256, numpy.int64)
+        # by opcode, for the families that need them
+        self.modes = numpy.zeros(256, numpy.int64) # index in MODES
+        self.operations = numpy.zeros(256, numpy.int64) # index in ALU
+        self.lengths = numpy.zeros(256, numpy.int64) # 0 for immediate
+        self.bits = numpy.zeros(256, numpy.int64) # flag and value for
+        self.values = numpy.zeros(256, numpy.int64) # flag and branch opcodes
+
+        overridden = _overridden(mpuClass)
+        if [name for name in overridden
+                if not name.startswith('inst_') and name != 'instruct']:
+            return
+        families = {}
+        for opcode in range(256):
+            if mpuClass.instruct[opcode] is not MPU.instruct[opcode]:
+                continue
+            name, mode = MPU.disassemble[opcode]
+            if name in ALU and mode in MODES:
+                family = self.accumulator
+                self.modes[opcode] = MODES.index(mode)
+                self.operations[opcode] = ALU.index(name)
+                self.lengths[opcode] = LENGTHS.get(mode, 0)
+            elif name in FLAGS:
+                family = self.flag
+                self.bits[opcode], self.values[opcode] = FLAGS[name]
+            elif name in BRANCHES:
+                family = self.branch
+                bit, taken = BRANCHES[name]
+                self.bits[opcode] = bit
+                self.values[opcode] = bit if taken else 0
+            elif name in ('LDX', 'LDY', 'CPX', 'CPY') and mode == 'imm':
+                family = self.index(name)
+            elif name in ('INX', 'INY', 'DEX', 'DEY'):
+                family = self.stepIndex(name)
+            elif name in ('INC', 'DEC') and mode == 'acc':
+                family = self.stepAccumulator(name)
+            elif name == 'BRA':
+                family = self.relative
+            elif name == 'NOP':
+                family = self.nop
+            elif name == 'JMP' and mode == 'abs':
+                family = self.jump
+            else:
+                continue
+            if family not in families:
+                families[family] = len(self.handlers)
+                self.handlers.append(family)
+            self.families[opcode] = families[family]
+
+    def vectorized(self, opcode):
+        return self.families[opcode] != 0
+
+    def setup(self, states):
+        # the first len(states) machines from vector format states (see
+        # vectors.py), "ram" included, the memories are cleared
+        self.memory.clear()
+        self.errors = {}
+        rows, addresses, values = _flatten([state['ram'] for state in states])
+        self.memory.load(rows, addresses, values)
+
+        n = len(states)
+
+        def field(name):
+            return numpy.array([state[name] for state in states], numpy.int64)
+
+        mode = field('e')
+        p = field('p')
+        a = field('a')
+        s = field('s')
+        narrow = (mode != 0) | (p & MS != 0)
+        self.mode[:n] = mode
+        self.p[:n] = p
+        self.a[:n] = numpy.where(narrow, a & 0xff, a)
+        self.b[:n] = numpy.where(narrow, a >> 8, 0)
+        self.sp[:n] = numpy.where(mode != 0, s & 0xff, s)
+        self.x[:n] = field('x')
+        self.y[:n] = field('y')
+        self.pc[:n] = field('pc')
+        self.pbr[:n] = field('pbr')
+        self.dbr[:n] = field('dbr')
+        self.dpr[:n] = field('d')
+        for name in ('waiting', 'stopped', 'processorCycles'):
+            getattr(self, name)[:n] = 0
+
+    def registers(self, count):
+        # {register: array} for the first count machines in the vector format
+        mode = self.mode[:count]
+        narrow = (mode != 0) | (self.p[:count] & MS != 0)
+        return {'pc': self.pc[:count], 'p': self.p[:count],
+                'a': numpy.where(narrow, (self.b[:count] << 8) + self.a[:count],
+                                 self.a[:count]),
+                's': numpy.where(mode != 0, self.sp[:count] + 0x100,
+                                 self.sp[:count]),
+                'x': self.x[:count], 'y': self.y[:count],
+                'dbr': self.dbr[:count], 'd': self.dpr[:count],
+                'pbr': self.pbr[:count], 'e': mode}
+
+    # running
+
+    def step(self, count=None):
+        # steps the first count machines (default all) once
+        rows = numpy.arange(self.count if count is None else count)
+        if self.errors:
+            rows = rows[~numpy.isin(rows, list(self.errors))]
+        waiting = self.waiting[rows] != 0
+        if waiting.any():
+            idle = rows[waiting]
+            self.processorCycles[idle[self.stopped[idle] == 0]] += 1
+            rows = rows[~waiting]
+        if not len(rows):
+            return self
+
+        # the same fetch as MPU.step()
+        opcodes = self.memory.read(rows, (self.pbr[rows] << 16) + self.pc[rows])
+        for family, selector in _groups(self.families[opcodes]):
+            group = rows[selector]
+            if not family:
+                self.fallback(group)
+                continue
+            codes = opcodes[selector]
+            self.pc[group] = (self.pc[group] + 1) & 0xffff
+            excycles = self.handlers[family](group, codes)
+            self.pc[group] &= 0xffff
+            self.processorCycles[group] += self.cycletime[codes] + excycles
+        return self
+
+    def fallback(self, rows):
+        # steps the machines one at a time with the MPU
+        mpu = self.mpu
+        for row in rows.tolist():
+            for name in STATE:
+                setattr(mpu, name, int(getattr(self, name)[row]))
+            mpu.memory = RowMemory(self.memory, row)
+            try:
+                mpu.step()
+            except Exception as e:
+                self.errors[row] = e
+                continue
+            for name in STATE:
+                getattr(self, name)[row] = int(getattr(mpu, name))
+
+    # memory
+
+    def byte(self, rows, addresses):
+        return self.memory.read(rows, addresses)
+
+    def word(self, rows, addresses):
+        return self.byte(rows, addresses) + (self.byte(rows, addresses + 1) << 8)
+
+    def directWord(self, rows, addresses, page):
+        # MPU.DirectPageWordAt(), the high byte wraps within the page where
+        # page is set and within bank 0 elsewhere
+        high = numpy.where(page, (addresses & 0xff00) + ((addresses + 1) & 0xff),
+                           (addresses + 1) & 0xffff)
+        return self.byte(rows, addresses) + (self.byte(rows, high) << 8)
+
+    def bankWord(self, rows, addresses):
+        # MPU.BankZeroWordAt()
+        return self.byte(rows, addresses) + (self.byte(rows, (addresses + 1) & 0xffff) << 8)
+
+    def operand(self, rows):
+        return (self.pbr[rows] << 16) + self.pc[rows]
+
+    def operandWord(self, rows, addresses):
+        # MPU.OperandWord(), the high byte wraps within the program bank
+        high = (addresses & 0xff0000) + ((addresses + 1) & 0xffff)
+        return self.byte(rows, addresses) + (self.byte(rows, high) << 8)
+
+    def flagsNZ(self, rows, values, wide):
+        # FlagsNZ() or FlagsNZWord() by row
+        sign = numpy.where(wide, values >> 8, values) & NEGATIVE
+        self.p[rows] = (self.p[rows] & ~(ZERO | NEGATIVE)) | \
+            numpy.where(values == 0, ZERO, sign)
+
+    # addressing modes, as in the MPU
+
+    def address(self, rows, mode, addcycles):
+        # (effective address, page crossing cycles)
+        epc = self.operand(rows)
+        if mode == 'imm':
+            return epc, 0
+        if mode in ('abl', 'alx'):
+            address = self.operandWord(rows, epc) + \
+                (self.byte(rows, (epc & 0xff0000) + ((epc + 2) & 0xffff)) << 16)
+            if mode == 'alx':
+                address = (address + self.x[rows]) & 0xffffff
+            return address, 0
+        if mode in ('abs', 'abx', 'aby'):
+            base = (self.dbr[rows] << 16) + self.operandWord(rows, epc)
+            if mode == 'abs':
+                return base, 0
+            address = base + (self.x[rows] if mode == 'abx' else self.y[rows])
+            return address & 0xffffff, self.crossed(base, address, addcycles)
+
+        offset = self.byte(rows, epc)
+        emulation = self.mode[rows] != 0
+        if mode in ('str', 'siy'):
+            stack = (self.sp[rows] + numpy.where(emulation, 0x100, 0) + offset) & 0xffff
+            if mode == 'str':
+                return stack, 0
+            return ((self.dbr[rows] << 16) + self.bankWord(rows, stack) + self.y[rows]) & 0xffffff, 0
+        dpr = self.dpr[rows]
+        # the emulation mode direct page wraps within the page when DL = 0
+        page = emulation & (dpr & 0xff == 0)
+        if mode in ('dpx', 'dix'):
+            index = self.x[rows]
+            direct = numpy.where(page, dpr + ((offset + index) & 0xff),
+                                 (dpr + offset + index) & 0xffff)
+        else:
+            direct = (dpr + offset) & 0xffff
+        if mode in ('dpg', 'dpx'):
+            return direct, 0
+        if mode in ('dix', 'dpi'):
+            return (self.dbr[rows] << 16) + self.directWord(rows, direct, page), 0
+        if mode == 'diy':
+            base = self.directWord(rows, direct, page)
+            address = (self.dbr[rows] << 16) + base + self.y[rows]
+        else:
+            base = (self.byte(rows, (direct + 2) & 0xffff) << 16) + self.bankWord(rows, direct)
+            if mode == 'dil':
+                return base, 0
+            address = base + self.y[rows]
+        return address & 0xffffff, self.crossed(base, address, addcycles)
+
+    def crossed(self, base, address, addcycles):
+        mask = self.mpu.crossMask
+        return addcycles & ((base & mask) != (address & mask))
+
+    # instruction families, each returns the extra cycles
+
+    def accumulator(self, rows, opcodes):
+        # ORA, AND, EOR, ADC, STA, LDA, CMP and SBC in any mode
+        p = self.p[rows]
+        wide = p & MS == 0
+        excycles = numpy.zeros(len(rows), numpy.int64)
+        address = numpy.zeros(len(rows), numpy.int64)
+        addcycles = self.addcycles[opcodes]
+        modes = self.modes[opcodes]
+        for mode, selector in _groups(modes):
+            address[selector], extra = self.address(rows[selector], MODES[mode],
+                                                    addcycles[selector])
+            excycles[selector] += extra
+        lengths = self.lengths[opcodes]
+        self.pc[rows] += numpy.where(lengths == 0, numpy.where(wide, 2, 1), lengths)
+        for operation, selector in _groups(self.operations[opcodes]):
+            self.operate(ALU[operation], rows[selector], address[selector],
+                         wide[selector], p[selector])
+        return excycles
+
+    def operate(self, name, rows, address, wide, p):
+        a = self.a[rows]
+        if name == 'STA':
+            self.memory.write(rows, address, a & 0xff)
+            if wide.any():
+                self.memory.write(rows[wide], address[wide] + 1,
+                                  (a[wide] >> 8) & 0xff)
+            return
+
+        data = self.byte(rows, address)
+        if wide.any():
+            data[wide] += self.byte(rows[wide], address[wide] + 1) << 8
+        mask = numpy.where(wide, 0xffff, 0xff)
+        sign = numpy.where(wide, 0x8000, 0x80)
+
+        if name == 'CMP':
+            difference = a - data
+            p &= ~(CARRY | ZERO | NEGATIVE)
+            p |= numpy.where(a == data, CARRY | ZERO,
+                             numpy.where(a > data, CARRY, 0))
+            p |= numpy.where(wide, difference >> 8, difference) & NEGATIVE
+            self.p[rows] = p
+            return
+        if name in ('ADC', 'SBC'):
+            decimal = p & DECIMAL != 0
+            if decimal.any():
+                self.decimal(name, rows[decimal], a[decimal], data[decimal],
+                             p[decimal])
+                if decimal.all():
+                    return
+                binary = ~decimal
+                rows = rows[binary]
+                p = p[binary]
+                a = a[binary]
+                data = data[binary]
+                mask = mask[binary]
+                sign = sign[binary]
+            carry = p & CARRY
+            if name == 'ADC':
+                result = data + a + carry
+                overflow = ~(a ^ data) & (a ^ result) & sign
+            else:
+                result = a + (~data & mask) + carry
+                overflow = (a ^ data) & (a ^ result) & sign
+            p &= ~(CARRY | ZERO | OVERFLOW | NEGATIVE)
+            p |= numpy.where(overflow != 0, OVERFLOW, 0)
+            p |= numpy.where(result > mask, CARRY, 0)
+            result &= mask
+            p |= numpy.where(result == 0, ZERO,
+                             numpy.where(result & sign != 0, NEGATIVE, 0))
+            self.p[rows] = p
+            self.a[rows] = result
+            return
+
+        if name == 'LDA':
+            a = data
+        elif name == 'ORA':
+            a = a | data
+        elif name == 'AND':
+            a = a & data
+        else:
+            a = a ^ data
+        self.a[rows] = a
+        self.flagsNZ(rows, a, wide)
+
+    def decimal(self, name, rows, a, data, p):
+        # the MPU's decimal mode ADC and SBC, 8 bits at either width
+        carry = p & CARRY
+        if name == 'ADC':
+            nibble0 = (data & 0xf) + (a & 0xf) + carry
+            half = nibble0 > 9
+            nibble1 = ((data >> 4) & 0xf) + ((a >> 4) & 0xf) + half
+            decimalCarry = nibble1 > 9
+            result = ((nibble1 & 0xf) << 4) + (nibble0 & 0xf)
+            nibble0 = (nibble0 + numpy.where(half, 6, 0)) & 0xf
+            nibble1 = (nibble1 + numpy.where(decimalCarry, 6, 0)) & 0xf
+            overflow = ~(a ^ data) & (a ^ result) & NEGATIVE
+        else:
+            nibble0 = (a & 0xf) + (~data & 0xf) + carry
+            half = nibble0 > 0xf
+            nibble1 = ((a >> 4) & 0xf) + ((~data >> 4) & 0xf) + half
+            result = a + (~data & 0xff) + carry
+            decimalCarry = result > 0xff
+            result &= 0xff
+            nibble0 = (result + numpy.where(half, 0, 10)) & 0xf
+            nibble1 = ((result + numpy.where(nibble1 <= 0xf, 10 << 4, 0)) >> 4) & 0xf
+            overflow = (a ^ data) & (a ^ result) & NEGATIVE
+        p &= ~(CARRY | ZERO | OVERFLOW | NEGATIVE)
+        p |= numpy.where(result == 0, ZERO, result & NEGATIVE)
+        p |= numpy.where(decimalCarry, CARRY, 0)
+        p |= numpy.where(overflow != 0, OVERFLOW, 0)
+        self.p[rows] = p
+        self.a[rows] = (nibble1 << 4) + nibble0
+
+    def index(self, name):
+        # LDX, LDY, CPX or CPY immediate
+        register = getattr(self, 'x' if name[-1] == 'X' else 'y')
+
+        def execute(rows, opcodes):
+            epc = self.operand(rows)
+            wide = self.p[rows] & IRS == 0
+            data = self.byte(rows, epc)
+            if wide.any():
+                data[wide] += self.byte(rows[wide], epc[wide] + 1) << 8
+            self.pc[rows] += numpy.where(wide, 2, 1)
+            if name[0] == 'L':
+                register[rows] = data
+                self.flagsNZ(rows, data, wide)
+                return 0
+            value = register[rows]
+            difference = value - data
+            p = self.p[rows] & ~(CARRY | ZERO | NEGATIVE)
+            p |= numpy.where(value == data, CARRY | ZERO,
+                             numpy.where(value > data, CARRY, 0))
+            p |= numpy.where(wide, difference >> 8, difference) & NEGATIVE
+            self.p[rows] = p
+            return 0
+        return execute
+
+    def stepIndex(self, name):
+        # INX, INY, DEX or DEY
+        register = getattr(self, name[-1].lower())
+        change = 1 if name[0] == 'I' else -1
+
+        def execute(rows, opcodes):
+            wide = self.p[rows] & IRS == 0
+            value = (register[rows] + change) & numpy.where(wide, 0xffff, 0xff)
+            register[rows] = value
+            self.flagsNZ(rows, value, wide)
+            return 0
+        return execute
+
+    def stepAccumulator(self, name):
+        # INC A or DEC A
+        change = 1 if name == 'INC' else -1
+
+        def execute(rows, opcodes):
+            wide = self.p[rows] & MS == 0
+            value = (self.a[rows] + change) & numpy.where(wide, 0xffff, 0xff)
+            self.a[rows] = value
+            self.flagsNZ(rows, value, wide)
+            return 0
+        return execute
+
+    def flag(self, rows, opcodes):
+        # CLC, SEC, CLD, SED and CLV
+        self.p[rows] = (self.p[rows] & ~self.bits[opcodes]) | self.values[opcodes]
+        return 0
+
+    def branch(self, rows, opcodes):
+        # the conditional branches
+        taken = self.p[rows] & self.bits[opcodes] == self.values[opcodes]
+        excycles = numpy.zeros(len(rows), numpy.int64)
+        if taken.any():
+            excycles[taken] = self.relative(rows[taken], opcodes[taken])
+        if not taken.all():
+            self.pc[rows[~taken]] += 1
+        return excycles
+
+    def relative(self, rows, opcodes):
+        # MPU.ProgramCounterRelAddr(), BRA and taken branches
+        offset = self.byte(rows, self.operand(rows))
+        pc = (self.pc[rows] + 1) & 0xffff
+        address = numpy.where(offset & NEGATIVE, pc - (offset ^ 0xff) - 1,
+                              pc + offset)
+        self.pc[rows] = address & 0xffff
+        return 1 + ((pc & 0xff00) != (address & 0xff00))
+
+    def nop(self, rows, opcodes):
+        return 0
+
+    def jump(self, rows, opcodes):
+        # JMP abs
+        self.pc[rows] = self.operandWord(rows, self.operand(rows))
+        return 0
+
+
+class BatchRunner(Runner):
+    # runs vector files count tests at a time, the tests the batch fails or
+    # can't vouch for are rerun by the scalar runner for their differences
+    def __init__(self, count=1000, size=0x1000, cycles=False):
+        Runner.__init__(self, cycles)
+        self.batch = Batch(count, size)
+
+    def runTests(self, tests):
+        if self.cycles:
+            # cycle accurate timing isn't vectorized
+            yield from Runner.runTests(self, tests)
+            return
+        count = self.batch.count
+        for start in range(0, len(tests), count):
+            chunk = tests[start:start + count]
+            for test, passed in zip(chunk, self.check(chunk)):
+                yield [] if passed else self.differences(test)
+
+    def check(self, tests):
+        # [passed] for the tests, run together
+        batch = self.batch
+        n = len(tests)
+        batch.setup([test['initial'] for test in tests])
+        batch.step(n)
+
+        passed = ~batch.memory.conflict[:n]
+        passed[list(batch.errors)] = False
+        for register, value in batch.registers(n).items():
+            passed &= value == [test['final'][register] for test in tests]
+
+        rows, addresses, expected = _flatten([test['final']['ram'] for test in tests])
+        values = batch.memory.read(rows, addresses)
+        passed[rows[values != expected]] = False
+        return passed.tolist()
+
+
+class BatchFuzzer(Fuzzer):
+    # a Fuzzer that runs the MPU side of count cases at a time, the oracle
+    # still runs case by case
+    def __init__(self, mpuClass=MPU, seed=0, programBank=None, count=1000,
+                 size=0x1000):
+        Fuzzer.__init__(self, mpuClass, seed, programBank)
+        self.seeds = numpy.zeros(count, numpy.int64)
+        self.batch = Batch(count, size, mpuClass, self.unwritten)
+
+    def unwritten(self, rows, addresses):
+        # RandomMemory by row
+        return (((addresses ^ self.seeds[rows]) * 0x9E3779B1) >> 13) & 0xff
+
+    def results(self, count):
+        # the same cases as Fuzzer.results(), generated a batch at a time
+        while count > 0:
+            cases = [self.generate() for i in range(min(count, self.batch.count))]
+            count -= len(cases)
+            for case, differences in zip(cases, self.checkAll(cases)):
+                yield case, differences
+
+    def checkAll(self, cases):
+        # [differences] as check() gives them
+        batch = self.batch
+        n = len(cases)
+        self.seeds[:n] = [case['seed'] for case in cases]
+        states = []
+        for case in cases:
+            state = dict(case['initial'])
+            state['ram'] = list(case['ram'].items())
+            states.append(state)
+        batch.setup(states)
+        batch.step(n)
+
+        registers = dict((register, value.tolist()) for register, value
+                         in batch.registers(n).items())
+        written = batch.memory.written(n)
+        results = []
+        for row, case in enumerate(cases):
+            if batch.memory.conflict[row] or row in batch.errors:
+                results.append(self.check(case))
+                continue
+            self.memory.clear()
+            self.memory.update(case['ram'])
+            self.memory.seed = case['seed']
+            expected, writes = self.oracle.execute(case['initial'])
+            memory = RandomMemory(case['ram'])
+            memory.seed = case['seed']
+            memory.update(written[row])
+            state = dict((register, registers[register][row])
+                         for register in REGISTERS)
+            results.append(self.compare(case, expected, writes, state, memory))
+        return results
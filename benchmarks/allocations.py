@@ -0,0 +1,143 @@
+# Memory allocated per instruction, measured with tracemalloc, by addressing
+# mode in emulation, native 8 bit and native 16 bit modes.
+#
+# Each opcode is set up as in opcodes.py and stepped with tracemalloc
+# tracing.  The temporary objects an instruction makes (ints, bound methods,
+# closures) are freed as soon as it's done with them, so the memory traced
+# after the step is no different from before it.  Instead a trace function
+# runs between each bytecode of the step and counts the bytecodes that
+# allocated, those during which the traced memory peaked above what it was
+# before them, and the bytes they allocated.  A bytecode that allocates
+# twice counts once, and the frame objects the tracing itself makes for
+# each call aren't counted.
+# --baseline loads another mpu65c816.py, e.g. an older version, and shows
+# it alongside.
+#
+# From the py65 folder (with devices/mpu65c816.py installed):
+#   python -m benchmarks.allocations
+#   git show HEAD~1:mpu65c816.py > /tmp/old.py
+#   python -m benchmarks.allocations --baseline /tmp/old.py --modes dix,dpi,diy
+
+import argparse
+import importlib.util
+import sys
+import tracemalloc
+from array import array
+
+import devices.mpu65c816
+from benchmarks import opcodes
+
+
+def load_mpu(path):
+    # the MPU class of another copy of mpu65c816.py
+    spec = importlib.util.spec_from_file_location('baseline_mpu65c816', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.MPU
+
+
+def make_mpu(mpuClass, opcode):
+    # opcodes.make_mpu() for any MPU class
+    template = opcodes.make_mpu(opcode)
+    return mpuClass(memory=template.memory)
+
+
+def counter():
+    # a trace function counting allocations and the array it counts them in:
+    # the memory traced after the last bytecode, allocations, bytes.  It
+    # allocates nothing that's still there when the next bytecode runs, and
+    # keeps its counts in the array since an int stored anywhere else would
+    # be an allocation.
+    get = tracemalloc.get_traced_memory
+    reset = tracemalloc.reset_peak
+    counts = array('q', [0, 0, 0])
+
+    def trace(frame, event, arg):
+        current, peak = get()
+        if event == 'call':
+            # the frame object was made for the tracing
+            frame.f_trace_opcodes = True
+        elif peak > counts[0]:
+            counts[1] += 1
+            counts[2] += peak - counts[0]
+        del current, peak
+        reset()
+        counts[0] = get()[0]
+        reset()
+        return trace
+
+    return counts, trace
+
+
+def measure(mpuClass, opcode, mode, number=5):
+    # the fewest allocations, and bytes, over number steps of the opcode
+    mpu = make_mpu(mpuClass, opcode)
+    restore = opcodes.make_restore(mpu, mode)
+    step = mpu.step
+    restore()
+    step()
+    counts, trace = counter()
+    least = None
+    tracemalloc.start()
+    try:
+        for i in range(number):
+            restore()
+            counts[1] = counts[2] = 0
+            tracemalloc.reset_peak()
+            counts[0] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            sys.settrace(trace)
+            step()
+            sys.settrace(None)
+            if least is None or counts[1] < least[0]:
+                least = (counts[1], counts[2])
+    finally:
+        sys.settrace(None)
+        tracemalloc.stop()
+    return least
+
+
+def measure_modes(mpuClass, modes=opcodes.MODES, addressing=None, number=5):
+    # {mode: {addressing mode: (mean allocations, mean bytes) over its opcodes}}
+    results = {}
+    for mode in modes:
+        groups = {}
+        for opcode in range(256):
+            name, group = devices.mpu65c816.MPU.disassemble[opcode]
+            if addressing is None or group in addressing:
+                groups.setdefault(group, []).append(measure(mpuClass, opcode, mode, number))
+        results[mode] = dict((group, (sum(c for c, b in counts) / len(counts),
+                                      sum(b for c, b in counts) / len(counts)))
+                             for group, counts in groups.items())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='allocations per instruction')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='another mpu65c816.py to compare with')
+    parser.add_argument('--modes', help='addressing modes to measure, e.g. dix,dpi,diy')
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help='steps of each opcode (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    addressing = args.modes.split(',') if args.modes else None
+    current = measure_modes(devices.mpu65c816.MPU, addressing=addressing,
+                            number=args.number)
+    baseline = None
+    if args.baseline:
+        baseline = measure_modes(load_mpu(args.baseline), addressing=addressing,
+                                 number=args.number)
+
+    for mode in opcodes.MODES:
+        print(mode)
+        for group in sorted(current[mode]):
+            line = '  %-4s %5.1f allocations %5.0f bytes' % ((group,) + current[mode][group])
+            if baseline is not None:
+                line += '  baseline %5.1f allocations %5.0f bytes' % baseline[mode][group]
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+# Compare benchmark results against a stored baseline and report significant
+# slowdowns per opcode group and per Forth workload.
+#
+# From the py65 folder:
+#   python -m benchmarks.compare baseline.json                 # run now, compare
+#   python -m benchmarks.compare baseline.json --current new.json
+#   python -m benchmarks.compare baseline.json --save new.json --threshold 3
+#
+# Opcodes are grouped by addressing mode (which exercises the addressing
+# mode helpers) and by mnemonic (which exercises the op* methods), within
+# each of emulation, native 8 bit and native 16 bit modes.  A group has
+# regressed when its geometric mean slowdown is above the threshold and a
+# one sided t-test on the per opcode log ratios (or on the samples when the
+# group is a single opcode) gives p below alpha.  Workloads are tested the
+# same way on their samples.  The exit status is 1 if anything regressed.
+
+import argparse
+import json
+import math
+import statistics
+import sys
+
+from benchmarks import run as runner
+
+GROUPINGS = ('mode', 'name')
+
+
+# Student's t distribution, enough of it for a one sided p value without
+# needing scipy
+
+def _betacf(a, b, x):
+    # continued fraction for the incomplete beta function (modified Lentz)
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+
+def betai(a, b, x):
+    # regularized incomplete beta function I_x(a, b)
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def t_cdf(t, df):
+    tail = 0.5 * betai(df / 2.0, 0.5, df / (df + t * t))
+    if t < 0:
+        return tail
+    return 1.0 - tail
+
+
+def p_slower_one_sample(diffs):
+    # p value for the mean of diffs (log current/baseline) being below zero,
+    # None when there are too few values to say
+    n = len(diffs)
+    if n < 2:
+        return None
+    mean = statistics.fmean(diffs)
+    sd = statistics.stdev(diffs)
+    if sd == 0.0:
+        return 0.0 if mean < 0 else 1.0
+    return t_cdf(mean / (sd / math.sqrt(n)), n - 1)
+
+
+def p_slower_welch(baseline, current):
+    # p value for current samples being below baseline samples (Welch)
+    n1 = len(baseline)
+    n2 = len(current)
+    if n1 < 2 or n2 < 2:
+        return None
+    v1 = statistics.variance(baseline) / n1
+    v2 = statistics.variance(current) / n2
+    diff = statistics.fmean(current) - statistics.fmean(baseline)
+    se = math.sqrt(v1 + v2)
+    if se == 0.0:
+        return 0.0 if diff < 0 else 1.0
+    df = (v1 + v2) ** 2 / (v1 * v1 / (n1 - 1) + v2 * v2 / (n2 - 1))
+    return t_cdf(diff / se, df)
+
+
+# comparisons
+
+class Finding:
+    def __init__(self, kind, key, slowdown, p, members):
+        self.kind = kind # e.g. "native16 mode" or "macro"
+        self.key = key # e.g. "diy", "LDA" or "liara_boot"
+        self.slowdown = slowdown # percent, negative is faster
+        self.p = p # None when there weren't enough samples
+        self.members = members
+
+    def regressed(self, threshold, alpha):
+        if self.slowdown <= threshold:
+            return False
+        return self.p is None or self.p < alpha
+
+    def __repr__(self):
+        if self.p is None:
+            p = '   -  '
+        else:
+            p = '%6.4f' % self.p
+        return '%-16s %-12s %+7.1f%%  p=%s  (%d)' % (self.kind, self.key,
+                                                   self.slowdown, p,
+                                                   self.members)
+
+
+def _logs(samples):
+    return [math.log(s) for s in samples if s > 0]
+
+
+def _slowdown(ratio):
+    # ratio is current/baseline throughput, slowdown in percent of time
+    return (1.0 / ratio - 1.0) * 100.0
+
+
+def compare_opcodes(baseline, current, grouping):
+    findings = []
+    for mode in sorted(set(baseline) & set(current)):
+        groups = {}
+        for code, base in baseline[mode].items():
+            if code not in current[mode]:
+                continue
+            groups.setdefault(base[grouping], []).append(
+                (_logs(base['ips']), _logs(current[mode][code]['ips'])))
+
+        for key in sorted(groups):
+            members = groups[key]
+            diffs = [statistics.fmean(c) - statistics.fmean(b)
+                     for b, c in members]
+            ratio = math.exp(statistics.fmean(diffs))
+            if len(members) == 1:
+                p = p_slower_welch(*members[0])
+            else:
+                p = p_slower_one_sample(diffs)
+            findings.append(Finding('%s %s' % (mode, grouping), key,
+                                    _slowdown(ratio), p, len(members)))
+    return findings
+
+
+def compare_macro(baseline, current):
+    findings = []
+    for name in sorted(set(baseline) & set(current)):
+        base = _logs(baseline[name]['ips'])
+        cur = _logs(current[name]['ips'])
+        ratio = math.exp(statistics.fmean(cur) - statistics.fmean(base))
+        findings.append(Finding('macro', name, _slowdown(ratio),
+                                p_slower_welch(base, cur), 1))
+    return findings
+
+
+def compare(baseline, current, groupings=GROUPINGS):
+    findings = []
+    if 'opcodes' in baseline and 'opcodes' in current:
+        for grouping in groupings:
+            findings += compare_opcodes(baseline['opcodes'],
+                                        current['opcodes'], grouping)
+    if 'macro' in baseline and 'macro' in current:
+        findings += compare_macro(baseline['macro'], current['macro'])
+    return findings
+
+
+def report(findings, threshold, macro_threshold, alpha, verbose=False,
+           out=None):
+    if out is None:
+        out = sys.stdout
+    regressions = []
+    for finding in findings:
+        if finding.kind == 'macro':
+            limit = macro_threshold
+        else:
+            limit = threshold
+        if finding.regressed(limit, alpha):
+            regressions.append(finding)
+        elif verbose:
+            out.write('  %r\n' % finding)
+
+    if regressions:
+        out.write('%d regression(s):\n' % len(regressions))
+        for finding in sorted(regressions, key=lambda f: -f.slowdown):
+            out.write('  %r\n' % finding)
+    else:
+        out.write('no regressions\n')
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('format') != runner.FORMAT:
+        raise ValueError('%s: unknown results format %r' %
+                         (path, results.get('format')))
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='65C816 benchmark regression gate')
+    parser.add_argument('baseline', help='JSON results to compare against')
+    parser.add_argument('--current', help='JSON results to check (default: run the benchmarks now)')
+    parser.add_argument('--save', help='save the results of this run as JSON')
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help='opcode group slowdown in percent (default %(default)s)')
+    parser.add_argument('--macro-threshold', type=float, default=5.0,
+                        help='workload slowdown in percent (default %(default)s)')
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help='significance level (default %(default)s)')
+    parser.add_argument('--group', choices=GROUPINGS, action='append',
+                        help='opcode grouping, may be repeated (default both)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='also list groups that did not regress')
+    # passed through to the benchmark run
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer and shorter samples, for a baseline without saved settings')
+    parser.add_argument('--bin-dir', default=runner.DEFAULT_BIN_DIR)
+    return parser.parse_args(argv)
+
+
+def bench_args(baseline, bin_dir, quick=False):
+    # benchmarks.run arguments measuring what the baseline measured, the
+    # same modes, opcodes and workloads, with the sample sizes it saved
+    # (older results didn't, quick picks the sizes for those)
+    argv = ['--label', 'current', '--bin-dir', bin_dir]
+    if 'opcodes' in baseline:
+        modes = baseline['opcodes']
+        argv += ['--modes', ','.join(modes)]
+        codes = sorted(set(code for results in modes.values() for code in results))
+        if len(codes) < 256:
+            argv += ['--opcodes', ','.join(codes)]
+    else:
+        argv.append('--no-micro')
+    if 'macro' not in baseline:
+        argv.append('--no-macro')
+    settings = baseline.get('settings')
+    if settings is not None:
+        argv += ['--number', str(settings['number']),
+                 '--repeat', str(settings['repeat']),
+                 '--macro-repeat', str(settings['macro_repeat'])]
+    elif quick:
+        argv.append('--quick')
+    return argv
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = load(args.baseline)
+
+    if args.current:
+        current = load(args.current)
+    else:
+        current = runner.run(runner.parse_args(bench_args(baseline, args.bin_dir,
+                                                          args.quick)))
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(current, f, indent=1, sort_keys=True)
+
+    regressions = report(compare(baseline, current, args.group or GROUPINGS),
+                         args.threshold, args.macro_threshold, args.alpha,
+                         args.verbose)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
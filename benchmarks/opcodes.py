@@ -0,0 +1,112 @@
+# Micro benchmarks: instructions per second for each of the 256 opcodes in
+# emulation, native 8 bit and native 16 bit modes.
+#
+# Each opcode is placed at CODE followed by operand bytes pointing into a
+# scratch data area.  The processor state is restored before every step so
+# each execution does the same work, whatever the opcode does to pc, the
+# stack or the mode (branches, jumps, BRK, XCE, MVN, etc.).  The time taken
+# to restore the state is measured on its own and subtracted.
+#
+# Timings on a busy or frequency scaling host can easily vary by tens of
+# percent between processes, so compare results taken on the same quiet
+# machine.
+
+import timeit
+
+from devices.mpu65c816 import MPU
+
+MODES = ('emulation', 'native8', 'native16')
+
+MEMORY_SIZE = 0x30000
+CODE = 0x1000
+
+# dp $10, abs $2010, long $01:2010, imm #$10 or #$2010, rel +$10
+OPERAND = (0x10, 0x20, 0x01)
+# MVN/MVP need banks inside the modeled memory
+BLOCK_OPERAND = (0x01, 0x00, 0x00)
+
+# a, b, x, y, p, sp, mode
+STATES = {
+    'emulation': (0x34, 0x12, 0x02, 0x02, MPU.BREAK | MPU.UNUSED, 0xf0, 1),
+    'native8': (0x34, 0x12, 0x02, 0x02, MPU.MS | MPU.IRS, 0x1f0, 0),
+    'native16': (0x1234, 0x00, 0x0002, 0x0002, 0x00, 0x1f0, 0),
+}
+
+
+def make_mpu(opcode):
+    memory = MEMORY_SIZE * [0x00]
+    mpu = MPU(memory=memory)
+    # direct page and stack hold pointers to $01:0101 so indirect modes stay
+    # inside the modeled memory
+    memory[0x0000:0x0200] = 0x200 * [0x01]
+    if opcode in (0x44, 0x54):
+        operand = BLOCK_OPERAND
+    else:
+        operand = OPERAND
+    memory[CODE:CODE + 4] = (opcode,) + operand
+    return mpu
+
+
+def make_restore(mpu, mode):
+    # returns a function putting back the registers the opcode changes,
+    # found by a trial step, so fast opcodes aren't swamped by the restore.
+    # The function is generated as plain attribute assignments, going
+    # through mpu.__dict__ would slow down every attribute access.
+    a, b, x, y, p, sp, emulation = STATES[mode]
+    state = (
+        ('pc', CODE), ('pbr', 0), ('dbr', 0), ('dpr', 0),
+        ('a', a), ('b', b), ('x', x), ('y', y), ('p', p), ('sp', sp),
+        ('mode', emulation), ('waiting', False), ('stopped', False),
+    )
+    for name, value in state:
+        setattr(mpu, name, value)
+    mpu.step()
+    changed = [(name, value) for name, value in state
+               if name == 'pc' or getattr(mpu, name) != value]
+    for name, value in state:
+        setattr(mpu, name, value)
+
+    source = 'def restore():\n'
+    for name, value in changed:
+        source += '    mpu.%s = %r\n' % (name, value)
+    namespace = {'mpu': mpu}
+    exec(source, namespace)
+    return namespace['restore']
+
+
+def bench_opcode(opcode, mode, number=2000, repeat=5):
+    # returns a list of instructions per second samples
+    mpu = make_mpu(opcode)
+    restore = make_restore(mpu, mode)
+    step = mpu.step
+
+    def execute():
+        restore()
+        step()
+
+    # warm up first, the first sample is otherwise consistently slow
+    timeit.timeit(execute, number=number)
+    overhead = min(timeit.repeat(restore, number=number, repeat=repeat))
+    samples = []
+    for seconds in timeit.repeat(execute, number=number, repeat=repeat):
+        seconds = max(seconds - overhead, 1e-9)
+        samples.append(number / seconds)
+    return samples
+
+
+def bench_opcodes(modes=MODES, opcodes=range(256), number=2000, repeat=5,
+                  progress=None):
+    # returns {mode: {"xx": {"name":, "mode":, "ips": [samples]}}}
+    results = {}
+    for mode in modes:
+        results[mode] = {}
+        for opcode in opcodes:
+            name, addressing = MPU.disassemble[opcode]
+            results[mode]['%02x' % opcode] = {
+                'name': name,
+                'mode': addressing,
+                'ips': bench_opcode(opcode, mode, number, repeat),
+            }
+            if progress is not None:
+                progress(mode, opcode)
+    return results
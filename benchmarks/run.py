@@ -0,0 +1,121 @@
+# Run the opcode and Forth benchmarks and save the results as JSON.
+#
+# From the py65 folder (with devices/mpu65c816.py installed):
+#   python -m benchmarks.run -o results.json
+#   python -m benchmarks.run --quick --label "before ROL fix" -o quick.json
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import sys
+
+import devices.mpu65c816
+from benchmarks import opcodes, workloads
+
+FORMAT = 1
+
+DEFAULT_BIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def source_hash(module):
+    with open(module.__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def metadata(label):
+    return {
+        'label': label,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'mpu_sha1': source_hash(devices.mpu65c816),
+    }
+
+
+def settings(args):
+    # what was measured and how, compare.py measures the same again
+    return {
+        'modes': args.modes,
+        'opcodes': args.opcodes,
+        'number': args.number,
+        'repeat': args.repeat,
+        'macro_repeat': args.macro_repeat,
+    }
+
+
+def run(args):
+    results = {'format': FORMAT, 'meta': metadata(args.label),
+               'settings': settings(args)}
+
+    if not args.no_micro:
+        if args.opcodes:
+            codes = [int(code, 16) for code in args.opcodes.split(',')]
+        else:
+            codes = range(256)
+
+        def progress(mode, opcode):
+            if args.verbose:
+                sys.stderr.write('%s %02x\n' % (mode, opcode))
+        results['opcodes'] = opcodes.bench_opcodes(args.modes, codes,
+                                                   args.number, args.repeat,
+                                                   progress)
+
+    if not args.no_macro:
+        def progress(name, result):
+            if args.verbose:
+                sys.stderr.write('%s %d instructions %.0f ips\n' %
+                                 (name, result['instructions'],
+                                  max(result['ips'])))
+        results['macro'] = workloads.bench_workloads(args.bin_dir, None,
+                                                     args.macro_repeat,
+                                                     progress)
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='65C816 simulator benchmarks')
+    parser.add_argument('-o', '--output', help='JSON results file (default stdout)')
+    parser.add_argument('--label', default='', help='free text saved with the results')
+    parser.add_argument('--modes', default=','.join(opcodes.MODES),
+                        help='comma separated modes (default %(default)s)')
+    parser.add_argument('--opcodes', default='',
+                        help='comma separated hex opcodes (default all)')
+    parser.add_argument('--number', type=int, default=2000,
+                        help='steps per opcode sample (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='samples per opcode (default %(default)s)')
+    parser.add_argument('--macro-repeat', type=int, default=3,
+                        help='samples per Forth workload (default %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer and shorter samples')
+    parser.add_argument('--no-micro', action='store_true', help='skip the opcode benchmarks')
+    parser.add_argument('--no-macro', action='store_true', help='skip the Forth benchmarks')
+    parser.add_argument('--bin-dir', default=DEFAULT_BIN_DIR,
+                        help='folder with liara.bin and of816_forth.bin')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    args.modes = args.modes.split(',')
+    if args.quick:
+        args.number = 500
+        args.repeat = 3
+        args.macro_repeat = 1
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# A/B benchmark of MPU against SlottedMPU, GeneratedMPU and LazyFlagsMPU on
+# the Forth workloads.
+#
+# Each repeat runs every workload once with each class, reversing the order
+# every other time, so they all see the same machine load.  The best and
+# median instructions per second of each are shown with the speed up of its
+# best over MPU's, and each is checked to have run the same number of
+# instructions and cycles as MPU and printed the same output.
+#
+# From the py65 folder (with devices/mpu65c816.py, devices/slotted.py,
+# devices/codegen.py and devices/lazyflags.py installed):
+#   python -m benchmarks.slots
+#   python -m benchmarks.slots --workloads liara_fib,of816_boot -r 5
+
+import argparse
+import statistics
+import sys
+
+from devices.mpu65c816 import MPU
+from devices.slotted import SlottedMPU
+from devices.codegen import GeneratedMPU
+from devices.lazyflags import LazyFlagsMPU
+from benchmarks import workloads
+from benchmarks.run import DEFAULT_BIN_DIR
+
+CLASSES = (MPU, SlottedMPU, GeneratedMPU, LazyFlagsMPU)
+
+
+def compare(bin_dir, names=None, repeat=3, progress=None):
+    # {name: {class name: {"ips": [samples], "instructions":, "cycles":,
+    #                      "output":, "correct":}}}
+    if names is None:
+        names = sorted(workloads.WORKLOADS)
+    results = {}
+    for name in names:
+        result = dict((cls.__name__, {'ips': []}) for cls in CLASSES)
+        for i in range(repeat):
+            order = CLASSES if i % 2 == 0 else CLASSES[::-1]
+            for cls in order:
+                run = workloads.run_workload(name, bin_dir, mpuClass=cls)
+                samples = result[cls.__name__]
+                samples['ips'].append(run['instructions'] / run['seconds'])
+                for key in ('instructions', 'cycles', 'output', 'correct'):
+                    samples[key] = run[key]
+        results[name] = result
+        if progress is not None:
+            progress(name, result)
+    return results
+
+
+def mismatches(result):
+    # the keys on which a class's runs of a workload differ from MPU's
+    base = result[CLASSES[0].__name__]
+    return sorted(set(key for cls in CLASSES[1:] for key in ('instructions', 'cycles', 'output')
+                      if result[cls.__name__][key] != base[key]))
+
+
+def report(name, result):
+    best = max(result[CLASSES[0].__name__]['ips'])
+    line = name
+    for cls in CLASSES:
+        ips = result[cls.__name__]['ips']
+        line += '\n  %-12s %8.0f ips (median %8.0f)' % (cls.__name__, max(ips),
+                                                       statistics.median(ips))
+        if cls is not CLASSES[0]:
+            line += '  %+6.1f%%' % (100.0 * (max(ips) / best - 1))
+    different = mismatches(result)
+    if different:
+        line += '\n  DIFFERENT ' + ','.join(different)
+    wrong = [cls.__name__ for cls in CLASSES if not result[cls.__name__]['correct']]
+    if wrong:
+        line += '\n  WRONG OUTPUT ' + ','.join(wrong)
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MPU against SlottedMPU, GeneratedMPU and LazyFlagsMPU')
+    parser.add_argument('--bin-dir', default=DEFAULT_BIN_DIR,
+                        help='folder with liara.bin and of816_forth.bin')
+    parser.add_argument('--workloads', help='workloads to run, e.g. liara_fib,of816_boot')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each workload with each class (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    names = args.workloads.split(',') if args.workloads else None
+    results = compare(args.bin_dir, names, args.repeat, report)
+    return 1 if any(mismatches(result) for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
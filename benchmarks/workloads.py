@@ -0,0 +1,131 @@
+# Macro benchmarks: boot Liara Forth and OF816 and run a few canned Forth
+# programs fed through the console.
+#
+# The console is wired up the same way the py65 monitor does it, with
+# ObservableMemory subscribers on the getc/putc addresses.  A workload ends
+# the first time the firmware polls for a key once all of its input has been
+# read, i.e. when it is back at the prompt.  Its output has to end the way
+# it does on a working simulation too, otherwise the run is wrong and the
+# timing meaningless.
+
+import os
+import time
+
+from devices.mpu65c816 import MPU
+from memory import ObservableMemory
+
+MEMORY_SIZE = 0x30000
+
+# image, load address, start pc (None to reset into it), getc, putc
+LIARA = ('liara.bin', 0x0000, 0x5000, 0xfff0, 0xfff1)
+OF816 = ('of816_forth.bin', 0x8000, None, 0x7fc0, 0x7fe0)
+
+FIB = b': fib dup 2 < if exit then dup 1- recurse swap 2 - recurse + ;\r' \
+      b'18 fib .\r'
+
+# the primes from 3 to 2001, 302 of them.  Liara's words made by CONSTANT
+# and CREATE don't work in colon definitions, so the size is a literal and
+# the flags are past HERE
+SIEVE = b': flags here 16 + ;\r' \
+        b': init 1000 0 do 1 flags i + c! loop ;\r' \
+        b': sieve init 0 1000 0 do flags i + c@ if i dup + 3 + dup i +\r' \
+        b'begin dup 1000 < while 0 over flags + c! over + repeat\r' \
+        b'drop drop 1+ then loop ;\r' \
+        b'sieve .\r'
+
+COUNT = b': count 0 10000 0 do i + loop ; count .\r'
+
+# image, input, how the output ends
+WORKLOADS = {
+    'liara_boot': (LIARA, b'', "Type 'bye' to exit\n"),
+    'of816_boot': (OF816, b'', 'OF816 by M.G.\r\n\r\n'),
+    'liara_fib': (LIARA, FIB, '18 fib . 2584  ok\n'),
+    'liara_sieve': (LIARA, SIEVE, 'sieve . 302  ok\n'),
+    'liara_count': (LIARA, COUNT, 'count . -8968  ok\n'),
+}
+
+# no workload gets near this, it only guards against a broken simulation
+LIMIT = 50000000
+
+
+class Console:
+    def __init__(self, text):
+        self.input = list(text)
+        self.output = []
+        self.idle = False
+
+    def getc(self, address):
+        if self.input:
+            return self.input.pop(0)
+        self.idle = True
+        return 0
+
+    def putc(self, address, value):
+        self.output.append(value)
+
+
+def make_board(image, bin_dir, text, mpuClass=MPU):
+    filename, load, pc, getc, putc = image
+    with open(os.path.join(bin_dir, filename), 'rb') as f:
+        data = f.read()
+    memory = MEMORY_SIZE * [0x00]
+    memory[load:load + len(data)] = list(data)
+
+    console = Console(text)
+    observable = ObservableMemory(subject=memory, addrWidth=MPU.ADDRL_WIDTH)
+    observable.subscribe_to_read([getc], console.getc)
+    observable.subscribe_to_write([putc], console.putc)
+
+    mpu = mpuClass(memory=observable)
+    if pc is not None:
+        mpu.pc = pc
+    return mpu, console
+
+
+def run_workload(name, bin_dir, limit=LIMIT, mpuClass=MPU):
+    image, text, expected = WORKLOADS[name]
+    mpu, console = make_board(image, bin_dir, text, mpuClass)
+    step = mpu.step
+    count = 0
+    start = time.perf_counter()
+    while not console.idle and count < limit:
+        step()
+        count += 1
+    seconds = time.perf_counter() - start
+    output = bytes(console.output).decode('latin-1')
+    return {
+        'instructions': count,
+        'cycles': mpu.processorCycles,
+        'seconds': seconds,
+        'completed': console.idle,
+        'correct': console.idle and output.endswith(expected),
+        'output': output,
+    }
+
+
+def bench_workloads(bin_dir, names=None, repeat=3, progress=None):
+    # returns {name: {"instructions":, "cycles":, "completed":,
+    #                 "seconds": [samples], "ips": [samples]}}, raises
+    # RuntimeError if a workload's output is wrong
+    if names is None:
+        names = sorted(WORKLOADS)
+    results = {}
+    for name in names:
+        seconds = []
+        for i in range(repeat):
+            result = run_workload(name, bin_dir)
+            if not result['correct']:
+                raise RuntimeError('%s: wrong output after %d instructions: %r'
+                                   % (name, result['instructions'],
+                                      result['output'][-80:]))
+            seconds.append(result['seconds'])
+        results[name] = {
+            'instructions': result['instructions'],
+            'cycles': result['cycles'],
+            'completed': result['completed'],
+            'seconds': seconds,
+            'ips': [result['instructions'] / s for s in seconds],
+        }
+        if progress is not None:
+            progress(name, results[name])
+    return results
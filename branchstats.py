@@ -0,0 +1,203 @@
+# Branch statistics and hot loops
+#
+# BranchStats counts, for each branch in the program, how often it was
+# taken and not taken, and treats each taken branch backwards (to the same
+# address or lower) as the back edge of a loop from its target (the head)
+# to the branch (the tail).  The helpers the branch instructions go through
+# (bCLR, bSET, ProgramCounterRelAddr and ProgramCounterRelLongAddr) are
+# replaced on the instance while counting, nothing changes otherwise:
+#
+#   stats = BranchStats(mpu)
+#   stats.start()
+#   mpu.run(count=1000000)
+#   stats.stop()
+#   stats.report(sys.stdout, 10)    # the 10 hottest loops and branches
+#
+# A loop's run starts when its back edge is first taken and ends when the
+# branch falls through or a taken branch goes outside the head to tail
+# range, its iterations are the times the back edge was taken and its
+# cycles the processorCycles between the first take and the end of the run.
+#
+# * The iteration before the first take isn't counted, the loop isn't seen
+#   until it branches back.
+# * A loop left by a jump or return (rather than a branch) ends its run at
+#   the next taken branch outside it, a little late.
+# * GeneratedMPU and LazyFlagsMPU inline their branches, count with MPU or
+#   SlottedMPU.
+# * The passes of an idle loop (addSpinLoop()) that run() skips over aren't
+#   stepped and so aren't counted.
+#
+# From the py65 folder:
+#   python -m devices.branchstats of816_forth.bin --load 0x8000 --count 1000000
+
+import argparse
+import sys
+
+from devices.mpu65c816 import MPU
+
+HELPERS = ('bCLR', 'bSET', 'ProgramCounterRelAddr', 'ProgramCounterRelLongAddr')
+
+# the index of each count in a branches entry
+TAKEN = 0
+NOT_TAKEN = 1
+
+# the index of each field in a loops entry
+HEAD = 0
+ITERATIONS = 1
+RUNS = 2
+CYCLES = 3
+STARTED = 4 # processorCycles when the current iteration started, or None
+TAIL = 5
+
+
+class BranchStats:
+    def __init__(self, mpu):
+        self.mpu = mpu
+        self.branches = {} # site: [taken, not taken]
+        self.loops = {} # tail: [head, iterations, runs, cycles, started, tail]
+        self.active = [] # the loops entries in a run
+        self.helpers = None # the mpu's own helpers while counting
+
+    def start(self):
+        mpu = self.mpu
+        self.helpers = dict((name, getattr(mpu, name)) for name in HELPERS)
+        for name in HELPERS:
+            setattr(mpu, name, getattr(self, name))
+
+    def stop(self):
+        if self.helpers is None:
+            return
+        mpu = self.mpu
+        for name in HELPERS:
+            delattr(mpu, name)
+        self.helpers = None
+        now = mpu.processorCycles
+        for loop in self.active:
+            loop[CYCLES] += now - loop[STARTED]
+            loop[STARTED] = None
+        self.active = []
+
+    def clear(self):
+        self.branches = {}
+        self.loops = {}
+        self.active = []
+
+    # the replaced helpers
+
+    def bCLR(self, x):
+        self.conditional(self.helpers['bCLR'], x)
+
+    def bSET(self, x):
+        self.conditional(self.helpers['bSET'], x)
+
+    def ProgramCounterRelAddr(self):
+        self.taken(self.helpers['ProgramCounterRelAddr'])
+
+    def ProgramCounterRelLongAddr(self):
+        self.taken(self.helpers['ProgramCounterRelLongAddr'])
+
+    def conditional(self, helper, x):
+        # the branch, counted as not taken if it didn't go through
+        # ProgramCounterRelAddr()
+        mpu = self.mpu
+        site = (mpu.pbr << 16) + ((mpu.pc - 1) & 0xffff)
+        counts = self.branches.get(site)
+        taken = counts[TAKEN] if counts is not None else 0
+        helper(x)
+        counts = self.branches.get(site)
+        if counts is None:
+            self.branches[site] = counts = [0, 0]
+        if counts[TAKEN] == taken:
+            counts[NOT_TAKEN] += 1
+            loop = self.loops.get(site)
+            if loop is not None and loop[STARTED] is not None:
+                self.end(loop)
+
+    def taken(self, helper):
+        mpu = self.mpu
+        bank = mpu.pbr << 16
+        site = bank + ((mpu.pc - 1) & 0xffff)
+        helper()
+        target = bank + mpu.pc
+        counts = self.branches.get(site)
+        if counts is None:
+            self.branches[site] = counts = [0, 0]
+        counts[TAKEN] += 1
+
+        for loop in self.active[:]:
+            if not loop[HEAD] <= target <= loop[TAIL]:
+                self.end(loop)
+        if target > site:
+            return
+        now = mpu.processorCycles
+        loop = self.loops.get(site)
+        if loop is None:
+            self.loops[site] = loop = [target, 0, 0, 0, None, site]
+        loop[ITERATIONS] += 1
+        if loop[STARTED] is None:
+            loop[RUNS] += 1
+            self.active.append(loop)
+        else:
+            loop[CYCLES] += now - loop[STARTED]
+        loop[STARTED] = now
+
+    def end(self, loop):
+        loop[CYCLES] += self.mpu.processorCycles - loop[STARTED]
+        loop[STARTED] = None
+        self.active.remove(loop)
+
+    # results
+
+    def hottest(self, limit=None):
+        # [(head, tail, iterations, runs, cycles)], the most cycles first
+        loops = sorted(((loop[HEAD], tail, loop[ITERATIONS], loop[RUNS], loop[CYCLES])
+                        for tail, loop in self.loops.items()),
+                       key=lambda loop: (-loop[4], -loop[2], loop[0]))
+        return loops[:limit]
+
+    def busiest(self, limit=None):
+        # [(site, taken, not taken)], the most executed first
+        branches = sorted(((site, counts[TAKEN], counts[NOT_TAKEN])
+                           for site, counts in self.branches.items()),
+                          key=lambda branch: (-(branch[1] + branch[2]), branch[0]))
+        return branches[:limit]
+
+    def report(self, f, limit=10):
+        mpu = self.mpu
+        f.write('loop                iterations      runs      cycles  cycles/iteration\n')
+        for head, tail, iterations, runs, cycles in self.hottest(limit):
+            f.write('%06x-%06x   %12d %9d %11d  %16.1f\n'
+                    % (head, tail, iterations, runs, cycles, cycles / float(iterations)))
+        f.write('\nbranch               taken  not taken  taken%\n')
+        for site, taken, notTaken in self.busiest(limit):
+            f.write('%06x %-4s %11d %10d  %6.1f\n'
+                    % (site, mpu.disassemble[mpu.memory[site]][0], taken, notTaken,
+                       100.0 * taken / (taken + notTaken)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 branch statistics and hot loops')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0,
+                        help='load address (default %(default)s)')
+    parser.add_argument('--count', type=int, default=1000000,
+                        help='instructions to run from reset (default %(default)s)')
+    parser.add_argument('-n', '--limit', type=int, default=10,
+                        help='loops and branches to show (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    mpu = MPU(memory=[0] * 0x1000000)
+    mpu.memory[args.load:args.load + len(image)] = image
+    mpu.reset()
+    stats = BranchStats(mpu)
+    stats.start()
+    mpu.run(count=args.count)
+    stats.stop()
+    stats.report(sys.stdout, args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
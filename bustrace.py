@@ -0,0 +1,310 @@
+# Bus cycle trace for hardware co-simulation
+#
+# BusTrace records the bus cycles of each instruction rather than only the
+# final state: address, data, read/write and the VDA/VPA/VPB/MLB signals of
+# the W65C816S.  It is a separate step path, the normal step() is untouched
+# until a trace is started:
+#
+#   trace = BusTrace(mpu)
+#   trace.start()
+#   mpu.run(count=100)
+#   trace.stop()
+#   for address, data, signals in trace.cycles():
+#       ...
+#
+# The memory accesses come from the simulation itself, the memory is wrapped
+# while tracing so every read and write is recorded.  They are then laid out
+# in cycles by a script for the instruction, taken from the addressing mode
+# tables in the W65C816S datasheet (table 5-7).  Script tokens:
+#
+#   O  opcode fetch (VDA and VPA)
+#   P  one operand byte (VPA)
+#   Q  the rest of the operand bytes, 1 or 2 for immediate data
+#   I  internal operation
+#   D  internal operation when the low byte of D isn't zero
+#   X  internal operation when indexing crossed a page or X is 16 bit
+#   B  internal operations for a taken branch (and page crossing)
+#   r  next data read, w next data write
+#   R  remaining data reads, W remaining data writes
+#   A  remaining data accesses in the order they happened
+#   V  remaining data reads as vector pulls (VPB)
+#   L  the following cycles are locked (MLB, read-modify-write)
+#
+# The cycle counts are the 65816 ones, starting a trace turns on the cycle
+# accurate mode (see MPU.setCycleAccurate) and a trace has as many cycles as
+# processorCycles advances.  16 bit read-modify-write results are written
+# in the order the simulation writes them, low byte first, where the
+# hardware writes the high byte first.
+#
+# Each cycle is stored in an array of 64 bit integers as
+#   address << 16 | data << 8 | signals
+
+from array import array
+
+# signals
+BUS_VPA = 1 # valid program address
+BUS_VDA = 2 # valid data address
+BUS_VPB = 4 # vector pull
+BUS_MLB = 8 # memory lock
+BUS_WRITE = 16 # R/W low
+
+BUS_INTERNAL = 0
+BUS_OPCODE = BUS_VDA | BUS_VPA
+BUS_PROGRAM = BUS_VPA
+BUS_DATA = BUS_VDA
+
+# scripts by addressing mode, then overrides by mnemonic and addressing mode
+SCRIPTS = {
+    'abs': 'OPPA',
+    'abx': 'OPPXA',
+    'aby': 'OPPXA',
+    'abl': 'OPPPA',
+    'alx': 'OPPPA',
+    'abi': 'OPPA',
+    'ail': 'OPPA',
+    'aix': 'OPPIA',
+    'acc': 'OI',
+    'blk': 'OPPAII',
+    'dpg': 'OPDA',
+    'dpx': 'OPDIA',
+    'dpy': 'OPDIA',
+    'dix': 'OPDIrrA',
+    'dpi': 'OPDrrA',
+    'dil': 'OPDrrrA',
+    'diy': 'OPDrrXA',
+    'dly': 'OPDrrrA',
+    'imm': 'OQ',
+    'imp': 'OI',
+    'pcr': 'OPB',
+    'prl': 'OPPI',
+    'str': 'OPIA',
+    'siy': 'OPIrrIA',
+    'ska': 'OPPA',
+    'ski': 'OPDA',
+    'spc': 'OPPIA',
+    'stk': 'OIA', # pushes
+}
+
+RMW = ('ASL', 'LSR', 'ROL', 'ROR', 'INC', 'DEC', 'TSB', 'TRB')
+RMW_SCRIPTS = {
+    'abs': 'OPPLRIW',
+    'abx': 'OPPILRIW',
+    'dpg': 'OPDLRIW',
+    'dpx': 'OPDILRIW',
+}
+
+WRITES = ('STA', 'STX', 'STY', 'STZ')
+WRITE_SCRIPTS = {
+    'abx': 'OPPIA',
+    'aby': 'OPPIA',
+    'diy': 'OPDrrIA',
+}
+
+NAME_SCRIPTS = {
+    ('BRK', 'stk'): 'OPWV',
+    ('COP', 'stk'): 'OPWV',
+    ('RTI', 'stk'): 'OIIA',
+    ('RTS', 'stk'): 'OIIAI',
+    ('RTL', 'stk'): 'OIIA',
+    ('PLA', 'stk'): 'OIIA',
+    ('PLB', 'stk'): 'OIIA',
+    ('PLD', 'stk'): 'OIIA',
+    ('PLP', 'stk'): 'OIIA',
+    ('PLX', 'stk'): 'OIIA',
+    ('PLY', 'stk'): 'OIIA',
+    ('JMP', 'abs'): 'OPP',
+    ('JML', 'abl'): 'OPPP',
+    ('JSR', 'abs'): 'OPPIA',
+    ('JSL', 'abl'): 'OPPwIPA',
+    ('JSR', 'aix'): 'OPwwPIrr',
+    ('REP', 'imm'): 'OPI',
+    ('SEP', 'imm'): 'OPI',
+    ('WAI', 'imp'): 'OII',
+    ('STP', 'imp'): 'OII',
+    ('XBA', 'imp'): 'OII',
+}
+
+
+def script(name, mode):
+    if (name, mode) in NAME_SCRIPTS:
+        return NAME_SCRIPTS[(name, mode)]
+    if name in RMW and mode in RMW_SCRIPTS:
+        return RMW_SCRIPTS[mode]
+    if name in WRITES and mode in WRITE_SCRIPTS:
+        return WRITE_SCRIPTS[mode]
+    return SCRIPTS[mode]
+
+
+class RecordingMemory:
+    # wraps the mpu's memory while tracing, every access is appended to
+    # accesses as (address, value, write)
+    def __init__(self, subject):
+        self.subject = subject
+        self.accesses = []
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        value = self.subject[address]
+        if not isinstance(address, slice):
+            self.accesses.append((address, value, False))
+        return value
+
+    def __setitem__(self, address, value):
+        self.subject[address] = value
+        if not isinstance(address, slice):
+            self.accesses.append((address, value, True))
+
+
+class BusTrace:
+    def __init__(self, mpu):
+        self.mpu = mpu
+        self.buffer = array('Q')
+        self.scripts = [script(*mpu.disassemble[op]) for op in range(256)]
+        self.memory = None
+        self.wasAccurate = False
+
+    def start(self):
+        mpu = self.mpu
+        self.memory = RecordingMemory(mpu.memory)
+        mpu.memory = self.memory
+        self.wasAccurate = mpu.cycleAccurate
+        mpu.setCycleAccurate(True)
+        mpu.step = self.step
+
+    def stop(self):
+        mpu = self.mpu
+        mpu.memory = self.memory.subject
+        self.memory = None
+        mpu.step = mpu.stepAccurate
+        mpu.setCycleAccurate(self.wasAccurate)
+
+    def clear(self):
+        del self.buffer[:]
+
+    def cycles(self):
+        # yields (address, data, signals) for each cycle
+        for entry in self.buffer:
+            yield entry >> 16, (entry >> 8) & 0xff, entry & 0xff
+
+    def step(self):
+        mpu = self.mpu
+        accesses = self.memory.accesses
+        del accesses[:]
+        if mpu.waiting:
+            if not mpu.stopped:
+                # WAI, the processor idles a cycle at a time
+                address = (mpu.pbr << mpu.ADDR_WIDTH) + mpu.pc
+                self.buffer.append(address << 16 | BUS_INTERNAL)
+            return mpu.stepAccurate()
+
+        p = mpu.p
+        mode = mpu.mode
+        dpr = mpu.dpr
+        pc = mpu.pc
+        pbr = mpu.pbr
+        cycles = mpu.processorCycles
+        mpu.stepAccurate()
+        cycles = mpu.processorCycles - cycles
+        if not cycles:
+            # the end of a block move, nothing happens on the bus
+            return mpu
+
+        opcode = accesses[0]
+        self.emit(self.scripts[opcode[1]], opcode, accesses[1:], pbr, pc,
+                  mpu.pc, p, mode, dpr, cycles)
+        return mpu
+
+    def emit(self, script, opcode, accesses, pbr, pc, nextpc, p, mode, dpr,
+             cycles):
+        mpu = self.mpu
+        append = self.buffer.append
+        bank = pbr << mpu.ADDR_WIDTH
+
+        # reads repeated by the simulation only happen once on the bus
+        reads = []
+        writes = []
+        data = []
+        seen = set()
+        for access in accesses:
+            address, value, write = access
+            if write:
+                seen.discard(address)
+                writes.append(access)
+                data.append(access)
+            elif address in seen:
+                continue
+            else:
+                seen.add(address)
+                reads.append(access)
+                data.append(access)
+
+        # operand bytes, the simulation reads them at pbr:pc
+        length = (nextpc - pc - 1) & mpu.addrMask
+        fetched = 1
+        address = opcode[0]
+        lock = 0
+        for token in script:
+            if token == 'O':
+                append(opcode[0] << 16 | opcode[1] << 8 | BUS_OPCODE)
+            elif token == 'P' or token == 'Q':
+                count = 1 if token == 'P' else length - fetched + 1
+                for i in range(count):
+                    address = bank + ((pc + fetched) & mpu.addrMask)
+                    value = self.operandByte(address, reads, data)
+                    append(address << 16 | value << 8 | BUS_PROGRAM)
+                    fetched += 1
+            elif token == 'I':
+                append(address << 16 | BUS_INTERNAL | lock)
+            elif token == 'D':
+                if dpr & mpu.byteMask:
+                    append(address << 16 | BUS_INTERNAL)
+            elif token == 'X':
+                if (not mode and not p & mpu.IRS) or mpu.excycles:
+                    append(address << 16 | BUS_INTERNAL)
+            elif token == 'B':
+                for i in range(cycles - 2):
+                    append(address << 16 | BUS_INTERNAL)
+            elif token == 'L':
+                lock = BUS_MLB
+            else:
+                if token == 'r' or token == 'R' or token == 'V':
+                    queue = reads
+                elif token == 'w' or token == 'W':
+                    queue = writes
+                else:
+                    queue = data
+                count = 1 if token == 'r' or token == 'w' else len(queue)
+                signals = BUS_DATA | lock
+                if token == 'V':
+                    signals |= BUS_VPB
+                for access in queue[:count]:
+                    address, value, write = access
+                    flags = signals | BUS_WRITE if write else signals
+                    append(address << 16 | value << 8 | flags)
+                    data.remove(access)
+                    if write:
+                        writes.remove(access)
+                    else:
+                        reads.remove(access)
+
+    def operandByte(self, address, reads, data):
+        # the operand byte as the simulation read it, if it did
+        for access in reads:
+            if access[0] == address:
+                reads.remove(access)
+                data.remove(access)
+                return access[1]
+        return self.memory.subject[address]
+
+    @staticmethod
+    def format(address, data, signals):
+        # one cycle as text, e.g. "01:2345 a9 R VDA VPA"
+        text = '%02x:%04x %02x %s' % (address >> 16, address & 0xffff, data,
+                                      'W' if signals & BUS_WRITE else 'R')
+        for flag, name in ((BUS_VDA, 'VDA'), (BUS_VPA, 'VPA'),
+                           (BUS_VPB, 'VPB'), (BUS_MLB, 'MLB')):
+            if signals & flag:
+                text += ' ' + name
+        return text
@@ -0,0 +1,299 @@
+# Static control flow graph of a ROM image
+#
+# Walks the code from the interrupt vectors (and any other entry points)
+# instruction by instruction, following branches, jumps and calls, and
+# splits it into basic blocks.  A block is keyed by its first address and
+# the M, X and E flags it's entered with, the widths are followed through
+# the block with disasm.follow(), so the same bytes reached in 8 and 16 bit
+# modes are two blocks.  The instructions are decoded by a disasm
+# Disassembler, whose cache is then warm for listings and traces of the same
+# code.
+#
+#   analyser = Analyser(memory, start=0x8000, end=0x10000)
+#   analyser.analyse(analyser.vectors())
+#   analyser.addresses()            # the set of instruction addresses
+#   analyser.prewarm(disassembler)  # decodes them into another disassembler
+#
+# * A call is assumed to return, with the widths it was made with, to the
+#   instruction after it (after the signature byte for COP).
+# * JMP (a) and JML [a] through a pointer inside the analysed range are
+#   followed, other indirect jumps and calls (JMP (a,X), JSR (a,X)) only
+#   mark the block as indirect.
+# * BRK, STP and the returns end a block without a successor, and targets
+#   outside the range are collected in outside rather than followed.
+# * Native mode interrupt handlers are entered with M and X as the
+#   interrupted code had them, taken as 8 bit (set native to change that).
+#
+# From the py65 folder:
+#   python -m devices.cfg of816_forth.bin --load 0x8000
+#   python -m devices.cfg liara.bin --load 0 --entry 0x5000 -o liara.lst
+
+import argparse
+import sys
+
+from devices.mpu65c816 import MPU
+from devices.disasm import Disassembler, follow, format_line
+
+# opcodes that change the flow, by what they do
+BRANCHES = (0x10, 0x30, 0x50, 0x70, 0x90, 0xb0, 0xd0, 0xf0)
+ALWAYS = (0x80, 0x82) # BRA, BRL
+JUMPS = (0x4c, 0x5c) # JMP a, JML al
+POINTER_JUMPS = (0x6c, 0xdc) # JMP (a), JML [a]
+INDIRECT = (0x7c,) # JMP (a,X)
+CALLS = (0x20, 0x22) # JSR a, JSL al
+INDIRECT_CALLS = (0xfc,) # JSR (a,X)
+ENDS = (0x00, 0x40, 0x60, 0x6b, 0xdb) # BRK, RTI, RTS, RTL, STP
+
+
+def vectors(mpuClass=MPU):
+    # [(name, vector address, e)] of the MPU's vectors, native ones first
+    found = []
+    for name in ('RESET', 'NMI', 'IRQ', 'COP', 'BRK', 'ABORT'):
+        value = getattr(mpuClass, name)
+        if isinstance(value, list):
+            found.append((name, value[0], 0))
+            found.append((name, value[1], 1))
+        else:
+            found.append((name, value, 1 if name == 'RESET' else 0))
+    return sorted(found, key=lambda entry: entry[2])
+
+
+class Block:
+    def __init__(self, start, m, x, e):
+        self.start = start # 24 bit address
+        self.m = m
+        self.x = x
+        self.e = e # None if not known
+        self.instructions = [] # [(address, m, x, e)]
+        self.end = start # the address after the last instruction
+        self.successors = [] # keys of the blocks control can go to next
+        self.calls = [] # keys of the subroutines called
+        self.indirect = False # leaves through an address that isn't known
+
+    def key(self):
+        return (self.start, self.m, self.x, self.e)
+
+
+class Analyser:
+    def __init__(self, memory, disassembler=None, start=0, end=0x1000000):
+        self.memory = memory
+        if disassembler is None:
+            disassembler = Disassembler(memory)
+        self.disassembler = disassembler
+        self.start = start # the code analysed is from start up to end
+        self.end = end
+        self.blocks = {} # key: Block
+        self.owner = {} # (address, m, x, e) of an instruction: its Block
+        self.entries = {} # name: key
+        self.outside = set() # keys of targets outside the range
+
+    def vectors(self, native=(1, 1), mpuClass=MPU):
+        # [(name, address, m, x, e)] of the vectors set in memory, those
+        # of the native mode handlers with native's (m, x)
+        entries = []
+        for name, vector, e in vectors(mpuClass):
+            address = self.memory[vector] | (self.memory[vector + 1] << 8)
+            if address in (0x0000, 0xffff):
+                continue # not set
+            if e:
+                entries.append((name, address, 1, 1, 1))
+            else:
+                entries.append((name + ' (native)', address) + tuple(native) + (0,))
+        return entries
+
+    def analyse(self, entries):
+        # adds the code reached from each (name, address, m, x, e) entry,
+        # returns the blocks
+        work = []
+        for name, address, m, x, e in entries:
+            key = (address, m, x, e)
+            self.entries[name] = key
+            work.append((key, None))
+        while work:
+            key, c = work.pop()
+            if key in self.blocks:
+                continue
+            if key in self.owner:
+                self._split(key)
+            elif self.start <= key[0] < self.end:
+                work.extend(self._walk(key, c))
+            else:
+                self.outside.add(key)
+        return self.blocks
+
+    def addresses(self):
+        # the set of the addresses of the instructions found
+        return set([state[0] for state in self.owner])
+
+    def prewarm(self, disassembler):
+        # decodes the instructions found, with their widths, into another
+        # disassembler's cache
+        for address, m, x, e in self.owner:
+            disassembler.decode(address, m, x)
+
+    def listing(self):
+        # [(block, [(address, code, text, (m, x))])] in address order
+        decode = self.disassembler.decode
+        result = []
+        for key in sorted(self.blocks, key=_order):
+            block = self.blocks[key]
+            lines = []
+            for address, m, x, e in block.instructions:
+                code, length, text = decode(address, m, x)
+                lines.append((address, code, text, (m, x)))
+            result.append((block, lines))
+        return result
+
+    def write(self, f):
+        # writes the blocks, each with a header of its widths and successors
+        # (* a call, ? an indirect exit), to the open file f
+        for block, lines in self.listing():
+            targets = ['%02x:%04x' % (key[0] >> 16, key[0] & 0xffff)
+                       for key in block.successors]
+            targets += ['*%02x:%04x' % (key[0] >> 16, key[0] & 0xffff)
+                        for key in block.calls]
+            if block.indirect:
+                targets.append('?')
+            f.write('; m=%s x=%s e=%s -> %s\n' % (block.m, block.x, block.e,
+                                                   ' '.join(targets)))
+            for line in lines:
+                f.write(format_line(line) + '\n')
+            f.write('\n')
+
+    def _walk(self, key, c):
+        # decodes a new block from key, returns [(key, carry)] to go on to
+        address, m, x, e = key
+        block = Block(address, m, x, e)
+        self.blocks[key] = block
+        decode = self.disassembler.decode
+        memory = self.memory
+        bank = address & 0xff0000
+        while True:
+            state = (address, m, x, e)
+            if address != block.start and state in self.owner:
+                # ran into code already found
+                self._split(state)
+                block.successors.append(state)
+                break
+            if not self.start <= address < self.end:
+                self.outside.add(state)
+                break
+            code, length, text = decode(address, m, x)
+            block.instructions.append(state)
+            self.owner[state] = block
+            m, x, e, c = follow(code, m, x, e, c)
+            address = bank | ((address + length) & 0xffff)
+            block.end = address
+            opcode = code[0]
+            if opcode in ENDS:
+                break
+            elif opcode in BRANCHES:
+                block.successors += [(_target(state[0], code), m, x, e),
+                                     (address, m, x, e)]
+                break
+            elif opcode in ALWAYS:
+                block.successors.append((_target(state[0], code), m, x, e))
+                break
+            elif opcode in JUMPS:
+                block.successors.append((_operand(bank, code), m, x, e))
+                break
+            elif opcode in POINTER_JUMPS:
+                pointer = code[1] | (code[2] << 8)
+                if self.start <= pointer and pointer + 2 < self.end:
+                    target = memory[pointer] | (memory[pointer + 1] << 8)
+                    target |= memory[pointer + 2] << 16 if opcode == 0xdc else bank
+                    block.successors.append((target, m, x, e))
+                else:
+                    block.indirect = True
+                break
+            elif opcode in INDIRECT:
+                block.indirect = True
+                break
+            elif opcode in CALLS:
+                block.calls.append((_operand(bank, code), m, x, e))
+                block.successors.append((address, m, x, e))
+                break
+            elif opcode in INDIRECT_CALLS:
+                block.indirect = True
+                block.successors.append((address, m, x, e))
+                break
+        return [(target, c) for target in block.successors + block.calls]
+
+    def _split(self, state):
+        # makes the instruction at state the start of a block
+        block = self.owner[state]
+        if block.instructions[0] == state:
+            return
+        i = block.instructions.index(state)
+        tail = Block(*state)
+        tail.instructions = block.instructions[i:]
+        tail.end = block.end
+        tail.successors = block.successors
+        tail.calls = block.calls
+        tail.indirect = block.indirect
+        for instruction in tail.instructions:
+            self.owner[instruction] = tail
+        self.blocks[state] = tail
+        del block.instructions[i:]
+        block.end = state[0]
+        block.successors = [state]
+        block.calls = []
+        block.indirect = False
+
+
+def _operand(bank, code):
+    # the target of an absolute (in the program bank) or long jump or call
+    if len(code) == 4:
+        return code[1] | (code[2] << 8) | (code[3] << 16)
+    return bank | code[1] | (code[2] << 8)
+
+
+def _target(address, code):
+    # the target of a branch
+    if len(code) == 3:
+        offset = code[1] | (code[2] << 8)
+        if offset & 0x8000:
+            offset -= 0x10000
+    else:
+        offset = code[1]
+        if offset & 0x80:
+            offset -= 0x100
+    return (address & 0xff0000) | ((address + len(code) + offset) & 0xffff)
+
+
+def _order(key):
+    return tuple(-1 if value is None else value for value in key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 control flow graph')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0,
+                        help='load address (default %(default)s)')
+    parser.add_argument('--entry', type=lambda s: int(s, 0), action='append', default=[],
+                        help='an entry point in emulation mode (repeatable, default the vectors)')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='write the blocks to PATH')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    memory = [0] * 0x1000000
+    memory[args.load:args.load + len(image)] = image
+
+    analyser = Analyser(memory, start=args.load, end=args.load + len(image))
+    entries = [('%04x' % address, address, 1, 1, 1) for address in args.entry]
+    analyser.analyse(entries or analyser.vectors())
+    code = sum([block.end - block.start for block in analyser.blocks.values()])
+    print('%d blocks, %d instructions, %d bytes of code, %d indirect exits, %d targets outside'
+          % (len(analyser.blocks), len(analyser.owner), code,
+             len([block for block in analyser.blocks.values() if block.indirect]),
+             len(analyser.outside)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            analyser.write(f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,616 @@
+# Instruction handlers generated from an opcode table
+#
+# Each of MPU's inst_0x.. methods calls a generic op* method with an
+# addressing mode method, three Python calls an instruction, and the op*
+# method then tests M or X to pick the width every time.  The generator
+# reads the opcode table the @instruction decorators build (mnemonic,
+# addressing mode, cycles and extra cycles, by opcode) together with
+# OPERATIONS below (the width each mnemonic depends on and the flags it
+# affects) and writes one flat function per opcode and combination of the
+# M, X and E flags it runs with, the addressing mode, the operation, the pc
+# update and the cycle count inlined, the widths fixed:
+#
+#   def h_b5_110(mpu): # LDA dpx m=1 x=1 e=0
+#       memory = mpu.memory
+#       f = mpu.fetchAddr
+#       addr = (mpu.dpr + memory[f] + mpu.x) & 0xffff
+#       ...
+#
+# GeneratedMPU generates them when it's first used and picks the table for
+# the flags in step():
+#
+#   mpu = GeneratedMPU(memory=memory)
+#
+# * The opcodes the generator doesn't know (interrupts, mode changes, block
+#   moves, the long and indirect jumps ...) and ADC and SBC in decimal mode
+#   are run by the MPU's own handlers, wrapped with step()'s bookkeeping.
+# * The generated handlers don't keep excycles and addcycles up to date or
+#   go through the op*, addressing mode and memory helper methods, a subclass
+#   overriding those (or replacing instruct) needs MPU's step().
+# * Cycle accurate mode (setCycleAccurate()) steps with the MPU's handlers.
+# * With lazy=True the handlers are LazyFlagsMPU's (lazyflags.py), leaving
+#   N and Z to be worked out when P is read.
+# * MPU keeps its inst_0x.. methods, op* methods and addressing modes, for
+#   py65, cycle accurate mode and the opcodes not generated here, so the
+#   generated handlers are a second implementation of the instructions they
+#   cover.  Changing what an instruction does means changing OPERATIONS
+#   and the generator here as well as MPU's method.  The only link between
+#   the two is test_mpu65c816_codegen, which steps every opcode from random
+#   states on both and compares them, and runtests.py runs it with the
+#   rest of the suites.
+#
+# From the py65 folder, the generated source:
+#   python -m devices.codegen -o handlers.py
+
+import argparse
+import sys
+
+from devices.mpu65c816 import MPU
+from devices.slotted import SlottedMPU
+
+CARRY = 0x01
+ZERO = 0x02
+DECIMAL = 0x08
+OVERFLOW = 0x40
+NEGATIVE = 0x80
+MS = 0x20
+IRS = 0x10
+
+# the (m, x, e) combinations by the table index step() uses, p & 0x30 | e
+STATES = dict(((m * MS) | (x * IRS) | e, (m, x, e))
+              for m in (0, 1) for x in (0, 1) for e in (0, 1))
+
+# mnemonic: (width, flags)
+#   width: 'm' or 'x' for the register width the operation depends on
+#   flags: the flags it can change, the handler keeps P in a local
+OPERATIONS = {
+    'ADC': ('m', 'NVZC'), 'AND': ('m', 'NZ'), 'ASL': ('m', 'NZC'),
+    'BIT': ('m', 'NVZ'), 'CMP': ('m', 'NZC'), 'CPX': ('x', 'NZC'),
+    'CPY': ('x', 'NZC'), 'DEC': ('m', 'NZ'), 'EOR': ('m', 'NZ'),
+    'INC': ('m', 'NZ'), 'LDA': ('m', 'NZ'), 'LDX': ('x', 'NZ'),
+    'LDY': ('x', 'NZ'), 'LSR': ('m', 'NZC'), 'ORA': ('m', 'NZ'),
+    'ROL': ('m', 'NZC'), 'ROR': ('m', 'NZC'), 'SBC': ('m', 'NVZC'),
+    'STA': ('m', ''), 'STX': ('x', ''), 'STY': ('x', ''), 'STZ': ('m', ''),
+    'TRB': ('m', 'Z'), 'TSB': ('m', 'Z'),
+    # implied
+    'CLC': (None, 'C'), 'SEC': (None, 'C'), 'CLI': (None, 'I'),
+    'SEI': (None, 'I'), 'CLD': (None, 'D'), 'SED': (None, 'D'),
+    'CLV': (None, 'V'), 'NOP': (None, ''),
+    'INX': ('x', 'NZ'), 'INY': ('x', 'NZ'), 'DEX': ('x', 'NZ'),
+    'DEY': ('x', 'NZ'), 'TAX': ('x', 'NZ'), 'TAY': ('x', 'NZ'),
+    'TXA': ('m', 'NZ'), 'TYA': ('m', 'NZ'), 'TXY': ('x', 'NZ'),
+    'TYX': ('x', 'NZ'), 'TSX': ('x', 'NZ'),
+    # stack
+    'PHA': ('m', ''), 'PHX': ('x', ''), 'PHY': ('x', ''),
+    'PLA': ('m', 'NZ'), 'PLX': ('x', 'NZ'), 'PLY': ('x', 'NZ'),
+    # flow
+    'BPL': (None, ''), 'BMI': (None, ''), 'BVC': (None, ''),
+    'BVS': (None, ''), 'BCC': (None, ''), 'BCS': (None, ''),
+    'BNE': (None, ''), 'BEQ': (None, ''), 'BRA': (None, ''),
+    'JMP': (None, ''), 'JSR': (None, ''), 'RTS': (None, ''),
+}
+
+# the addressing modes the generator inlines, with their operand bytes
+# (the immediate mode's 1 or 2 by width)
+OPERAND_BYTES = {
+    'imm': None, 'dpg': 1, 'dpx': 1, 'dpy': 1, 'dix': 1, 'dpi': 1,
+    'dil': 1, 'diy': 1, 'dly': 1, 'str': 1, 'siy': 1,
+    'abs': 2, 'abx': 2, 'aby': 2, 'abl': 3, 'alx': 3, 'acc': 0,
+}
+
+# the operand bytes after the opcode at f, wrapping within the program bank
+# like pc does
+OPERAND_WORD = 'memory[f] + (memory[f + 1 if f & 0xffff != 0xffff else f - 0xffff] << 8)'
+OPERAND_LONG = ('memory[f] + (memory[(f & 0xff0000) + ((f + 1) & 0xffff)] << 8) + '
+                '(memory[(f & 0xff0000) + ((f + 2) & 0xffff)] << 16)')
+
+# the opcodes of these only in these modes
+MODES = {
+    'BIT': ('dpg', 'dpx', 'abs', 'abx'), # BIT # only changes Z
+    'JMP': ('abs',), 'JSR': ('abs',),
+}
+
+BRANCHES = {
+    'BPL': (NEGATIVE, False), 'BMI': (NEGATIVE, True),
+    'BVC': (OVERFLOW, False), 'BVS': (OVERFLOW, True),
+    'BCC': (CARRY, False), 'BCS': (CARRY, True),
+    'BNE': (ZERO, False), 'BEQ': (ZERO, True),
+}
+
+# the operations that don't set N and Z from a single result (or only set
+# Z), with lazy flags they read and write mpu.p, materializing P
+EAGER = ('BIT', 'CMP', 'CPX', 'CPY', 'TRB', 'TSB')
+
+FLAGS = {'CLC': CARRY, 'SEC': CARRY, 'CLI': 0x04, 'SEI': 0x04,
+         'CLD': DECIMAL, 'SED': DECIMAL, 'CLV': OVERFLOW}
+
+
+def table(mpuClass=MPU):
+    # [(opcode, mnemonic, mode, cycles, extracycles, width, flags)] of the
+    # opcodes the generator handles
+    rows = []
+    for opcode in range(256):
+        name, mode = mpuClass.disassemble[opcode]
+        if name not in OPERATIONS:
+            continue
+        if name in MODES:
+            if mode not in MODES[name]:
+                continue
+        elif mode not in OPERAND_BYTES and mode not in ('imp', 'stk', 'pcr'):
+            continue
+        width, flags = OPERATIONS[name]
+        rows.append((opcode, name, mode, mpuClass.cycletime[opcode],
+                     mpuClass.extracycles[opcode], width, flags))
+    return rows
+
+
+# Addressing modes, lines setting addr
+
+def _pointer(e, wrap):
+    # the word at the direct page address d, wrapping within the page in
+    # emulation mode when wrap (DL = 0) and within bank 0 otherwise
+    if e and wrap:
+        return 'memory[d] + (memory[(d & 0xff00) + ((d + 1) & 0xff)] << 8)'
+    return 'memory[d] + (memory[(d + 1) & 0xffff] << 8)'
+
+
+def _direct(e, index=None):
+    # [(condition, d expression)] for the direct page address, indexed by
+    # index, in emulation mode split on DL
+    if index is None:
+        return [(None, '(mpu.dpr + memory[f]) & 0xffff')]
+    indexed = '(mpu.dpr + memory[f] + mpu.%s) & 0xffff' % index
+    if not e:
+        return [(None, indexed)]
+    return [('dpr & 0xff', '(dpr + memory[f] + mpu.%s) & 0xffff' % index),
+            ('else', 'dpr + ((memory[f] + mpu.%s) & 0xff)' % index)]
+
+
+def _split(e, index, body):
+    # lines computing d for the direct page mode and then body(wrap), in
+    # emulation mode with the DL = 0 case apart
+    cases = _direct(e, index)
+    if len(cases) == 1 and not e:
+        return ['d = ' + cases[0][1]] + body(False)
+    if len(cases) == 1:
+        lines = ['dpr = mpu.dpr', 'd = (dpr + memory[f]) & 0xffff',
+                 'if dpr & 0xff:']
+        lines += ['    ' + line for line in body(False)]
+        lines += ['else:'] + ['    ' + line for line in body(True)]
+        return lines
+    lines = ['dpr = mpu.dpr', 'if dpr & 0xff:', '    d = ' + cases[0][1]]
+    lines += ['    ' + line for line in body(False)]
+    lines += ['else:', '    d = ' + cases[1][1]]
+    lines += ['    ' + line for line in body(True)]
+    return lines
+
+
+def _wrap():
+    # the effective address wrapping past $FFFFFF to bank 0
+    return ['if addr > 0xffffff:', '    addr &= 0xffffff']
+
+
+def _cross(base, extra):
+    # the extra cycle for indexing across a bank (the default crossMask)
+    if not extra:
+        return []
+    return ['if (%s ^ addr) & 0xff0000:' % base,
+            '    mpu.processorCycles += 1']
+
+
+def address(mode, e, extra):
+    # lines setting addr for the addressing mode
+    if mode == 'imm':
+        return ['addr = f']
+    if mode == 'dpg':
+        return ['addr = (mpu.dpr + memory[f]) & 0xffff']
+    if mode in ('dpx', 'dpy'):
+        cases = _direct(e, mode[2])
+        if len(cases) == 1:
+            return ['addr = ' + cases[0][1]]
+        return ['dpr = mpu.dpr', 'if dpr & 0xff:', '    addr = ' + cases[0][1],
+                'else:', '    addr = ' + cases[1][1]]
+    if mode == 'dix':
+        return _split(e, 'x', lambda wrap: ['addr = (mpu.dbr << 16) + ' + _pointer(e, wrap)])
+    if mode == 'dpi':
+        return _split(e, None, lambda wrap: ['addr = (mpu.dbr << 16) + ' + _pointer(e, wrap)])
+    if mode == 'diy':
+        return _split(e, None, lambda wrap: ['inaddr = ' + _pointer(e, wrap),
+                                             'addr = (mpu.dbr << 16) + inaddr + mpu.y'] +
+                      _cross('inaddr', extra) + _wrap())
+    if mode in ('dil', 'dly'):
+        lines = ['d = (mpu.dpr + memory[f]) & 0xffff',
+                 'inaddr = (memory[d] + (memory[(d + 1) & 0xffff] << 8) +',
+                 '          (memory[(d + 2) & 0xffff] << 16))']
+        if mode == 'dil':
+            return lines + ['addr = inaddr']
+        return lines + ['addr = inaddr + mpu.y'] + _cross('inaddr', extra) + _wrap()
+    if mode == 'str':
+        return ['addr = (%smpu.sp + memory[f]) & 0xffff' % ('0x100 + ' if e else '')]
+    if mode == 'siy':
+        return ['s = (%smpu.sp + memory[f]) & 0xffff' % ('0x100 + ' if e else ''),
+                'addr = (mpu.dbr << 16) + memory[s] + (memory[(s + 1) & 0xffff] << 8) + mpu.y'] + _wrap()
+    if mode == 'abs':
+        return ['addr = (mpu.dbr << 16) + ' + OPERAND_WORD]
+    if mode in ('abx', 'aby'):
+        return ['base = (mpu.dbr << 16) + ' + OPERAND_WORD,
+                'addr = base + mpu.%s' % mode[2]] + _cross('base', extra) + _wrap()
+    if mode == 'abl':
+        return ['addr = ' + OPERAND_LONG]
+    if mode == 'alx':
+        return ['addr = ' + OPERAND_LONG + ' + mpu.x'] + _wrap()
+    raise ValueError('no addressing mode %s' % mode)
+
+
+# Operations, lines using addr (or the accumulator) and the local p
+
+def _nz(value, wide, lazy=False):
+    # FlagsNZ() or FlagsNZWord() of value, lazily the value kept in mpu.nz
+    # with its sign in bit 15
+    if lazy:
+        return ['mpu.nz = %s' % value if wide else 'mpu.nz = %s << 8' % value]
+    negative = '(%s >> 8) & 0x80' % value if wide else '%s & 0x80' % value
+    return ['if %s:' % value,
+            '    p = (p & ~0x82) | (%s)' % negative,
+            'else:',
+            '    p = (p & ~0x82) | 0x02']
+
+
+def _read(name, wide):
+    if wide:
+        return ['%s = memory[addr] + (memory[addr + 1] << 8)' % name]
+    return ['%s = memory[addr]' % name]
+
+
+def _write(value, wide):
+    # the value, masked to the width, to memory at addr
+    if wide:
+        return ['memory[addr] = %s & 0xff' % value,
+                'memory[addr + 1] = (%s >> 8) & 0xff' % value]
+    return ['memory[addr] = %s & 0xff' % value]
+
+
+def _push(values, e):
+    # stPush() of each byte expression in turn
+    lines = ['sp = mpu.sp']
+    for value in values:
+        if e:
+            lines += ['memory[0x100 + sp] = %s & 0xff' % value, 'sp = (sp - 1) & 0xff']
+        else:
+            lines += ['memory[sp] = %s & 0xff' % value, 'sp = (sp - 1) & 0xffff']
+    return lines + ['mpu.sp = sp']
+
+
+def _pull(names, e):
+    # stPop() into each name in turn
+    lines = ['sp = mpu.sp']
+    for name in names:
+        if e:
+            lines += ['sp = (sp + 1) & 0xff', '%s = memory[0x100 + sp]' % name]
+        else:
+            lines += ['sp = (sp + 1) & 0xffff', '%s = memory[sp]' % name]
+    return lines + ['mpu.sp = sp']
+
+
+def _arithmetic(name, wide, lazy=False):
+    # binary ADC and SBC, decimal mode goes to the MPU's handler
+    top = 0x8000 if wide else 0x80
+    mask = 0xffff if wide else 0xff
+    clear = 'p &= ~0x41' if lazy else 'p &= ~0xc3'
+    lines = _read('data', wide) + ['a = mpu.a']
+    if name == 'ADC':
+        lines += ['result = data + a + (p & 0x01)', clear,
+                  'if (~(a ^ data) & (a ^ result)) & 0x%x:' % top]
+    else:
+        lines += ['result = a + (~data & 0x%x) + (p & 0x01)' % mask, clear,
+                  'if ((a ^ data) & (a ^ result)) & 0x%x:' % top]
+    lines += ['    p |= 0x40',
+              'if result > 0x%x:' % mask,
+              '    p |= 0x01',
+              '    result &= 0x%x' % mask]
+    if lazy:
+        lines += _nz('result', wide, lazy)
+    else:
+        lines += ['if result:',
+                  '    p |= %s' % ('(result >> 8) & 0x80' if wide else 'result & 0x80'),
+                  'else:',
+                  '    p |= 0x02']
+    return lines + ['mpu.a = result']
+
+
+def _shift(name, wide, accumulator, lazy=False):
+    # ASL, LSR, ROL, ROR, INC and DEC of A or memory
+    top = 0x8000 if wide else 0x80
+    mask = 0xffff if wide else 0xff
+    negative = '(t >> 8) & 0x80' if wide else 't & 0x80'
+    lines = ['t = mpu.a'] if accumulator else _read('t', wide)
+    if lazy and name in ('ASL', 'LSR'):
+        if name == 'ASL':
+            lines += ['p &= ~0x01', 'if t & 0x%x:' % top, '    p |= 0x01',
+                      't = (t << 1) & 0x%x' % mask]
+        else:
+            lines += ['p = (p & ~0x01) | (t & 1)', 't = t >> 1']
+        lines += _nz('t', wide, lazy)
+    elif name == 'ASL':
+        lines += ['p &= ~0x83',
+                  'if t & 0x%x:' % top, '    p |= 0x01',
+                  't = (t << 1) & 0x%x' % mask,
+                  'if t:', '    p |= ' + negative, 'else:', '    p |= 0x02']
+    elif name == 'LSR':
+        lines += ['p = (p & ~0x83) | (t & 1)', 't = t >> 1',
+                  'if not t:', '    p |= 0x02']
+    elif name == 'ROL':
+        lines += ['if p & 0x01:',
+                  '    if not t & 0x%x:' % top, '        p &= ~0x01',
+                  '    t = ((t << 1) | 1) & 0x%x' % mask,
+                  'else:',
+                  '    if t & 0x%x:' % top, '        p |= 0x01',
+                  '    t = (t << 1) & 0x%x' % mask] + _nz('t', wide, lazy)
+    elif name == 'ROR':
+        lines += ['if p & 0x01:',
+                  '    if not t & 1:', '        p &= ~0x01',
+                  '    t = (t >> 1) | 0x%x' % top,
+                  'else:',
+                  '    if t & 1:', '        p |= 0x01',
+                  '    t = t >> 1'] + _nz('t', wide, lazy)
+    else:
+        lines += ['t = (t %s 1) & 0x%x' % ('+' if name == 'INC' else '-', mask)]
+        lines += _nz('t', wide, lazy)
+    if accumulator:
+        return lines + ['mpu.a = t']
+    return lines + _write('t', wide)
+
+
+def _transfer(name, m, x, lazy=False):
+    # the register transfers, with the widths of both registers
+    target = 'mpu.' + name[2].lower()
+    if name in ('TAX', 'TAY'):
+        if m and not x:
+            value = '(mpu.b << 8) + mpu.a'
+        elif not m and x:
+            value = 'mpu.a & 0xff'
+        else:
+            value = 'mpu.a'
+        wide = not x
+    elif name in ('TXA', 'TYA'):
+        source = 'mpu.' + name[1].lower()
+        value = source + ' & 0xff' if m and not x else source
+        wide = not m
+    elif name == 'TSX':
+        value = 'mpu.sp & 0xff' if x else 'mpu.sp'
+        wide = not x
+    else: # TXY, TYX
+        value = 'mpu.' + name[1].lower()
+        wide = not x
+    return ['%s = v = %s' % (target, value)] + _nz('v', wide, lazy)
+
+
+def operation(name, mode, m, x, e, lazy=False):
+    # (lines, operand bytes, pc already set) for the operation, lazy for
+    # LazyFlagsMPU's N and Z
+    width = OPERATIONS[name][0]
+    wide = not (m if width == 'm' else x)
+    length = OPERAND_BYTES.get(mode, 0)
+    if mode == 'imm':
+        length = 2 if wide else 1
+    if name in ('LDA', 'LDX', 'LDY'):
+        register = 'mpu.' + name[2].lower()
+        return _read('v', wide) + ['%s = v' % register] + _nz('v', wide, lazy), length, False
+    if name in ('STA', 'STX', 'STY'):
+        return _write('mpu.' + name[2].lower(), wide), length, False
+    if name == 'STZ':
+        return _write('0', wide), length, False
+    if name in ('AND', 'ORA', 'EOR'):
+        operator = {'AND': '&', 'ORA': '|', 'EOR': '^'}[name]
+        return (_read('data', wide) + ['mpu.a = v = mpu.a %s data' % operator] +
+                _nz('v', wide, lazy)), length, False
+    if name in ('ADC', 'SBC'):
+        return _arithmetic(name, wide, lazy), length, False
+    if name in ('CMP', 'CPX', 'CPY'):
+        register = {'CMP': 'mpu.a', 'CPX': 'mpu.x', 'CPY': 'mpu.y'}[name]
+        negative = '((r - data) >> 8) & 0x80' if wide else '(r - data) & 0x80'
+        return (_read('data', wide) + ['r = %s' % register, 'p &= ~0x83',
+                                       'if r == data:', '    p |= 0x03',
+                                       'elif r > data:', '    p |= 0x01',
+                                       'p |= ' + negative]), length, False
+    if name == 'BIT':
+        overflow = '(data >> 8) & 0xc0' if wide else 'data & 0xc0'
+        return (_read('data', wide) + ['p &= ~0xc2', 'if not mpu.a & data:',
+                                       '    p |= 0x02', 'p |= ' + overflow]), length, False
+    if name in ('ASL', 'LSR', 'ROL', 'ROR', 'INC', 'DEC'):
+        return _shift(name, wide, mode == 'acc', lazy), length, False
+    if name in ('TSB', 'TRB'):
+        lines = ['m = (memory[addr + 1] << 8) + memory[addr]' if wide else 'm = memory[addr]',
+                 'a = mpu.a', 'if m & a:', '    p &= ~0x02', 'else:', '    p |= 0x02']
+        lines += ['r = m | a' if name == 'TSB' else 'r = m & ~a']
+        return lines + _write('r', wide), length, False
+    if name in FLAGS:
+        if name.startswith('CL'):
+            return ['p &= ~0x%02x' % FLAGS[name]], 0, False
+        return ['p |= 0x%02x' % FLAGS[name]], 0, False
+    if name == 'NOP':
+        return [], 0, False
+    if name in ('INX', 'INY', 'DEX', 'DEY'):
+        register = 'mpu.' + name[2].lower()
+        operator = '+' if name.startswith('IN') else '-'
+        return (['%s = v = (%s %s 1) & 0x%x' % (register, register, operator,
+                                                 0xffff if wide else 0xff)] +
+                _nz('v', wide, lazy)), 0, False
+    if name in ('TAX', 'TAY', 'TXA', 'TYA', 'TXY', 'TYX', 'TSX'):
+        return _transfer(name, m, x, lazy), 0, False
+    if name in ('PHA', 'PHX', 'PHY'):
+        register = 'mpu.' + name[2].lower()
+        values = ['(v >> 8)', 'v'] if wide else ['v']
+        return ['v = ' + register] + _push(values, e), 0, False
+    if name in ('PLA', 'PLX', 'PLY'):
+        register = 'mpu.' + name[2].lower()
+        if wide:
+            lines = _pull(['low', 'high'], e) + ['v = low + (high << 8)']
+        else:
+            lines = _pull(['v'], e)
+        return lines + ['%s = v' % register] + _nz('v', wide, lazy), 0, False
+    if name in BRANCHES or name == 'BRA':
+        return _branch(name, lazy), 1, True
+    if name == 'JMP':
+        return ['mpu.pc = ' + OPERAND_WORD], 2, True
+    if name == 'JSR':
+        return (['v = (mpu.pc + 1) & 0xffff'] + _push(['(v >> 8)', 'v'], e) +
+                ['mpu.pc = ' + OPERAND_WORD]), 2, True
+    if name == 'RTS':
+        return (_pull(['low', 'high'], e) +
+                ['mpu.pc = (low + (high << 8) + 1) & 0xffff']), 0, True
+    raise ValueError('no operation %s' % name)
+
+
+def _branch(name, lazy=False):
+    # ProgramCounterRelAddr() when the branch is taken, its extra cycles
+    # added here, lazily N and Z from mpu.nz unless it's None
+    lines = ['offset = memory[f]',
+             'pc = (mpu.pc + 1) & 0xffff',
+             'if offset & 0x80:',
+             '    addr = pc - (offset ^ 0xff) - 1',
+             'else:',
+             '    addr = pc + offset',
+             'if (pc ^ addr) & 0xff00:',
+             '    mpu.processorCycles += 2',
+             'else:',
+             '    mpu.processorCycles += 1',
+             'mpu.pc = addr & 0xffff']
+    if name == 'BRA':
+        return lines
+    flag, taken = BRANCHES[name]
+    if lazy and flag in (NEGATIVE, ZERO):
+        test = ['nz = mpu.nz',
+                'if %s(mpu.flags & 0x%02x if nz is None else %s):'
+                % ('' if taken else 'not ', flag, 'nz & 0x8000' if flag == NEGATIVE else 'nz == 0')]
+    else:
+        test = ['if %s%s & 0x%02x:' % ('' if taken else 'not ',
+                                       'mpu.flags' if lazy else 'mpu.p', flag)]
+    return (test +
+            ['    ' + line for line in lines] +
+            ['else:', '    mpu.pc = (mpu.pc + 1) & 0xffff'])
+
+
+def handler(row, m, x, e, lazy=False):
+    # the source of the handler for the table row with the flags, lazy for
+    # LazyFlagsMPU: P without the pending N and Z is mpu.flags, the
+    # operations in EAGER read and write mpu.p
+    opcode, name, mode, cycles, extra, width, flags = row
+    lines, length, flow = operation(name, mode, m, x, e, lazy)
+    register = 'mpu.p'
+    if lazy and name not in EAGER:
+        register = 'mpu.flags'
+        flags = flags.replace('N', '').replace('Z', '')
+    body = []
+    if name in ('ADC', 'SBC'):
+        body += ['if %s & 0x08:' % register, '    return d_%02x(mpu)' % opcode]
+    addressed = mode in OPERAND_BYTES and mode != 'acc'
+    if addressed or flow or mode == 'stk':
+        body += ['memory = mpu.memory', 'f = mpu.fetchAddr']
+    if addressed:
+        body += address(mode, e, extra)
+    if flags:
+        body += ['p = ' + register] + lines + [register + ' = p']
+    else:
+        body += lines
+    if length and not flow:
+        body.append('mpu.pc = (mpu.pc + %d) & 0xffff' % length)
+    body.append('mpu.processorCycles += %d' % cycles)
+    return ['def h_%02x_%d%d%d(mpu): # %s %s m=%d x=%d e=%d'
+            % (opcode, m, x, e, name, mode, m, x, e)] + ['    ' + line for line in body]
+
+
+def delegate(opcode, mpuClass=MPU):
+    # the source of the handler running the MPU's own handler i_xx with the
+    # bookkeeping of step()
+    return ['def d_%02x(mpu): # %s %s' % ((opcode,) + tuple(mpuClass.disassemble[opcode])),
+            '    mpu.excycles = 0',
+            '    mpu.addcycles = %d' % mpuClass.extracycles[opcode],
+            '    i_%02x(mpu)' % opcode,
+            '    mpu.pc &= 0xffff',
+            '    mpu.processorCycles += %d + mpu.excycles' % mpuClass.cycletime[opcode]]
+
+
+def source(mpuClass=MPU, lazy=False):
+    # the module source: the handlers, a d_xx delegate for each opcode and
+    # HANDLERS, the 256 handlers of each table index (None where unused),
+    # the i_xx names are the MPU's handlers
+    rows = dict((row[0], row) for row in table(mpuClass))
+    functions = []
+    for opcode in range(256):
+        functions.append('\n'.join(delegate(opcode, mpuClass)))
+    names = {} # (index, opcode): function name
+    seen = {} # body: function name, combinations with the same code share it
+    for index in sorted(STATES):
+        m, x, e = STATES[index]
+        for opcode in range(256):
+            if opcode not in rows:
+                names[index, opcode] = 'd_%02x' % opcode
+                continue
+            lines = handler(rows[opcode], m, x, e, lazy)
+            body = '\n'.join(lines[1:])
+            if body not in seen:
+                seen[body] = lines[0].split('(')[0][4:]
+                functions.append('\n'.join(lines))
+            names[index, opcode] = seen[body]
+    tables = ['HANDLERS = [None] * 0x%x' % (max(STATES) + 1)]
+    for index in sorted(STATES):
+        tables.append('HANDLERS[0x%02x] = [%s]' % (index, ', '.join(
+            names[index, opcode] for opcode in range(256))))
+    return '\n\n'.join(functions) + '\n\n' + '\n'.join(tables) + '\n'
+
+
+def build(mpuClass=MPU, lazy=False):
+    # compiles the source, returns HANDLERS
+    namespace = dict(('i_%02x' % opcode, handler)
+                     for opcode, handler in enumerate(mpuClass.instruct))
+    exec(compile(source(mpuClass, lazy), '<handlers>', 'exec'), namespace)
+    return namespace['HANDLERS']
+
+
+class GeneratedMPU(SlottedMPU):
+    __slots__ = ()
+
+    handlers = None # HANDLERS, built for the class when it's first used
+    lazy = False # build the handlers for LazyFlagsMPU
+
+    def __init__(self, *args, **kargs):
+        cls = type(self)
+        if cls.__dict__.get('handlers') is None:
+            cls.handlers = build(cls, cls.lazy)
+        SlottedMPU.__init__(self, *args, **kargs)
+
+    def step(self):
+        if self.waiting:
+            if not self.stopped:
+                self.processorCycles += 1
+        else:
+            bank = self.pbr << 16
+            instructCode = self.memory[bank + self.pc]
+            self.pc = pc = (self.pc + 1) & 0xffff
+            self.fetchAddr = bank + pc
+            self.handlers[(self.p & 0x30) | self.mode][instructCode](self)
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='generate the instruction handlers')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='write the source to PATH (default stdout)')
+    parser.add_argument('--lazy', action='store_true',
+                        help="LazyFlagsMPU's handlers")
+    args = parser.parse_args(argv)
+
+    text = source(lazy=args.lazy)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        sys.stderr.write('%d opcodes generated, %d functions\n'
+                         % (len(table()), text.count('\ndef h_') + text.startswith('def h_')))
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
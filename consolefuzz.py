@@ -0,0 +1,455 @@
+# Coverage guided fuzzing of firmware through the console
+#
+# Boots a firmware image until it first waits for console input (e.g. at the
+# OF816 "ok" prompt), snapshots the machine there and then feeds it mutated
+# lines of input, one per execution, restoring the snapshot before each one.
+# Inputs that reach control flow edges no earlier input reached are kept in
+# the corpus and mutated further.
+#
+# * Coverage is a bitmap of edges, the PBR:PC of a branch, jump, call,
+#   return, BRK or COP and the PBR:PC it went to, hashed into 64K entries.
+#   Only those opcodes are instrumented (in this MPU's copy of the
+#   instruction table), every other instruction runs as it always does.
+# * The snapshot is copy-on-write.  The memory is a dict of the bytes
+#   written since the snapshot over a list holding the snapshot itself, so
+#   restoring is clearing the few entries an execution wrote.
+# * A crash is a BRK or COP through a vector that isn't expected, STP, the
+#   stack pointer leaving the configured range after a stack operation or
+#   an exception in the simulation.  An execution that hasn't asked for
+#   more input after the instruction budget is a hang.
+#
+# From the py65 folder:
+#   python -m devices.consolefuzz --preset of816 -n 2000 -j 4 --out crashes
+#   python -m devices.consolefuzz forth.bin --load 0x8000 --getc 0x7fc0 \
+#       --putc 0x7fe0 --stack 0x0800:0x09ff --vector 0xffe4
+#
+# A line of Forth costs the firmware tens of thousands of instructions, so
+# expect executions per second per core rather than thousands.
+
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+from devices.mpu65c816 import MPU
+from devices.lockstep import SNAPSHOT
+
+MAP_SIZE = 0x10000
+MAP_MASK = MAP_SIZE - 1
+
+# opcodes that end a basic block
+FLOW = (0x00, 0x02, 0x10, 0x20, 0x22, 0x30, 0x40, 0x4c, 0x50, 0x5c, 0x60,
+        0x6b, 0x6c, 0x70, 0x7c, 0x80, 0x82, 0x90, 0xb0, 0xd0, 0xdc, 0xf0,
+        0xfc)
+
+# opcodes that move the stack pointer
+STACK = (0x00, 0x02, 0x08, 0x0b, 0x1b, 0x20, 0x22, 0x28, 0x2b, 0x40, 0x48,
+         0x4b, 0x5a, 0x60, 0x62, 0x68, 0x6b, 0x7a, 0x8b, 0x9a, 0xab, 0xd4,
+         0xda, 0xf4, 0xfa, 0xfc)
+
+# image file, load address, start pc (None to reset into it), getc, putc,
+# stack range (None not to check it)
+PRESETS = {
+    'of816': ('of816_forth.bin', 0x8000, None, 0x7fc0, 0x7fe0, (0x0800, 0x09ff)),
+    'liara': ('liara.bin', 0x0000, 0x5000, 0xfff0, 0xfff1, None),
+}
+
+SEEDS = (b'1 2 + .\r', b': sq dup * ; 7 sq .\r', b'variable v 5 v ! v @ .\r',
+         b'hex ff decimal .\r', b'foo\r')
+
+TOKENS = (b' ', b':', b';', b'.', b'."', b'(', b')', b'\\', b"'", b'-1', b'0',
+          b'65535', b'2147483647', b'$ff', b'#10', b'%101', b'dup', b'drop',
+          b'swap', b'over', b'rot', b'+', b'-', b'*', b'/', b'mod', b'@', b'!',
+          b'c@', b'c!', b'allot', b'here', b'create', b'does>', b'variable',
+          b'constant', b'if', b'else', b'then', b'begin', b'until', b'again',
+          b'do', b'loop', b'i', b'recurse', b'exit', b'execute', b'>r', b'r>',
+          b'base', b'hex', b'decimal', b's"', b'see', b'forget', b'abort',
+          b'\x08', b'\x00', b'\x7f', b'\xff')
+
+MAX_LENGTH = 80
+
+
+class Crash(Exception):
+    def __init__(self, kind, address, detail=''):
+        Exception.__init__(self, kind, address, detail)
+        self.kind = kind
+        self.address = address # PBR:PC of the instruction
+        self.detail = detail
+
+    def key(self):
+        return self.kind, self.address
+
+    def __str__(self):
+        text = '%s at %02x:%04x' % (self.kind, self.address >> 16,
+                                     self.address & 0xffff)
+        if self.detail:
+            text += ' (%s)' % self.detail
+        return text
+
+
+class Idle(Exception):
+    # the firmware asked for input once it had all of it
+    pass
+
+
+class SnapshotMemory(dict):
+    # the bytes written since the snapshot over the snapshot itself, the
+    # console input is read from getc
+    def __init__(self, base, getc):
+        dict.__init__(self)
+        self.base = base
+        self.getc = getc
+        self.input = b''
+        self.position = 0
+        self.idle = False
+        self.raising = True # raise Idle rather than set idle
+
+    def __missing__(self, address):
+        if address == self.getc:
+            if self.position < len(self.input):
+                self.position += 1
+                return self.input[self.position - 1]
+            if self.raising:
+                raise Idle()
+            self.idle = True
+            return 0
+        return self.base[address]
+
+    def commit(self):
+        # make the bytes written part of the snapshot
+        base = self.base
+        for address, value in self.items():
+            base[address] = value
+        self.clear()
+
+
+class EchoMemory(SnapshotMemory):
+    # a snapshot memory that also keeps what's written to putc
+    def __init__(self, base, getc, putc):
+        SnapshotMemory.__init__(self, base, getc)
+        self.putc = putc
+        self.output = []
+
+    def __setitem__(self, address, value):
+        if address == self.putc:
+            self.output.append(value)
+        dict.__setitem__(self, address, value)
+
+
+class ConsoleFuzzer:
+    def __init__(self, image, load, getc, putc=None, pc=None, stack=None,
+                 vectors=(), size=0x30000, budget=200000, boot=10000000,
+                 seed=0, tokens=TOKENS, seeds=SEEDS):
+        base = size * [0x00]
+        base[load:load + len(image)] = list(image)
+        self.memory = SnapshotMemory(base, getc)
+        self.getc = getc
+        self.putc = putc
+        self.stack = stack
+        self.vectors = frozenset(vectors) # BRK/COP vectors the firmware uses
+        self.budget = budget
+        self.random = random.Random(seed)
+        self.tokens = tokens
+
+        mpu = MPU(memory=self.memory)
+        if pc is not None:
+            mpu.pc = pc
+        self.mpu = mpu
+        self.boot(boot)
+
+        self.seen = bytearray(MAP_SIZE)
+        self.fresh = []
+        self.instrument()
+
+        self.corpus = []
+        self.crashes = {} # (kind, address) => (crash, input)
+        self.hangs = 0
+        self.executions = 0
+        for data in seeds:
+            if self.execute(data)[1]:
+                self.corpus.append(data)
+        if not self.corpus:
+            self.corpus = list(seeds)
+
+    # snapshot
+
+    def boot(self, limit):
+        # run to the first wait for input and take the snapshot there
+        memory = self.memory
+        memory.raising = False
+        step = self.mpu.step
+        count = 0
+        while not memory.idle:
+            if count == limit:
+                raise RuntimeError('firmware not waiting for input after %d instructions' % limit)
+            step()
+            count += 1
+        memory.raising = True
+        memory.idle = False
+        memory.commit()
+        self.snapshot = [getattr(self.mpu, field) for field in SNAPSHOT]
+
+    def restore(self):
+        self.memory.clear()
+        mpu = self.mpu
+        for field, value in zip(SNAPSHOT, self.snapshot):
+            setattr(mpu, field, value)
+
+    # instrumentation
+
+    def instrument(self):
+        # wrap the block ending and stack opcodes in this MPU's own copy of
+        # the instruction table
+        mpu = self.mpu
+        instruct = list(mpu.instruct)
+        if self.stack is not None:
+            for opcode in STACK:
+                instruct[opcode] = self.stackCheck(instruct[opcode])
+        for opcode in (0x00, 0x02):
+            instruct[opcode] = self.vectorCheck(instruct[opcode], opcode)
+        instruct[0xdb] = self.stopCheck(instruct[0xdb])
+        for opcode in FLOW:
+            instruct[opcode] = self.edge(instruct[opcode])
+        mpu.instruct = instruct
+
+    def edge(self, inst):
+        seen = self.seen
+        fresh = self.fresh
+
+        def wrapped(mpu):
+            source = (mpu.pbr << 16) | mpu.pc
+            inst(mpu)
+            index = ((source * 40503) ^ (mpu.pbr << 16) ^ mpu.pc) & MAP_MASK
+            if not seen[index]:
+                seen[index] = 1
+                fresh.append(index)
+        return wrapped
+
+    def stackCheck(self, inst):
+        low, high = self.stack
+
+        def wrapped(mpu):
+            inst(mpu)
+            sp = mpu.sp | 0x100 if mpu.mode else mpu.sp
+            if not low <= sp <= high:
+                raise Crash('stack', (mpu.pbr << 16) | mpu.pc, 'S = %04x' % sp)
+        return wrapped
+
+    def vectorCheck(self, inst, opcode):
+        vectors = self.vectors
+        name = 'BRK' if opcode == 0x00 else 'COP'
+
+        def wrapped(mpu):
+            if opcode == 0x00:
+                vector = mpu.IRQ[1] if mpu.mode else mpu.BRK
+            else:
+                vector = mpu.COP[mpu.mode]
+            if vector not in vectors:
+                raise Crash(name, (mpu.pbr << 16) | ((mpu.pc - 1) & 0xffff),
+                            'vector %04x' % vector)
+            inst(mpu)
+        return wrapped
+
+    def stopCheck(self, inst):
+        def wrapped(mpu):
+            raise Crash('STP', (mpu.pbr << 16) | ((mpu.pc - 1) & 0xffff))
+        return wrapped
+
+    # execution
+
+    def execute(self, data):
+        # returns (outcome, new edges), outcome is None when the firmware
+        # asked for more input, 'hang' or a Crash
+        self.restore()
+        memory = self.memory
+        memory.input = data
+        memory.position = 0
+        fresh = self.fresh
+        del fresh[:]
+        step = self.mpu.step
+        self.executions += 1
+        try:
+            for i in range(self.budget):
+                step()
+        except Idle:
+            outcome = None
+        except Crash as e:
+            outcome = e
+        except Exception as e:
+            mpu = self.mpu
+            outcome = Crash('exception', (mpu.pbr << 16) | mpu.pc, repr(e))
+        else:
+            outcome = 'hang'
+        return outcome, len(fresh)
+
+    def replay(self, data):
+        # returns (outcome, console output) without changing the coverage
+        memory = EchoMemory(self.memory.base, self.getc, self.putc)
+        saved = self.memory, self.mpu.memory, bytearray(self.seen)
+        self.memory = self.mpu.memory = memory
+        try:
+            outcome, edges = self.execute(data)
+        finally:
+            self.memory, self.mpu.memory, seen = saved
+            self.seen[:] = seen
+            self.executions -= 1
+        return outcome, bytes(memory.output)
+
+    def edges(self):
+        return sum(self.seen)
+
+    # mutation
+
+    def mutate(self, data):
+        rand = self.random
+        data = bytearray(data.rstrip(b'\r'))
+        for i in range(rand.choice((1, 1, 2, 4, 8))):
+            position = rand.randrange(len(data) + 1)
+            choice = rand.randrange(7)
+            if choice == 0 and data:
+                # flip a bit
+                position = min(position, len(data) - 1)
+                data[position] ^= 1 << rand.randrange(8)
+            elif choice == 1 and data:
+                # random byte
+                data[min(position, len(data) - 1)] = rand.randrange(0x100)
+            elif choice in (2, 3):
+                # insert a token, space separated
+                token = rand.choice(self.tokens)
+                data[position:position] = b' ' + token + b' '
+            elif choice == 4 and data:
+                # delete a span
+                del data[position:position + rand.randrange(1, 8)]
+            elif choice == 5 and data:
+                # repeat a span
+                span = data[position:position + rand.randrange(1, 8)]
+                data[position:position] = span * rand.randrange(1, 4)
+            else:
+                # splice in part of another input
+                other = rand.choice(self.corpus)
+                start = rand.randrange(len(other))
+                data[position:position] = other[start:start + rand.randrange(1, 16)].rstrip(b'\r')
+        return bytes(data[:MAX_LENGTH]) + b'\r'
+
+    def run(self, count):
+        # fuzz for count executions, returns the crashes found
+        for i in range(count):
+            data = self.mutate(self.random.choice(self.corpus))
+            outcome, edges = self.execute(data)
+            if isinstance(outcome, Crash):
+                key = outcome.key()
+                if key not in self.crashes:
+                    self.crashes[key] = (outcome, data)
+            elif outcome == 'hang':
+                self.hangs += 1
+            elif edges:
+                self.corpus.append(data)
+        return self.crashes
+
+
+def load_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _fuzz(args):
+    # one worker, returns (crashes, corpus, coverage map, hangs)
+    config, seed, count = args
+    fuzzer = ConsoleFuzzer(seed=seed, **config)
+    fuzzer.run(count)
+    crashes = [(str(crash), crash.key(), data)
+               for crash, data in fuzzer.crashes.values()]
+    return crashes, fuzzer.corpus, bytes(fuzzer.seen), fuzzer.hangs
+
+
+def fuzz(config, count, processes=1, seed=0):
+    # returns ({key: (description, input)}, corpus, edges, hangs) from
+    # processes workers of count executions each
+    jobs = [(config, seed * 1000003 + i, count) for i in range(processes)]
+    if processes == 1:
+        results = [_fuzz(jobs[0])]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_fuzz, jobs))
+    crashes = {}
+    corpus = []
+    coverage = bytearray(MAP_SIZE)
+    hangs = 0
+    for found, inputs, seen, hung in results:
+        for description, key, data in found:
+            crashes.setdefault(key, (description, data))
+        corpus.extend([data for data in inputs if data not in corpus])
+        coverage = bytearray([a | b for a, b in zip(coverage, seen)])
+        hangs += hung
+    return crashes, corpus, sum(coverage), hangs
+
+
+def _range(text):
+    low, high = text.split(':')
+    return int(low, 0), int(high, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='coverage guided console fuzzer')
+    parser.add_argument('image', nargs='?', help='firmware image (default the preset\'s)')
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        help='load address, console and stack of a known firmware')
+    parser.add_argument('--load', type=lambda s: int(s, 0), help='load address')
+    parser.add_argument('--pc', type=lambda s: int(s, 0), help='start address (default reset)')
+    parser.add_argument('--getc', type=lambda s: int(s, 0), help='console input address')
+    parser.add_argument('--putc', type=lambda s: int(s, 0), help='console output address')
+    parser.add_argument('--stack', type=_range, help='allowed stack pointer range LOW:HIGH')
+    parser.add_argument('--vector', type=lambda s: int(s, 0), action='append', default=[],
+                        help='a BRK/COP vector the firmware uses (repeatable)')
+    parser.add_argument('-n', '--executions', type=int, default=1000,
+                        help='executions per process (default %(default)s)')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='worker processes (default %(default)s)')
+    parser.add_argument('--budget', type=int, default=200000,
+                        help='instructions per execution (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='folder to save crashing inputs and the corpus in')
+    args = parser.parse_args(argv)
+
+    image, load, pc, getc, putc, stack = PRESETS.get(args.preset, (None,) * 6)
+    image = args.image or image
+    if image is None or (args.load is None and load is None) or \
+       (args.getc is None and getc is None):
+        parser.error('an image with --load and --getc, or a --preset, is needed')
+    config = {
+        'image': load_image(image),
+        'load': load if args.load is None else args.load,
+        'pc': pc if args.pc is None else args.pc,
+        'getc': getc if args.getc is None else args.getc,
+        'putc': putc if args.putc is None else args.putc,
+        'stack': stack if args.stack is None else args.stack,
+        'vectors': args.vector,
+        'budget': args.budget,
+    }
+
+    start = time.perf_counter()
+    crashes, corpus, edges, hangs = fuzz(config, args.executions,
+                                         args.processes, args.seed)
+    seconds = time.perf_counter() - start
+    executions = args.executions * args.processes
+    print('%d executions in %.1fs (%.1f/s), %d edges, %d inputs in the corpus, %d hangs'
+          % (executions, seconds, executions / seconds, edges, len(corpus), hangs))
+    for key in sorted(crashes):
+        description, data = crashes[key]
+        print('%s: %r' % (description, data))
+
+    if args.out:
+        os.makedirs(os.path.join(args.out, 'corpus'), exist_ok=True)
+        for (kind, address), (description, data) in crashes.items():
+            with open(os.path.join(args.out, 'crash-%s-%06x' % (kind, address)), 'wb') as f:
+                f.write(data)
+        for i, data in enumerate(corpus):
+            with open(os.path.join(args.out, 'corpus', '%04d' % i), 'wb') as f:
+                f.write(data)
+    return 1 if crashes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
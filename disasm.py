@@ -0,0 +1,260 @@
+# 65816 disassembler that follows the register widths
+#
+# How long an immediate operand is depends on M (the accumulator
+# instructions and BIT) or X (LDX, LDY, CPX and CPY), which py65's
+# disassembler, decoding one instruction at a time from the MPU's
+# disassemble table, can't know.  Disassembler follows REP, SEP and XCE
+# (with the carry from CLC, SEC, REP and SEP for XCE) along the instructions
+# it decodes, so a listing is right after the usual CLC, XCE, REP #$30
+# start up, and it caches each decoded instruction by (address, M, X).  A
+# cached instruction is checked against memory when it's used again, so code
+# that has been overwritten is decoded afresh.
+#
+#   disassembler = Disassembler(mpu.memory)
+#   length, text = disassembler.instruction(0x8000, m=0, x=0)
+#   lines = disassembler.listing(0x8000, 0x9000)    # from emulation mode
+#   disassembler.write(f, 0x8000, 0x9000, m=0, x=0, e=0)
+#   trace(mpu, 1000, f)    # each instruction as it runs, with the registers
+#
+# PLP and RTI leave M and X as they were, and a listing runs straight
+# through the instructions without following jumps or branches (cfg.py
+# follows them and can fill the cache with the code it finds).
+#
+# From the py65 folder:
+#   python -m devices.disasm of816_forth.bin --load 0x8000
+#   python -m devices.disasm image.bin --load 0 --start 0x1000 --native -o image.lst
+
+import argparse
+import sys
+
+from devices.mpu65c816 import MPU
+
+CARRY = 0x01
+IRS = 0x10
+MS = 0x20
+
+# operand formats by addressing mode, the operand is the value of the bytes
+# after the opcode (for the relative modes the target address)
+FORMATS = {
+    'imp': '', 'stk': '', 'acc': ' A',
+    'imm': ' #$%0*x',
+    'dpg': ' $%02x', 'dpx': ' $%02x,X', 'dpy': ' $%02x,Y',
+    'dix': ' ($%02x,X)', 'dpi': ' ($%02x)', 'diy': ' ($%02x),Y',
+    'dil': ' [$%02x]', 'dly': ' [$%02x],Y', 'str': ' $%02x,S',
+    'siy': ' ($%02x,S),Y', 'ski': ' ($%02x)',
+    'abs': ' $%04x', 'abx': ' $%04x,X', 'aby': ' $%04x,Y', 'abi': ' ($%04x)',
+    'aix': ' ($%04x,X)', 'ail': ' [$%04x]', 'ska': ' $%04x',
+    'abl': ' $%06x', 'alx': ' $%06x,X',
+    'pcr': ' $%04x', 'prl': ' $%04x', 'spc': ' $%04x',
+    'blk': ' $%02x,$%02x',
+}
+
+SIZES = {'imp': 0, 'stk': 0, 'acc': 0, 'abs': 2, 'abx': 2, 'aby': 2,
+         'abi': 2, 'aix': 2, 'ail': 2, 'ska': 2, 'abl': 3, 'alx': 3,
+         'prl': 2, 'spc': 2, 'blk': 2}
+
+# immediate operands sized by X, the others not sized by M
+INDEX_IMMEDIATE = ('LDX', 'LDY', 'CPX', 'CPY')
+BYTE_IMMEDIATE = ('REP', 'SEP')
+
+# a signature byte after the opcode
+SIGNATURE = ('BRK', 'COP', 'WDM')
+
+
+def _operand_sizes():
+    # [operand bytes, or 'm' or 'x' for the immediate sizes] by opcode
+    sizes = []
+    for name, mode in MPU.disassemble:
+        if name in SIGNATURE:
+            sizes.append(1)
+        elif mode == 'imm' and name in INDEX_IMMEDIATE:
+            sizes.append('x')
+        elif mode == 'imm' and name not in BYTE_IMMEDIATE:
+            sizes.append('m')
+        else:
+            sizes.append(SIZES.get(mode, 1))
+    return sizes
+
+OPERAND_SIZES = _operand_sizes()
+
+
+class Disassembler:
+    def __init__(self, memory):
+        self.memory = memory # anything indexed by a 24 bit address
+        self.cache = {} # (address, m, x): (code, length, text)
+        self.decoded = 0 # instructions decoded rather than found in the cache
+
+    def instruction(self, address, m=1, x=1):
+        # (length, text) of the instruction at the 24 bit address with the
+        # given M and X flags (1 for 8 bits), operands wrap within the bank
+        code, length, text = self.decode(address, m, x)
+        return length, text
+
+    def decode(self, address, m=1, x=1):
+        # (the instruction's bytes, length, text), cached
+        memory = self.memory
+        key = (address, m, x)
+        cached = self.cache.get(key)
+        if cached is not None:
+            bank = address & 0xff0000
+            for i, value in enumerate(cached[0]):
+                if memory[bank | ((address + i) & 0xffff)] != value:
+                    break
+            else:
+                return cached
+
+        self.decoded += 1
+        bank = address & 0xff0000
+        opcode = memory[address]
+        size = OPERAND_SIZES[opcode]
+        if size == 'm':
+            size = 2 - m
+        elif size == 'x':
+            size = 2 - x
+        code = (opcode,) + tuple(memory[bank | ((address + 1 + i) & 0xffff)]
+                                  for i in range(size))
+        operand = 0
+        for i in range(size, 0, -1):
+            operand = (operand << 8) | code[i]
+
+        name, mode = MPU.disassemble[opcode]
+        template = FORMATS[mode]
+        if name in SIGNATURE:
+            text = name + ' $%02x' % operand
+        elif mode == 'imm':
+            text = name + template % (2 * size, operand)
+        elif mode in ('pcr', 'prl', 'spc'):
+            if operand & (0x80 << (8 * (size - 1))):
+                operand -= 0x100 << (8 * (size - 1))
+            text = name + template % ((address + 1 + size + operand) & 0xffff)
+        elif mode == 'blk':
+            # MVN/MVP dst,src in memory, written src,dst
+            text = name + template % (code[2], code[1])
+        elif size:
+            text = name + template % operand
+        else:
+            text = name + template
+        cached = (code, 1 + size, text)
+        self.cache[key] = cached
+        return cached
+
+    def invalidate(self, start=0, end=0x1000000):
+        # forgets the instructions from start up to end
+        for key in [key for key in self.cache if start <= key[0] < end]:
+            del self.cache[key]
+
+    def listing(self, start, end, m=1, x=1, e=1, c=None):
+        # [(address, code, text, (m, x))] for the instructions from start
+        # up to end, M, X, E and the carry (None if not known) are followed
+        # through the instructions
+        lines = []
+        address = start
+        while address < end:
+            code, length, text = self.decode(address, m, x)
+            lines.append((address, code, text, (m, x)))
+            m, x, e, c = follow(code, m, x, e, c)
+            address += length
+        return lines
+
+    def bank(self, bank, m=1, x=1, e=1):
+        # the listing of a whole bank
+        return self.listing(bank << 16, (bank + 1) << 16, m, x, e)
+
+    def write(self, f, start, end, m=1, x=1, e=1):
+        # writes the listing to the open file f
+        for line in self.listing(start, end, m, x, e):
+            f.write(format_line(line) + '\n')
+
+
+def follow(code, m, x, e, c):
+    # (m, x, e, carry) after the instruction with the bytes code, e and the
+    # carry may be None
+    opcode = code[0]
+    if opcode == 0xc2: # REP
+        if code[1] & CARRY:
+            c = 0
+        if e != 1:
+            if code[1] & MS:
+                m = 0
+            if code[1] & IRS:
+                x = 0
+    elif opcode == 0xe2: # SEP
+        if code[1] & CARRY:
+            c = 1
+        if code[1] & MS:
+            m = 1
+        if code[1] & IRS:
+            x = 1
+    elif opcode == 0x18: # CLC
+        c = 0
+    elif opcode == 0x38: # SEC
+        c = 1
+    elif opcode == 0xfb: # XCE
+        # M and X are set in emulation mode, so entering or leaving it they
+        # end up set, native to native they're left alone
+        if c == 1 or e == 1:
+            m = x = 1
+        e, c = c, e
+    return m, x, e, c
+
+
+def trace(mpu, count, f, disassembler=None):
+    # steps the MPU count times, writing each instruction before it runs
+    # with the registers, the widths are the MPU's own
+    if disassembler is None:
+        disassembler = Disassembler(mpu.memory)
+    for i in range(count):
+        address = (mpu.pbr << 16) | mpu.pc
+        p = mpu.p
+        code, length, text = disassembler.decode(address, 1 if p & MS else 0,
+                                                 1 if p & IRS else 0)
+        a = mpu.a
+        if mpu.mode or p & MS:
+            a |= mpu.b << 8
+        f.write('%-36s A=%04x X=%04x Y=%04x S=%04x D=%04x B=%02x P=%02x E=%d\n' %
+                (format_line((address, code, text, None)), a, mpu.x, mpu.y,
+                 mpu.sp, mpu.dpr, mpu.dbr, p, mpu.mode))
+        mpu.step()
+
+
+def format_line(line):
+    address, code, text, widths = line
+    return '%02x:%04x  %-11s  %s' % (address >> 16, address & 0xffff,
+                                     ' '.join(['%02x' % value for value in code]),
+                                     text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 disassembler')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0,
+                        help='load address (default %(default)s)')
+    parser.add_argument('--start', type=lambda s: int(s, 0), default=None,
+                        help='first address (default the load address)')
+    parser.add_argument('--end', type=lambda s: int(s, 0), default=None,
+                        help='address after the last (default the end of the image)')
+    parser.add_argument('--native', action='store_true',
+                        help='start in native mode with 16 bit registers')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='write the listing to PATH')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    memory = [0] * 0x1000000
+    memory[args.load:args.load + len(image)] = image
+    start = args.load if args.start is None else args.start
+    end = args.load + len(image) if args.end is None else args.end
+    flags = (0, 0, 0) if args.native else (1, 1, 1)
+
+    disassembler = Disassembler(memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            disassembler.write(f, start, end, *flags)
+    else:
+        disassembler.write(sys.stdout, start, end, *flags)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,615 @@
+# Property based fuzzing of instruction semantics
+#
+# Random initial states (registers, P, E, D, DBR, PBR and memory) and random
+# opcodes are run through the MPU and through an independent table driven
+# oracle, and any difference in the registers, flags or memory writes is
+# shrunk to a small failing case.  The oracle covers the eight accumulator
+# instructions (ORA, AND, EOR, ADC, STA, LDA, CMP, SBC) in all fifteen of
+# their addressing modes, with the direct page indirect, stack relative
+# indirect indexed and decimal mode cases weighted up since they are the
+# least tested parts of the simulation.
+#
+# Cases are states in the single step test vector format (see vectors.py),
+# so a shrunk failure can be saved and rerun as a test vector.  Memory that
+# a case doesn't set reads as a pseudo random function of the address, so a
+# wrong effective address shows up as wrong data without any memory being
+# allocated per case.
+#
+# From the py65 folder:
+#   python -m devices.fuzz -n 1000000 -j 8
+#   python -m devices.fuzz -n 100000 --seed 7 --save failures.json
+#   python -m devices.fuzz -n 1000000 --batch 1000
+#
+# Assumptions the oracle makes about the hardware, from the 65816
+# Programming Manual:
+# * in emulation mode with DL = 0 the 6502 direct page modes (d, d,x, (d),
+#   (d,x) and (d),y) wrap within the direct page, [d] and [d],y don't
+# * direct page and stack relative addresses otherwise wrap within bank 0,
+#   other addresses (e.g. abs,X or (d),y) carry into the next bank
+# * decimal mode ADC/SBC give the decimally adjusted result with N and Z
+#   taken from it, V isn't compared in decimal mode and only valid BCD
+#   operands are generated
+
+import argparse
+import concurrent.futures
+import json
+import random
+import sys
+
+from devices.mpu65c816 import MPU
+from devices.vectors import Runner, SparseMemory, REGISTERS
+
+OPERATIONS = ('ORA', 'AND', 'EOR', 'ADC', 'STA', 'LDA', 'CMP', 'SBC')
+
+# addressing mode by the low 5 bits of the opcode
+MODES = {
+    0x01: 'dix', 0x03: 'str', 0x05: 'dpg', 0x07: 'dil', 0x09: 'imm',
+    0x0d: 'abs', 0x0f: 'abl', 0x11: 'diy', 0x12: 'dpi', 0x13: 'siy',
+    0x15: 'dpx', 0x17: 'dly', 0x19: 'aby', 0x1d: 'abx', 0x1f: 'alx',
+}
+
+LENGTHS = {
+    'dix': 1, 'str': 1, 'dpg': 1, 'dil': 1, 'imm': 1, 'abs': 2, 'abl': 3,
+    'diy': 1, 'dpi': 1, 'siy': 1, 'dpx': 1, 'dly': 1, 'aby': 2, 'abx': 2,
+    'alx': 3,
+}
+
+# opcode => (operation, mode), STA # is BIT # on the 65816
+OPCODES = {}
+for _row, _operation in enumerate(OPERATIONS):
+    for _column, _mode in MODES.items():
+        if (_operation, _mode) != ('STA', 'imm'):
+            OPCODES[(_row << 5) | _column] = (_operation, _mode)
+
+WEAK_MODES = ('dix', 'dpi', 'dil', 'diy', 'dly', 'siy')
+
+CARRY = 0x01
+ZERO = 0x02
+DECIMAL = 0x08
+IRS = 0x10
+MS = 0x20
+OVERFLOW = 0x40
+NEGATIVE = 0x80
+
+
+class RandomMemory(SparseMemory):
+    # memory a case hasn't written reads as a hash of the address
+    seed = 0
+
+    def __missing__(self, address):
+        return (((address ^ self.seed) * 0x9E3779B1) >> 13) & 0xff
+
+
+class Oracle:
+    # executes one instruction on a vector format state, written directly
+    # from the programming manual rather than from the MPU code
+
+    def __init__(self, memory):
+        self.memory = memory # read only, writes are collected separately
+        self.reads = None # a dict to record the addresses read
+
+    def read(self, address):
+        address &= 0xffffff
+        value = self.memory[address]
+        if self.reads is not None:
+            self.reads[address] = value
+        return value
+
+    def pointer(self, address, wrap, size):
+        # size bytes at address, wrap is the mask for the following bytes
+        value = 0
+        for i in range(size):
+            value |= self.read(wrap(address, i)) << (8 * i)
+        return value
+
+    def address(self, state, mode):
+        # (effective address, wrap for the bytes after it), None for immediate
+        e = state['e']
+        d = state['d']
+        x = state['x']
+        y = state['y']
+        bank = state['dbr'] << 16
+        pc = (state['pbr'] << 16) | ((state['pc'] + 1) & 0xffff)
+        operand = self.pointer(pc, self.programWrap, LENGTHS[mode])
+
+        if e and not d & 0xff:
+            # emulation mode direct page, stays within the page
+            def page(address, i):
+                return (address & 0xff00) | ((address + i) & 0xff)
+            direct = page
+        else:
+            direct = self.bankWrap
+
+        if mode == 'imm':
+            return None, None
+        if mode == 'dpg':
+            return direct(d + operand, 0), direct
+        if mode == 'dpx':
+            return direct(d + operand, x), direct
+        if mode == 'dix':
+            return bank | self.pointer(direct(d + operand, x), direct, 2), self.longWrap
+        if mode == 'dpi':
+            return bank | self.pointer(direct(d + operand, 0), direct, 2), self.longWrap
+        if mode == 'diy':
+            return (bank + self.pointer(direct(d + operand, 0), direct, 2) + y) & 0xffffff, self.longWrap
+        if mode == 'dil':
+            return self.pointer((d + operand) & 0xffff, self.bankWrap, 3), self.longWrap
+        if mode == 'dly':
+            return (self.pointer((d + operand) & 0xffff, self.bankWrap, 3) + y) & 0xffffff, self.longWrap
+        if mode == 'str':
+            return (state['s'] + operand) & 0xffff, self.bankWrap
+        if mode == 'siy':
+            base = self.pointer((state['s'] + operand) & 0xffff, self.bankWrap, 2)
+            return (bank + base + y) & 0xffffff, self.longWrap
+        if mode == 'abs':
+            return bank | operand, self.longWrap
+        if mode == 'abx':
+            return (bank + operand + x) & 0xffffff, self.longWrap
+        if mode == 'aby':
+            return (bank + operand + y) & 0xffffff, self.longWrap
+        if mode == 'abl':
+            return operand, self.longWrap
+        if mode == 'alx':
+            return (operand + x) & 0xffffff, self.longWrap
+
+    @staticmethod
+    def programWrap(address, i):
+        return (address & 0xff0000) | ((address + i) & 0xffff)
+
+    @staticmethod
+    def bankWrap(address, i):
+        return (address + i) & 0xffff
+
+    @staticmethod
+    def longWrap(address, i):
+        return (address + i) & 0xffffff
+
+    def execute(self, state):
+        # returns (final state, {address: value} written)
+        operation, mode = OPCODES[self.read((state['pbr'] << 16) | state['pc'])]
+        wide = not state['e'] and not state['p'] & MS
+        width = 2 if wide else 1
+
+        length = width if mode == 'imm' else LENGTHS[mode]
+        final = dict(state)
+        final['pc'] = (state['pc'] + 1 + length) & 0xffff
+
+        mask = 0xffff if wide else 0xff
+        sign = 0x8000 if wide else 0x80
+        a = state['a'] & mask
+        p = state['p']
+        writes = {}
+
+        address, wrap = self.address(state, mode)
+        if operation == 'STA':
+            for i in range(width):
+                writes[wrap(address, i)] = (a >> (8 * i)) & 0xff
+            return final, writes
+
+        if address is None:
+            pc = (state['pbr'] << 16) | ((state['pc'] + 1) & 0xffff)
+            data = self.pointer(pc, self.programWrap, width)
+        else:
+            data = self.pointer(address, wrap, width)
+
+        if operation == 'ORA':
+            result = a | data
+        elif operation == 'AND':
+            result = a & data
+        elif operation == 'EOR':
+            result = a ^ data
+        elif operation == 'LDA':
+            result = data
+        elif operation == 'CMP':
+            result = (a - data) & mask
+            p = (p & ~CARRY) | (CARRY if a >= data else 0)
+        elif operation == 'ADC':
+            if p & DECIMAL:
+                result, carry = decimalAdd(a, data, p & CARRY, width)
+            else:
+                total = a + data + (p & CARRY)
+                result = total & mask
+                carry = total > mask
+                p &= ~OVERFLOW
+                if ~(a ^ data) & (a ^ result) & sign:
+                    p |= OVERFLOW
+            p = (p & ~CARRY) | (CARRY if carry else 0)
+        elif operation == 'SBC':
+            if p & DECIMAL:
+                result, carry = decimalSubtract(a, data, p & CARRY, width)
+            else:
+                total = a - data - (1 - (p & CARRY))
+                result = total & mask
+                carry = total >= 0
+                p &= ~OVERFLOW
+                if (a ^ data) & (a ^ result) & sign:
+                    p |= OVERFLOW
+            p = (p & ~CARRY) | (CARRY if carry else 0)
+
+        p &= ~(ZERO | NEGATIVE)
+        if result == 0:
+            p |= ZERO
+        if result & sign:
+            p |= NEGATIVE
+        final['p'] = p
+        if operation != 'CMP':
+            final['a'] = (state['a'] & ~mask) | result
+        return final, writes
+
+
+def decimalAdd(a, b, carry, width):
+    result = 0
+    for shift in range(0, 8 * width, 4):
+        digit = ((a >> shift) & 0xf) + ((b >> shift) & 0xf) + carry
+        carry = digit > 9
+        if carry:
+            digit -= 10
+        result |= digit << shift
+    return result, carry
+
+
+def decimalSubtract(a, b, carry, width):
+    result = 0
+    for shift in range(0, 8 * width, 4):
+        digit = ((a >> shift) & 0xf) - ((b >> shift) & 0xf) - (1 - carry)
+        carry = digit >= 0
+        if not carry:
+            digit += 10
+        result |= digit << shift
+    return result, int(carry)
+
+
+def isBCD(value, width):
+    return all([((value >> shift) & 0xf) < 10 for shift in range(0, 8 * width, 4)])
+
+
+def toBCD(value, width):
+    result = 0
+    for shift in range(0, 8 * width, 4):
+        result |= (value % 10) << shift
+        value //= 10
+    return result
+
+
+class Fuzzer:
+    def __init__(self, mpuClass=MPU, seed=0, programBank=None):
+        self.random = random.Random(seed)
+        self.programBank = programBank # None for a random PBR
+        self.runner = Runner()
+        self.memory = RandomMemory()
+        self.runner.memory = self.memory
+        self.runner.mpu = mpuClass(memory=self.memory)
+        self.oracle = Oracle(self.memory)
+        self.opcodes = sorted(OPCODES)
+        self.weights = []
+        for opcode in self.opcodes:
+            operation, mode = OPCODES[opcode]
+            weight = 1
+            if mode in WEAK_MODES:
+                weight *= 3
+            if operation in ('ADC', 'SBC'):
+                weight *= 2
+            self.weights.append(weight)
+
+    # case generation
+
+    def generate(self):
+        rand = self.random
+        e = int(rand.random() < 0.3)
+        p = rand.randrange(0x100)
+        if e:
+            p |= MS | IRS
+        opcode = rand.choices(self.opcodes, self.weights)[0]
+        operation, mode = OPCODES[opcode]
+        if operation in ('ADC', 'SBC') and rand.random() < 0.5:
+            p |= DECIMAL
+        index = not e and not p & IRS
+
+        d = rand.choice((0, rand.randrange(0x100) << 8, rand.randrange(0x10000)))
+        state = {
+            'pc': rand.choice((rand.randrange(0x10000), 0xfffc + rand.randrange(4))),
+            's': 0x100 | rand.randrange(0x100) if e else rand.randrange(0x10000),
+            'p': p,
+            'a': rand.randrange(0x10000),
+            'x': rand.randrange(0x10000 if index else 0x100),
+            'y': rand.randrange(0x10000 if index else 0x100),
+            'dbr': rand.randrange(0x100),
+            'd': d,
+            'pbr': rand.randrange(0x100) if self.programBank is None else self.programBank,
+            'e': e,
+        }
+        pc = (state['pbr'] << 16) | state['pc']
+        ram = {pc: opcode}
+        for i in range(3):
+            ram[(state['pbr'] << 16) | ((state['pc'] + 1 + i) & 0xffff)] = rand.randrange(0x100)
+        case = {'seed': rand.randrange(1 << 30), 'initial': state, 'ram': ram}
+        if p & DECIMAL:
+            self.makeDecimal(case)
+        return case
+
+    def makeDecimal(self, case):
+        # valid BCD in the accumulator and the operand
+        state = case['initial']
+        ram = case['ram']
+        operation, mode = OPCODES[ram[(state['pbr'] << 16) | state['pc']]]
+        width = 2 if not state['e'] and not state['p'] & MS else 1
+        rand = self.random
+        state['a'] = (state['a'] & ~(0xffff if width == 2 else 0xff)) | \
+                     toBCD(rand.randrange(100 ** width), width)
+        self.setup(case)
+        address, wrap = self.oracle.address(state, mode)
+        if address is None:
+            pc = (state['pbr'] << 16) | ((state['pc'] + 1) & 0xffff)
+            address, wrap = pc, Oracle.programWrap
+        value = toBCD(rand.randrange(100 ** width), width)
+        saved = dict(ram)
+        for i in range(width):
+            ram[wrap(address, i)] = (value >> (8 * i)) & 0xff
+        if not self.valid(case):
+            # the operand overlapped the instruction or its pointer
+            ram.clear()
+            ram.update(saved)
+            state['p'] &= ~DECIMAL
+
+    def opcode(self, case):
+        state = case['initial']
+        return case['ram'].get((state['pbr'] << 16) | state['pc'])
+
+    def valid(self, case):
+        # the instruction is one the oracle knows, with BCD operands in
+        # decimal mode
+        if self.opcode(case) not in OPCODES:
+            return False
+        state = case['initial']
+        operation, mode = OPCODES[self.opcode(case)]
+        if not state['p'] & DECIMAL or operation not in ('ADC', 'SBC'):
+            return True
+        width = 2 if not state['e'] and not state['p'] & MS else 1
+        self.setup(case)
+        address, wrap = self.oracle.address(state, mode)
+        if address is None:
+            address = (state['pbr'] << 16) | ((state['pc'] + 1) & 0xffff)
+            wrap = Oracle.programWrap
+        return isBCD(state['a'], width) and \
+            isBCD(self.oracle.pointer(address, wrap, width), width)
+
+    # running
+
+    def setup(self, case):
+        self.memory.seed = case['seed']
+        state = dict(case['initial'])
+        state['ram'] = list(case['ram'].items())
+        self.runner.setup(state)
+
+    def check(self, case):
+        # returns the sorted fields that differ, empty if the case passed
+        self.setup(case)
+        expected, writes = self.oracle.execute(case['initial'])
+        try:
+            self.runner.mpu.step()
+        except Exception as e:
+            return ('exception ' + type(e).__name__,)
+        return self.compare(case, expected, writes, self.runner.state(),
+                            self.memory)
+
+    def compare(self, case, expected, writes, state, memory):
+        # the fields where the MPU's state and memory after the step differ
+        # from the oracle's
+        differences = []
+        ignore = 0
+        if expected['p'] & DECIMAL and OPCODES[self.opcode(case)][0] in ('ADC', 'SBC'):
+            ignore = OVERFLOW
+        for register in REGISTERS:
+            if register == 'p':
+                if (expected['p'] ^ state['p']) & ~ignore:
+                    differences.append('p')
+            elif expected[register] != state[register]:
+                differences.append(register)
+
+        ram = case['ram']
+        for address, value in writes.items():
+            if memory[address] != value:
+                differences.append('write')
+                break
+        else:
+            for address, value in memory.items():
+                if address not in writes and ram.get(address) != value:
+                    differences.append('write')
+                    break
+        return tuple(differences)
+
+    def signature(self, case, differences):
+        return self.opcode(case), differences
+
+    # shrinking
+
+    def shrink(self, case, differences):
+        # simplifies a failing case while it fails the same way
+        target = self.signature(case, differences)
+        changed = True
+        while changed:
+            changed = False
+            for candidate in self.simpler(case):
+                if not self.valid(candidate):
+                    continue
+                differences = self.check(candidate)
+                if differences and self.signature(candidate, differences) == target:
+                    case = candidate
+                    changed = True
+                    break
+        return case
+
+    def simpler(self, case):
+        state = case['initial']
+        e = state['e']
+        for field in ('a', 'x', 'y', 'd', 'dbr', 's', 'pbr', 'pc'):
+            if field == 'pbr' and self.programBank is not None:
+                continue
+            value = state[field]
+            if field == 's' and e:
+                value &= 0xff
+            for smaller in (0, value >> 8 << 8, value >> 1):
+                if smaller >= value:
+                    continue
+                if field == 's' and e:
+                    smaller |= 0x100
+                yield self.moved(case, field, smaller)
+        for bit in (CARRY, ZERO, 0x04, IRS, MS, OVERFLOW, NEGATIVE):
+            if state['p'] & bit and not (e and bit in (IRS, MS)):
+                candidate = self.copy(case)
+                candidate['initial']['p'] &= ~bit
+                yield candidate
+        if case['seed']:
+            candidate = self.copy(case)
+            candidate['seed'] = 0
+            yield candidate
+        opcodeAddress = (state['pbr'] << 16) | state['pc']
+        for address, value in case['ram'].items():
+            if value and address != opcodeAddress:
+                candidate = self.copy(case)
+                candidate['ram'][address] = 0
+                yield candidate
+
+    def copy(self, case):
+        return {'seed': case['seed'], 'initial': dict(case['initial']),
+                'ram': dict(case['ram'])}
+
+    def moved(self, case, field, value):
+        # a copy with field changed, the program moves with pc and pbr
+        candidate = self.copy(case)
+        state = candidate['initial']
+        if field in ('pc', 'pbr'):
+            old = (state['pbr'] << 16) | state['pc']
+            state[field] = value
+            new = (state['pbr'] << 16) | state['pc']
+            ram = candidate['ram']
+            program = [ram.pop(Oracle.programWrap(old, i), None) for i in range(4)]
+            for i, value in enumerate(program):
+                if value is not None:
+                    ram[Oracle.programWrap(new, i)] = value
+        else:
+            state[field] = value
+        return candidate
+
+    def vector(self, case, name):
+        # the case as a single step test vector with the final state from
+        # the oracle, the memory it read is part of the initial state
+        self.setup(case)
+        self.oracle.reads = {}
+        final, writes = self.oracle.execute(case['initial'])
+        ram = dict(self.oracle.reads)
+        self.oracle.reads = None
+        ram.update(case['ram'])
+        initial = dict(case['initial'])
+        initial['ram'] = sorted(ram.items())
+        ram.update(writes)
+        final['ram'] = sorted(ram.items())
+        return {'name': name, 'initial': initial, 'final': final}
+
+    def run(self, count, limit=3):
+        # returns {signature: [hits, shrunk cases up to limit]}
+        failures = {}
+        for case, differences in self.results(count):
+            if differences:
+                key = self.signature(case, differences)
+                found = failures.setdefault(key, [0, []])
+                found[0] += 1
+                if len(found[1]) < limit:
+                    found[1].append(self.shrink(case, differences))
+        return failures
+
+    def results(self, count):
+        # yields count (case, differences)
+        for i in range(count):
+            case = self.generate()
+            yield case, self.check(case)
+
+
+# one fuzzer per worker process, remade when the options change
+_fuzzer = None
+_options = None
+
+
+def _run_batch(args):
+    global _fuzzer, _options
+    seed, count, limit, programBank, lockstep = args
+    if _fuzzer is None or _options != (programBank, lockstep):
+        _options = (programBank, lockstep)
+        if lockstep:
+            from devices.batch import BatchFuzzer
+            _fuzzer = BatchFuzzer(programBank=programBank, count=lockstep)
+        else:
+            _fuzzer = Fuzzer(programBank=programBank)
+    _fuzzer.random.seed(seed)
+    return _fuzzer.run(count, limit)
+
+
+def fuzz(count, processes=None, seed=0, limit=3, batch=10000, programBank=None,
+         lockstep=None):
+    # returns {signature: [hits, shrunk cases]} merged across processes,
+    # lockstep cases at a time run together (see batch.py)
+    jobs = []
+    for i in range(0, count, batch):
+        jobs.append((seed * 1000003 + i, min(batch, count - i), limit,
+                     programBank, lockstep))
+    if processes == 1:
+        results = map(_run_batch, jobs)
+        return _merge(results, limit)
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        return _merge(pool.map(_run_batch, jobs), limit)
+
+
+def _merge(results, limit):
+    failures = {}
+    for result in results:
+        for key, (hits, cases) in result.items():
+            found = failures.setdefault(key, [0, []])
+            found[0] += hits
+            found[1].extend(cases[:limit - len(found[1])])
+    return failures
+
+
+def describe(key):
+    opcode, differences = key
+    operation, mode = OPCODES[opcode]
+    return '%02x %s %s: %s' % (opcode, operation, mode, ' '.join(differences))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 instruction fuzzer')
+    parser.add_argument('-n', '--cases', type=int, default=100000,
+                        help='cases to run (default %(default)s)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default one per core)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default %(default)s)')
+    parser.add_argument('--pbr', type=lambda s: int(s, 0), default=None,
+                        help='keep the program bank at PBR (default random)')
+    parser.add_argument('--save', metavar='PATH',
+                        help='save the shrunk failures as test vectors')
+    parser.add_argument('--batch', type=int, default=None, metavar='N',
+                        help='run N cases at a time in lockstep (needs NumPy)')
+    args = parser.parse_args(argv)
+
+    failures = fuzz(args.cases, args.processes, args.seed,
+                    programBank=args.pbr, lockstep=args.batch)
+    fuzzer = Fuzzer(programBank=args.pbr)
+    vectors = []
+    for key in sorted(failures):
+        hits, cases = failures[key]
+        print('%-40s %7d' % (describe(key), hits))
+        for i, case in enumerate(cases):
+            vector = fuzzer.vector(case, '%s %d' % (describe(key), i))
+            vectors.append(vector)
+            initial = vector['initial']
+            print('    ' + ' '.join(['%s=%x' % (register, initial[register])
+                                     for register in REGISTERS]))
+    print('%d cases, %d failure signatures' % (args.cases, len(failures)))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(vectors, f)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# GDB remote serial protocol stub
+#
+# GdbStub serves an MPU to a GDB remote protocol client (gdb's target
+# remote, or any front end speaking the protocol) on a local TCP port:
+# registers, memory, breakpoints, watchpoints, single step and continue,
+# which runs the MPU with run() in chunks so a stub never holds up the
+# others.  The stubs run on asyncio, one event loop serves any number of
+# boards, each on its own port:
+#
+#   stubs = [GdbStub(mpu) for mpu in mpus]
+#   servers = await serve(stubs, port=3333)     # ports 3333, 3334 ...
+#
+#   (gdb) target remote localhost:3333
+#
+# The registers, in the order of g and G and numbered for p and P, are
+# REGISTERS below: a is the full 16 bit accumulator (B and A with an 8 bit
+# accumulator), sp has page 1 in it in emulation mode, pc is the 16 bit
+# program counter with pbr its bank, and p is the status register, with M
+# and X as its bits 5 and 4, and e the emulation flag.  target.xml
+# (qXfer:features:read) describes them.  Addresses are 24 bit.
+#
+# * Breakpoints (Z0, Z1) and watchpoints (Z2 write, Z3 read, Z4 access) are
+#   a watchpoints.Watcher's, nothing is installed while there are none.
+# * Writing p or e doesn't do what REP, SEP and XCE would to the registers.
+# * A stopped (STP) or idle (WAI with nothing scheduled) MPU stops with
+#   SIGTRAP, an interrupt (^C) with SIGINT.
+#
+# From the py65 folder:
+#   python -m devices.gdbstub of816_forth.bin --load 0x8000 --port 3333
+
+import argparse
+import asyncio
+import sys
+
+from devices.mpu65c816 import MPU
+from devices.watchpoints import Watcher, RUN_BREAK
+
+# (name, bits)
+REGISTERS = (
+    ('a', 16), ('x', 16), ('y', 16), ('sp', 16), ('d', 16),
+    ('dbr', 8), ('pbr', 8), ('pc', 16), ('p', 8), ('e', 8),
+)
+
+SIGINT = 2
+SIGTRAP = 5
+
+FLAGS = ('C', 'Z', 'I', 'D', 'X', 'M', 'V', 'N') # p's bits, from bit 0
+
+TARGET_XML = ('<?xml version="1.0"?>\n'
+              '<!DOCTYPE target SYSTEM "gdb-target.dtd">\n'
+              '<target version="1.0">\n'
+              '<feature name="org.py65.w65c816">\n'
+              '<flags id="p_flags" size="1">\n' +
+              ''.join('<field name="%s" start="%d" end="%d"/>\n' % (flag, bit, bit)
+                      for bit, flag in enumerate(FLAGS)) +
+              '</flags>\n' +
+              ''.join('<reg name="%s" bitsize="%d" type="%s"/>\n'
+                      % (name, bits, 'p_flags' if name == 'p' else 'uint%d' % bits)
+                      for name, bits in REGISTERS) +
+              '</feature>\n'
+              '</target>\n')
+
+
+def checksum(data):
+    return sum(data.encode('latin-1')) & 0xff
+
+
+def frame(data):
+    return ('$%s#%02x' % (data, checksum(data))).encode('latin-1')
+
+
+def little(value, bits):
+    # the value as little endian hex
+    return ''.join('%02x' % ((value >> shift) & 0xff) for shift in range(0, bits, 8))
+
+
+def unlittle(text):
+    return sum(int(text[i:i + 2], 16) << (i * 4) for i in range(0, len(text), 2))
+
+
+class GdbStub:
+    def __init__(self, mpu, chunk=10000):
+        self.mpu = mpu
+        self.chunk = chunk # instructions run between looking for ^C
+        self.watcher = Watcher(mpu)
+        self.points = {} # (type, address, length): watcher id
+        self.ack = True
+
+    # registers
+
+    def register(self, name):
+        mpu = self.mpu
+        if name == 'a':
+            return (mpu.b << 8) | mpu.a if mpu.p & mpu.MS else mpu.a
+        if name == 'sp':
+            return 0x100 | mpu.sp if mpu.mode else mpu.sp
+        if name == 'd':
+            return mpu.dpr
+        if name == 'e':
+            return mpu.mode
+        return getattr(mpu, name)
+
+    def setRegister(self, name, value):
+        mpu = self.mpu
+        if name == 'a':
+            if mpu.p & mpu.MS:
+                mpu.a = value & 0xff
+                mpu.b = value >> 8
+            else:
+                mpu.a = value
+        elif name == 'sp':
+            mpu.sp = value & 0xff if mpu.mode else value
+        elif name == 'd':
+            mpu.dpr = value
+        elif name == 'e':
+            mpu.mode = value & 1
+        else:
+            setattr(mpu, name, value)
+
+    def registers(self):
+        return ''.join(little(self.register(name), bits) for name, bits in REGISTERS)
+
+    def setRegisters(self, text):
+        for name, bits in REGISTERS:
+            self.setRegister(name, unlittle(text[:bits // 4]))
+            text = text[bits // 4:]
+
+    # packets
+
+    def command(self, packet):
+        # the reply to a packet other than c and s
+        mpu = self.mpu
+        kind, rest = packet[:1], packet[1:]
+        try:
+            if kind == '?':
+                return 'S%02x' % SIGTRAP
+            if kind == 'g':
+                return self.registers()
+            if kind == 'G':
+                self.setRegisters(rest)
+                return 'OK'
+            if kind == 'p':
+                name, bits = REGISTERS[int(rest, 16)]
+                return little(self.register(name), bits)
+            if kind == 'P':
+                number, value = rest.split('=')
+                self.setRegister(REGISTERS[int(number, 16)][0], unlittle(value))
+                return 'OK'
+            if kind == 'm':
+                address, length = [int(field, 16) for field in rest.split(',')]
+                return ''.join('%02x' % mpu.memory[(address + i) & 0xffffff]
+                               for i in range(length))
+            if kind == 'M':
+                where, data = rest.split(':')
+                address, length = [int(field, 16) for field in where.split(',')]
+                for i in range(length):
+                    mpu.memory[(address + i) & 0xffffff] = int(data[i * 2:i * 2 + 2], 16)
+                return 'OK'
+            if kind and kind in 'Zz':
+                return self.point(kind == 'Z', rest)
+            if kind == 'H':
+                return 'OK'
+            if kind == 'D':
+                return 'OK'
+            if packet.startswith('qSupported'):
+                return 'PacketSize=1000;qXfer:features:read+;QStartNoAckMode+'
+            if packet.startswith('qXfer:features:read:target.xml:'):
+                offset, length = [int(field, 16) for field in packet.split(':')[4].split(',')]
+                data = TARGET_XML[offset:offset + length]
+                return ('m' if offset + length < len(TARGET_XML) else 'l') + data
+            if packet == 'QStartNoAckMode':
+                self.ack = False
+                return 'OK'
+            if packet == 'qAttached':
+                return '1'
+            if packet == 'qC':
+                return 'QC1'
+            if packet == 'qfThreadInfo':
+                return 'm1'
+            if packet == 'qsThreadInfo':
+                return 'l'
+        except (ValueError, IndexError, KeyError):
+            return 'E01'
+        return '' # not supported
+
+    def point(self, insert, rest):
+        # Z and z, breakpoints and watchpoints
+        kind, address, length = rest.split(';')[0].split(',')
+        key = (kind, int(address, 16), int(length, 16))
+        if kind not in '01234' or len(kind) != 1:
+            return ''
+        if not insert:
+            if key in self.points:
+                self.watcher.remove(self.points.pop(key))
+            return 'OK'
+        if key not in self.points:
+            start = key[1] & 0xffffff
+            if kind in '01':
+                self.points[key] = self.watcher.breakpoint(start)
+            else:
+                kinds = {'2': 'w', '3': 'r', '4': 'rw'}[kind]
+                self.points[key] = self.watcher.watch(start, start + max(key[2], 1), kinds)
+        return 'OK'
+
+    def stopped(self, reason):
+        # the stop reply for a run() reason
+        hit = self.watcher.hit
+        if reason != RUN_BREAK or hit is None:
+            return 'S%02x' % SIGTRAP
+        kind, what, at = hit
+        if kind in 'rw':
+            name = 'watch' if kind == 'w' else 'rwatch'
+            for (point, address, length) in self.points:
+                if point == '4' and address <= what < address + max(length, 1):
+                    name = 'awatch'
+            return 'T%02x%s:%x;' % (SIGTRAP, name, what)
+        return 'T%02x' % SIGTRAP
+
+    async def resume(self, packet, packets):
+        # c and s, the reply once the MPU stops
+        mpu = self.mpu
+        if len(packet) > 1:
+            mpu.pc = int(packet[1:], 16) & 0xffff
+        if packet[0] == 's':
+            return self.stopped(self.watcher.run(count=1))
+        resume = True
+        while True:
+            reason = self.watcher.run(count=self.chunk, resume=resume)
+            resume = False
+            if reason != mpu.RUN_COUNT:
+                return self.stopped(reason)
+            await asyncio.sleep(0)
+            while not packets.empty():
+                if packets.get_nowait() == '\x03':
+                    return 'S%02x' % SIGINT
+
+    # the connection
+
+    async def read(self, reader, writer, packets):
+        # puts each packet (or ^C) on packets, None at the end
+        buffer = b''
+        while True:
+            try:
+                data = await reader.read(4096)
+            except ConnectionError:
+                data = b''
+            if not data:
+                await packets.put(None)
+                return
+            buffer += data
+            while buffer:
+                if buffer[:1] in (b'+', b'-'):
+                    buffer = buffer[1:]
+                elif buffer[:1] == b'\x03':
+                    buffer = buffer[1:]
+                    await packets.put('\x03')
+                elif buffer[:1] == b'$':
+                    end = buffer.find(b'#')
+                    if end < 0 or len(buffer) < end + 3:
+                        break
+                    packet = buffer[1:end].decode('latin-1')
+                    try:
+                        good = checksum(packet) == int(buffer[end + 1:end + 3], 16)
+                    except ValueError: # not hex
+                        good = False
+                    buffer = buffer[end + 3:]
+                    if self.ack:
+                        writer.write(b'+' if good else b'-')
+                    if good:
+                        await packets.put(packet)
+                else:
+                    buffer = buffer[1:]
+
+    async def session(self, reader, writer):
+        packets = asyncio.Queue()
+        reading = asyncio.ensure_future(self.read(reader, writer, packets))
+        self.ack = True
+        try:
+            while True:
+                packet = await packets.get()
+                if packet is None or packet == 'k':
+                    break
+                if packet == '\x03':
+                    reply = 'S%02x' % SIGINT
+                elif packet[:1] in ('c', 's'):
+                    reply = await self.resume(packet, packets)
+                else:
+                    reply = self.command(packet)
+                writer.write(frame(reply))
+                await writer.drain()
+                if packet == 'D':
+                    break
+        except (asyncio.CancelledError, ConnectionError):
+            pass # the server shutting down or the client gone
+        finally:
+            reading.cancel()
+            await asyncio.gather(reading, return_exceptions=True)
+            writer.close()
+
+
+async def serve(stubs, host='127.0.0.1', port=3333):
+    # a server for each stub, on port and those after it, port 0 for any
+    # free ports
+    servers = []
+    for i, stub in enumerate(stubs):
+        servers.append(await asyncio.start_server(stub.session, host,
+                                                  port + i if port else 0))
+    return servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 GDB remote protocol stub')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0,
+                        help='load address (default %(default)s)')
+    parser.add_argument('--port', type=int, default=3333,
+                        help='first TCP port on localhost (default %(default)s)')
+    parser.add_argument('--boards', type=int, default=1,
+                        help='MPUs to serve, each with the image (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    stubs = []
+    for i in range(args.boards):
+        mpu = MPU(memory=[0] * 0x1000000)
+        mpu.memory[args.load:args.load + len(image)] = image
+        mpu.reset()
+        stubs.append(GdbStub(mpu))
+
+    async def run():
+        servers = await serve(stubs, port=args.port)
+        for server in servers:
+            sys.stderr.write('listening on %s:%d\n' % server.sockets[0].getsockname()[:2])
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# Memory access heat map and working set
+#
+# HeatMap counts the reads and writes of each 256 byte page of the 24 bit
+# address space, in two preallocated arrays of 65536 counters, and, for
+# ranges asked for with watch(), of each byte.  The memory is wrapped while
+# counting, the same way bustrace.py records the bus, nothing changes
+# otherwise:
+#
+#   heat = HeatMap(mpu, window=100000)
+#   heat.watch(0x0000, 0x0200)      # direct page and stack byte by byte
+#   heat.start()
+#   mpu.run(count=1000000)
+#   heat.stop()
+#   heat.report(sys.stdout)
+#
+# Every window cycles run() calls back, at the end of the instruction
+# reaching them, to close a window, recording the pages touched in it (the
+# working set), its reads and writes and where the direct page and the
+# stack were at the time.  hottest() marks the pages the direct page and
+# stack have been in, for spotting them crowding the same hot pages.
+#
+# * Opcode and operand fetches are reads like any other.
+# * Slice reads and writes (loading an image) aren't counted.
+# * Windows are closed by scheduled events, so only while run() is running
+#   them, a window skipped over by an idle loop closes late with the idle
+#   time in it.
+# * The counters are arrays from the standard library rather than NumPy's,
+#   so profiling a board doesn't pay for importing NumPy, which only
+#   batch.py needs.
+#
+# From the py65 folder:
+#   python -m devices.heatmap of816_forth.bin --load 0x8000 --count 1000000
+
+import argparse
+import sys
+from array import array
+
+from devices.mpu65c816 import MPU
+
+PAGES = 0x10000 # 256 byte pages in 24 bits
+
+
+class CountingMemory:
+    # wraps the mpu's memory while counting
+    def __init__(self, subject, heat):
+        self.subject = subject
+        self.reads = heat.reads
+        self.writes = heat.writes
+        self.seen = heat.seen
+        self.heat = heat
+        self.ranges = heat.ranges
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        if not isinstance(address, slice):
+            page = address >> 8
+            self.reads[page] += 1
+            if self.seen[page] != self.heat.current:
+                self.heat.touch(page)
+            for start, end, reads, writes in self.ranges:
+                if start <= address < end:
+                    reads[address - start] += 1
+        return self.subject[address]
+
+    def __setitem__(self, address, value):
+        self.subject[address] = value
+        if not isinstance(address, slice):
+            page = address >> 8
+            self.writes[page] += 1
+            if self.seen[page] != self.heat.current:
+                self.heat.touch(page)
+            for start, end, reads, writes in self.ranges:
+                if start <= address < end:
+                    writes[address - start] += 1
+
+
+class HeatMap:
+    def __init__(self, mpu, window=100000):
+        self.mpu = mpu
+        self.window = window
+        self.reads = array('L', [0]) * PAGES
+        self.writes = array('L', [0]) * PAGES
+        self.seen = array('L', [0]) * PAGES # the window a page was last touched in
+        self.ranges = [] # [(start, end, reads, writes)] counted by byte
+        self.windows = [] # [(start cycle, end cycle, pages, reads, writes, dpr, sp)]
+        self.dpPages = set() # the pages the direct page has been in
+        self.stackPages = set()
+        self.current = 1 # the window being counted, from 2
+        self.touched = 0 # pages touched in it
+        self.windowStart = 0
+        self.counts = (0, 0) # reads and writes when the window started
+        self.memory = None
+        self.generation = 0
+
+    def watch(self, start, end):
+        # count the bytes from start up to end one by one
+        self.ranges.append((start, end, array('L', [0]) * (end - start),
+                            array('L', [0]) * (end - start)))
+
+    def start(self):
+        mpu = self.mpu
+        self.memory = CountingMemory(mpu.memory, self)
+        mpu.memory = self.memory
+        self.begin()
+        self.generation += 1
+        self.schedule(self.generation)
+
+    def stop(self):
+        if self.memory is None:
+            return
+        mpu = self.mpu
+        mpu.memory = self.memory.subject
+        self.memory = None
+        self.close()
+        self.generation += 1
+
+    def clear(self):
+        for counts in (self.reads, self.writes, self.seen):
+            counts[:] = array('L', [0]) * PAGES
+        for start, end, reads, writes in self.ranges:
+            reads[:] = array('L', [0]) * (end - start)
+            writes[:] = array('L', [0]) * (end - start)
+        self.windows = []
+        self.dpPages = set()
+        self.stackPages = set()
+        self.current = 1
+        self.begin()
+
+    # windows
+
+    def touch(self, page):
+        self.seen[page] = self.current
+        self.touched += 1
+
+    def totals(self):
+        return sum(self.reads), sum(self.writes)
+
+    def begin(self):
+        mpu = self.mpu
+        self.current += 1
+        self.touched = 0
+        self.windowStart = mpu.processorCycles
+        self.counts = self.totals()
+        self.places()
+
+    def places(self):
+        # the pages the direct page and stack are in now
+        mpu = self.mpu
+        self.dpPages.update((mpu.dpr >> 8, ((mpu.dpr + 0xff) & 0xffff) >> 8))
+        self.stackPages.add((0x100 + mpu.sp if mpu.mode else mpu.sp) >> 8)
+
+    def close(self):
+        mpu = self.mpu
+        if mpu.processorCycles == self.windowStart:
+            return
+        reads, writes = self.totals()
+        self.places()
+        self.windows.append((self.windowStart, mpu.processorCycles, self.touched,
+                             reads - self.counts[0], writes - self.counts[1],
+                             mpu.dpr, mpu.sp))
+
+    def schedule(self, generation):
+        mpu = self.mpu
+        end = (mpu.processorCycles // self.window + 1) * self.window
+
+        def tick(mpu):
+            if generation != self.generation:
+                return # stopped since
+            self.close()
+            self.begin()
+            self.schedule(generation)
+        mpu.schedule(end, tick)
+
+    # results
+
+    def pages(self):
+        # [(page, reads, writes)] of the pages touched, by address
+        reads = self.reads
+        writes = self.writes
+        return [(page, reads[page], writes[page]) for page in range(PAGES)
+                if reads[page] or writes[page]]
+
+    def hottest(self, limit=None):
+        # [(page, reads, writes, places)], the most accesses first, places
+        # 'D' for a page the direct page has been in and 'S' the stack
+        pages = sorted(self.pages(), key=lambda page: (-(page[1] + page[2]), page[0]))
+        return [(page, reads, writes, ('D' if page in self.dpPages else '') +
+                 ('S' if page in self.stackPages else ''))
+                for page, reads, writes in pages[:limit]]
+
+    def banks(self):
+        # {bank: (pages touched, reads, writes)}
+        banks = {}
+        for page, reads, writes in self.pages():
+            touched, bankReads, bankWrites = banks.get(page >> 8, (0, 0, 0))
+            banks[page >> 8] = (touched + 1, bankReads + reads, bankWrites + writes)
+        return banks
+
+    def bytes(self, start, end):
+        # [(address, reads, writes)] of the bytes touched in a watched range
+        for first, last, reads, writes in self.ranges:
+            if first <= start and end <= last:
+                return [(address, reads[address - first], writes[address - first])
+                        for address in range(start, end)
+                        if reads[address - first] or writes[address - first]]
+        raise ValueError('%06x-%06x not watched' % (start, end))
+
+    def report(self, f, limit=10):
+        f.write('bank  pages       reads      writes\n')
+        for bank, (touched, reads, writes) in sorted(self.banks().items()):
+            f.write('  %02x %6d %11d %11d\n' % (bank, touched, reads, writes))
+        f.write('\npage         reads      writes\n')
+        for page, reads, writes, places in self.hottest(limit):
+            f.write('%04x00 %11d %11d  %s\n' % (page, reads, writes, places))
+        if self.windows:
+            sizes = [window[2] for window in self.windows]
+            f.write('\n%d windows of %d cycles, working set %d to %d pages, mean %.1f\n'
+                    % (len(self.windows), self.window, min(sizes), max(sizes),
+                       sum(sizes) / float(len(sizes))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 memory heat map and working set')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0,
+                        help='load address (default %(default)s)')
+    parser.add_argument('--count', type=int, default=1000000,
+                        help='instructions to run from reset (default %(default)s)')
+    parser.add_argument('--window', type=int, default=100000,
+                        help='cycles in a working set window (default %(default)s)')
+    parser.add_argument('-n', '--limit', type=int, default=10,
+                        help='pages to show (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    mpu = MPU(memory=[0] * 0x1000000)
+    mpu.memory[args.load:args.load + len(image)] = image
+    mpu.reset()
+    heat = HeatMap(mpu, args.window)
+    heat.start()
+    mpu.run(count=args.count)
+    heat.stop()
+    heat.report(sys.stdout, args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# The 65C816 MPU with lazy N and Z flags
+#
+# Most instructions set N and Z from their result, and the next one that
+# does overwrites them before anything looks.  LazyFlagsMPU keeps the result
+# instead, in nz with its sign moved to bit 15 (an 8 bit result shifted left
+# 8), and works N and Z out of it only when P is read:
+#
+#   mpu = LazyFlagsMPU(memory=memory)
+#
+# P is a property.  Reading it folds a pending result into the flags, so the
+# MPU's own handlers (PHP, BRK, COP and the interrupts pushing P, PLP, RTI,
+# REP, SEP, XCE ...), cycle accurate mode, __repr__() and the monitor see
+# the flags MPU would have; writing it drops the pending result.  The
+# generated handlers (codegen.py with lazy=True) use flags, P with N and Z
+# possibly stale, for C, V and the rest, test nz directly in BPL, BMI, BNE
+# and BEQ, and read and write P in the few operations that set N or Z some
+# other way (BIT, the compares, TSB and TRB).  FlagsNZ() and FlagsNZWord(),
+# where the MPU's handlers set N and Z, are lazy too.
+#
+# * flags and nz are the state, p isn't a slot of its own here.  Something
+#   saving and restoring the registers should go through p.
+# * M and X are never pending, step() picks the handlers from flags.
+#
+# From the py65 folder, MPU against the other classes on the Forth workloads:
+#   python -m benchmarks.slots
+
+from devices.codegen import GeneratedMPU
+
+NEGATIVE = GeneratedMPU.NEGATIVE
+ZERO = GeneratedMPU.ZERO
+NZ_MASK = ~(ZERO | NEGATIVE)
+
+
+class LazyFlagsMPU(GeneratedMPU):
+    __slots__ = ('flags', 'nz')
+
+    lazy = True
+
+    def getP(self, NZ_MASK=NZ_MASK, ZERO=ZERO, NEGATIVE=NEGATIVE):
+        nz = self.nz
+        if nz is not None:
+            if nz == 0:
+                self.flags = (self.flags & NZ_MASK) | ZERO
+            else:
+                self.flags = (self.flags & NZ_MASK) | ((nz >> 8) & NEGATIVE)
+            self.nz = None
+        return self.flags
+
+    def setP(self, value):
+        self.flags = value
+        self.nz = None
+
+    p = property(getP, setP)
+
+    def step(self):
+        if self.waiting:
+            if not self.stopped:
+                self.processorCycles += 1
+        else:
+            bank = self.pbr << 16
+            instructCode = self.memory[bank + self.pc]
+            self.pc = pc = (self.pc + 1) & 0xffff
+            self.fetchAddr = bank + pc
+            self.handlers[(self.flags & 0x30) | self.mode][instructCode](self)
+        return self
+
+    # Helpers
+
+    def FlagsNZ(self, value):
+        self.nz = value << 8
+
+    def FlagsNZWord(self, value):
+        self.nz = value
@@ -0,0 +1,232 @@
+# Differential lockstep testing
+#
+# Runs a candidate MPU side by side with a reference, either another MPU
+# (e.g. the normal step() and a different implementation or mode) or a trace
+# file recorded from real hardware or an earlier known good run, and reports
+# the first instruction where the registers, flags or memory writes differ.
+#
+#   reference = MPUSide(MPU(memory=...))
+#   candidate = MPUSide(OtherMPU(memory=...))
+#   divergence = Lockstep(reference, candidate).run(1000000)
+#   if divergence:
+#       print(divergence)
+#
+# To stay fast the two sides are compared a batch of instructions at a time
+# using a hash of the final state and all the memory writes in the batch.
+# Only when the hashes differ are both sides rewound to the start of the
+# batch and stepped one instruction at a time to find the divergence.  A
+# difference in the registers that is gone again by the end of the batch
+# and never reaches memory isn't reported.  Rewinding undoes memory writes
+# but not side effects of memory mapped I/O, so use batch=1 for programs
+# that do I/O.
+#
+# A trace file has a JSON object per line with the state after each
+# instruction, e.g.
+#   {"pc": 4098, "a": 18, "p": 48, "writes": [[8192, 18]]}
+# Only the fields present in the first line are compared, so give the MPU
+# side the same ones:
+#   reference = TraceSide('hardware.jsonl')
+#   candidate = MPUSide(mpu, reference.fields)
+# record() writes such a file from an MPU run.
+
+import json
+
+# compared by default
+FIELDS = ('pc', 'pbr', 'dbr', 'dpr', 'a', 'b', 'x', 'y', 'p', 'sp', 'mode')
+
+# restored when rewinding an MPU
+SNAPSHOT = FIELDS + ('processorCycles', 'waiting', 'stopped')
+
+
+class JournalMemory:
+    # wraps an MPU's memory, recording each write as (address, value) and
+    # the value it replaced so the writes can be undone
+    def __init__(self, subject):
+        self.subject = subject
+        # the list behind an ObservableMemory, undoing doesn't go through
+        # the subscribers
+        self.raw = getattr(subject, '_subject', subject)
+        self.writes = []
+        self.undo = []
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        return self.subject[address]
+
+    def __setitem__(self, address, value):
+        if not isinstance(address, slice):
+            self.undo.append((address, self.raw[address]))
+            self.writes.append((address, value))
+        self.subject[address] = value
+
+    def rewind(self):
+        undo = self.undo
+        while undo:
+            address, value = undo.pop()
+            self.raw[address] = value
+        del self.writes[:]
+
+
+class MPUSide:
+    def __init__(self, mpu, fields=FIELDS):
+        self.mpu = mpu
+        self.fields = fields
+        self.memory = JournalMemory(mpu.memory)
+        mpu.memory = self.memory
+        self.snapshot = None
+
+    def detach(self):
+        self.mpu.memory = self.memory.subject
+
+    def state(self):
+        mpu = self.mpu
+        return tuple([getattr(mpu, field) for field in self.fields])
+
+    def save(self):
+        mpu = self.mpu
+        self.snapshot = [getattr(mpu, field) for field in SNAPSHOT]
+        # the journal is only needed back to the start of the batch
+        del self.memory.writes[:]
+        del self.memory.undo[:]
+
+    def restore(self):
+        mpu = self.mpu
+        for field, value in zip(SNAPSHOT, self.snapshot):
+            setattr(mpu, field, value)
+        self.memory.rewind()
+
+    def run(self, count):
+        # returns a digest of count instructions
+        step = self.mpu.step
+        for i in range(count):
+            step()
+        return hash((self.state(), tuple(self.memory.writes)))
+
+    def step(self):
+        # returns (state, writes) for one instruction
+        writes = self.memory.writes
+        start = len(writes)
+        self.mpu.step()
+        return self.state(), tuple(writes[start:])
+
+
+class TraceSide:
+    def __init__(self, path, fields=None):
+        self.records = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if fields is None:
+                    fields = tuple([key for key in record if key != 'writes'])
+                state = tuple([record[field] for field in fields])
+                writes = tuple([tuple(write) for write in record.get('writes', ())])
+                self.records.append((state, writes))
+        self.fields = fields
+        self.position = 0
+        self.snapshot = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def save(self):
+        self.snapshot = self.position
+
+    def restore(self):
+        self.position = self.snapshot
+
+    def run(self, count):
+        records = self.records[self.position:self.position + count]
+        self.position += len(records)
+        writes = []
+        for state, written in records:
+            writes.extend(written)
+        return hash((records[-1][0], tuple(writes)))
+
+    def step(self):
+        record = self.records[self.position]
+        self.position += 1
+        return record
+
+
+class Divergence:
+    def __init__(self, instruction, fields, reference, candidate):
+        self.instruction = instruction # count of instructions before it
+        self.fields = fields
+        self.reference = reference # (state, writes)
+        self.candidate = candidate
+
+    def registers(self):
+        # [(field, reference value, candidate value)] for the fields that differ
+        return [(field, r, c) for field, r, c in
+                zip(self.fields, self.reference[0], self.candidate[0]) if r != c]
+
+    def __repr__(self):
+        lines = ['divergence at instruction %d' % self.instruction]
+        for field, r, c in self.registers():
+            lines.append('  %-15s reference %6x  candidate %6x' % (field, r, c))
+        if self.reference[1] != self.candidate[1]:
+            lines.append('  writes reference %s' % _writes(self.reference[1]))
+            lines.append('         candidate %s' % _writes(self.candidate[1]))
+        return '\n'.join(lines)
+
+
+def _writes(writes):
+    return ' '.join(['%06x=%02x' % write for write in writes]) or '-'
+
+
+class Lockstep:
+    def __init__(self, reference, candidate, batch=1000):
+        if tuple(reference.fields) != tuple(candidate.fields):
+            raise ValueError('the two sides compare different fields')
+        self.reference = reference
+        self.candidate = candidate
+        self.batch = batch
+        self.instructions = 0
+
+    def run(self, count):
+        # runs count instructions, or to the end of a trace on either side,
+        # and returns the first Divergence or None
+        reference = self.reference
+        candidate = self.candidate
+        for side in (reference, candidate):
+            if isinstance(side, TraceSide):
+                count = min(count, len(side) - side.position)
+        end = self.instructions + count
+        while self.instructions < end:
+            n = min(self.batch, end - self.instructions)
+            reference.save()
+            candidate.save()
+            if reference.run(n) != candidate.run(n):
+                reference.restore()
+                candidate.restore()
+                for i in range(n):
+                    r = reference.step()
+                    c = candidate.step()
+                    if r != c:
+                        self.instructions += i
+                        return Divergence(self.instructions, reference.fields,
+                                          r, c)
+            self.instructions += n
+        return None
+
+
+def record(mpu, count, path, fields=FIELDS):
+    # runs the mpu for count instructions writing a trace file of it
+    side = MPUSide(mpu, fields)
+    try:
+        with open(path, 'w') as f:
+            for i in range(count):
+                state, writes = side.step()
+                entry = dict(zip(fields, state))
+                if writes:
+                    entry['writes'] = [list(write) for write in writes]
+                f.write(json.dumps(entry) + '\n')
+                del side.memory.writes[:]
+                del side.memory.undo[:]
+    finally:
+        side.detach()
@@ -1,3 +1,5 @@
+import heapq
+
 from utils.conversions import itoa
 from utils.devices import make_instruction_decorator
 
@@ -36,20 +38,56 @@ class MPU:
     ADDRL_WIDTH = 24
     ADDRL_FORMAT = "%05x"
 
+    # run() stop reasons
+    RUN_CYCLES = 'cycles' # cycle budget used up
+    RUN_COUNT = 'count' # instruction budget used up
+    RUN_IDLE = 'idle' # waiting or spinning with nothing scheduled to wake it
+    RUN_STOP = 'stop' # STP executed, only a reset restarts the processor
+
+    NEVER = float('inf')
+
+    # the page 1 address of each sp + offset in emulation mode, made once
+    # rather than an int for every stack relative instruction
+    STACK_PAGE = tuple(range(0x100, 0x300))
+
+    # accurateflags, extra cycles in cycle accurate mode
+    CM = 1 # +1 with a 16 bit accumulator/memory (M = 0)
+    CM2 = 2 # +2 with M = 0, read-modify-write
+    CX = 4 # +1 with 16 bit index registers (X = 0)
+    CD = 8 # +1 when the direct page register low byte is not zero
+    CI = 16 # +1 when indexing crosses a page or with X = 0
+    CB = 32 # +1 when the branch is taken, +1 more crossing a page in emulation mode
+    CN = 64 # +1 in native mode
+    CV = 128 # block move, nothing extra but the final step isn't a transfer
+
     def __init__(self, memory=None, pc=0x0000):
         # config
         self.name = '65C816'
         self.waiting = False
+        self.stopped = False # STP also sets waiting, keeping step() fast
         self.byteMask = ((1 << self.BYTE_WIDTH) - 1)
         self.addrMask = ((1 << self.ADDR_WIDTH) - 1)
         self.addrMaskL = ((1 << self.ADDRL_WIDTH) - 1) # *** TODO: do we need to restrict this more hardwired memory model limit? ***
         self.addrHighMask = (self.byteMask << self.BYTE_WIDTH)
         self.addrBankMask = (self.addrHighMask << self.BYTE_WIDTH) # *** TODO: should this be limited to 0x110000? ***
 
+        # timing, see setCycleAccurate()
+        self.cycleAccurate = False
+        self.crossMask = self.addrBankMask # page crossing test for indexed modes
+
         # vm status
         self.excycles = 0
         self.addcycles = False
         self.processorCycles = 0
+        self.fetchAddr = 0 # 24 bit address of the instruction's first operand byte
+
+        # scheduled events, a heap of (cycle, sequence, callback)
+        self.events = []
+        self.eventSeq = 0
+        self.nextEvent = self.NEVER
+
+        # idle loops, loop head => [start, end, registers, cycles] (24 bit addresses)
+        self.spinLoops = {}
 
         if memory is None:
             memory = 0x10000 * [0x00]
@@ -83,17 +121,206 @@ class MPU:
 
     def step(self):
         if self.waiting:
-            self.processorCycles += 1
-        else:
-            instructCode = self.memory[self.pc]
-            self.incPC()
+            if not self.stopped:
+                self.processorCycles += 1
+        else:
+            # the fetch unit, the operand helpers read from fetchAddr.  In
+            # bank 0, and without masking a pc that stays in the bank, it
+            # makes no ints beyond pc + 1.
+            pc = self.pc
+            bank = self.pbr << self.ADDR_WIDTH
+            if bank:
+                instructCode = self.memory[bank + pc]
+            else:
+                instructCode = self.memory[pc]
+            pc += 1
+            if pc > self.addrMask:
+                pc = 0
+            self.pc = pc
+            self.fetchAddr = bank + pc if bank else pc
             self.excycles = 0
             self.addcycles = self.extracycles[instructCode]
             self.instruct[instructCode](self)
-            self.pc &= self.addrMask
+            pc = self.pc
+            if not 0 <= pc <= self.addrMask:
+                self.pc = pc & self.addrMask
             self.processorCycles += self.cycletime[instructCode] + self.excycles
         return self
 
+    def stepAccurate(self):
+        # step() with the 65816 cycle counts, the extra cycles depend on the
+        # register widths and mode the instruction started with
+        if self.waiting:
+            if not self.stopped:
+                self.processorCycles += 1
+            return self
+
+        p = self.p
+        mode = self.mode
+        bank = self.pbr << self.ADDR_WIDTH
+        instructCode = self.memory[bank + self.pc]
+        self.pc = pc = (self.pc + 1) & self.addrMask
+        self.fetchAddr = bank + pc
+        flags = self.accurateflags[instructCode]
+        self.excycles = 0
+        self.addcycles = flags & self.CI
+        self.instruct[instructCode](self)
+        self.pc &= self.addrMask
+
+        cycles = self.accuratecycles[instructCode]
+        if flags:
+            if flags & self.CB:
+                if self.excycles:
+                    cycles += 1
+                    if mode and ((pc + 1) ^ self.pc) & self.addrHighMask:
+                        cycles += 1
+            elif flags & self.CV:
+                if self.pc != pc - 1:
+                    cycles = 0 # the count ran out on the previous step
+            else:
+                if not mode:
+                    if not p & self.MS:
+                        if flags & self.CM:
+                            cycles += 1
+                        elif flags & self.CM2:
+                            cycles += 2
+                    if flags & self.CN:
+                        cycles += 1
+                if flags & self.CD and self.dpr & self.byteMask:
+                    cycles += 1
+                if not mode and not p & self.IRS:
+                    if flags & self.CX:
+                        cycles += 1
+                    if flags & self.CI:
+                        cycles += 1
+                elif flags & self.CI:
+                    cycles += self.excycles
+        self.processorCycles += cycles
+        return self
+
+    def setCycleAccurate(self, accurate=True):
+        # switch between the default cycle counts and the 65816 cycle counts:
+        # +1 for 16 bit M or X, +1 when the low byte of D isn't zero, +1 for
+        # a page crossed by indexing (rather than a bank), +1 for branches
+        # taken and +1 more crossing a page in emulation mode, +1 for native
+        # mode interrupts
+        if accurate == self.cycleAccurate:
+            return
+        self.cycleAccurate = accurate
+        if accurate:
+            self.step = self.stepAccurate
+            self.crossMask = self.addrHighMask
+        else:
+            if vars(self).get('step') == self.stepAccurate:
+                del self.step # back to the class method, not one put in since
+            self.crossMask = self.addrBankMask
+
+    def run(self, cycles=None, count=None):
+        # Run until cycles processor cycles or count instructions have gone by.
+        # Scheduled events are dispatched as their cycle comes up.  While
+        # waiting (WAI) or spinning in a configured idle loop the cycle count
+        # jumps straight to the next event rather than stepping through the
+        # idle time.  Returns the reason the run stopped.
+        end = self.NEVER if cycles is None else self.processorCycles + cycles
+        remaining = -1 if count is None else count
+        spins = self.spinLoops
+        loop = None
+        for spin in spins.values():
+            # a pass seen before this run (one that returned RUN_IDLE or was
+            # broken out of) says nothing about the memory now
+            spin[2] = None
+        check = None
+
+        while True:
+            if self.processorCycles >= self.nextEvent:
+                self.dispatchEvents()
+            if self.processorCycles >= end:
+                return self.RUN_CYCLES
+            if not remaining:
+                return self.RUN_COUNT
+
+            if self.waiting:
+                if self.stopped:
+                    return self.RUN_STOP
+                # nothing happens until an interrupt, skip to the next event
+                target = min(self.nextEvent, end)
+                if target == self.NEVER:
+                    return self.RUN_IDLE
+                self.processorCycles = max(self.processorCycles, target)
+                continue
+
+            if spins:
+                addr = (self.pbr << self.ADDR_WIDTH) + self.pc
+                if loop is not None and not (loop[0] <= addr <= loop[1]):
+                    # left the loop, it wasn't idle
+                    loop[2] = None
+                    loop = None
+                if addr in spins:
+                    loop = spins[addr]
+                    regs = (self.a, self.b, self.x, self.y, self.p, self.sp,
+                            self.dbr, self.dpr, self.mode)
+                    if loop[2] == regs and self.processorCycles > loop[3]:
+                        # a full pass through the loop changed nothing, it
+                        # will keep doing so until something external happens
+                        target = min(self.nextEvent, end)
+                        if target == self.NEVER:
+                            return self.RUN_IDLE
+                        period = self.processorCycles - loop[3]
+                        # whole passes only, so the loop stays in phase
+                        passes = -(-(target - self.processorCycles) // period)
+                        self.processorCycles += passes * period
+                        loop[3] = self.processorCycles
+                        continue
+                    loop[2] = regs
+                    loop[3] = self.processorCycles
+
+            if loop is None:
+                self.step()
+            else:
+                # a pass writing memory isn't idle, watch for one
+                if check is None:
+                    check = WriteCheck()
+                check.subject = memory = self.memory
+                check.written = False
+                self.memory = check
+                try:
+                    self.step()
+                finally:
+                    self.memory = memory
+                if check.written:
+                    loop[2] = None
+            remaining -= 1
+
+    def schedule(self, cycle, callback):
+        # call callback(mpu) once processorCycles reaches cycle, callbacks
+        # are dispatched by run() and may schedule further events
+        heapq.heappush(self.events, (cycle, self.eventSeq, callback))
+        self.eventSeq += 1
+        self.nextEvent = self.events[0][0]
+
+    def dispatchEvents(self):
+        events = self.events
+        while events and events[0][0] <= self.processorCycles:
+            callback = heapq.heappop(events)[2]
+            callback(self)
+        if events:
+            self.nextEvent = events[0][0]
+        else:
+            self.nextEvent = self.NEVER
+
+    def addSpinLoop(self, start, end):
+        # start and end are the 24 bit addresses of the first and last byte of
+        # a polling loop, entered at start.  It's skipped once a pass through
+        # it writes no memory and leaves the registers as they were, e.g. a
+        # KEY routine spinning on an input register:
+        #   5049 LDA $FFF0
+        #   504C BEQ $5049
+        # would be added with addSpinLoop(0x5049, 0x504d)
+        self.spinLoops[start] = [start, end, None, 0]
+
+    def removeSpinLoop(self, start):
+        del self.spinLoops[start]
+
     def reset(self):
         # pc is just the 16 bit program counter and must be combined with pbr to
         # access the program in memory
@@ -109,6 +336,8 @@ class MPU:
         self.p = self.BREAK | self.UNUSED
 #        self.p = self.BREAK | self.UNUSED | self.INTERRUPT
         self.processorCycles = 0
+        self.waiting = False
+        self.stopped = False
 
         self.mode = 1
         self.dbr = 0
@@ -118,6 +347,11 @@ class MPU:
     def irq(self):
         # triggers a normal IRQ
         # this is very similar to the BRK instruction
+        # an IRQ ends WAI even when masked, in which case execution simply
+        # continues with the instruction following WAI
+        if self.stopped:
+            return
+        self.waiting = False
         if self.p & self.INTERRUPT:
             return
 
@@ -134,10 +368,15 @@ class MPU:
         self.pbr = 0
         self.pc = self.WordAt(self.IRQ[self.mode])
         self.processorCycles += 7
+        if self.cycleAccurate and not self.mode:
+            self.processorCycles += 1
 
     def nmi(self):
         # triggers a NMI IRQ in the processor
         # this is very similar to the BRK instruction
+        if self.stopped:
+            return
+        self.waiting = False
         if self.mode:
             self.p &= ~self.BREAK
             self.p | self.UNUSED
@@ -151,6 +390,8 @@ class MPU:
         self.pbr = 0
         self.pc = self.WordAt(self.NMI[self.mode])
         self.processorCycles += 7
+        if self.cycleAccurate and not self.mode:
+            self.processorCycles += 1
 
     # Helpers for addressing modes and instructions
 
@@ -168,22 +409,68 @@ class MPU:
         return (self.WordAt(addr + 2) << self.ADDR_WIDTH) + self.WordAt(addr)
 
     def WrapAt(self, addr):
-        wrap = lambda x: (x & self.addrHighMask) + ((x + 1) & self.byteMask)
-        return self.ByteAt(addr) + (self.ByteAt(wrap(addr)) << self.BYTE_WIDTH)
-
+        # the word at addr with the high byte wrapping within the page
+        high = (addr & self.addrHighMask) + ((addr + 1) & self.byteMask)
+        return self.ByteAt(addr) + (self.ByteAt(high) << self.BYTE_WIDTH)
+
+    def DirectPageWordAt(self, addr):
+        # the pointer at the direct page address addr, the high byte wraps
+        # the same way as the direct page
+        memory = self.memory
+        if self.mode and not self.dpr & self.byteMask:
+            high = (addr & self.addrHighMask) + ((addr + 1) & self.byteMask)
+        else:
+            high = addr + 1
+            if high > self.addrMask:
+                high = 0
+        return memory[addr] + (memory[high] << self.BYTE_WIDTH)
+
+    def BankZeroWordAt(self, addr):
+        # the word at addr in bank 0, wrapping within the bank
+        memory = self.memory
+        if addr == self.addrMask:
+            return memory[addr] + (memory[0] << self.BYTE_WIDTH)
+        return memory[addr] + (memory[addr + 1] << self.BYTE_WIDTH)
+
+    def BankZeroLongAt(self, addr):
+        # the long pointer at addr in bank 0, wrapping within the bank
+        memory = self.memory
+        mask = self.addrMask
+        bank = addr + 2
+        if bank > mask:
+            return (memory[addr] + (memory[(addr + 1) & mask] << self.BYTE_WIDTH) +
+                    (memory[bank & mask] << self.ADDR_WIDTH))
+        return (memory[addr] + (memory[addr + 1] << self.BYTE_WIDTH) +
+                (memory[bank] << self.ADDR_WIDTH))
+
+    # The operand bytes follow the opcode in the program bank, step() works
+    # out their address once when it fetches the opcode.  Only the bytes an
+    # instruction uses are read, reading ahead could touch memory mapped I/O.
+    # Like pc, they wrap within the bank, an instruction at $xx:FFFE has its
+    # last operand byte at $xx:0000.
     def OperandAddr(self):
-        return (self.pbr << self.ADDR_WIDTH) + self.pc
+        return self.fetchAddr
 
     def OperandByte(self):
-        return self.ByteAt(self.OperandAddr())
+        return self.memory[self.fetchAddr]
 
-    # *** TODO: likely these next two need some form of WrapAt
     def OperandWord(self):
-        return self.WordAt(self.OperandAddr())
+        memory = self.memory
+        addr = self.fetchAddr
+        if addr & self.addrMask == self.addrMask:
+            return memory[addr] + (memory[addr & self.addrBankMask] << self.BYTE_WIDTH)
+        return memory[addr] + (memory[addr + 1] << self.BYTE_WIDTH)
 
     def OperandLong(self):
-        epc = self.OperandAddr()
-        return (self.ByteAt(epc+2) << self.ADDR_WIDTH) + self.WordAt(epc)
+        memory = self.memory
+        addr = self.fetchAddr
+        if addr & self.addrMask >= self.addrMask - 1:
+            bank = addr & self.addrBankMask
+            mask = self.addrMask
+            return (memory[addr] + (memory[bank + ((addr + 1) & mask)] << self.BYTE_WIDTH) +
+                    (memory[bank + ((addr + 2) & mask)] << self.ADDR_WIDTH))
+        return (memory[addr] + (memory[addr + 1] << self.BYTE_WIDTH) +
+                (memory[addr + 2] << self.ADDR_WIDTH))
 
     def incPC(self, inc=1):
         # pc must remain within current program bank
@@ -285,6 +572,9 @@ class MPU:
     #    Stack Relative                            LDA 15,S
     #    Stack Relative Indirect Indexed Y         LDA (9,S),Y
 
+    # Indexed addresses carry into the next bank, and from the last bank
+    # wrap around to bank 0.
+
     def AbsoluteAddr(self): # "abs" (26 opcodes)
         return (self.dbr << self.ADDR_WIDTH) + self.OperandWord()
 
@@ -293,8 +583,10 @@ class MPU:
         a1 = (self.dbr << self.ADDR_WIDTH) + tmp
         a2 = a1 + self.x
         if self.addcycles:
-            if (a1 & self.addrBankMask) != (a2 & self.addrBankMask):
+            if (a1 & self.crossMask) != (a2 & self.crossMask):
                 self.excycles += 1
+        if a2 > self.addrMaskL:
+            return a2 & self.addrMaskL
         return a2
 
     def AbsoluteYAddr(self): # "aby" (9 opcodes)
@@ -302,8 +594,10 @@ class MPU:
         a1 = (self.dbr << self.ADDR_WIDTH) + addr
         a2 = a1 + self.y
         if self.addcycles:
-            if (a1 & self.addrBankMask) != (a2 & self.addrBankMask):
+            if (a1 & self.crossMask) != (a2 & self.crossMask):
                 self.excycles += 1
+        if a2 > self.addrMaskL:
+            return a2 & self.addrMaskL
         return a2
 
     def AbsoluteIndirectAddr(self): # "abi" (1 opcodes)
@@ -321,7 +615,10 @@ class MPU:
     def AbsoluteLongXAddr(self): # new to 65816, "alx" (8 opcodes)
         # *** TODO: add 1 cycle if mode = 0 (do it either here or in instruction) generally it 
         # seems that it's done in address mode def ***
-        return self.OperandLong() + self.x
+        addr = self.OperandLong() + self.x
+        if addr > self.addrMaskL:
+            return addr & self.addrMaskL
+        return addr
 
     # Accumulator "acc" (6 opcodes) modeled as a None address argument in appropriate operation call
 
@@ -348,60 +645,64 @@ class MPU:
     #
     # See 65816 Programming Manual, pg 156, which states that this save 1 cycle
 
+    # In emulation mode with DL = 0 the 6502 direct page modes (d,X, d,Y,
+    # (d,X), (d) and (d),Y) wrap within the direct page like the 6502's zero
+    # page, otherwise direct page addresses and the pointers read there wrap
+    # within bank 0.  [d] and [d],Y wrap within bank 0 in either mode.
+    # Masking only the addresses that carry out of the bank, rather than
+    # all of them, saves making another int for each one that doesn't.
+
     def DirectPageAddr(self): # "dpg" (24 opcodes)
-        return (self.dpr + self.OperandByte()) & self.addrMask
+        addr = self.dpr + self.OperandByte()
+        if addr > self.addrMask:
+            return addr & self.addrMask
+        return addr
 
     def DirectPageXAddr(self): # "dpx" (18 opcodes)
-        return (self.dpr + self.OperandByte() + self.x) & self.addrMask
+        dpr = self.dpr
+        if self.mode and not dpr & self.byteMask:
+            return dpr + ((self.OperandByte() + self.x) & self.byteMask)
+        addr = dpr + self.OperandByte() + self.x
+        if addr > self.addrMask:
+            return addr & self.addrMask
+        return addr
 
     def DirectPageYAddr(self): # "dpy" (2 opcodes)
-        return (self.dpr + self.OperandByte() + self.y) & self.addrMask
+        dpr = self.dpr
+        if self.mode and not dpr & self.byteMask:
+            return dpr + ((self.OperandByte() + self.y) & self.byteMask)
+        addr = dpr + self.OperandByte() + self.y
+        if addr > self.addrMask:
+            return addr & self.addrMask
+        return addr
 
     def DirectPageIndirectXAddr(self): # "dix" (8 opcodes)
-        # *** TODO: verify WrapAt works correctly at $ffff ***
-#        dpaddr = self.WrapAt((self.dpr + self.x + self.OperandByte()) & self.addrMask)
-        dpaddr = (self.dpr + self.x + self.OperandByte()) & self.addrMask
-        inaddr = self.WrapAt(dpaddr)
-        return (self.dbr << self.ADDR_WIDTH) + inaddr
+        return (self.dbr << self.ADDR_WIDTH) + self.DirectPageWordAt(self.DirectPageXAddr())
 
     def DirectPageIndirectAddr(self): # "dpi" (8 opcodes)
-        # *** TODO: verify WrapAt works correctly at $ffff ***
-        dpaddr = (self.dpr + self.OperandByte()) & self.addrMask
-        inaddr = self.WrapAt(dpaddr)
-        return (self.dbr << self.ADDR_WIDTH) + inaddr
+        return (self.dbr << self.ADDR_WIDTH) + self.DirectPageWordAt(self.DirectPageAddr())
 
     def DirectPageIndirectLongAddr(self): # new to 65816, "dil" (8 opcodes)
-        # *** TODO: check on if need wrap at $ffff (seems likely) ***
-        dpaddr = (self.dpr + self.OperandByte()) & self.addrMask
-        addr = (self.ByteAt(dpaddr + 2) << self.ADDR_WIDTH) + self.WordAt(dpaddr)
-        return addr
+        return self.BankZeroLongAt(self.DirectPageAddr())
 
     def DirectPageIndirectYAddr(self): # "diy" (8 opcodes)
-        # *** TODO: verify WrapAt works correctly at $ffff ***
-#        dpaddr = self.WrapAt((self.dpr + self.OperandByte()) & self.addrMask)
-#        a1 = (self.dbr << self.ADDR_WIDTH) + dpaddr
-#        a2 = a1 + self.y
-        dpaddr = (self.dpr + self.OperandByte()) & self.addrMask
-        #inaddr = self.WrapAt(dpaddr)
-        inaddr = self.WordAt(dpaddr)
+        inaddr = self.DirectPageWordAt(self.DirectPageAddr())
         efaddr = (self.dbr << self.ADDR_WIDTH) + inaddr + self.y
         if self.addcycles:
-            if (inaddr & self.addrBankMask) != (efaddr & self.addrBankMask):
+            if (inaddr & self.crossMask) != (efaddr & self.crossMask):
                 self.excycles += 1
+        if efaddr > self.addrMaskL:
+            return efaddr & self.addrMaskL
         return efaddr
 
     def DirectPageIndirectLongYAddr(self): # new to 65816, "dly" (8 opcodes)
-        # *** TODO: verify WrapAt works correctly at $ffff ***
-#        dpaddr = self.WrapAt((self.dpr + self.OperandByte()) & self.addrMask)
-#        dpaddr = self.WordAt((self.dpr + self.OperandByte()) & self.addrMask)
-#        a1 = (self.ByteAt(dpaddr + 2) << self.ADDR_WIDTH) + dpaddr
-#        a2 = a1 + self.y
-        dpaddr = (self.dpr + self.OperandByte()) & self.addrMask
-        inaddr = (self.ByteAt(dpaddr + 2) << self.ADDR_WIDTH) + self.WordAt(dpaddr)
+        inaddr = self.BankZeroLongAt(self.DirectPageAddr())
         efaddr = inaddr + self.y
         if self.addcycles:
-            if (inaddr & self.addrBankMask) != (efaddr & self.addrBankMask):
+            if (inaddr & self.crossMask) != (efaddr & self.crossMask):
                 self.excycles += 1
+        if efaddr > self.addrMaskL:
+            return efaddr & self.addrMaskL
         return efaddr
 
     def ImmediateAddr(self): # "imm" (14 opcodes)
@@ -428,7 +729,7 @@ class MPU:
     def ProgramCounterRelLongAddr(self): # "prl" (1 opcode)
         self.excycles += 1
         offset = self.OperandWord()
-        self.incPC()
+        self.incPC(2)
 
         if (offset >> self.BYTE_WIDTH) & self.NEGATIVE:
             addr = self.pc - (offset ^ self.addrMask) - 1
@@ -449,17 +750,22 @@ class MPU:
     # Stack Push Addressing "stk" (7 opcodes) modeled directly 65816 Programming manual only lists 6
     # Stack RTI, RTL, RTS Addressing "stk" (3 opcodes) modeled directly
 
+    # the stack is in page 1 in emulation mode, where sp holds only the low byte
     def StackRelAddr(self): # "str" (8 opcode) 65816 Programming manual only lists 4
-        return (self.sp + self.OperandByte()) & self.addrMask
+        addr = self.sp + self.OperandByte()
+        if self.mode:
+            return self.STACK_PAGE[addr]
+        if addr > self.addrMask:
+            return addr & self.addrMask
+        return addr
 
     def StackRelIndirectYAddr(self): # "siy" (8 opcode)
-        # *** TODO: does this need WrapAt? ***
-#        return (self.dbr << self.ADDR_WIDTH) + self.WordAt((self.sp + self.OperandByte()) & self.addrMask) + self.y
-        spaddr = (self.sp + self.OperandByte()) & self.addrMask
-        #inaddr = self.WrapAt(spaddr)
-        inaddr = self.WordAt(spaddr)
+        inaddr = self.BankZeroWordAt(self.StackRelAddr())
         # *** TODO: any extra cycles? ***
-        return (self.dbr << self.ADDR_WIDTH) + inaddr + self.y
+        efaddr = (self.dbr << self.ADDR_WIDTH) + inaddr + self.y
+        if efaddr > self.addrMaskL:
+            return efaddr & self.addrMaskL
+        return efaddr
 
     # operations
 
@@ -564,7 +870,7 @@ class MPU:
             tbyte = (tbyte << 1) & self.addrMask
 
         if tbyte:
-            if tbyte & self.NEGATIVE:
+            if self.p & self.MS:
                 self.p |= tbyte & self.NEGATIVE
             else:
                 self.p |= (tbyte >> self.BYTE_WIDTH) & self.NEGATIVE
@@ -948,7 +1254,7 @@ class MPU:
 
     def opSTZ(self, x):
         addr = x()
-        if self.p & self.IRS:
+        if self.p & self.MS:
             self.memory[addr] = 0x00
         else:
             self.memory[addr] = 0x00
@@ -994,6 +1300,11 @@ class MPU:
 
     # instructions
 
+    # codegen.py generates handlers for most of these from the opcode table
+    # and its own OPERATIONS, a second implementation of them: a change to
+    # an instruction or addressing mode here needs the same change there.
+    # test_mpu65c816_codegen steps every opcode on both and compares them.
+
     # the 65816 implements all opcodes
     instruct = [0] * 256
     cycletime = [0] * 256
@@ -1218,10 +1529,11 @@ class MPU:
 
     @instruction(name="JSL", mode="abl", cycles=8) # new to 65816
     def inst_0x22(self):
+        addr = self.OperandLong()
         self.stPush(self.pbr)
         self.stPushWord((self.pc + 2) & self.addrMask)
-        self.pbr = self.ByteAt(self.pc + 2)
-        self.pc = self.OperandWord()
+        self.pbr = addr >> self.ADDR_WIDTH
+        self.pc = addr & self.addrMask
 
     @instruction(name="AND", mode="str", cycles=4) # new to 65816
     def inst_0x23(self):
@@ -1574,8 +1886,9 @@ class MPU:
 
     @instruction(name="JML", mode="abl", cycles=4)  # new to 65816
     def inst_0x5c(self):
-        self.pbr = self.ByteAt(self.pc + 2)
-        self.pc = self.OperandWord()
+        addr = self.OperandLong()
+        self.pbr = addr >> self.ADDR_WIDTH
+        self.pc = addr & self.addrMask
 
     @instruction(name="EOR", mode="abx", cycles=4, extracycles=1)
     def inst_0x5d(self):
@@ -2284,7 +2597,7 @@ class MPU:
 
     @instruction(name="PEI", mode="ski", cycles=6) # new to 65816
     def inst_0xd4(self):
-        addr = self.WordAt(self.dpr + self.OperandByte()) # in Bank 0
+        addr = self.DirectPageWordAt(self.DirectPageAddr()) # in Bank 0
         self.stPushWord(addr)
         self.incPC()
 
@@ -2321,10 +2634,10 @@ class MPU:
 
     @instruction(name="STP", mode="imp", cycles=3) # new to 65816
     def inst_0xdb(self):
-        # *** TODO: need to implement stop the processor ***
-        # *** and wait for reset pin to be pulled low    ***
-        # *** for now just reset ***
-        self.reset()
+        # stop the clock until the reset pin is pulled low, only reset()
+        # restarts the processor, interrupts are ignored
+        self.stopped = True
+        self.waiting = True
 
     @instruction(name="JML", mode="ail", cycles=6)  # new to 65816
     def inst_0xdc(self):
@@ -2561,3 +2874,77 @@ class MPU:
         self.opSBC(self.AbsoluteLongXAddr)
         self.incPC(3)
 
+    # cycle accurate mode, see setCycleAccurate()
+    # base cycles for 8 bit registers in native mode with DL = 0 and no page
+    # crossing, extras are added according to accurateflags
+    accuratecycles = [
+    #   0  1  2  3  4  5  6  7  8  9  a  b  c  d  e  f
+        7, 6, 7, 4, 5, 3, 5, 6, 3, 2, 2, 4, 6, 4, 6, 5, # 0
+        2, 5, 5, 7, 5, 4, 6, 6, 2, 4, 2, 2, 6, 4, 7, 5, # 1
+        6, 6, 8, 4, 3, 3, 5, 6, 4, 2, 2, 5, 4, 4, 6, 5, # 2
+        2, 5, 5, 7, 4, 4, 6, 6, 2, 4, 2, 2, 4, 4, 7, 5, # 3
+        6, 6, 2, 4, 7, 3, 5, 6, 3, 2, 2, 3, 3, 4, 6, 5, # 4
+        2, 5, 5, 7, 7, 4, 6, 6, 2, 4, 3, 2, 4, 4, 7, 5, # 5
+        6, 6, 6, 4, 3, 3, 5, 6, 4, 2, 2, 6, 5, 4, 6, 5, # 6
+        2, 5, 5, 7, 4, 4, 6, 6, 2, 4, 4, 2, 6, 4, 7, 5, # 7
+        2, 6, 4, 4, 3, 3, 3, 6, 2, 2, 2, 3, 4, 4, 4, 5, # 8
+        2, 6, 5, 7, 4, 4, 4, 6, 2, 5, 2, 2, 4, 5, 5, 5, # 9
+        2, 6, 2, 4, 3, 3, 3, 6, 2, 2, 2, 4, 4, 4, 4, 5, # a
+        2, 5, 5, 7, 4, 4, 4, 6, 2, 4, 2, 2, 4, 4, 4, 5, # b
+        2, 6, 3, 4, 3, 3, 5, 6, 2, 2, 2, 3, 4, 4, 6, 5, # c
+        2, 5, 5, 7, 6, 4, 6, 6, 2, 4, 3, 3, 6, 4, 7, 5, # d
+        2, 6, 3, 4, 3, 3, 5, 6, 2, 2, 2, 3, 4, 4, 6, 5, # e
+        2, 5, 5, 7, 5, 4, 6, 6, 2, 4, 4, 2, 8, 4, 7, 5, # f
+    ]
+
+    accurateflags = [
+        CN,        CM|CD,     CN,        CM,        CM2|CD,    CM|CD,     CM2|CD,    CM|CD, # 00-07
+        0,         CM,        0,         0,         CM2,       CM,        CM2,       CM, # 08-0f
+        CB,        CM|CD|CI,  CM|CD,     CM,        CM2|CD,    CM|CD,     CM2|CD,    CM|CD, # 10-17
+        0,         CM|CI,     0,         0,         CM2,       CM|CI,     CM2,       CM, # 18-1f
+        0,         CM|CD,     0,         CM,        CM|CD,     CM|CD,     CM2|CD,    CM|CD, # 20-27
+        0,         CM,        0,         0,         CM,        CM,        CM2,       CM, # 28-2f
+        CB,        CM|CD|CI,  CM|CD,     CM,        CM|CD,     CM|CD,     CM2|CD,    CM|CD, # 30-37
+        0,         CM|CI,     0,         0,         CM|CI,     CM|CI,     CM2,       CM, # 38-3f
+        CN,        CM|CD,     0,         CM,        CV,        CM|CD,     CM2|CD,    CM|CD, # 40-47
+        CM,        CM,        0,         0,         0,         CM,        CM2,       CM, # 48-4f
+        CB,        CM|CD|CI,  CM|CD,     CM,        CV,        CM|CD,     CM2|CD,    CM|CD, # 50-57
+        0,         CM|CI,     CX,        0,         0,         CM|CI,     CM2,       CM, # 58-5f
+        0,         CM|CD,     0,         CM,        CM|CD,     CM|CD,     CM2|CD,    CM|CD, # 60-67
+        CM,        CM,        0,         0,         0,         CM,        CM2,       CM, # 68-6f
+        CB,        CM|CD|CI,  CM|CD,     CM,        CM|CD,     CM|CD,     CM2|CD,    CM|CD, # 70-77
+        0,         CM|CI,     CX,        0,         0,         CM|CI,     CM2,       CM, # 78-7f
+        CB,        CM|CD,     0,         CM,        CX|CD,     CM|CD,     CX|CD,     CM|CD, # 80-87
+        0,         CM,        0,         0,         CX,        CM,        CX,        CM, # 88-8f
+        CB,        CM|CD,     CM|CD,     CM,        CX|CD,     CM|CD,     CX|CD,     CM|CD, # 90-97
+        0,         CM,        0,         0,         CM,        CM,        CM,        CM, # 98-9f
+        CX,        CM|CD,     CX,        CM,        CX|CD,     CM|CD,     CX|CD,     CM|CD, # a0-a7
+        0,         CM,        0,         0,         CX,        CM,        CX,        CM, # a8-af
+        CB,        CM|CD|CI,  CM|CD,     CM,        CX|CD,     CM|CD,     CX|CD,     CM|CD, # b0-b7
+        0,         CM|CI,     0,         0,         CX|CI,     CM|CI,     CX|CI,     CM, # b8-bf
+        CX,        CM|CD,     0,         CM,        CX|CD,     CM|CD,     CM2|CD,    CM|CD, # c0-c7
+        0,         CM,        0,         0,         CX,        CM,        CM2,       CM, # c8-cf
+        CB,        CM|CD|CI,  CM|CD,     CM,        CD,        CM|CD,     CM2|CD,    CM|CD, # d0-d7
+        0,         CM|CI,     CX,        0,         0,         CM|CI,     CM2,       CM, # d8-df
+        CX,        CM|CD,     0,         CM,        CX|CD,     CM|CD,     CM2|CD,    CM|CD, # e0-e7
+        0,         CM,        0,         0,         CX,        CM,        CM2,       CM, # e8-ef
+        CB,        CM|CD|CI,  CM|CD,     CM,        0,         CM|CD,     CM2|CD,    CM|CD, # f0-f7
+        0,         CM|CI,     CX,        0,         0,         CM|CI,     CM2,       CM, # f8-ff
+    ]
+
+
+class WriteCheck:
+    # wraps the memory for a step in a spin loop, noting whether it wrote
+    def __init__(self):
+        self.subject = None
+        self.written = False
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        return self.subject[address]
+
+    def __setitem__(self, address, value):
+        self.written = True
+        self.subject[address] = value
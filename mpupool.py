@@ -0,0 +1,70 @@
+# Pooled memory for the unit tests
+#
+# Each test used to allocate a fresh 0x10000 or 0x30000 entry list, plus
+# the default memory MPU() allocates before it's replaced.  The pooled
+# memories are dicts holding only the addresses a test wrote, every other
+# address reads as the fill value, so they are reset by clearing the few
+# entries a test touched and handed to the next test in the same process.
+#
+#   mpu = klass(memory=mpupool.BOOT)
+#   mpu.memory = mpupool.memory(self, 0x30000, 0xAA)
+#
+# The memory goes back to the pool when the test finishes.
+
+
+class PooledMemory(dict):
+    # a list of size entries of fill as far as the MPU and tests can tell
+    def __init__(self, size, fill):
+        dict.__init__(self)
+        self.size = size
+        self.fill = fill
+
+    def _index(self, address):
+        if address < 0:
+            address += self.size
+        if not 0 <= address < self.size:
+            raise IndexError('memory index out of range')
+        return address
+
+    def __missing__(self, address):
+        index = self._index(address)
+        if index != address:
+            return self[index]
+        return self.fill
+
+    def __setitem__(self, address, value):
+        if isinstance(address, slice):
+            for a, v in zip(range(*address.indices(self.size)), value):
+                dict.__setitem__(self, a, v)
+        else:
+            dict.__setitem__(self, self._index(address), value)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for address in range(self.size):
+            yield self[address]
+
+
+# MPU() reads its reset vector from here, it is never written
+BOOT = PooledMemory(0x10000, 0x00)
+
+_free = {}
+
+
+def memory(test, size, fill):
+    # a memory of size entries of fill, returned to the pool when the test
+    # case finishes
+    free = _free.setdefault((size, fill), [])
+    if free:
+        pooled = free.pop()
+    else:
+        pooled = PooledMemory(size, fill)
+    test.addCleanup(release, pooled)
+    return pooled
+
+
+def release(pooled):
+    pooled.clear()
+    _free[(pooled.size, pooled.fill)].append(pooled)
@@ -0,0 +1,373 @@
+# Deterministic record and replay of a board's inputs
+#
+# Recorder logs everything that comes into a board from outside while it
+# runs: the value of each read of a device register (console input, a
+# status port ...) and the cycle each IRQ and NMI was asserted at.
+# Replayer runs the board again from the log alone, bit for bit and at full
+# speed, serving the device reads from the log and asserting the
+# interrupts from scheduled events at their cycles, without the devices or
+# whatever was typed at them:
+#
+#   recorder = Recorder(mpu, devices=(0x7fc0,))     # OF816's getc
+#   recorder.start()
+#   ...                                             # mpu.run(), mpu.irq() ...
+#   recorder.stop().save('session.log')
+#
+#   replayer = Replayer(mpu, load('session.log'))   # a board built the same way
+#   replayer.start()
+#   replayer.run()                                  # raises Diverged
+#   replayer.stop()
+#
+# The log holds hashes of the registers and memory too, at the start, at
+# the first device read after every interval cycles and at the end.
+# Replaying checks each of them, each read's device and the reads made
+# before each interrupt, and raises Diverged at the first that doesn't
+# match: a board not built the same way, a change to the simulator since
+# recording or a damaged log.
+#
+# A log is gzipped JSON, a byte for each read and a few numbers for each
+# interrupt and hash, so it's about the size of the input it holds.
+#
+# * Devices are addresses as the MPU reads them.  Writes aren't logged, the
+#   program makes them, and they go through to the memory (and a console's
+#   output subscriber) as always, replaying too.
+# * Interrupts are logged by irq() and nmi() replaced on the instance, an
+#   interrupt asserted from a scheduled event or between runs happens at an
+#   instruction boundary on the cycle it's logged at, which is where replay
+#   asserts it again.
+# * Replay on a board without the devices and timers, or the interrupts
+#   happen twice.  Other scheduled events (a HeatMap's windows) are fine.
+# * A hash is a pass over all of the memory, make interval a lot of cycles
+#   for a big one.
+#
+# From the py65 folder:
+#   python -m devices.replay record session.log --preset of816 --input session.txt
+#   python -m devices.replay replay session.log --preset of816
+
+import argparse
+import gzip
+import json
+import sys
+import zlib
+
+from devices.mpu65c816 import MPU
+from devices.lockstep import SNAPSHOT
+from devices.consolefuzz import PRESETS
+
+VERSION = 1
+
+
+class Diverged(Exception):
+    pass
+
+
+def raw_memory(memory):
+    # the list under any wrappers (these modules' subject) and an
+    # ObservableMemory (its _subject)
+    while getattr(memory, 'subject', None) is not None:
+        memory = memory.subject
+    return getattr(memory, '_subject', memory)
+
+
+def state_hash(mpu):
+    # CRC-32 of the registers and all of the memory
+    registers = repr(tuple(getattr(mpu, field) for field in SNAPSHOT)).encode()
+    return zlib.crc32(bytes(raw_memory(mpu.memory)), zlib.crc32(registers))
+
+
+class Log:
+    def __init__(self, devices=(), interval=1000000):
+        self.devices = list(devices)
+        self.interval = interval # cycles between hashes
+        self.registers = {} # SNAPSHOT at the start
+        self.values = bytearray() # each device read's value
+        self.sources = bytearray() # and the index in devices of its address
+        self.interrupts = [] # [(cycle, 'irq' or 'nmi', reads before it)]
+        self.hashes = [] # [(reads before it, cycle, hash)]
+        self.end = 0 # the cycle recording stopped at
+
+    def save(self, path):
+        data = {
+            'version': VERSION,
+            'devices': self.devices,
+            'interval': self.interval,
+            'registers': self.registers,
+            'values': self.values.hex(),
+            'sources': self.sources.hex(),
+            'interrupts': self.interrupts,
+            'hashes': self.hashes,
+            'end': self.end,
+        }
+        with gzip.open(path, 'wt') as f:
+            json.dump(data, f)
+
+
+def load(path):
+    with gzip.open(path, 'rt') as f:
+        data = json.load(f)
+    if data.get('version') != VERSION:
+        raise ValueError('%s: log version %r, not %d' % (path, data.get('version'), VERSION))
+    log = Log(data['devices'], data['interval'])
+    log.registers = data['registers']
+    log.values = bytearray.fromhex(data['values'])
+    log.sources = bytearray.fromhex(data['sources'])
+    log.interrupts = [tuple(interrupt) for interrupt in data['interrupts']]
+    log.hashes = [tuple(entry) for entry in data['hashes']]
+    log.end = data['end']
+    return log
+
+
+class RecordingMemory:
+    # wraps the mpu's memory while recording, logging device reads
+    def __init__(self, subject, recorder):
+        self.subject = subject
+        self.recorder = recorder
+        self.devices = recorder.devices
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        value = self.subject[address]
+        if type(address) is int and address in self.devices:
+            self.recorder.read(address, value)
+        return value
+
+    def __setitem__(self, address, value):
+        self.subject[address] = value
+
+
+class ReplayingMemory:
+    # wraps the mpu's memory while replaying, device reads come from the log
+    def __init__(self, subject, replayer):
+        self.subject = subject
+        self.replayer = replayer
+        self.devices = replayer.devices
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        if type(address) is int and address in self.devices:
+            return self.replayer.read(address)
+        return self.subject[address]
+
+    def __setitem__(self, address, value):
+        self.subject[address] = value
+
+
+class Recorder:
+    def __init__(self, mpu, devices=(), interval=1000000):
+        self.mpu = mpu
+        self.devices = {address: i for i, address in enumerate(devices)}
+        self.log = Log(devices, interval)
+        self.nextHash = 0
+        self.memory = None
+        self.replaced = {} # the instance's own irq and nmi, if it had them
+
+    def start(self):
+        mpu = self.mpu
+        log = self.log
+        log.registers = {field: getattr(mpu, field) for field in SNAPSHOT}
+        self.memory = RecordingMemory(mpu.memory, self)
+        mpu.memory = self.memory
+        for kind in ('irq', 'nmi'):
+            self.replaced[kind] = vars(mpu).get(kind)
+            setattr(mpu, kind, self.interrupt(kind, getattr(mpu, kind)))
+        self.hash()
+
+    def stop(self):
+        # stops recording, returns the log
+        mpu = self.mpu
+        mpu.memory = self.memory.subject
+        self.memory = None
+        for kind, replaced in self.replaced.items():
+            if replaced is None:
+                delattr(mpu, kind)
+            else:
+                setattr(mpu, kind, replaced)
+        self.replaced = {}
+        self.log.end = mpu.processorCycles
+        self.hash()
+        return self.log
+
+    def hash(self):
+        mpu = self.mpu
+        self.log.hashes.append((len(self.log.values), mpu.processorCycles, state_hash(mpu)))
+        self.nextHash = mpu.processorCycles + self.log.interval
+
+    def read(self, address, value):
+        if self.mpu.processorCycles >= self.nextHash:
+            self.hash()
+        self.log.values.append(value)
+        self.log.sources.append(self.devices[address])
+
+    def interrupt(self, kind, assert_):
+        def logged():
+            log = self.log
+            log.interrupts.append((self.mpu.processorCycles, kind, len(log.values)))
+            assert_()
+        return logged
+
+
+class Replayer:
+    def __init__(self, mpu, log):
+        self.mpu = mpu
+        self.log = log
+        self.devices = {address: i for i, address in enumerate(log.devices)}
+        self.reads = 0 # device reads served
+        self.hashes = 0 # hashes checked
+        self.memory = None
+        self.generation = 0
+
+    def start(self):
+        # puts the registers back to the start of the recording and checks
+        # the board against it
+        mpu = self.mpu
+        log = self.log
+        for field, value in log.registers.items():
+            setattr(mpu, field, value)
+        self.reads = 0
+        self.hashes = 0
+        self.check()
+        self.memory = ReplayingMemory(mpu.memory, self)
+        mpu.memory = self.memory
+        self.generation += 1
+        for cycle, kind, reads in log.interrupts:
+            mpu.schedule(cycle, self.interrupt(cycle, kind, reads, self.generation))
+
+    def stop(self):
+        self.mpu.memory = self.memory.subject
+        self.memory = None
+        self.generation += 1
+
+    def run(self):
+        # runs to the end of the recording and checks the last hash
+        mpu = self.mpu
+        mpu.run(cycles=max(self.log.end - mpu.processorCycles, 0))
+        if mpu.processorCycles != self.log.end:
+            raise Diverged('stopped at cycle %d, the recording at %d'
+                           % (mpu.processorCycles, self.log.end))
+        if self.reads != len(self.log.values):
+            raise Diverged('%d device reads, %d recorded' % (self.reads, len(self.log.values)))
+        self.check()
+
+    def check(self):
+        # the next hash, if it was taken here
+        mpu = self.mpu
+        hashes = self.log.hashes
+        if self.hashes < len(hashes) and hashes[self.hashes][0] == self.reads:
+            reads, cycle, expected = hashes[self.hashes]
+            self.hashes += 1
+            if mpu.processorCycles != cycle:
+                raise Diverged('device read %d at cycle %d, recorded at %d'
+                               % (reads, mpu.processorCycles, cycle))
+            if state_hash(mpu) != expected:
+                raise Diverged('state differs at cycle %d, device read %d' % (cycle, reads))
+
+    def read(self, address):
+        log = self.log
+        i = self.reads
+        if i >= len(log.values):
+            raise Diverged('device read %d of $%06x at cycle %d, %d recorded'
+                           % (i, address, self.mpu.processorCycles, len(log.values)))
+        if log.devices[log.sources[i]] != address:
+            raise Diverged('device read %d of $%06x at cycle %d, recorded from $%06x'
+                           % (i, address, self.mpu.processorCycles, log.devices[log.sources[i]]))
+        self.check()
+        self.reads = i + 1
+        return log.values[i]
+
+    def interrupt(self, cycle, kind, reads, generation):
+        def fire(mpu):
+            if generation != self.generation:
+                return # stopped since
+            if mpu.processorCycles != cycle:
+                raise Diverged('%s at cycle %d, recorded at %d'
+                               % (kind, mpu.processorCycles, cycle))
+            if self.reads != reads:
+                raise Diverged('%s at cycle %d after %d device reads, recorded after %d'
+                               % (kind, mpu.processorCycles, self.reads, reads))
+            getattr(mpu, kind)()
+        return fire
+
+
+class Console:
+    # getc and putc subscribers, input from a file, output to stdout
+    def __init__(self, text):
+        self.input = list(text)
+
+    def getc(self, address):
+        if self.input:
+            return self.input.pop(0)
+        return 0
+
+    def putc(self, address, value):
+        sys.stdout.write(chr(value))
+        sys.stdout.flush()
+
+
+def make_board(preset, memorySize):
+    from memory import ObservableMemory # py65's
+    filename, load, pc, getc, putc, stack = PRESETS[preset]
+    with open(filename, 'rb') as f:
+        image = f.read()
+    memory = memorySize * [0x00]
+    memory[load:load + len(image)] = list(image)
+    observable = ObservableMemory(subject=memory, addrWidth=MPU.ADDRL_WIDTH)
+    mpu = MPU(memory=observable)
+    if pc is None:
+        mpu.reset()
+    else:
+        mpu.pc = pc
+    return mpu, observable
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='record and replay a console session')
+    parser.add_argument('mode', choices=('record', 'replay'))
+    parser.add_argument('log', help='the log file')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='of816')
+    parser.add_argument('--input', help='file typed at the console while recording')
+    parser.add_argument('--cycles', type=int, default=50000000,
+                        help='cycles to record (default %(default)s)')
+    parser.add_argument('--interval', type=int, default=1000000,
+                        help='cycles between hashes (default %(default)s)')
+    parser.add_argument('--memory', type=lambda s: int(s, 0), default=0x30000,
+                        help='memory size (default %(default)#x)')
+    args = parser.parse_args(argv)
+
+    mpu, memory = make_board(args.preset, args.memory)
+    getc, putc = PRESETS[args.preset][3:5]
+    console = Console(b'')
+    memory.subscribe_to_write([putc], console.putc)
+    if args.mode == 'record':
+        if args.input:
+            with open(args.input, 'rb') as f:
+                console.input = list(f.read().replace(b'\n', b'\r'))
+        memory.subscribe_to_read([getc], console.getc)
+        recorder = Recorder(mpu, (getc,), args.interval)
+        recorder.start()
+        mpu.run(cycles=args.cycles)
+        log = recorder.stop()
+        log.save(args.log)
+        print('\n%d cycles, %d device reads, %d interrupts'
+              % (log.end, len(log.values), len(log.interrupts)))
+        return 0
+
+    replayer = Replayer(mpu, load(args.log))
+    try:
+        replayer.start()
+        replayer.run()
+    except Diverged as e:
+        print('\ndiverged: %s' % e)
+        return 1
+    finally:
+        if replayer.memory is not None:
+            replayer.stop()
+    print('\nreplayed %d cycles, %d hashes checked' % (mpu.processorCycles, replayer.hashes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# Run the unit tests sharded across processes
+#
+# From the py65 folder (with the test modules, mpupool.py and this module in
+# tests/devices):
+#   python -m tests.devices.runtests             # the 65C816 suites, a process per core
+#   python -m tests.devices.runtests -j 4 tests.devices.test_mpu65c816_native_16
+#
+# The tests are dealt out round robin to the processes, so each process
+# gets a mix of the emulation, native 8 bit and native 16 bit tests and
+# they finish together.  Within a process the tests share pooled memory
+# (see mpupool.py).  The exit status is 1 if any test failed.
+#
+# Run them after any change to mpu65c816.py: the codegen and lazyflags
+# suites step every opcode on the generated handlers and on MPU, and are
+# what keeps the two implementations of the instructions in step.
+
+import argparse
+import concurrent.futures
+import io
+import multiprocessing
+import sys
+import time
+import unittest
+
+MODULES = (
+    'tests.devices.test_mpu65c816_emulation',
+    'tests.devices.test_mpu65c816_native_8',
+    'tests.devices.test_mpu65c816_native_16',
+    'tests.devices.test_mpu65c816_cycles',
+    'tests.devices.test_mpu65c816_bustrace',
+    'tests.devices.test_mpu65c816_lockstep',
+    'tests.devices.test_mpu65c816_vectors',
+    'tests.devices.test_mpu65c816_fuzz',
+    'tests.devices.test_mpu65c816_consolefuzz',
+    'tests.devices.test_mpu65c816_batch',
+    'tests.devices.test_mpu65c816_disasm',
+    'tests.devices.test_mpu65c816_cfg',
+    'tests.devices.test_mpu65c816_translate',
+    'tests.devices.test_mpu65c816_slotted',
+    'tests.devices.test_mpu65c816_codegen',
+    'tests.devices.test_mpu65c816_lazyflags',
+    'tests.devices.test_mpu65c816_branchstats',
+    'tests.devices.test_mpu65c816_heatmap',
+    'tests.devices.test_mpu65c816_watchpoints',
+    'tests.devices.test_mpu65c816_gdbstub',
+    'tests.devices.test_mpu65c816_replay',
+    'tests.devices.test_mpu65c816_compare',
+)
+
+
+def test_ids(suite):
+    ids = []
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            ids.extend(test_ids(test))
+        else:
+            ids.append(test.id())
+    return ids
+
+
+def run_shard(ids):
+    # returns (tests run, [(kind, test id, traceback)])
+    suite = unittest.defaultTestLoader.loadTestsFromNames(ids)
+    result = unittest.TextTestRunner(io.StringIO(), verbosity=0).run(suite)
+    problems = [('FAIL', test.id(), text) for test, text in result.failures]
+    problems += [('ERROR', test.id(), text) for test, text in result.errors]
+    return result.testsRun, problems
+
+
+def shard(ids, count):
+    return [ids[i::count] for i in range(count) if ids[i::count]]
+
+
+def run(names, processes=None):
+    # returns (tests run, problems)
+    ids = test_ids(unittest.defaultTestLoader.loadTestsFromNames(names))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    shards = shard(ids, processes)
+    if len(shards) <= 1:
+        results = [run_shard(ids)]
+    else:
+        # not a multiprocessing.Pool, its daemon workers couldn't run tests
+        # that start processes themselves
+        with concurrent.futures.ProcessPoolExecutor(len(shards)) as pool:
+            results = list(pool.map(run_shard, shards))
+    tests = sum([count for count, problems in results])
+    problems = [problem for count, found in results for problem in found]
+    return tests, problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='run the unit tests in parallel')
+    parser.add_argument('names', nargs='*', default=MODULES,
+                        help='test modules, classes or methods (default the 65C816 suites)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default one per core)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    tests, problems = run(args.names, args.processes)
+    seconds = time.perf_counter() - start
+
+    for kind, test, text in problems:
+        print('=' * 70)
+        print('%s: %s' % (kind, test))
+        print('-' * 70)
+        print(text)
+    print('Ran %d tests in %.3fs' % (tests, seconds))
+    if problems:
+        print('FAILED (%d)' % len(problems))
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
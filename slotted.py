@@ -0,0 +1,214 @@
+# The 65C816 MPU with a slotted register file
+#
+# MPU keeps the registers and its configuration (a, b, x, y, p, sp, dbr,
+# pbr, dpr, mode, byteMask, addrMask ...) in the instance __dict__ and its
+# handlers look up the class constants (self.MS, self.BYTE_WIDTH) through
+# the instance every time.  SlottedMPU holds the same state in __slots__,
+# a fixed table in the object read by index, and replaces the helpers and
+# instructions nearly every instruction goes through (the fetch in step(),
+# the operand, memory and stack reads, the flags, branches, loads and
+# stores) with versions that take the constants as default arguments, which
+# are local variable reads.  The results are those of MPU, the test suites
+# run against both:
+#
+#   mpu = SlottedMPU(memory=memory)
+#
+# * Everything not replaced here is MPU's.  The instance still has a
+#   __dict__, MPU has none of its own slots, so setCycleAccurate() and
+#   bustrace.py can still replace step and consolefuzz.py the instruct table.
+# * The replacements read memory directly rather than through ByteAt() and
+#   OperandByte(), overriding those in a subclass doesn't reach them.
+#
+# From the py65 folder, MPU against SlottedMPU on the Forth workloads:
+#   python -m benchmarks.slots
+
+from devices.mpu65c816 import MPU
+
+# the constants the replacements use, bound as default arguments
+NEGATIVE = MPU.NEGATIVE
+ZERO = MPU.ZERO
+MS = MPU.MS
+IRS = MPU.IRS
+BYTE_WIDTH = MPU.BYTE_WIDTH
+ADDR_WIDTH = MPU.ADDR_WIDTH
+BYTE_MASK = (1 << BYTE_WIDTH) - 1
+ADDR_MASK = (1 << ADDR_WIDTH) - 1
+ADDR_HIGH_MASK = BYTE_MASK << BYTE_WIDTH
+NZ_MASK = ~(ZERO | NEGATIVE)
+
+# the register file, everything MPU.__init__() and reset() set
+REGISTERS = (
+    # registers
+    'a', 'b', 'x', 'y', 'p', 'sp', 'pc', 'dbr', 'pbr', 'dpr', 'mode',
+    # config
+    'name', 'waiting', 'stopped', 'byteMask', 'addrMask', 'addrMaskL',
+    'addrHighMask', 'addrBankMask', 'cycleAccurate', 'crossMask',
+    # vm status
+    'excycles', 'addcycles', 'processorCycles', 'fetchAddr',
+    'events', 'eventSeq', 'nextEvent', 'spinLoops',
+    'memory', 'start_pc',
+)
+
+
+class SlottedMPU(MPU):
+    __slots__ = REGISTERS
+
+    def step(self, ADDR_WIDTH=ADDR_WIDTH, ADDR_MASK=ADDR_MASK):
+        if self.waiting:
+            if not self.stopped:
+                self.processorCycles += 1
+        else:
+            bank = self.pbr << ADDR_WIDTH
+            instructCode = self.memory[bank + self.pc]
+            self.pc = pc = (self.pc + 1) & ADDR_MASK
+            self.fetchAddr = bank + pc
+            self.excycles = 0
+            self.addcycles = self.extracycles[instructCode]
+            self.instruct[instructCode](self)
+            self.pc &= ADDR_MASK
+            self.processorCycles += self.cycletime[instructCode] + self.excycles
+        return self
+
+    # Helpers
+
+    def ByteAt(self, addr):
+        return self.memory[addr]
+
+    def WordAt(self, addr, BYTE_WIDTH=BYTE_WIDTH):
+        memory = self.memory
+        return memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+
+    def OperandByte(self):
+        return self.memory[self.fetchAddr]
+
+    def OperandWord(self, BYTE_WIDTH=BYTE_WIDTH, ADDR_MASK=ADDR_MASK):
+        memory = self.memory
+        addr = self.fetchAddr
+        if addr & ADDR_MASK == ADDR_MASK:
+            return memory[addr] + (memory[addr - ADDR_MASK] << BYTE_WIDTH)
+        return memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+
+    def incPC(self, inc=1, ADDR_MASK=ADDR_MASK):
+        self.pc = (self.pc + inc) & ADDR_MASK
+
+    def bCLR(self, x, ADDR_MASK=ADDR_MASK):
+        if self.p & x:
+            self.pc = (self.pc + 1) & ADDR_MASK
+        else:
+            self.ProgramCounterRelAddr()
+
+    def bSET(self, x, ADDR_MASK=ADDR_MASK):
+        if self.p & x:
+            self.ProgramCounterRelAddr()
+        else:
+            self.pc = (self.pc + 1) & ADDR_MASK
+
+    def stPush(self, z, BYTE_MASK=BYTE_MASK, ADDR_MASK=ADDR_MASK):
+        if self.mode:
+            self.memory[0x100 + self.sp] = z & BYTE_MASK
+            self.sp = (self.sp - 1) & BYTE_MASK
+        else:
+            self.memory[self.sp] = z & BYTE_MASK
+            self.sp = (self.sp - 1) & ADDR_MASK
+
+    def stPop(self, BYTE_MASK=BYTE_MASK, ADDR_MASK=ADDR_MASK):
+        if self.mode:
+            self.sp = sp = (self.sp + 1) & BYTE_MASK
+            return self.memory[0x100 + sp]
+        self.sp = sp = (self.sp + 1) & ADDR_MASK
+        return self.memory[sp]
+
+    def FlagsNZ(self, value, NZ_MASK=NZ_MASK, ZERO=ZERO, NEGATIVE=NEGATIVE):
+        if value == 0:
+            self.p = (self.p & NZ_MASK) | ZERO
+        else:
+            self.p = (self.p & NZ_MASK) | (value & NEGATIVE)
+
+    def FlagsNZWord(self, value, NZ_MASK=NZ_MASK, ZERO=ZERO, NEGATIVE=NEGATIVE,
+                    BYTE_WIDTH=BYTE_WIDTH):
+        if value == 0:
+            self.p = (self.p & NZ_MASK) | ZERO
+        else:
+            self.p = (self.p & NZ_MASK) | ((value >> BYTE_WIDTH) & NEGATIVE)
+
+    # Addressing modes
+
+    def AbsoluteAddr(self, ADDR_WIDTH=ADDR_WIDTH, BYTE_WIDTH=BYTE_WIDTH, ADDR_MASK=ADDR_MASK):
+        memory = self.memory
+        addr = self.fetchAddr
+        if addr & ADDR_MASK == ADDR_MASK:
+            return (self.dbr << ADDR_WIDTH) + memory[addr] + (memory[addr - ADDR_MASK] << BYTE_WIDTH)
+        return (self.dbr << ADDR_WIDTH) + memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+
+    def DirectPageAddr(self, ADDR_MASK=ADDR_MASK):
+        addr = self.dpr + self.memory[self.fetchAddr]
+        if addr > ADDR_MASK:
+            return addr & ADDR_MASK
+        return addr
+
+    def ProgramCounterRelAddr(self, NEGATIVE=NEGATIVE, BYTE_MASK=BYTE_MASK,
+                              ADDR_MASK=ADDR_MASK, ADDR_HIGH_MASK=ADDR_HIGH_MASK):
+        offset = self.memory[self.fetchAddr]
+        pc = (self.pc + 1) & ADDR_MASK
+        if offset & NEGATIVE:
+            addr = pc - (offset ^ BYTE_MASK) - 1
+        else:
+            addr = pc + offset
+        if (pc & ADDR_HIGH_MASK) != (addr & ADDR_HIGH_MASK):
+            self.excycles += 2
+        else:
+            self.excycles += 1
+        self.pc = addr & ADDR_MASK
+
+    # Instructions
+
+    def opLDA(self, x, MS=MS, BYTE_WIDTH=BYTE_WIDTH):
+        memory = self.memory
+        addr = x()
+        if self.p & MS:
+            self.a = value = memory[addr]
+            self.FlagsNZ(value)
+        else:
+            self.a = value = memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+            self.FlagsNZWord(value)
+
+    def opLDX(self, y, IRS=IRS, BYTE_WIDTH=BYTE_WIDTH):
+        memory = self.memory
+        addr = y()
+        if self.p & IRS:
+            self.x = value = memory[addr]
+            self.FlagsNZ(value)
+        else:
+            self.x = value = memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+            self.FlagsNZWord(value)
+
+    def opLDY(self, x, IRS=IRS, BYTE_WIDTH=BYTE_WIDTH):
+        memory = self.memory
+        addr = x()
+        if self.p & IRS:
+            self.y = value = memory[addr]
+            self.FlagsNZ(value)
+        else:
+            self.y = value = memory[addr] + (memory[addr + 1] << BYTE_WIDTH)
+            self.FlagsNZWord(value)
+
+    def opSTA(self, x, MS=MS, BYTE_WIDTH=BYTE_WIDTH, BYTE_MASK=BYTE_MASK):
+        addr = x()
+        a = self.a
+        self.memory[addr] = a & BYTE_MASK
+        if not self.p & MS:
+            self.memory[addr + 1] = (a >> BYTE_WIDTH) & BYTE_MASK
+
+    def opSTX(self, y, IRS=IRS, BYTE_WIDTH=BYTE_WIDTH, BYTE_MASK=BYTE_MASK):
+        addr = y()
+        value = self.x
+        self.memory[addr] = value & BYTE_MASK
+        if not self.p & IRS:
+            self.memory[addr + 1] = (value >> BYTE_WIDTH) & BYTE_MASK
+
+    def opSTY(self, x, IRS=IRS, BYTE_WIDTH=BYTE_WIDTH, BYTE_MASK=BYTE_MASK):
+        addr = x()
+        value = self.y
+        self.memory[addr] = value & BYTE_MASK
+        if not self.p & IRS:
+            self.memory[addr + 1] = (value >> BYTE_WIDTH) & BYTE_MASK
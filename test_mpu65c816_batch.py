@@ -0,0 +1,163 @@
+import unittest
+import random
+import sys
+import devices.mpu65c816
+from devices.fuzz import Fuzzer, fuzz
+from devices.vectors import Runner
+
+try:
+    import numpy
+    from devices.batch import Batch, BatchFuzzer, BatchRunner, STATE
+except ImportError: # NumPy is optional
+    numpy = None
+
+
+class BrokenLDA(devices.mpu65c816.MPU):
+    # LDA d,X ignores X
+    instruct = list(devices.mpu65c816.MPU.instruct)
+
+    def inst_0xb5(self):
+        x = self.x
+        self.x = 0
+        devices.mpu65c816.MPU.inst_0xb5(self)
+        self.x = x
+
+    instruct[0xb5] = inst_0xb5
+
+
+@unittest.skipIf(numpy is None, 'needs NumPy')
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Batch Execution"""
+
+    def test_batch_matches_separate_mpus(self):
+        rand = random.Random(7)
+        batch = Batch(64)
+        vectorized = [opcode for opcode in range(256) if batch.vectorized(opcode)]
+        states = [self._random_state(rand, vectorized) for i in range(64)]
+        batch.setup(states)
+        mpus = [self._make_mpu(state) for state in states]
+        for i in range(12):
+            batch.step()
+            for mpu in mpus:
+                mpu.step()
+        written = batch.memory.written(64)
+        for row, mpu in enumerate(mpus):
+            if batch.memory.conflict[row]:
+                continue
+            for name in STATE:
+                self.assertEqual(int(getattr(mpu, name)),
+                                 int(getattr(batch, name)[row]), name)
+            for address, value in written[row].items():
+                self.assertEqual(mpu.memory[address], value)
+
+    def test_machines_diverge_at_branches(self):
+        # LDA $10 : BEQ +2 : LDX #1 : NOP
+        program = [0xa5, 0x10, 0xf0, 0x02, 0xa2, 0x01, 0xea]
+        batch = Batch(2)
+        ram = list(enumerate(program, 0x1000))
+        batch.setup([self._state(ram + [(0x10, 0)]),
+                     self._state(ram + [(0x10, 5)])])
+        for i in range(3):
+            batch.step()
+        self.assertEqual([0x1007, 0x1006], batch.pc.tolist())
+        self.assertEqual([0, 1], batch.x.tolist())
+        self.assertEqual([3 + 3 + 2, 3 + 2 + 2], batch.processorCycles.tolist())
+
+    def test_other_opcodes_run_on_the_mpu(self):
+        # PHA then JSR $2000
+        batch = Batch(2)
+        self.assertFalse(batch.vectorized(0x48))
+        state = self._state([(0x1000, 0x48), (0x1001, 0x20), (0x1002, 0x00),
+                             (0x1003, 0x20)], a=0x5a, s=0x1ff)
+        batch.setup([state, state])
+        batch.step().step()
+        self.assertEqual([0x2000, 0x2000], batch.pc.tolist())
+        self.assertEqual([0xfc, 0xfc], batch.sp.tolist())
+        self.assertEqual([{0x1ff: 0x5a, 0x1fe: 0x10, 0x1fd: 0x03}] * 2,
+                         batch.memory.written(2))
+
+    def test_overridden_instructions_run_on_the_subclass(self):
+        batch = Batch(1, mpuClass=BrokenLDA)
+        self.assertFalse(batch.vectorized(0xb5))
+        self.assertTrue(batch.vectorized(0xa5))
+        batch.setup([self._state([(0x1000, 0xb5), (0x1001, 0x10), (0x10, 0x11),
+                                  (0x30, 0x22)], x=0x20)])
+        batch.step()
+        self.assertEqual(0x11, batch.a[0])
+
+    def test_unwritten_memory_reads_the_default(self):
+        def default(rows, addresses):
+            return (addresses + rows) & 0xff
+        batch = Batch(2, size=0x100, default=default)
+        state = self._state([(0x1000, 0xad), (0x1001, 0x34), (0x1002, 0x12)])
+        batch.setup([state, state])
+        batch.step()
+        self.assertEqual([0x34, 0x35], batch.a.tolist())
+
+    def test_addresses_sharing_a_slot_are_a_conflict(self):
+        # STA $1100 with the program at $1000 in 256 byte rows
+        batch = Batch(2, size=0x100)
+        batch.setup([self._state([(0x1000, 0x8d), (0x1001, 0x00), (0x1002, 0x11)]),
+                     self._state([(0x1000, 0x8d), (0x1001, 0x40), (0x1002, 0x11)])])
+        batch.step()
+        self.assertEqual([True, False], batch.memory.conflict.tolist())
+
+    def test_batch_runner_matches_runner(self):
+        fuzzer = Fuzzer(seed=2, programBank=0)
+        tests = []
+        for i in range(300):
+            tests.append(fuzzer.vector(fuzzer.generate(), 'case %d' % i))
+        tests[5]['final']['a'] ^= 0x100
+        runner = Runner()
+        expected = list(runner.runTests(tests))
+        self.assertEqual(expected, list(BatchRunner(64).runTests(tests)))
+        self.assertTrue(expected[5])
+
+    def test_batch_fuzzer_matches_fuzzer(self):
+        for mpuClass in (devices.mpu65c816.MPU, BrokenLDA):
+            self.assertEqual(
+                Fuzzer(mpuClass, seed=4, programBank=0).run(300),
+                BatchFuzzer(mpuClass, seed=4, programBank=0, count=100).run(300))
+
+    def test_fuzz_runs_in_lockstep(self):
+        self.assertEqual(fuzz(200, 1, seed=5, batch=100, programBank=0),
+                         fuzz(200, 1, seed=5, batch=100, programBank=0,
+                              lockstep=50))
+
+    # Test Helpers
+
+    def _state(self, ram, pc=0x1000, a=0, x=0, s=0x1ff, p=0x30, e=1):
+        return {'pc': pc, 's': s, 'p': p, 'a': a, 'x': x, 'y': 0, 'dbr': 0,
+                'd': 0, 'pbr': 0, 'e': e, 'ram': ram}
+
+    def _random_state(self, rand, vectorized):
+        e = int(rand.random() < 0.3)
+        p = rand.randrange(0x100) | (0x30 if e else 0)
+        index = 0x100 if e or p & 0x10 else 0x10000
+        state = {'pc': rand.randrange(0x10000), 'p': p, 'e': e,
+                 's': 0x100 | rand.randrange(0x100) if e else rand.randrange(0x10000),
+                 'a': rand.randrange(0x10000), 'x': rand.randrange(index),
+                 'y': rand.randrange(index), 'dbr': rand.randrange(0x100),
+                 'd': rand.randrange(0x10000), 'pbr': 0}
+        ram = dict((rand.randrange(0x10000), rand.randrange(0x100))
+                   for i in range(300))
+        for i in range(40):
+            ram[(state['pc'] + i) & 0xffff] = rand.choice(
+                vectorized + [rand.randrange(0x100)])
+        state['ram'] = list(ram.items())
+        return state
+
+    def _make_mpu(self, state):
+        runner = Runner()
+        runner.setup(state)
+        return runner.mpu
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,116 @@
+import unittest
+import sys
+import io
+import devices.mpu65c816
+from devices.slotted import SlottedMPU
+from devices.branchstats import BranchStats, HELPERS
+
+# a loop over X around a loop over Y
+NESTED = [
+    0xa2, 0x03,             # 0000 LDX #$03
+    0xa0, 0x02,             # 0002 LDY #$02
+    0x88,                   # 0004 DEY
+    0xd0, 0xfd,             # 0005 BNE $0004
+    0xca,                   # 0007 DEX
+    0xd0, 0xf8,             # 0008 BNE $0002
+    0xdb,                   # 000a STP
+]
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Branch Statistics"""
+
+    def test_branches_taken_and_not_taken(self):
+        mpu, stats = self._run(NESTED)
+        self.assertEqual([(0x0005, 3, 3), (0x0008, 2, 1)], stats.busiest())
+
+    def test_nested_loops(self):
+        mpu, stats = self._run(NESTED)
+        # (head, tail, iterations, runs, cycles), an outer pass is LDY, DEY,
+        # BNE taken, DEY, BNE not taken, DEX and BNE taken, 16 cycles, an
+        # inner pass DEY and BNE taken, 5 cycles
+        self.assertEqual([(0x0002, 0x0008, 2, 1, 32), (0x0004, 0x0005, 3, 3, 15)],
+                         stats.hottest())
+        self.assertEqual([(0x0002, 0x0008, 2, 1, 32)], stats.hottest(1))
+
+    def test_branch_out_of_a_loop_ends_its_run(self):
+        mpu, stats = self._run([
+            0xa2, 0x02,             # 0000 LDX #$02
+            0xca,                   # 0002 DEX
+            0xf0, 0x02,             # 0003 BEQ $0007
+            0x80, 0xfb,             # 0005 BRA $0002
+            0xdb,                   # 0007 STP
+        ])
+        # BRA and DEX, 4 cycles
+        self.assertEqual([(0x0002, 0x0005, 1, 1, 4)], stats.hottest())
+        self.assertEqual([], stats.active)
+
+    def test_brl_back_edge(self):
+        mpu, stats = self._run([
+            0xa2, 0x02,             # 0000 LDX #$02
+            0xca,                   # 0002 DEX
+            0xf0, 0x03,             # 0003 BEQ $0008
+            0x82, 0xfa, 0xff,       # 0005 BRL $0002
+            0xdb,                   # 0008 STP
+        ])
+        self.assertEqual([(0x0002, 0x0005, 1, 1)],
+                         [loop[:4] for loop in stats.hottest()])
+        self.assertEqual([(0x0003, 1, 1), (0x0005, 1, 0)], stats.busiest())
+
+    def test_stop_restores_the_helpers(self):
+        mpu, stats = self._run(NESTED)
+        for name in HELPERS:
+            self.assertFalse(name in vars(mpu))
+        mpu.reset()
+        mpu.pc = 0x0000
+        mpu.run(count=100)
+        self.assertEqual([(0x0005, 3, 3), (0x0008, 2, 1)], stats.busiest())
+
+    def test_stop_without_start_or_twice_does_nothing(self):
+        mpu = self._get_target_class()(memory=0x10000 * [0x00])
+        BranchStats(mpu).stop()
+        mpu, stats = self._run(NESTED)
+        stats.stop()
+        for name in HELPERS:
+            self.assertFalse(name in vars(mpu))
+
+    def test_report(self):
+        mpu, stats = self._run(NESTED)
+        f = io.StringIO()
+        stats.report(f, 1)
+        lines = f.getvalue().splitlines()
+        self.assertEqual('000002-000008              2         1          32              16.0',
+                         lines[1])
+        self.assertEqual('000005 BNE            3          3    50.0', lines[4])
+        self.assertEqual(5, len(lines))
+
+    # Test Helpers
+
+    def _run(self, program):
+        mpu = self._get_target_class()(memory=0x10000 * [0x00])
+        mpu.memory[0x0000:len(program)] = program
+        mpu.pc = 0x0000
+        mpu.sp = 0xff
+        stats = BranchStats(mpu)
+        stats.start()
+        mpu.run(count=100)
+        stats.stop()
+        self.assertTrue(mpu.stopped)
+        return mpu, stats
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+class SlottedTests(MPUTests):
+    """CMOS 65C816 Tests - Branch Statistics - Slotted"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
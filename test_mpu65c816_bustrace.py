@@ -0,0 +1,149 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.bustrace import (BusTrace, BUS_OPCODE, BUS_PROGRAM, BUS_DATA,
+                              BUS_INTERNAL, BUS_VPB, BUS_MLB, BUS_WRITE)
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Bus Cycle Trace"""
+
+    def test_lda_absolute(self):
+        mpu, trace = self._make_traced_mpu()
+        # $0000 LDA $C000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0))
+        mpu.memory[0xC000] = 0x42
+        mpu.step()
+        self.assertEqual([(0x0000, 0xAD, BUS_OPCODE),
+                          (0x0001, 0x00, BUS_PROGRAM),
+                          (0x0002, 0xC0, BUS_PROGRAM),
+                          (0xC000, 0x42, BUS_DATA)],
+                         list(trace.cycles()))
+
+    def test_lda_immediate_16_bit(self):
+        mpu, trace = self._make_traced_mpu(native=True, m16=True)
+        # $0000 LDA #$1234
+        self._write(mpu.memory, 0x0000, (0xA9, 0x34, 0x12))
+        mpu.step()
+        self.assertEqual([(0x0000, 0xA9, BUS_OPCODE),
+                          (0x0001, 0x34, BUS_PROGRAM),
+                          (0x0002, 0x12, BUS_PROGRAM)],
+                         list(trace.cycles()))
+
+    def test_sta_absolute_16_bit_writes(self):
+        mpu, trace = self._make_traced_mpu(native=True, m16=True)
+        mpu.a = 0x1234
+        # $0000 STA $C000
+        self._write(mpu.memory, 0x0000, (0x8D, 0x00, 0xC0))
+        mpu.step()
+        cycles = list(trace.cycles())
+        self.assertEqual(5, len(cycles))
+        self.assertEqual([(0xC000, 0x34, BUS_DATA | BUS_WRITE),
+                          (0xC001, 0x12, BUS_DATA | BUS_WRITE)], cycles[3:])
+
+    def test_lda_direct_page_dl_not_zero_has_internal_cycle(self):
+        mpu, trace = self._make_traced_mpu()
+        mpu.dpr = 0x0001
+        # $0000 LDA $10
+        self._write(mpu.memory, 0x0000, (0xA5, 0x10))
+        mpu.step()
+        signals = [cycle[2] for cycle in trace.cycles()]
+        self.assertEqual([BUS_OPCODE, BUS_PROGRAM, BUS_INTERNAL, BUS_DATA],
+                         signals)
+
+    def test_inc_direct_page_locks_the_bus(self):
+        mpu, trace = self._make_traced_mpu()
+        # $0000 INC $10
+        self._write(mpu.memory, 0x0000, (0xE6, 0x10))
+        mpu.memory[0x0010] = 0x41
+        mpu.step()
+        self.assertEqual([(0x0000, 0xE6, BUS_OPCODE),
+                          (0x0001, 0x10, BUS_PROGRAM),
+                          (0x0010, 0x41, BUS_DATA | BUS_MLB),
+                          (0x0010, 0x00, BUS_INTERNAL | BUS_MLB),
+                          (0x0010, 0x42, BUS_DATA | BUS_MLB | BUS_WRITE)],
+                         list(trace.cycles()))
+
+    def test_jsr_absolute(self):
+        mpu, trace = self._make_traced_mpu()
+        # $0000 JSR $C000
+        self._write(mpu.memory, 0x0000, (0x20, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual([(0x0000, 0x20, BUS_OPCODE),
+                          (0x0001, 0x00, BUS_PROGRAM),
+                          (0x0002, 0xC0, BUS_PROGRAM),
+                          (0x0002, 0x00, BUS_INTERNAL),
+                          (0x01FF, 0x00, BUS_DATA | BUS_WRITE),
+                          (0x01FE, 0x02, BUS_DATA | BUS_WRITE)],
+                         list(trace.cycles()))
+
+    def test_brk_pulls_the_vector(self):
+        mpu, trace = self._make_traced_mpu()
+        # $0000 BRK
+        self._write(mpu.memory, 0x0000, (0x00, 0x00))
+        self._write(mpu.memory, 0xFFFE, (0x00, 0x30))
+        mpu.step()
+        cycles = list(trace.cycles())
+        self.assertEqual(7, len(cycles))
+        self.assertEqual([(0xFFFE, 0x00, BUS_DATA | BUS_VPB),
+                          (0xFFFF, 0x30, BUS_DATA | BUS_VPB)], cycles[5:])
+
+    def test_trace_has_a_cycle_for_each_processor_cycle(self):
+        mpu, trace = self._make_traced_mpu(native=True)
+        # $0000 LDX #$05
+        # $0002 LDA $2000,X
+        # $0005 STA ($10),Y
+        # $0007 DEX
+        # $0008 BNE $0002
+        # $000A JSR $0020
+        # $0020 INC $3000
+        # $0023 RTS
+        self._write(mpu.memory, 0x0000, (0xA2, 0x05, 0xBD, 0xFE, 0x20, 0x91,
+                                         0x10, 0xCA, 0xD0, 0xF8, 0x20, 0x20,
+                                         0x00))
+        self._write(mpu.memory, 0x0010, (0xF0, 0x30))
+        self._write(mpu.memory, 0x0020, (0xEE, 0x00, 0x30, 0x60))
+        mpu.run(count=24)
+        self.assertEqual(0x000D, mpu.pc)
+        self.assertEqual(mpu.processorCycles, len(list(trace.cycles())))
+
+    def test_stop_restores_the_normal_step(self):
+        mpu, trace = self._make_traced_mpu()
+        memory = mpu.memory
+        trace.stop()
+        self.assertFalse('step' in vars(mpu))
+        self.assertFalse(mpu.cycleAccurate)
+        self.assertIsNot(memory, mpu.memory)
+        mpu.step()
+        self.assertEqual(0, len(trace.buffer))
+
+    # Test Helpers
+
+    def _make_traced_mpu(self, native=False, m16=False):
+        mpu = self._get_target_class()(memory=0x30000 * [0x00])
+        if native:
+            mpu.pCLR(mpu.CARRY)
+            mpu.inst_0xfb() # XCE
+            mpu.pCLR(mpu.CARRY)
+            if m16:
+                mpu.pCLR(mpu.MS)
+            mpu.sp = 0x1ff
+        else:
+            mpu.sp = 0xff
+        mpu.processorCycles = 0
+        trace = BusTrace(mpu)
+        trace.start()
+        return mpu, trace
+
+    def _write(self, memory, start_address, bytes):
+        memory[start_address:start_address + len(bytes)] = bytes
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
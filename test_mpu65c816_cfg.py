@@ -0,0 +1,118 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.cfg import Analyser, vectors
+from devices.disasm import Disassembler
+
+# A ROM at $8000 in emulation mode:
+#   8000 CLC
+#   8001 XCE
+#   8002 REP #$30
+#   8004 LDX #$0000
+#   8007 JSR $8020      with 16 bit registers
+#   800A SEP #$30
+#   800C JSR $8020      and with 8 bit registers
+#   800F DEX
+#   8010 BNE $800C      into the middle of the block from 800A
+#   8012 JMP ($8030)
+#   8020 LDA #$01       two bytes or three
+#   ...  RTS
+#   8030 .word $8040
+#   8040 STP
+ROM = {0x8000: [0x18, 0xfb, 0xc2, 0x30, 0xa2, 0x00, 0x00, 0x20, 0x20, 0x80,
+                0xe2, 0x30, 0x20, 0x20, 0x80, 0xca, 0xd0, 0xfa, 0x6c, 0x30,
+                0x80],
+       0x8020: [0xa9, 0x01, 0x00, 0x60],
+       0x8030: [0x40, 0x80],
+       0x8040: [0xdb],
+       0xfffc: [0x00, 0x80]}
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Control Flow Graph"""
+
+    def test_vectors_that_are_set_are_entries(self):
+        memory = self._make_memory({0xffe6: [0x00, 0x90], 0xffee: [0xff, 0xff]})
+        analyser = Analyser(memory)
+        self.assertEqual([('BRK (native)', 0x9000, 1, 1, 0),
+                          ('RESET', 0x8000, 1, 1, 1)], analyser.vectors())
+        self.assertEqual(('RESET', 0xfffc, 1), vectors()[5])
+
+    def test_blocks_end_at_changes_of_flow(self):
+        analyser = self._analyse()
+        self.assertEqual([0x8000, 0x800a, 0x800c, 0x800f, 0x8012, 0x8020,
+                          0x8020, 0x8040],
+                         sorted([key[0] for key in analyser.blocks]))
+        block = analyser.blocks[(0x8000, 1, 1, 1)]
+        self.assertEqual(0x800a, block.end)
+        self.assertEqual([(0x800a, 0, 0, 0)], block.successors)
+        self.assertEqual([(0x8020, 0, 0, 0)], block.calls)
+        block = analyser.blocks[(0x800f, 1, 1, 0)]
+        self.assertEqual([(0x800c, 1, 1, 0), (0x8012, 1, 1, 0)], block.successors)
+        self.assertEqual(0x8012, block.end)
+
+    def test_branch_into_a_block_splits_it(self):
+        analyser = self._analyse()
+        first = analyser.blocks[(0x800a, 0, 0, 0)]
+        self.assertEqual(0x800c, first.end)
+        self.assertEqual([(0x800c, 1, 1, 0)], first.successors)
+        self.assertEqual([], first.calls)
+        second = analyser.blocks[(0x800c, 1, 1, 0)]
+        self.assertEqual([(0x800f, 1, 1, 0)], second.successors)
+        self.assertEqual([(0x8020, 1, 1, 0)], second.calls)
+        self.assertTrue(analyser.owner[(0x800c, 1, 1, 0)] is second)
+
+    def test_widths_are_tracked_per_block(self):
+        analyser = self._analyse()
+        wide = analyser.blocks[(0x8020, 0, 0, 0)]
+        narrow = analyser.blocks[(0x8020, 1, 1, 0)]
+        self.assertEqual([0x8020, 0x8023], [state[0] for state in wide.instructions])
+        self.assertEqual([0x8020, 0x8022], [state[0] for state in narrow.instructions])
+        self.assertTrue(0x8022 in analyser.addresses())
+
+    def test_pointer_jumps_in_the_rom_are_followed(self):
+        analyser = self._analyse()
+        self.assertEqual([(0x8040, 1, 1, 0)],
+                         analyser.blocks[(0x8012, 1, 1, 0)].successors)
+        # not through RAM or a table
+        analyser = self._analyse({0x8012: [0x6c, 0x00, 0x02]})
+        self.assertTrue(analyser.blocks[(0x8012, 1, 1, 0)].indirect)
+        analyser = self._analyse({0x8012: [0x7c, 0x30, 0x80]})
+        self.assertTrue(analyser.blocks[(0x8012, 1, 1, 0)].indirect)
+        self.assertEqual([], analyser.blocks[(0x8012, 1, 1, 0)].successors)
+
+    def test_targets_outside_the_range_are_not_followed(self):
+        analyser = self._analyse({0x8012: [0x5c, 0x00, 0x10, 0x00]})
+        self.assertEqual(set([(0x1000, 1, 1, 0)]), analyser.outside)
+
+    def test_prewarm_fills_the_disassembler_cache(self):
+        analyser = self._analyse()
+        disassembler = Disassembler(analyser.memory)
+        analyser.prewarm(disassembler)
+        decoded = disassembler.decoded
+        self.assertEqual(len(analyser.owner), decoded)
+        self.assertEqual((3, 'LDA #$0001'), disassembler.instruction(0x8020, 0, 0))
+        self.assertEqual(decoded, disassembler.decoded)
+
+    # Test Helpers
+
+    def _make_memory(self, changes=None):
+        memory = [0] * 0x10000
+        for address, values in list(ROM.items()) + list((changes or {}).items()):
+            memory[address:address + len(values)] = values
+        return memory
+
+    def _analyse(self, changes=None):
+        analyser = Analyser(self._make_memory(changes), start=0x8000, end=0x10000)
+        analyser.analyse(analyser.vectors())
+        return analyser
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
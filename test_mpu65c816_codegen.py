@@ -0,0 +1,145 @@
+import unittest
+import sys
+import random
+import devices.mpu65c816
+from devices.codegen import GeneratedMPU, STATES, table, source, build
+from tests.devices import test_mpu65c816_emulation
+from tests.devices import test_mpu65c816_native_8
+from tests.devices import test_mpu65c816_native_16
+from tests.devices import test_mpu65c816_cycles
+
+REGISTERS = ('a', 'b', 'x', 'y', 'p', 'sp', 'pc', 'dbr', 'pbr', 'dpr', 'mode',
+             'processorCycles', 'waiting')
+
+
+class HashedMemory(dict):
+    # 24 bit memory, unwritten addresses read as a hash of the address so a
+    # wrong effective address reads the wrong data
+    def __missing__(self, address):
+        return ((address * 2654435761) >> 13) & 0xff
+
+
+# the MPU suites again, run against GeneratedMPU
+
+class EmulationTests(test_mpu65c816_emulation.MPUTests):
+    """CMOS 65C816 Tests - Generated - Emulation Mode"""
+
+    def _get_target_class(self):
+        return GeneratedMPU
+
+
+class Native8Tests(test_mpu65c816_native_8.MPUTests):
+    """CMOS 65C816 Tests - Generated - Native Mode - 8 Bit"""
+
+    def _get_target_class(self):
+        return GeneratedMPU
+
+
+class Native16Tests(test_mpu65c816_native_16.MPUTests):
+    """CMOS 65C816 Tests - Generated - Native Mode - 16 Bit"""
+
+    def _get_target_class(self):
+        return GeneratedMPU
+
+
+class CycleTests(test_mpu65c816_cycles.MPUTests):
+    """CMOS 65C816 Tests - Generated - Cycles"""
+
+    def _get_target_class(self):
+        return GeneratedMPU
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Generated Handlers"""
+
+    def test_table_follows_the_decorators(self):
+        mpu = devices.mpu65c816.MPU
+        rows = table()
+        for opcode, name, mode, cycles, extra, width, flags in rows:
+            self.assertEqual([name, mode], list(mpu.disassemble[opcode]))
+            self.assertEqual(mpu.cycletime[opcode], cycles)
+            self.assertEqual(mpu.extracycles[opcode], extra)
+        opcodes = [row[0] for row in rows]
+        self.assertTrue(0xa9 in opcodes) # LDA #
+        self.assertTrue(0x20 in opcodes) # JSR a
+        self.assertFalse(0x89 in opcodes) # BIT # only changes Z
+        self.assertFalse(0xfb in opcodes) # XCE
+
+    def test_handlers_by_flags(self):
+        handlers = build()
+        self.assertEqual(sorted(STATES), [index for index in range(len(handlers))
+                                          if handlers[index] is not None])
+        # LDA # depends on M only, XCE isn't generated
+        self.assertTrue(handlers[0x30][0xa9] is handlers[0x20][0xa9])
+        self.assertFalse(handlers[0x30][0xa9] is handlers[0x10][0xa9])
+        self.assertEqual('d_fb', handlers[0x00][0xfb].__name__)
+
+    def test_source_compiles(self):
+        text = source()
+        compile(text, '<handlers>', 'exec')
+        self.assertTrue('def h_a9_' in text)
+        self.assertTrue('HANDLERS[0x31] = [' in text)
+
+    def test_decimal_adc_uses_the_mpu_handler(self):
+        mpu = self._make_mpu(devices.mpu65c816.MPU)
+        generated = self._make_mpu()
+        for m in (mpu, generated):
+            m.p |= m.DECIMAL
+            m.a = 0x19
+            m.memory[0x0000:0x0002] = [0x69, 0x01] # ADC #$01
+            m.step()
+        self.assertEqual(0x20, generated.a)
+        self.assertEqual([getattr(mpu, name) for name in REGISTERS],
+                         [getattr(generated, name) for name in REGISTERS])
+
+    def test_every_opcode_matches_mpu(self):
+        # each opcode from random states with each combination of M, X and
+        # E, the registers, cycles and memory writes the same as MPU's
+        rng = random.Random(816)
+        for index, (m, x, e) in sorted(STATES.items()):
+            for opcode in range(256):
+                for i in range(3):
+                    seed = rng.random()
+                    mpus = [self._random_mpu(klass, seed, opcode, m, x, e)
+                            for klass in (devices.mpu65c816.MPU, self._get_target_class())]
+                    for mpu in mpus:
+                        mpu.step()
+                    expected, actual = [([getattr(mpu, name) for name in REGISTERS],
+                                         dict(mpu.memory)) for mpu in mpus]
+                    self.assertEqual(expected, actual, '%02x m=%d x=%d e=%d'
+                                     % (opcode, m, x, e))
+
+    # Test Helpers
+
+    def _random_mpu(self, klass, seed, opcode, m, x, e):
+        rng = random.Random(seed)
+        mpu = klass(memory=HashedMemory())
+        mpu.mode = e
+        mpu.p = (rng.randrange(0x100) & ~0x30) | (m * mpu.MS) | (x * mpu.IRS)
+        mpu.a = rng.randrange(0x100 if m else 0x10000)
+        mpu.b = rng.randrange(0x100)
+        mpu.x = rng.randrange(0x100 if x else 0x10000)
+        mpu.y = rng.randrange(0x100 if x else 0x10000)
+        mpu.sp = rng.randrange(0x100 if e else 0x10000)
+        mpu.dpr = rng.choice([0, rng.randrange(0x100) << 8, rng.randrange(0x10000)])
+        mpu.dbr = rng.randrange(0x100)
+        mpu.pbr = rng.randrange(0x100)
+        mpu.pc = rng.randrange(0x10000)
+        mpu.memory[(mpu.pbr << 16) + mpu.pc] = opcode
+        mpu.processorCycles = 0
+        return mpu
+
+    def _make_mpu(self, klass=None):
+        if klass is None:
+            klass = self._get_target_class()
+        return klass(memory=0x10000 * [0x00])
+
+    def _get_target_class(self):
+        return GeneratedMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
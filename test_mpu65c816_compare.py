@@ -0,0 +1,103 @@
+import unittest
+import sys
+import io
+import os
+import json
+import tempfile
+from benchmarks import compare, run as runner
+
+STEADY = [100.0, 101.0, 99.0, 100.5, 99.5]
+
+
+def results(lda=STEADY, sta=STEADY, boot=STEADY, settings=True):
+    # benchmark results with two opcodes in one mode and one workload
+    samples = {
+        'format': runner.FORMAT,
+        'opcodes': {'native16': {
+            'a9': {'name': 'LDA', 'mode': 'imm', 'ips': list(lda)},
+            '8d': {'name': 'STA', 'mode': 'abs', 'ips': list(sta)},
+        }},
+        'macro': {'liara_boot': {'ips': list(boot)}},
+    }
+    if settings:
+        samples['settings'] = {'modes': ['native16'], 'opcodes': 'a9,8d',
+                               'number': 300, 'repeat': 7, 'macro_repeat': 2}
+    return samples
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Benchmark Regression Gate"""
+
+    def test_no_change_passes(self):
+        self.assertEqual([], self._regressions(results(), results()))
+
+    def test_a_slower_opcode_fails(self):
+        slower = [ips * 0.8 for ips in STEADY]
+        regressions = self._regressions(results(), results(lda=slower))
+        self.assertEqual([('native16 mode', 'imm'), ('native16 name', 'LDA')],
+                         sorted((finding.kind, finding.key) for finding in regressions))
+        self.assertAlmostEqual(25.0, regressions[0].slowdown, 0)
+
+    def test_a_slower_workload_fails(self):
+        slower = [ips * 0.9 for ips in STEADY]
+        regressions = self._regressions(results(), results(boot=slower))
+        self.assertEqual([('macro', 'liara_boot')],
+                         [(finding.kind, finding.key) for finding in regressions])
+
+    def test_below_the_threshold_or_not_significant_passes(self):
+        # 2% slower, under the 5% threshold
+        self.assertEqual([], self._regressions(results(), results(
+            lda=[ips * 0.98 for ips in STEADY])))
+        # 10% slower on average but all over the place
+        noisy = [50.0, 150.0, 60.0, 140.0, 55.0]
+        self.assertEqual([], self._regressions(results(), results(boot=noisy)))
+
+    def test_faster_passes(self):
+        faster = [ips * 1.5 for ips in STEADY]
+        self.assertEqual([], self._regressions(results(), results(lda=faster, boot=faster)))
+
+    def test_main_exit_status(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = []
+            for name, data in (('baseline', results()),
+                               ('same', results()),
+                               ('slower', results(sta=[ips * 0.7 for ips in STEADY]))):
+                paths.append(os.path.join(folder, name + '.json'))
+                with open(paths[-1], 'w') as f:
+                    json.dump(data, f)
+            out = io.StringIO()
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                self.assertEqual(0, compare.main([paths[0], '--current', paths[1]]))
+                self.assertEqual(1, compare.main([paths[0], '--current', paths[2]]))
+            finally:
+                sys.stdout = stdout
+            self.assertTrue('regression(s):' in out.getvalue())
+
+    def test_run_measures_with_the_baseline_settings(self):
+        args = runner.parse_args(compare.bench_args(results(), '.', quick=True))
+        self.assertEqual(['native16'], args.modes)
+        self.assertEqual(['8d', 'a9'], args.opcodes.split(','))
+        self.assertEqual((300, 7, 2), (args.number, args.repeat, args.macro_repeat))
+        self.assertFalse(args.no_micro or args.no_macro)
+        self.assertEqual(runner.settings(args)['number'], 300)
+
+    def test_run_without_saved_settings(self):
+        baseline = results(settings=False)
+        del baseline['macro']
+        args = runner.parse_args(compare.bench_args(baseline, '.', quick=True))
+        self.assertTrue(args.quick and args.no_macro)
+        self.assertEqual(500, args.number)
+
+    # Test Helpers
+
+    def _regressions(self, baseline, current):
+        findings = compare.compare(baseline, current)
+        return compare.report(findings, 5.0, 5.0, 0.01, out=io.StringIO())
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
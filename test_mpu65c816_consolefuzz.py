@@ -0,0 +1,117 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.consolefuzz import ConsoleFuzzer, Crash, fuzz
+
+# A console firmware in emulation mode, getc at $F000 and putc at $F001:
+#   0FF0 LDX #$FF
+#   0FF2 TXS
+#   0FF3 JMP $1000
+#   1000 LDA $F000    wait for a key
+#   1003 BEQ $1000
+#   1005 STA $F001    echo it
+#   1008 CMP #'!'
+#   100A BNE $100D
+#   100C BRK          ! crashes through the BRK vector
+#   100D CMP #'S'
+#   100F BNE $1012
+#   1011 STP          S stops the processor
+#   1012 CMP #'P'
+#   1014 BNE $1000
+#   1016 PHA          P leaks a byte of stack
+#   1017 BRA $1000
+FIRMWARE = [0xa2, 0xff, 0x9a, 0x4c, 0x00, 0x10] + 10 * [0xea] + \
+           [0xad, 0x00, 0xf0, 0xf0, 0xfb, 0x8d, 0x01, 0xf0, 0xc9, 0x21,
+            0xd0, 0x01, 0x00, 0xc9, 0x53, 0xd0, 0x01, 0xdb, 0xc9, 0x50,
+            0xd0, 0xea, 0x48, 0x80, 0xe7]
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Console Fuzzing"""
+
+    def test_snapshot_is_taken_waiting_for_input(self):
+        fuzzer = self._make_fuzzer()
+        fuzzer.restore()
+        self.assertEqual(0x1003, fuzzer.mpu.pc)
+        self.assertEqual(0xff, fuzzer.mpu.sp)
+        self.assertEqual({}, dict(fuzzer.memory))
+
+    def test_snapshot_is_restored_for_each_execution(self):
+        fuzzer = self._make_fuzzer()
+        fuzzer.execute(b'PPP\r')
+        self.assertEqual((None, 0), fuzzer.execute(b'PPP\r'))
+        self.assertEqual(0xfc, fuzzer.mpu.sp)
+        fuzzer.restore()
+        self.assertEqual(0xff, fuzzer.mpu.sp)
+        self.assertEqual({}, dict(fuzzer.memory))
+
+    def test_new_edges_are_counted_once(self):
+        fuzzer = self._make_fuzzer(seeds=())
+        outcome, edges = fuzzer.execute(b'a\r')
+        self.assertTrue(edges > 0)
+        self.assertEqual((None, 0), fuzzer.execute(b'b\r'))
+        outcome, edges = fuzzer.execute(b'P\r')
+        self.assertTrue(edges > 0)
+
+    def test_brk_through_an_unexpected_vector_is_a_crash(self):
+        outcome, edges = self._make_fuzzer().execute(b'a!\r')
+        self.assertTrue(isinstance(outcome, Crash))
+        self.assertEqual(('BRK', 0x100c), outcome.key())
+        # not when the firmware handles BRK, here by looping through it
+        fuzzer = self._make_fuzzer(vectors=[0xfffe], stack=None, budget=1000)
+        self.assertEqual('hang', fuzzer.execute(b'a!\r')[0])
+
+    def test_stp_is_a_crash(self):
+        outcome, edges = self._make_fuzzer().execute(b'S\r')
+        self.assertEqual(('STP', 0x1011), outcome.key())
+
+    def test_stack_leaving_its_range_is_a_crash(self):
+        fuzzer = self._make_fuzzer()
+        self.assertEqual(None, fuzzer.execute(15 * b'P' + b'\r')[0])
+        outcome, edges = fuzzer.execute(16 * b'P' + b'\r')
+        self.assertEqual(('stack', 0x1017), outcome.key())
+
+    def test_running_out_of_budget_is_a_hang(self):
+        fuzzer = self._make_fuzzer(budget=5)
+        self.assertEqual('hang', fuzzer.execute(b'abcdefgh\r')[0])
+
+    def test_replay_keeps_the_output(self):
+        fuzzer = self._make_fuzzer()
+        edges = fuzzer.edges()
+        self.assertEqual((None, b'hi\r'), fuzzer.replay(b'hi\r'))
+        outcome, output = fuzzer.replay(b'P!\r')
+        self.assertEqual(b'P!', output)
+        self.assertEqual(edges, fuzzer.edges())
+
+    def test_fuzzing_finds_the_crashes(self):
+        fuzzer = self._make_fuzzer(tokens=(b'!', b'S', b'x'))
+        crashes = fuzzer.run(300)
+        self.assertEqual([('BRK', 0x100c), ('STP', 0x1011)], sorted(crashes))
+        crash, data = crashes[('STP', 0x1011)]
+        self.assertTrue(b'S' in data)
+
+    def test_processes_merge_their_crashes(self):
+        config = {'image': bytes(FIRMWARE), 'load': 0x0ff0, 'pc': 0x0ff0,
+                  'getc': 0xf000, 'putc': 0xf001, 'stack': (0x1f0, 0x1ff),
+                  'tokens': (b'!', b'S'), 'seeds': (b'a\r',)}
+        crashes, corpus, edges, hangs = fuzz(config, 100, processes=2)
+        self.assertEqual([('BRK', 0x100c), ('STP', 0x1011)], sorted(crashes))
+        self.assertTrue(edges > 0)
+
+    # Test Helpers
+
+    def _make_fuzzer(self, **kargs):
+        options = {'pc': 0x0ff0, 'putc': 0xf001, 'stack': (0x1f0, 0x1ff),
+                   'seeds': (b'a\r',), 'size': 0x10000}
+        options.update(kargs)
+        return ConsoleFuzzer(bytes(FIRMWARE), 0x0ff0, 0xf000, **options)
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,244 @@
+import unittest
+import sys
+import devices.mpu65c816
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Cycle Accurate Mode"""
+
+    # register widths
+
+    def test_lda_absolute_8_bit_takes_4_cycles(self):
+        mpu = self._make_mpu(native=True)
+        # $0000 LDA $C000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(4, mpu.processorCycles)
+
+    def test_lda_absolute_16_bit_takes_5_cycles(self):
+        mpu = self._make_mpu(native=True, m16=True)
+        # $0000 LDA $C000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(5, mpu.processorCycles)
+
+    def test_asl_direct_page_16_bit_takes_7_cycles(self):
+        mpu = self._make_mpu(native=True, m16=True)
+        # $0000 ASL $10
+        self._write(mpu.memory, 0x0000, (0x06, 0x10))
+        mpu.step()
+        self.assertEqual(7, mpu.processorCycles)
+
+    def test_ldx_immediate_16_bit_index_takes_3_cycles(self):
+        mpu = self._make_mpu(native=True, x16=True)
+        # $0000 LDX #$1234
+        self._write(mpu.memory, 0x0000, (0xA2, 0x34, 0x12))
+        mpu.step()
+        self.assertEqual(3, mpu.processorCycles)
+        self.assertEqual(0x0003, mpu.pc)
+
+    def test_pha_16_bit_index_takes_3_cycles(self):
+        mpu = self._make_mpu(native=True, x16=True)
+        # $0000 PHA
+        self._write(mpu.memory, 0x0000, (0x48,))
+        mpu.step()
+        self.assertEqual(3, mpu.processorCycles)
+
+    # direct page
+
+    def test_lda_direct_page_dl_not_zero_adds_1_cycle(self):
+        mpu = self._make_mpu()
+        # $0000 LDA $10
+        self._write(mpu.memory, 0x0000, (0xA5, 0x10))
+        mpu.step()
+        self.assertEqual(3, mpu.processorCycles)
+
+        mpu = self._make_mpu()
+        mpu.dpr = 0x0001
+        self._write(mpu.memory, 0x0000, (0xA5, 0x10))
+        mpu.step()
+        self.assertEqual(4, mpu.processorCycles)
+
+    def test_lda_direct_page_dh_not_zero_adds_nothing(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x0100
+        # $0000 LDA $10
+        self._write(mpu.memory, 0x0000, (0xA5, 0x10))
+        mpu.step()
+        self.assertEqual(3, mpu.processorCycles)
+
+    # indexing
+
+    def test_lda_absolute_x_page_crossing_adds_1_cycle(self):
+        mpu = self._make_mpu()
+        mpu.x = 0x01
+        # $0000 LDA $C0FE,X
+        self._write(mpu.memory, 0x0000, (0xBD, 0xFE, 0xC0))
+        mpu.step()
+        self.assertEqual(4, mpu.processorCycles)
+
+        mpu = self._make_mpu()
+        mpu.x = 0x02
+        self._write(mpu.memory, 0x0000, (0xBD, 0xFE, 0xC0))
+        mpu.step()
+        self.assertEqual(5, mpu.processorCycles)
+
+    def test_lda_absolute_x_16_bit_index_always_adds_1_cycle(self):
+        mpu = self._make_mpu(native=True, x16=True)
+        mpu.x = 0x0001
+        # $0000 LDA $C000,X
+        self._write(mpu.memory, 0x0000, (0xBD, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(5, mpu.processorCycles)
+
+    def test_ldy_absolute_x_16_bit_takes_6_cycles(self):
+        mpu = self._make_mpu(native=True, x16=True)
+        mpu.x = 0x0001
+        # $0000 LDY $C000,X
+        self._write(mpu.memory, 0x0000, (0xBC, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(6, mpu.processorCycles)
+
+    def test_sta_absolute_x_takes_5_cycles_without_crossing(self):
+        mpu = self._make_mpu()
+        mpu.x = 0x01
+        # $0000 STA $C000,X
+        self._write(mpu.memory, 0x0000, (0x9D, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(5, mpu.processorCycles)
+
+    def test_lda_indirect_y_page_crossing_adds_1_cycle(self):
+        mpu = self._make_mpu()
+        mpu.y = 0x02
+        # $0000 LDA ($10),Y
+        self._write(mpu.memory, 0x0000, (0xB1, 0x10))
+        self._write(mpu.memory, 0x0010, (0xFF, 0xC0))
+        mpu.step()
+        self.assertEqual(6, mpu.processorCycles)
+
+    # branches
+
+    def test_branch_not_taken_takes_2_cycles(self):
+        mpu = self._make_mpu()
+        mpu.p |= mpu.ZERO
+        # $0000 BNE +$10
+        self._write(mpu.memory, 0x0000, (0xD0, 0x10))
+        mpu.step()
+        self.assertEqual(2, mpu.processorCycles)
+
+    def test_branch_taken_takes_3_cycles(self):
+        mpu = self._make_mpu()
+        # $0000 BNE +$10
+        self._write(mpu.memory, 0x0000, (0xD0, 0x10))
+        mpu.step()
+        self.assertEqual(0x0012, mpu.pc)
+        self.assertEqual(3, mpu.processorCycles)
+
+    def test_branch_taken_across_page_adds_1_cycle_in_emulation_mode(self):
+        mpu = self._make_mpu()
+        mpu.pc = 0x10F0
+        # $10F0 BRA +$20
+        self._write(mpu.memory, 0x10F0, (0x80, 0x20))
+        mpu.step()
+        self.assertEqual(0x1112, mpu.pc)
+        self.assertEqual(4, mpu.processorCycles)
+
+        mpu = self._make_mpu(native=True)
+        mpu.pc = 0x10F0
+        self._write(mpu.memory, 0x10F0, (0x80, 0x20))
+        mpu.step()
+        self.assertEqual(0x1112, mpu.pc)
+        self.assertEqual(3, mpu.processorCycles)
+
+    # interrupts
+
+    def test_brk_takes_7_cycles_in_emulation_mode_8_in_native_mode(self):
+        mpu = self._make_mpu()
+        # $0000 BRK
+        self._write(mpu.memory, 0x0000, (0x00, 0x00))
+        mpu.step()
+        self.assertEqual(7, mpu.processorCycles)
+
+        mpu = self._make_mpu(native=True)
+        self._write(mpu.memory, 0x0000, (0x00, 0x00))
+        mpu.step()
+        self.assertEqual(8, mpu.processorCycles)
+
+    def test_irq_takes_8_cycles_in_native_mode(self):
+        mpu = self._make_mpu(native=True)
+        mpu.p &= ~mpu.INTERRUPT
+        mpu.irq()
+        self.assertEqual(8, mpu.processorCycles)
+
+    # block moves
+
+    def test_mvn_takes_7_cycles_per_byte(self):
+        mpu = self._make_mpu(native=True, m16=True, x16=True)
+        mpu.a = 0x0002
+        mpu.x = 0x2000
+        mpu.y = 0x3000
+        # $0000 MVN $00,$00
+        self._write(mpu.memory, 0x0000, (0x54, 0x00, 0x00))
+        while mpu.pc == 0x0000:
+            mpu.step()
+        self.assertEqual(0x0003, mpu.pc)
+        self.assertEqual(21, mpu.processorCycles)
+
+    # switching
+
+    def test_turning_accurate_mode_off_restores_default_counts(self):
+        mpu = self._make_mpu(native=True, m16=True)
+        mpu.setCycleAccurate(False)
+        self.assertFalse(mpu.cycleAccurate)
+        # $0000 LDA $C000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0))
+        mpu.step()
+        self.assertEqual(mpu.cycletime[0xAD], mpu.processorCycles)
+
+    def test_turning_accurate_mode_off_leaves_another_step(self):
+        mpu = self._make_mpu()
+        replaced = []
+        mpu.step = lambda: replaced.append(mpu.pc)
+        mpu.setCycleAccurate(False)
+        self.assertFalse(mpu.cycleAccurate)
+        mpu.step()
+        self.assertEqual([0x0000], replaced)
+
+    def test_turning_accurate_mode_off_without_a_step_of_its_own(self):
+        mpu = self._make_mpu()
+        del mpu.step # taken out by something else
+        mpu.setCycleAccurate(False)
+        self.assertFalse('step' in vars(mpu))
+
+    # Test Helpers
+
+    def _make_mpu(self, native=False, m16=False, x16=False):
+        klass = self._get_target_class()
+        mpu = klass(memory=0x30000 * [0x00])
+        if native:
+            mpu.pCLR(mpu.CARRY)
+            mpu.inst_0xfb() # XCE
+            mpu.pCLR(mpu.CARRY)
+            if m16:
+                mpu.pCLR(mpu.MS)
+            if x16:
+                mpu.pCLR(mpu.IRS)
+            mpu.sp = 0x1ff
+        else:
+            mpu.sp = 0xff
+        mpu.processorCycles = 0
+        mpu.setCycleAccurate()
+        return mpu
+
+    def _write(self, memory, start_address, bytes):
+        memory[start_address:start_address + len(bytes)] = bytes
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,135 @@
+import unittest
+import io
+import sys
+import devices.mpu65c816
+from devices.disasm import Disassembler, follow, trace
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Disassembly"""
+
+    def test_immediate_operands_follow_m_and_x(self):
+        # LDA #$1234 : LDX #$5678 : REP #$30
+        disassembler = self._make_disassembler(
+            [0xa9, 0x34, 0x12, 0xa2, 0x78, 0x56, 0xc2, 0x30])
+        self.assertEqual((2, 'LDA #$34'), disassembler.instruction(0x1000))
+        self.assertEqual((3, 'LDA #$1234'), disassembler.instruction(0x1000, m=0))
+        self.assertEqual((2, 'LDX #$78'), disassembler.instruction(0x1003, m=0))
+        self.assertEqual((3, 'LDX #$5678'), disassembler.instruction(0x1003, x=0))
+        self.assertEqual((2, 'REP #$30'), disassembler.instruction(0x1006, m=0, x=0))
+
+    def test_listing_follows_the_mode_changes(self):
+        # CLC : XCE : REP #$30 : LDA #$0300 : SEP #$20 : LDA #$03 : LDY #$0000
+        disassembler = self._make_disassembler(
+            [0x18, 0xfb, 0xc2, 0x30, 0xa9, 0x00, 0x03, 0xe2, 0x20, 0xa9, 0x03,
+             0xa0, 0x00, 0x00])
+        lines = disassembler.listing(0x1000, 0x100e)
+        self.assertEqual(['CLC', 'XCE', 'REP #$30', 'LDA #$0300', 'SEP #$20',
+                          'LDA #$03', 'LDY #$0000'],
+                         [text for address, code, text, widths in lines])
+        self.assertEqual((0, 0), lines[3][3])
+        self.assertEqual((1, 0), lines[6][3])
+
+    def test_rep_does_not_widen_in_emulation_mode(self):
+        self.assertEqual((1, 1, 1, 0), follow((0xc2, 0x31), 1, 1, 1, None))
+        self.assertEqual((0, 0, 0, 0), follow((0xc2, 0x31), 1, 1, 0, None))
+        # XCE with an unknown carry leaves the mode unknown
+        self.assertEqual((1, 1, None, 1), follow((0xfb,), 1, 1, 1, None))
+        self.assertEqual((0, 1, None, 1), follow((0xc2, 0x20), 1, 1, None, 1))
+
+    def test_native_to_native_xce_keeps_the_widths(self):
+        self.assertEqual((0, 0, 0, 0), follow((0xfb,), 0, 0, 0, 0))
+        self.assertEqual((1, 1, 1, 0), follow((0xfb,), 0, 0, 0, 1))
+        self.assertEqual((1, 1, 0, 1), follow((0xfb,), 1, 1, 1, 0))
+        # CLC : XCE : REP #$30 : CLC : XCE : LDA #$1234 : LDX #$5678
+        disassembler = self._make_disassembler(
+            [0x18, 0xfb, 0xc2, 0x30, 0x18, 0xfb, 0xa9, 0x34, 0x12, 0xa2, 0x78,
+             0x56])
+        lines = disassembler.listing(0x1000, 0x100c)
+        self.assertEqual(['CLC', 'XCE', 'REP #$30', 'CLC', 'XCE', 'LDA #$1234',
+                          'LDX #$5678'],
+                         [text for address, code, text, widths in lines])
+
+    def test_operand_formats(self):
+        memory = [0] * 0x20000
+        program = [
+            (0x1000, [0xd0, 0xfe], 'BNE $1000'),
+            (0x1002, [0x82, 0x00, 0x80], 'BRL $9005'),
+            (0x1005, [0x54, 0x12, 0x34], 'MVN $34,$12'),
+            (0x1008, [0x22, 0x00, 0x80, 0x01], 'JSL $018000'),
+            (0x100c, [0xbf, 0x56, 0x34, 0x12], 'LDA $123456,X'),
+            (0x1010, [0xb3, 0x05], 'LDA ($05,S),Y'),
+            (0x1012, [0xb7, 0x10], 'LDA [$10],Y'),
+            (0x1014, [0xdc, 0x34, 0x12], 'JML [$1234]'),
+            (0x1017, [0xf4, 0x34, 0x12], 'PEA $1234'),
+            (0x101a, [0x0a], 'ASL A'),
+            (0x101b, [0x00, 0x42], 'BRK $42'),
+        ]
+        for address, code, text in program:
+            memory[address:address + len(code)] = code
+        disassembler = Disassembler(memory)
+        for address, code, text in program:
+            self.assertEqual((len(code), text), disassembler.instruction(address))
+
+    def test_operands_wrap_within_the_bank(self):
+        memory = [0] * 0x30000
+        memory[0x1ffff] = 0xad # LDA $1234, not the bytes in the next bank
+        memory[0x10000:0x10002] = [0x34, 0x12]
+        memory[0x20000:0x20002] = [0xff, 0xff]
+        disassembler = Disassembler(memory)
+        self.assertEqual((3, 'LDA $1234'), disassembler.instruction(0x1ffff))
+
+    def test_cached_instructions_are_decoded_once(self):
+        disassembler = self._make_disassembler([0xa9, 0x01, 0xea, 0xea])
+        disassembler.listing(0x1000, 0x1004)
+        self.assertEqual(3, disassembler.decoded)
+        disassembler.listing(0x1000, 0x1004)
+        self.assertEqual(3, disassembler.decoded)
+        # the same bytes at other widths are another instruction
+        disassembler.instruction(0x1000, m=0)
+        self.assertEqual(4, disassembler.decoded)
+
+    def test_overwritten_code_is_decoded_again(self):
+        disassembler = self._make_disassembler([0xa9, 0x01, 0xea])
+        self.assertEqual((2, 'LDA #$01'), disassembler.instruction(0x1000))
+        disassembler.memory[0x1001] = 0x02
+        self.assertEqual((2, 'LDA #$02'), disassembler.instruction(0x1000))
+        disassembler.invalidate(0x1000, 0x1001)
+        self.assertEqual({}, dict((key, value) for key, value
+                                  in disassembler.cache.items() if key[0] == 0x1000))
+
+    def test_write_formats_the_listing(self):
+        disassembler = self._make_disassembler([0xa9, 0x01, 0x5c, 0x00, 0x80, 0x01])
+        f = io.StringIO()
+        disassembler.write(f, 0x1000, 0x1006)
+        self.assertEqual('00:1000  a9 01        LDA #$01\n'
+                         '00:1002  5c 00 80 01  JML $018000\n', f.getvalue())
+
+    def test_trace_writes_the_executed_instructions(self):
+        # CLC : XCE : REP #$20 : LDA #$1234
+        mpu = self._get_target_class()()
+        mpu.memory[0:7] = [0x18, 0xfb, 0xc2, 0x20, 0xa9, 0x34, 0x12]
+        f = io.StringIO()
+        trace(mpu, 4, f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[3].startswith('00:0004  a9 34 12     LDA #$1234'))
+        self.assertTrue(' E=0' in lines[3])
+        self.assertEqual(0x1234, mpu.a | (mpu.b << 8))
+
+    # Test Helpers
+
+    def _make_disassembler(self, program, address=0x1000):
+        memory = [0] * 0x10000
+        memory[address:address + len(program)] = program
+        return Disassembler(memory)
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
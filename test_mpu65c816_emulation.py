@@ -1,6 +1,7 @@
 import unittest
 import sys
 import devices.mpu65c816
+from tests.devices import mpupool
 from tests.devices.test_mpu65816_Common6502 import Common6502Tests
 from tests.devices.test_mpu65816_Common65c02 import Common65C02Tests
 
@@ -319,16 +320,236 @@ class MPUTests(unittest.TestCase, Common6502Tests, Common65C02Tests):
         self.assertEqual(0x0000, mpu.pc)
         self.assertEqual(0xFF,   mpu.sp)
 
+    # WAI
 
+    def test_wai_run_skips_to_scheduled_irq(self):
+        mpu = self._make_mpu()
+        self._write(mpu.memory, 0xFFFE, (0x00, 0x04))
+        # $0000 CLI
+        # $0001 WAI
+        self._write(mpu.memory, 0x0000, (0x58, 0xCB))
+        mpu.schedule(1000, lambda m: m.irq())
+        self.assertEqual(mpu.RUN_COUNT, mpu.run(count=3))
+        self.assertEqual(0x0401, mpu.pc)
+        self.assertEqual(False, mpu.waiting)
+        self.assertEqual(1000 + 7 + 2, mpu.processorCycles)  # IRQ + TAX at $0400
+
+    def test_wai_run_returns_idle_with_nothing_scheduled(self):
+        mpu = self._make_mpu()
+        # $0000 WAI
+        mpu.memory[0x0000] = 0xCB
+        self.assertEqual(mpu.RUN_IDLE, mpu.run())
+        self.assertEqual(True, mpu.waiting)
+        self.assertEqual(3, mpu.processorCycles)
+
+    def test_wai_run_uses_cycle_budget_while_waiting(self):
+        mpu = self._make_mpu()
+        # $0000 WAI
+        mpu.memory[0x0000] = 0xCB
+        self.assertEqual(mpu.RUN_CYCLES, mpu.run(cycles=500))
+        self.assertEqual(500, mpu.processorCycles)
+
+    def test_irq_ends_wai_when_interrupts_disabled(self):
+        mpu = self._make_mpu()
+        mpu.p |= mpu.INTERRUPT
+        # $0000 WAI
+        mpu.memory[0x0000] = 0xCB
+        mpu.step()
+        self.assertEqual(True, mpu.waiting)
+        mpu.irq()
+        self.assertEqual(False, mpu.waiting)
+        self.assertEqual(0x0001, mpu.pc)
+        self.assertEqual(0xFF, mpu.sp)
+
+    # STP
+
+    def test_stp_stops_processor_until_reset(self):
+        mpu = self._make_mpu()
+        self._write(mpu.memory, 0xFFFC, (0x00, 0x04))
+        # $0000 STP
+        mpu.memory[0x0000] = 0xDB
+        mpu.step()
+        self.assertEqual(True, mpu.stopped)
+        self.assertEqual(0x0001, mpu.pc)
+        cycles = mpu.processorCycles
+        mpu.step()
+        self.assertEqual(0x0001, mpu.pc)
+        self.assertEqual(cycles, mpu.processorCycles)
+        mpu.reset()
+        self.assertEqual(False, mpu.stopped)
+        self.assertEqual(False, mpu.waiting)
+        self.assertEqual(0x0400, mpu.pc)
+
+    def test_stp_ignores_irq_and_nmi(self):
+        mpu = self._make_mpu()
+        # $0000 STP
+        mpu.memory[0x0000] = 0xDB
+        mpu.step()
+        mpu.irq()
+        mpu.nmi()
+        self.assertEqual(True, mpu.stopped)
+        self.assertEqual(0x0001, mpu.pc)
+        self.assertEqual(0xFF, mpu.sp)
+
+    def test_stp_ends_run(self):
+        mpu = self._make_mpu()
+        # $0000 LDA #$01
+        # $0002 STP
+        self._write(mpu.memory, 0x0000, (0xA9, 0x01, 0xDB))
+        mpu.schedule(1000, lambda m: m.nmi())
+        self.assertEqual(mpu.RUN_STOP, mpu.run(cycles=5000))
+        self.assertEqual(0x0003, mpu.pc)
+        self.assertEqual(0x01, mpu.a)
+        self.assertEqual(5, mpu.processorCycles)
+
+    # run
 
+    def test_run_dispatches_events_in_cycle_order(self):
+        mpu = self._make_mpu()
+        # $0000 NOP ...
+        self._write(mpu.memory, 0x0000, [0xEA] * 16)
+        fired = []
+        mpu.schedule(9, lambda m: fired.append((9, m.processorCycles)))
+        mpu.schedule(3, lambda m: fired.append((3, m.processorCycles)))
+        self.assertEqual(mpu.RUN_CYCLES, mpu.run(cycles=20))
+        self.assertEqual([(3, 4), (9, 10)], fired)
+        self.assertEqual(mpu.NEVER, mpu.nextEvent)
+
+    def test_run_skips_idle_spin_loop_to_scheduled_event(self):
+        mpu = self._make_mpu()
+        # $0000 LDA $C000
+        # $0003 BEQ $0000
+        # $0005 LDX #$01
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0, 0xF0, 0xFB, 0xA2, 0x01))
+        mpu.memory[0xC000] = 0x00
+        mpu.addSpinLoop(0x0000, 0x0004)
+
+        def key(m):
+            m.memory[0xC000] = 0x41
+        mpu.schedule(7000, key)
+
+        self.assertEqual(mpu.RUN_COUNT, mpu.run(count=7))
+        self.assertEqual(0x41, mpu.a)
+        self.assertEqual(0x01, mpu.x)
+        self.assertEqual(0x0007, mpu.pc)
+        # the loop takes 7 cycles a pass, the key is seen on the first
+        # pass starting after it was pressed
+        self.assertEqual(7000 + 4 + 2 + 2, mpu.processorCycles)
+
+    def test_run_returns_idle_in_spin_loop_with_nothing_scheduled(self):
+        mpu = self._make_mpu()
+        # $0000 LDA $C000
+        # $0003 BEQ $0000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0, 0xF0, 0xFB))
+        mpu.memory[0xC000] = 0x00
+        mpu.addSpinLoop(0x0000, 0x0004)
+        self.assertEqual(mpu.RUN_IDLE, mpu.run())
+        self.assertEqual(0x0000, mpu.pc)
+        self.assertEqual(14, mpu.processorCycles)
+
+    def test_run_sees_input_arriving_after_returning_idle(self):
+        mpu = self._make_mpu()
+        # $0000 LDA $C000
+        # $0003 BEQ $0000
+        self._write(mpu.memory, 0x0000, (0xAD, 0x00, 0xC0, 0xF0, 0xFB))
+        mpu.memory[0xC000] = 0x00
+        mpu.addSpinLoop(0x0000, 0x0004)
+        self.assertEqual(mpu.RUN_IDLE, mpu.run())
+        mpu.memory[0xC000] = 0x41
+        self.assertEqual(mpu.RUN_COUNT, mpu.run(count=2))
+        self.assertEqual(0x41, mpu.a)
+        self.assertEqual(0x0005, mpu.pc)
+
+    def test_run_does_not_skip_spin_loop_that_writes_memory(self):
+        mpu = self._make_mpu()
+        # $0000 INC $10
+        # $0002 LDA $C000
+        # $0005 BEQ $0000
+        self._write(mpu.memory, 0x0000, (0xE6, 0x10, 0xAD, 0x00, 0xC0, 0xF0, 0xF9))
+        mpu.memory[0xC000] = 0x00
+        mpu.memory[0x0010] = 0x00
+        memory = mpu.memory
+        mpu.addSpinLoop(0x0000, 0x0006)
+        self.assertEqual(mpu.RUN_CYCLES, mpu.run(cycles=130))
+        # 5 + 4 + 3 cycles a pass
+        self.assertEqual(11, mpu.memory[0x10])
+        self.assertTrue(mpu.memory is memory)
+
+    def test_run_does_not_skip_spin_loop_that_changes_registers(self):
+        mpu = self._make_mpu()
+        # $0000 INX
+        # $0001 BRA $0000
+        self._write(mpu.memory, 0x0000, (0xE8, 0x80, 0xFD))
+        mpu.addSpinLoop(0x0000, 0x0002)
+        self.assertEqual(mpu.RUN_CYCLES, mpu.run(cycles=50))
+        self.assertEqual(13, mpu.x)
+
+    # Direct Page Wrapping
+
+    def test_lda_dp_x_wraps_within_the_direct_page_when_dl_is_zero(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x1200
+        mpu.x = 0x20
+        # $0000 LDA $F0,X
+        self._write(mpu.memory, 0x0000, (0xB5, 0xF0))
+        mpu.memory[0x1210] = 0x42
+        mpu.memory[0x1310] = 0x99
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_dp_x_does_not_wrap_when_dl_is_not_zero(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x1201
+        mpu.x = 0x20
+        # $0000 LDA $F0,X
+        self._write(mpu.memory, 0x0000, (0xB5, 0xF0))
+        mpu.memory[0x1211] = 0x42
+        mpu.memory[0x1311] = 0x99
+        mpu.step()
+        self.assertEqual(0x99, mpu.a)
+
+    def test_lda_dp_indirect_pointer_wraps_within_the_direct_page(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x1200
+        # $0000 LDA ($FF)
+        self._write(mpu.memory, 0x0000, (0xB2, 0xFF))
+        mpu.memory[0x12FF] = 0x34
+        mpu.memory[0x1200] = 0x20
+        mpu.memory[0x1300] = 0x99
+        mpu.memory[0x2034] = 0x42
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_dp_indirect_long_does_not_wrap_within_the_page(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x1200
+        # $0000 LDA [$FF]
+        self._write(mpu.memory, 0x0000, (0xA7, 0xFF))
+        self._write(mpu.memory, 0x12FF, (0x34, 0x20, 0x00))
+        mpu.memory[0x1200] = 0x99
+        mpu.memory[0x2034] = 0x42
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_stack_relative_is_in_page_one(self):
+        mpu = self._make_mpu()
+        mpu.sp = 0xF0
+        # $0000 LDA $03,S
+        self._write(mpu.memory, 0x0000, (0xA3, 0x03))
+        mpu.memory[0x01F3] = 0x42
+        mpu.memory[0x00F3] = 0x99
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
 
     # Test Helpers
 
     def _make_mpu(self, *args, **kargs):
         klass = self._get_target_class()
-        mpu = klass(*args, **kargs)
-        if 'memory' not in kargs:
-            mpu.memory = 0x10000 * [0xAA]
+        if 'memory' in kargs:
+            mpu = klass(*args, **kargs)
+        else:
+            mpu = klass(*args, memory=mpupool.BOOT, **kargs)
+            mpu.memory = mpupool.memory(self, 0x10000, 0xAA)
 
         # py65 mpus have sp set to $ff, I've modeled the 65816
         # based on the physical chip which requires sp to be set
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.fuzz import Fuzzer, Oracle, RandomMemory, decimalAdd, \
+    decimalSubtract, fuzz
+from devices.vectors import Runner
+
+
+class BrokenLDA(devices.mpu65c816.MPU):
+    # LDA d,X ignores X once X reaches $80
+    instruct = list(devices.mpu65c816.MPU.instruct)
+
+    def inst_0xb5(self):
+        if self.x >= 0x80:
+            x = self.x
+            self.x = 0
+            devices.mpu65c816.MPU.inst_0xb5(self)
+            self.x = x
+        else:
+            devices.mpu65c816.MPU.inst_0xb5(self)
+
+    instruct[0xb5] = inst_0xb5
+
+
+def case(ram, seed=0, pc=0x1000, s=0x1ff, p=0x30, a=0x0000, x=0x00, y=0x00,
+         dbr=0x00, d=0x0000, pbr=0x00, e=0):
+    return {'seed': seed, 'ram': ram,
+            'initial': {'pc': pc, 's': s, 'p': p, 'a': a, 'x': x, 'y': y,
+                        'dbr': dbr, 'd': d, 'pbr': pbr, 'e': e}}
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Property Based Fuzzing"""
+
+    def test_decimal_add_is_16_bit(self):
+        self.assertEqual((0x5555, False), decimalAdd(0x1234, 0x4321, 0, 2))
+        self.assertEqual((0x0000, True), decimalAdd(0x9999, 0x0001, 0, 2))
+        self.assertEqual((0x00, True), decimalAdd(0x99, 0x00, 1, 1))
+
+    def test_decimal_subtract_is_16_bit(self):
+        self.assertEqual((0x0999, 1), decimalSubtract(0x1000, 0x0001, 1, 2))
+        self.assertEqual((0x9999, 0), decimalSubtract(0x0000, 0x0000, 0, 2))
+
+    def test_oracle_wraps_emulation_direct_page_indexed_indirect(self):
+        # LDA ($F0,X) with X = $20 and D = 0 reads the pointer at $10
+        memory = RandomMemory()
+        memory.update({0x1000: 0xa1, 0x1001: 0xf0, 0x0010: 0x34,
+                       0x0011: 0x12, 0x1234: 0x56})
+        state = case({}, x=0x20, e=1)['initial']
+        final, writes = Oracle(memory).execute(state)
+        self.assertEqual(0x56, final['a'])
+        self.assertEqual(0x1002, final['pc'])
+        # not in native mode
+        memory.update({0x0110: 0x78, 0x0111: 0x56, 0x5678: 0x9a})
+        state = case({}, x=0x20, e=0)['initial']
+        final, writes = Oracle(memory).execute(state)
+        self.assertEqual(0x9a, final['a'])
+
+    def test_oracle_stack_relative_indirect_indexed(self):
+        # STA ($03,S),Y with a 16 bit accumulator, DBR $7F and Y $FFFF
+        memory = RandomMemory()
+        memory.update({0x1000: 0x93, 0x1001: 0x03, 0x1f03: 0xff,
+                       0x1f04: 0xff})
+        state = case({}, s=0x1f00, p=0x00, a=0xbeef, y=0xffff,
+                     dbr=0x7f)['initial']
+        final, writes = Oracle(memory).execute(state)
+        self.assertEqual({0x80fffe: 0xef, 0x80ffff: 0xbe}, writes)
+
+    def test_passing_case_has_no_differences(self):
+        fuzzer = Fuzzer()
+        self.assertEqual((), fuzzer.check(case({0x1000: 0xb5, 0x1001: 0x10},
+                                               x=0x90, d=0x1234, seed=7)))
+
+    def test_injected_bug_is_found(self):
+        fuzzer = Fuzzer(BrokenLDA)
+        failing = case({0x1000: 0xb5, 0x1001: 0x10, 0x1244: 0x11, 0x12d4: 0x22},
+                       x=0x90, d=0x1234, seed=7)
+        self.assertEqual(('a',), fuzzer.check(failing))
+
+    def test_failures_are_shrunk(self):
+        fuzzer = Fuzzer(BrokenLDA)
+        failing = case({0x1000: 0xb5, 0x1001: 0x10}, seed=7, s=0x1234,
+                       p=0xf1, a=0x5a5a, x=0xc3, y=0x42, dbr=0x12, d=0x1234)
+        differences = fuzzer.check(failing)
+        shrunk = fuzzer.shrink(failing, differences)
+        self.assertEqual(differences, fuzzer.check(shrunk))
+        state = shrunk['initial']
+        self.assertEqual((0, 0, 0, 0, 0, 0),
+                         (state['a'], state['y'], state['dbr'], state['s'],
+                          state['pc'], shrunk['seed']))
+        self.assertTrue(state['x'] >= 0x80)
+        self.assertEqual(0x20, state['p'])
+
+    def test_decimal_cases_have_bcd_operands(self):
+        fuzzer = Fuzzer(seed=3)
+        decimal = 0
+        for i in range(500):
+            generated = fuzzer.generate()
+            if generated['initial']['p'] & 0x08:
+                decimal += 1
+                self.assertTrue(fuzzer.valid(generated))
+        self.assertTrue(decimal > 50)
+
+    def test_cases_save_as_test_vectors(self):
+        fuzzer = Fuzzer(BrokenLDA)
+        failing = case({0x1000: 0xb5, 0x1001: 0x10, 0x1244: 0x11, 0x12d4: 0x22},
+                       x=0x90, d=0x1234, seed=7)
+        vector = fuzzer.vector(failing, 'b5 LDA dpx')
+        self.assertEqual([], Runner().run(vector))
+        runner = Runner()
+        runner.mpu = BrokenLDA(memory=runner.memory)
+        self.assertEqual(['a'], [what for what, expected, got in runner.run(vector)])
+
+    def test_parallel_runs_match_a_single_process(self):
+        self.assertEqual(fuzz(300, 1, seed=5, batch=100, programBank=0),
+                         fuzz(300, 2, seed=5, batch=100, programBank=0))
+
+    # Test Helpers
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
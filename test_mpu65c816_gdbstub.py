@@ -0,0 +1,193 @@
+import unittest
+import sys
+import asyncio
+import devices.mpu65c816
+from devices.gdbstub import GdbStub, REGISTERS, TARGET_XML, serve, frame, checksum
+
+PROGRAM = [
+    0x18, 0xfb,             # 0200 CLC, XCE
+    0xc2, 0x30,             # 0202 REP #$30
+    0xa9, 0x34, 0x12,       # 0204 LDA #$1234
+    0x8d, 0x00, 0x10,       # 0207 STA $1000
+    0xad, 0x02, 0x10,       # 020a LDA $1002
+    0xdb,                   # 020d STP
+]
+
+LOOP = [
+    0xe8,                   # 0300 INX
+    0x80, 0xfd,             # 0301 BRA $0300
+]
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - GDB Stub"""
+
+    def test_registers_in_emulation_mode(self):
+        stub = self._make_stub()
+        mpu = stub.mpu
+        mpu.a = 0x34
+        mpu.b = 0x12
+        mpu.x = 0x56
+        mpu.sp = 0xfd
+        mpu.dbr = 0x02
+        # a x y sp d dbr pbr pc p e
+        self.assertEqual('3412' '5600' '0000' 'fd01' '0000' '02' '00' '0002' '%02x' % mpu.p + '01',
+                         stub.command('g'))
+        self.assertEqual(sum(bits for name, bits in REGISTERS) // 4, len(stub.command('g')))
+
+    def test_write_registers(self):
+        stub = self._make_stub()
+        mpu = stub.mpu
+        text = stub.command('g')
+        self.assertEqual('OK', stub.command('G' + '7856' + text[4:]))
+        self.assertEqual((0x78, 0x56), (mpu.a, mpu.b))
+        self.assertEqual('OK', stub.command('P5=03')) # dbr
+        self.assertEqual(0x03, mpu.dbr)
+        self.assertEqual('03', stub.command('p5'))
+        self.assertEqual('E01', stub.command('p20'))
+
+    def test_memory(self):
+        stub = self._make_stub()
+        self.assertEqual('18fbc230', stub.command('m200,4'))
+        self.assertEqual('OK', stub.command('M1000,2:aa55'))
+        self.assertEqual([0xaa, 0x55], stub.mpu.memory[0x1000:0x1002])
+        self.assertEqual('E01', stub.command('m200'))
+
+    def test_breakpoints_and_watchpoints(self):
+        stub = self._make_stub()
+        self.assertEqual('OK', stub.command('Z0,20a,1'))
+        self.assertEqual('OK', stub.command('Z2,1000,2'))
+        self.assertEqual(1, len(stub.watcher.breakpoints))
+        self.assertEqual(1, len(stub.watcher.watches))
+        self.assertEqual('OK', stub.command('z0,20a,1'))
+        self.assertEqual('OK', stub.command('z2,1000,2'))
+        self.assertEqual({}, stub.watcher.breakpoints)
+        self.assertFalse('step' in vars(stub.mpu))
+        self.assertEqual('', stub.command('Z9,0,1'))
+
+    def test_target_xml(self):
+        stub = self._make_stub()
+        reply = stub.command('qXfer:features:read:target.xml:0,10')
+        self.assertEqual('m' + TARGET_XML[:16], reply)
+        reply = stub.command('qXfer:features:read:target.xml:10,1000')
+        self.assertEqual('l' + TARGET_XML[16:], reply)
+        self.assertTrue('<field name="M" start="5" end="5"/>' in TARGET_XML)
+
+    def test_bad_checksum_is_nacked(self):
+        stub = self._make_stub()
+
+        async def session(reader, writer):
+            writer.write(b'$g#zz')
+            await writer.drain()
+            nack = await reader.readexactly(1)
+            return nack, await self._exchange(reader, writer, '?')
+
+        self.assertEqual((b'-', 'S05'), self._run([stub], session))
+
+    def test_unsupported(self):
+        self.assertEqual('', self._make_stub().command('vMustReplyEmpty'))
+
+    def test_session_continue_to_a_watchpoint_and_step(self):
+        stub = self._make_stub()
+
+        async def session(reader, writer):
+            replies = []
+            for packet in ('qSupported:swbreak+', 'Z2,1000,2', 'c', 'g', 's', 'p7'):
+                replies.append(await self._exchange(reader, writer, packet))
+            return replies
+
+        replies = self._run([stub], session)
+        self.assertEqual('OK', replies[1])
+        # STA $1000 wrote it, stopped after it
+        self.assertEqual('T05watch:1000;', replies[2])
+        self.assertEqual('3412', replies[3][:4])
+        self.assertEqual('S05', replies[4])
+        self.assertEqual('0d02', replies[5]) # after LDA $1002
+
+    def test_session_interrupt(self):
+        stub = self._make_stub()
+        stub.mpu.pc = 0x0300
+
+        async def session(reader, writer):
+            writer.write(frame('c'))
+            await writer.drain()
+            await reader.readexactly(1) # +
+            await asyncio.sleep(0.05)
+            writer.write(b'\x03')
+            return await self._reply(reader)
+
+        self.assertEqual('S02', self._run([stub], session))
+        self.assertTrue(stub.mpu.x > 0)
+
+    def test_boards_share_the_loop(self):
+        stubs = [self._make_stub(), self._make_stub()]
+        for stub in stubs:
+            stub.mpu.pc = 0x0300
+
+        async def session(reader, writer):
+            writer.write(frame('c'))
+            await writer.drain()
+            await reader.readexactly(1)
+            await asyncio.sleep(0.05)
+            writer.write(b'\x03')
+            return await self._reply(reader)
+
+        self.assertEqual(['S02', 'S02'], self._run(stubs, session))
+        for stub in stubs:
+            self.assertTrue(stub.mpu.x > 0)
+
+    # Test Helpers
+
+    def _make_stub(self):
+        memory = 0x10000 * [0x00]
+        memory[0x0200:0x0200 + len(PROGRAM)] = PROGRAM
+        memory[0x0300:0x0300 + len(LOOP)] = LOOP
+        memory[0xfffc:0xfffe] = [0x00, 0x02]
+        mpu = devices.mpu65c816.MPU(memory=memory)
+        mpu.sp = 0xff
+        return GdbStub(mpu, chunk=100)
+
+    def _run(self, stubs, session):
+        # session(reader, writer) against each stub at once, returns its
+        # result (a list of them with more than one stub)
+        async def main():
+            servers = await serve(stubs, port=0)
+            try:
+                async def connect(server):
+                    port = server.sockets[0].getsockname()[1]
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    try:
+                        return await asyncio.wait_for(session(reader, writer), 10)
+                    finally:
+                        # kill the session and wait for the stub to hang up
+                        writer.write(frame('k'))
+                        await asyncio.wait_for(reader.read(), 10)
+                        writer.close()
+                        await writer.wait_closed()
+                return await asyncio.gather(*[connect(server) for server in servers])
+            finally:
+                for server in servers:
+                    server.close()
+                    await server.wait_closed()
+        results = asyncio.run(main())
+        return results[0] if len(results) == 1 else results
+
+    async def _exchange(self, reader, writer, packet):
+        writer.write(frame(packet))
+        await writer.drain()
+        self.assertEqual(b'+', await reader.readexactly(1))
+        return await self._reply(reader)
+
+    async def _reply(self, reader):
+        data = await reader.readuntil(b'#')
+        self.assertEqual(b'$', data[:1])
+        reply = data[1:-1].decode('latin-1')
+        self.assertEqual(checksum(reply), int(await reader.readexactly(2), 16))
+        return reply
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,106 @@
+import unittest
+import sys
+import io
+import devices.mpu65c816
+from devices.heatmap import HeatMap
+
+PROGRAM = [
+    0xad, 0x34, 0x12,       # 0000 LDA $1234
+    0x85, 0x10,             # 0003 STA $10
+    0x48,                   # 0005 PHA
+    0x8f, 0x00, 0x00, 0x02, # 0006 STA $020000
+    0xdb,                   # 000a STP
+]
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Memory Heat Map"""
+
+    def test_pages(self):
+        mpu, heat = self._run(PROGRAM)
+        # the program's 11 bytes, LDA's read, STA to the direct page at
+        # $0300, PHA to the stack and the long STA
+        self.assertEqual([(0x0000, 11, 0), (0x0001, 0, 1), (0x0003, 0, 1),
+                          (0x0012, 1, 0), (0x0200, 0, 1)], heat.pages())
+
+    def test_banks(self):
+        mpu, heat = self._run(PROGRAM)
+        self.assertEqual({0x00: (4, 12, 2), 0x02: (1, 0, 1)}, heat.banks())
+
+    def test_hottest_marks_direct_page_and_stack(self):
+        mpu, heat = self._run(PROGRAM)
+        self.assertEqual([(0x0000, 11, 0, ''), (0x0001, 0, 1, 'S'),
+                          (0x0003, 0, 1, 'D')], heat.hottest(3))
+
+    def test_watched_bytes(self):
+        mpu, heat = self._run(PROGRAM, watch=(0x0300, 0x0320))
+        self.assertEqual([(0x0310, 0, 1)], heat.bytes(0x0300, 0x0320))
+        self.assertRaises(ValueError, heat.bytes, 0x0000, 0x0010)
+
+    def test_windows(self):
+        mpu, heat = self._run(PROGRAM, window=4)
+        # a window closes at the end of the instruction reaching a multiple
+        # of 4 cycles, each starts where the one before ended
+        windows = heat.windows
+        self.assertEqual([0, 4, 10, 15], [window[0] for window in windows])
+        self.assertEqual([window[0] for window in windows[1:]],
+                         [window[1] for window in windows[:-1]])
+        self.assertEqual(mpu.processorCycles, windows[-1][1])
+        self.assertEqual([2, 3, 2, 1], [window[2] for window in windows])
+        self.assertEqual(sum(heat.totals()), sum(window[3] + window[4] for window in windows))
+        for window in windows:
+            self.assertEqual(0x0300, window[5])
+
+    def test_stop_restores_the_memory(self):
+        memory = 0x30000 * [0x00]
+        mpu, heat = self._run(PROGRAM, memory=memory)
+        self.assertTrue(mpu.memory is memory)
+        self.assertEqual(0x00, memory[0x0310])
+
+    def test_stop_without_start_or_twice_does_nothing(self):
+        memory = 0x30000 * [0x00]
+        HeatMap(self._get_target_class()(memory=memory)).stop()
+        mpu, heat = self._run(PROGRAM, memory=memory)
+        windows = len(heat.windows)
+        heat.stop()
+        self.assertTrue(mpu.memory is memory)
+        self.assertEqual(windows, len(heat.windows))
+
+    def test_report(self):
+        mpu, heat = self._run(PROGRAM)
+        f = io.StringIO()
+        heat.report(f, 2)
+        lines = f.getvalue().splitlines()
+        self.assertEqual('  00      4          12           2', lines[1])
+        self.assertEqual('000000          11           0  ', lines[5])
+        self.assertTrue(lines[-1].startswith('1 windows of 100000 cycles'))
+
+    # Test Helpers
+
+    def _run(self, program, window=100000, watch=None, memory=None):
+        if memory is None:
+            memory = 0x30000 * [0x00]
+        mpu = self._get_target_class()(memory=memory)
+        mpu.memory[0x0000:len(program)] = program
+        mpu.pc = 0x0000
+        mpu.sp = 0xff
+        mpu.dpr = 0x0300
+        mpu.processorCycles = 0
+        heat = HeatMap(mpu, window)
+        if watch is not None:
+            heat.watch(*watch)
+        heat.start()
+        mpu.run(count=100)
+        heat.stop()
+        self.assertTrue(mpu.stopped)
+        return mpu, heat
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
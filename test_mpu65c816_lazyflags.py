@@ -0,0 +1,132 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.lazyflags import LazyFlagsMPU
+from tests.devices import test_mpu65c816_emulation
+from tests.devices import test_mpu65c816_native_8
+from tests.devices import test_mpu65c816_native_16
+from tests.devices import test_mpu65c816_cycles
+from tests.devices import test_mpu65c816_codegen
+
+
+# the MPU suites again, run against LazyFlagsMPU
+
+class EmulationTests(test_mpu65c816_emulation.MPUTests):
+    """CMOS 65C816 Tests - Lazy Flags - Emulation Mode"""
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+class Native8Tests(test_mpu65c816_native_8.MPUTests):
+    """CMOS 65C816 Tests - Lazy Flags - Native Mode - 8 Bit"""
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+class Native16Tests(test_mpu65c816_native_16.MPUTests):
+    """CMOS 65C816 Tests - Lazy Flags - Native Mode - 16 Bit"""
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+class CycleTests(test_mpu65c816_cycles.MPUTests):
+    """CMOS 65C816 Tests - Lazy Flags - Cycles"""
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+class GeneratedTests(test_mpu65c816_codegen.MPUTests):
+    """CMOS 65C816 Tests - Lazy Flags - Generated Handlers"""
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Lazy Flags"""
+
+    def test_load_leaves_n_and_z_pending(self):
+        mpu = self._make_mpu([0xa9, 0x80]) # LDA #$80
+        mpu.step()
+        self.assertEqual(0x8000, mpu.nz)
+        self.assertEqual(0, mpu.flags & mpu.NEGATIVE)
+        self.assertEqual(mpu.NEGATIVE, mpu.p & (mpu.NEGATIVE | mpu.ZERO))
+        self.assertEqual(None, mpu.nz)
+        self.assertEqual(mpu.NEGATIVE, mpu.flags & mpu.NEGATIVE)
+
+    def test_16_bit_result_keeps_its_sign(self):
+        mpu = self._make_mpu([0x18, 0xfb,             # CLC, XCE
+                              0xc2, 0x20,             # REP #$20
+                              0xa9, 0x00, 0x80])      # LDA #$8000
+        for i in range(4):
+            mpu.step()
+        self.assertEqual(0x8000, mpu.nz)
+        self.assertEqual(mpu.NEGATIVE, mpu.p & (mpu.NEGATIVE | mpu.ZERO))
+
+    def test_branch_reads_the_pending_result(self):
+        mpu = self._make_mpu([0xa9, 0x00,             # LDA #$00
+                              0xf0, 0x02,             # BEQ +2
+                              0xea, 0xea,             # NOP, NOP
+                              0x30, 0x02])            # BMI +2
+        mpu.step()
+        mpu.step()
+        self.assertEqual(0x0006, mpu.pc)
+        self.assertEqual(0, mpu.nz)
+        mpu.step()
+        self.assertEqual(0x0008, mpu.pc)
+
+    def test_compare_materializes_p(self):
+        mpu = self._make_mpu([0xa9, 0x80,             # LDA #$80
+                              0xc9, 0x80])            # CMP #$80
+        mpu.step()
+        mpu.step()
+        self.assertEqual(None, mpu.nz)
+        self.assertEqual(mpu.ZERO | mpu.CARRY,
+                         mpu.flags & (mpu.NEGATIVE | mpu.ZERO | mpu.CARRY))
+
+    def test_php_pushes_the_pending_flags(self):
+        mpu = self._make_mpu([0xa2, 0x00,             # LDX #$00
+                              0x08])                  # PHP
+        mpu.step()
+        mpu.step()
+        self.assertEqual(mpu.ZERO, mpu.memory[0x01ff] & (mpu.NEGATIVE | mpu.ZERO))
+
+    def test_writing_p_drops_the_pending_result(self):
+        mpu = self._make_mpu([0xa9, 0x00]) # LDA #$00
+        mpu.step()
+        mpu.p = mpu.NEGATIVE | mpu.MS | mpu.IRS
+        self.assertEqual(None, mpu.nz)
+        self.assertEqual(mpu.NEGATIVE, mpu.p & (mpu.NEGATIVE | mpu.ZERO))
+
+    def test_repr_shows_the_pending_flags(self):
+        mpus = [self._make_mpu([0xa9, 0x00], klass) # LDA #$00
+                for klass in (devices.mpu65c816.MPU, LazyFlagsMPU)]
+        for mpu in mpus:
+            mpu.step()
+        self.assertEqual(repr(mpus[0]), repr(mpus[1]))
+
+    # Test Helpers
+
+    def _make_mpu(self, program, klass=None):
+        if klass is None:
+            klass = self._get_target_class()
+        memory = 0x10000 * [0x00]
+        memory[0x0000:len(program)] = program
+        mpu = klass(memory=memory)
+        mpu.pc = 0x0000
+        mpu.sp = 0xff
+        return mpu
+
+    def _get_target_class(self):
+        return LazyFlagsMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
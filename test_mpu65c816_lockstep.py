@@ -0,0 +1,129 @@
+import unittest
+import sys
+import os
+import tempfile
+import devices.mpu65c816
+from devices.lockstep import Lockstep, MPUSide, TraceSide, record
+
+
+class BrokenINX(devices.mpu65c816.MPU):
+    # INX skips $41
+    instruct = list(devices.mpu65c816.MPU.instruct)
+
+    def inst_0xe8(self):
+        devices.mpu65c816.MPU.inst_0xe8(self)
+        if self.x == 0x41:
+            self.x += 1
+
+    instruct[0xe8] = inst_0xe8
+
+
+class BrokenSTA(devices.mpu65c816.MPU):
+    # STA abs,X writes one byte too far once X reaches $80
+    instruct = list(devices.mpu65c816.MPU.instruct)
+
+    def inst_0x9d(self):
+        if self.x >= 0x80:
+            self.x += 1
+            devices.mpu65c816.MPU.inst_0x9d(self)
+            self.x -= 1
+        else:
+            devices.mpu65c816.MPU.inst_0x9d(self)
+
+    instruct[0x9d] = inst_0x9d
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Lockstep"""
+
+    def test_identical_mpus_do_not_diverge(self):
+        lockstep = Lockstep(MPUSide(self._make_mpu()),
+                            MPUSide(self._make_mpu()), batch=64)
+        self.assertEqual(None, lockstep.run(2000))
+        self.assertEqual(2000, lockstep.instructions)
+
+    def test_register_divergence_is_found_within_a_batch(self):
+        lockstep = Lockstep(MPUSide(self._make_mpu()),
+                            MPUSide(self._make_mpu(BrokenINX)), batch=64)
+        divergence = lockstep.run(2000)
+        # 4 instructions a pass, INX is the third, x reaches $41 on pass $41
+        self.assertEqual(0x40 * 4 + 2, divergence.instruction)
+        self.assertEqual([('x', 0x41, 0x42)], divergence.registers())
+
+    def test_memory_write_divergence_is_reported(self):
+        lockstep = Lockstep(MPUSide(self._make_mpu()),
+                            MPUSide(self._make_mpu(BrokenSTA)), batch=64)
+        divergence = lockstep.run(2000)
+        self.assertEqual(0x80 * 4 + 1, divergence.instruction)
+        self.assertEqual([], divergence.registers())
+        self.assertEqual(((0x2080, 0x80),), divergence.reference[1])
+        self.assertEqual(((0x2081, 0x80),), divergence.candidate[1])
+
+    def test_rewinding_restores_memory(self):
+        mpu = self._make_mpu()
+        side = MPUSide(mpu)
+        side.save()
+        side.run(100)
+        self.assertEqual(0x01, mpu.memory[0x2001])
+        side.restore()
+        self.assertEqual(0x00, mpu.memory[0x2001])
+        self.assertEqual(0x0000, mpu.pc)
+
+    def test_trace_file_reference(self):
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            record(self._make_mpu(), 1000, path, ('pc', 'a', 'x'))
+            reference = TraceSide(path)
+            self.assertEqual(('pc', 'a', 'x'), reference.fields)
+
+            candidate = MPUSide(self._make_mpu(), reference.fields)
+            self.assertEqual(None, Lockstep(reference, candidate).run(5000))
+
+            reference = TraceSide(path)
+            candidate = MPUSide(self._make_mpu(BrokenSTA), reference.fields)
+            divergence = Lockstep(reference, candidate).run(5000)
+            self.assertEqual(0x80 * 4 + 1, divergence.instruction)
+        finally:
+            os.remove(path)
+
+    def test_trace_file_candidate_stops_at_its_end(self):
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            record(self._make_mpu(), 1000, path, ('pc', 'a', 'x'))
+            candidate = TraceSide(path)
+            reference = MPUSide(self._make_mpu(), candidate.fields)
+            lockstep = Lockstep(reference, candidate)
+            self.assertEqual(None, lockstep.run(5000))
+            self.assertEqual(1000, lockstep.instructions)
+        finally:
+            os.remove(path)
+
+    # Test Helpers
+
+    def _make_mpu(self, klass=None):
+        if klass is None:
+            klass = self._get_target_class()
+        mpu = klass(memory=0x30000 * [0x00])
+        # $0000 TXA
+        # $0001 STA $2000,X
+        # $0004 INX
+        # $0005 BRA $0000
+        self._write(mpu.memory, 0x0000, (0x8A, 0x9D, 0x00, 0x20, 0xE8, 0x80,
+                                         0xF9))
+        mpu.sp = 0xff
+        return mpu
+
+    def _write(self, memory, start_address, bytes):
+        memory[start_address:start_address + len(bytes)] = bytes
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
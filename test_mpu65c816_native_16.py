@@ -1,6 +1,7 @@
 import unittest
 import sys
 import devices.mpu65c816
+from tests.devices import mpupool
 
 # x tests
 class MPUTests(unittest.TestCase):
@@ -1463,6 +1464,17 @@ class MPUTests(unittest.TestCase):
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(mpu.ZERO, mpu.p & mpu.ZERO)
 
+    def test_asl_accumulator_n_flag_from_bit_15(self):
+        mpu = self._make_mpu()
+        mpu.a = 0x0040
+        # $0000 ASL
+        mpu.memory[0x0000] = 0x0A
+        mpu.step()
+        self.assertEqual(0x0001, mpu.pc)
+        self.assertEqual(0x0080, mpu.a)
+        self.assertEqual(0, mpu.p & mpu.NEGATIVE)
+        self.assertEqual(0, mpu.p & mpu.ZERO)
+
     # ASL Absolute
 
     def test_asl_absolute_sets_z_flag(self):
@@ -3154,13 +3166,39 @@ class MPUTests(unittest.TestCase):
 
 
 
+    # STZ Absolute
+
+    def test_stz_absolute_width_follows_m(self):
+        mpu = self._make_mpu()
+        mpu.p |= mpu.IRS # 8 bit index registers
+        # $0000 STZ $C000
+        self._write(mpu.memory, 0x0000, (0x9C, 0x00, 0xC0))
+        self._write(mpu.memory, 0xC000, (0xFF, 0xFF))
+        mpu.step()
+        self.assertEqual(0x0003, mpu.pc)
+        self.assertEqual(0x00, mpu.memory[0xC000])
+        self.assertEqual(0x00, mpu.memory[0xC001])
+
+    def test_stz_absolute_8_bit_m_16_bit_x(self):
+        mpu = self._make_mpu()
+        mpu.p |= mpu.MS
+        # $0000 STZ $C000
+        self._write(mpu.memory, 0x0000, (0x9C, 0x00, 0xC0))
+        self._write(mpu.memory, 0xC000, (0xFF, 0xFF))
+        mpu.step()
+        self.assertEqual(0x0003, mpu.pc)
+        self.assertEqual(0x00, mpu.memory[0xC000])
+        self.assertEqual(0xFF, mpu.memory[0xC001])
+
     # Test Helpers
 
     def _make_mpu(self, *args, **kargs):
         klass = self._get_target_class()
-        mpu = klass(*args, **kargs)
-        if 'memory' not in kargs:
-            mpu.memory = 0x30000 * [0xAA]
+        if 'memory' in kargs:
+            mpu = klass(*args, **kargs)
+        else:
+            mpu = klass(*args, memory=mpupool.BOOT, **kargs)
+            mpu.memory = mpupool.memory(self, 0x30000, 0xAA)
 
         # set native mode
         mpu.pCLR(mpu.CARRY)
@@ -1,6 +1,7 @@
 import unittest
 import sys
 import devices.mpu65c816
+from tests.devices import mpupool
 from tests.devices.test_mpu65816_Common6502 import Common6502Tests
 from tests.devices.test_mpu65816_Common65c02 import Common65C02Tests
 
@@ -102,6 +103,24 @@ class MPUTests(unittest.TestCase, Common6502Tests, Common65C02Tests):
 
         self.assertEqual(mpu.MS | mpu.IRS | mpu.INTERRUPT, mpu.p)
 
+    # BRL
+
+    def test_brl_forward_is_relative_to_the_next_instruction(self):
+        mpu = self._make_mpu()
+        # $1000 BRL $9003
+        self._write(mpu.memory, 0x1000, (0x82, 0x00, 0x80))
+        mpu.pc = 0x1000
+        mpu.step()
+        self.assertEqual(0x9003, mpu.pc)
+
+    def test_brl_backward_is_relative_to_the_next_instruction(self):
+        mpu = self._make_mpu()
+        # $1000 BRL $0FFD
+        self._write(mpu.memory, 0x1000, (0x82, 0xFA, 0xFF))
+        mpu.pc = 0x1000
+        mpu.step()
+        self.assertEqual(0x0FFD, mpu.pc)
+
     # IRQ and NMI handling (very similar to BRK)
 
     def test_irq_pushes_pc_and_correct_status_then_sets_pc_to_irq_vector(self):
@@ -158,6 +177,159 @@ class MPUTests(unittest.TestCase, Common6502Tests, Common65C02Tests):
         self.assertEqual(0xC0,   mpu.memory[0x01FF])  # PCH
         self.assertEqual(0x02,   mpu.memory[0x01FE])  # PCL+2
 
+    # Program Bank
+
+    def test_step_fetches_from_the_program_bank(self):
+        mpu = self._make_mpu()
+        # $00:C000 NOP, $02:C000 LDA #$42
+        mpu.memory[0xC000] = 0xEA
+        self._write(mpu.memory, 0x2C000, (0xA9, 0x42))
+        mpu.pc = 0xC000
+        mpu.pbr = 2
+        mpu.step()
+        self.assertEqual(0xC002, mpu.pc)
+        self.assertEqual(2, mpu.pbr)
+        self.assertEqual(0x42, mpu.a)
+
+    def test_jsl_from_another_bank_pushes_pbr_and_pc_plus_3(self):
+        mpu = self._make_mpu()
+        # $01:C000 JSL $02D000
+        self._write(mpu.memory, 0x1C000, (0x22, 0x00, 0xD0, 0x02))
+        mpu.pc = 0xC000
+        mpu.pbr = 1
+        mpu.step()
+        self.assertEqual(0xD000, mpu.pc)
+        self.assertEqual(2, mpu.pbr)
+        self.assertEqual(0x1FC, mpu.sp)
+        self.assertEqual(0x01, mpu.memory[0x01FF])  # PBR
+        self.assertEqual(0xC0, mpu.memory[0x01FE])  # PCH
+        self.assertEqual(0x03, mpu.memory[0x01FD])  # PCL+3
+
+    def test_jml_from_another_bank_sets_pbr_and_pc(self):
+        mpu = self._make_mpu()
+        # $02:C000 JML $01D000
+        self._write(mpu.memory, 0x2C000, (0x5C, 0x00, 0xD0, 0x01))
+        mpu.pc = 0xC000
+        mpu.pbr = 2
+        mpu.step()
+        self.assertEqual(0xD000, mpu.pc)
+        self.assertEqual(1, mpu.pbr)
+
+    def test_absolute_operand_wraps_within_the_program_bank(self):
+        mpu = self._make_mpu()
+        # $01:FFFE LDA $1234, the operand's high byte at $01:0000
+        self._write(mpu.memory, 0x1FFFE, (0xAD, 0x34))
+        mpu.memory[0x10000] = 0x12
+        mpu.memory[0x20000] = 0x99
+        mpu.memory[0x1234] = 0x42
+        mpu.memory[0x9934] = 0x24
+        mpu.pc = 0xFFFE
+        mpu.pbr = 1
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+        self.assertEqual(0x0001, mpu.pc)
+        self.assertEqual(1, mpu.pbr)
+
+    def test_jmp_operand_wraps_within_the_program_bank(self):
+        mpu = self._make_mpu()
+        # $01:FFFF JMP $C000, the operand at $01:0000
+        mpu.memory[0x1FFFF] = 0x4C
+        self._write(mpu.memory, 0x10000, (0x00, 0xC0))
+        mpu.pc = 0xFFFF
+        mpu.pbr = 1
+        mpu.step()
+        self.assertEqual(0xC000, mpu.pc)
+        self.assertEqual(1, mpu.pbr)
+
+    def test_long_operand_wraps_within_the_program_bank(self):
+        mpu = self._make_mpu()
+        # $01:FFFE LDA $021234, the operand's last two bytes at $01:0000
+        self._write(mpu.memory, 0x1FFFE, (0xAF, 0x34))
+        self._write(mpu.memory, 0x10000, (0x12, 0x02))
+        self._write(mpu.memory, 0x20000, (0x99, 0x00))
+        mpu.memory[0x21234] = 0x42
+        mpu.pc = 0xFFFE
+        mpu.pbr = 1
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+        self.assertEqual(0x0002, mpu.pc)
+
+    # Direct Page Wrapping
+
+    def test_lda_dp_indirect_pointer_does_not_wrap_within_the_page(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0x1200
+        # $0000 LDA ($FF)
+        self._write(mpu.memory, 0x0000, (0xB2, 0xFF))
+        mpu.memory[0x12FF] = 0x34
+        mpu.memory[0x1300] = 0x20
+        mpu.memory[0x1200] = 0x99
+        mpu.memory[0x2034] = 0x42
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_dp_x_wraps_within_bank_zero(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0xFF00
+        mpu.x = 0x20
+        # $0000 LDA $F0,X
+        self._write(mpu.memory, 0x0000, (0xB5, 0xF0))
+        mpu.memory[0x0010] = 0x42
+        mpu.memory[0x10010] = 0x99
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_dp_indirect_long_pointer_wraps_within_bank_zero(self):
+        mpu = self._make_mpu()
+        mpu.dpr = 0xFF00
+        mpu.pc = 0x0200
+        # $0200 LDA [$FE]
+        self._write(mpu.memory, 0x0200, (0xA7, 0xFE))
+        self._write(mpu.memory, 0xFFFE, (0x34, 0x12))
+        mpu.memory[0x0000] = 0x01
+        mpu.memory[0x10000] = 0x02
+        mpu.memory[0x11234] = 0x42
+        mpu.memory[0x21234] = 0x99
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_stack_relative_indirect_pointer_wraps_within_bank_zero(self):
+        mpu = self._make_mpu()
+        mpu.sp = 0xFFF0
+        mpu.pc = 0x0200
+        # $0200 LDA ($0F,S),Y
+        self._write(mpu.memory, 0x0200, (0xB3, 0x0F))
+        mpu.memory[0xFFFF] = 0x34
+        mpu.memory[0x0000] = 0x12
+        mpu.memory[0x10000] = 0x56
+        mpu.memory[0x1234] = 0x42
+        mpu.memory[0x5634] = 0x99
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_lda_dp_indirect_y_wraps_past_the_last_bank(self):
+        mpu = self._make_mpu()
+        mpu.dbr = 0xFF
+        mpu.y = 0x20
+        mpu.pc = 0x0200
+        # $0200 LDA ($20),Y
+        self._write(mpu.memory, 0x0200, (0xB1, 0x20))
+        self._write(mpu.memory, 0x0020, (0xF0, 0xFF))
+        mpu.memory[0x000010] = 0x42
+        mpu.step()
+        self.assertEqual(0x42, mpu.a)
+
+    def test_sta_absolute_x_wraps_past_the_last_bank(self):
+        mpu = self._make_mpu()
+        mpu.dbr = 0xFF
+        mpu.x = 0x03
+        mpu.a = 0x42
+        mpu.pc = 0x0200
+        # $0200 STA $FFFE,X
+        self._write(mpu.memory, 0x0200, (0x9D, 0xFE, 0xFF))
+        mpu.step()
+        self.assertEqual(0x42, mpu.memory[0x000001])
+
     # RTI
 
     def test_rti_restores_status_and_pc_and_updates_sp(self):
@@ -315,9 +487,11 @@ class MPUTests(unittest.TestCase, Common6502Tests, Common65C02Tests):
 
     def _make_mpu(self, *args, **kargs):
         klass = self._get_target_class()
-        mpu = klass(*args, **kargs)
-        if 'memory' not in kargs:
-            mpu.memory = 0x30000 * [0xAA]
+        if 'memory' in kargs:
+            mpu = klass(*args, **kargs)
+        else:
+            mpu = klass(*args, memory=mpupool.BOOT, **kargs)
+            mpu.memory = mpupool.memory(self, 0x30000, 0xAA)
 
         # set native mode
         mpu.pCLR(mpu.CARRY)
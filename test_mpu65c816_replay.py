@@ -0,0 +1,194 @@
+import unittest
+import sys
+import os
+import random
+import tempfile
+import devices.mpu65c816
+from devices.slotted import SlottedMPU
+from devices.replay import Recorder, Replayer, Diverged, load, state_hash
+from memory import ObservableMemory
+
+GETC = 0xf000
+PUTC = 0xf001
+
+# echoes the console until a CR, counting IRQs at $10 and NMIs at $11
+PROGRAM = [
+    0x58,                   # 0200 CLI
+    0xad, 0x00, 0xf0,       # 0201 LDA $F000
+    0xf0, 0xfb,             # 0204 BEQ $0201
+    0x8d, 0x01, 0xf0,       # 0206 STA $F001
+    0xc9, 0x0d,             # 0209 CMP #$0D
+    0xd0, 0xf4,             # 020b BNE $0201
+    0xdb,                   # 020d STP
+]
+
+IRQ = [
+    0xe6, 0x10,             # 0300 INC $10
+    0x40,                   # 0302 RTI
+]
+
+NMI = [
+    0xe6, 0x11,             # 0310 INC $11
+    0x40,                   # 0312 RTI
+]
+
+TEXT = b'hello\r'
+
+
+class Console:
+    # a keyboard typing at random times
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.input = list(TEXT)
+        self.output = []
+
+    def getc(self, address):
+        if self.input and self.random.random() < 0.02:
+            return self.input.pop(0)
+        return 0
+
+    def putc(self, address, value):
+        self.output.append(value)
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Record and Replay"""
+
+    def test_replay_reproduces_the_session(self):
+        mpu, console, log = self._record()
+        self.assertEqual(list(TEXT), console.output)
+        self.assertTrue(mpu.stopped)
+        self.assertTrue(len(log.interrupts) > 2)
+
+        replay, output = self._make_board()
+        replayer = Replayer(replay, log)
+        replayer.start()
+        replayer.run()
+        replayer.stop()
+        self.assertEqual(list(TEXT), output)
+        self.assertEqual(len(log.values), replayer.reads)
+        self.assertEqual(len(log.hashes), replayer.hashes)
+        self.assertTrue(replayer.hashes > 2)
+        self.assertEqual(state_hash(mpu), state_hash(replay))
+        self.assertEqual(mpu.memory[0x10:0x12], replay.memory[0x10:0x12])
+
+    def test_interrupt_cycles_are_logged(self):
+        mpu, console, log = self._record()
+        irqs = [interrupt for interrupt in log.interrupts if interrupt[1] == 'irq']
+        nmis = [interrupt for interrupt in log.interrupts if interrupt[1] == 'nmi']
+        self.assertTrue(irqs and nmis)
+        # the timer's IRQs on its multiples of 97 cycles, each at or just
+        # after one at the end of an instruction
+        for cycle, kind, reads in irqs:
+            self.assertTrue(cycle % 97 < 10)
+        self.assertEqual(len(irqs), mpu.memory[0x10])
+        self.assertEqual(len(nmis), mpu.memory[0x11])
+
+    def test_save_and_load(self):
+        mpu, console, log = self._record()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'session.log')
+            log.save(path)
+            loaded = load(path)
+        for name in ('devices', 'interval', 'registers', 'values', 'sources',
+                     'interrupts', 'hashes', 'end'):
+            self.assertEqual(getattr(log, name), getattr(loaded, name))
+        replay, output = self._make_board()
+        replayer = Replayer(replay, loaded)
+        replayer.start()
+        replayer.run()
+        self.assertEqual(list(TEXT), output)
+
+    def test_a_changed_input_diverges(self):
+        mpu, console, log = self._record()
+        # the program doesn't stop at the CR, and reads past the log
+        i = log.values.index(ord('\r'))
+        log.values[i] = ord('!')
+        replay, output = self._make_board()
+        replayer = Replayer(replay, log)
+        replayer.start()
+        self.assertRaises(Diverged, replayer.run)
+
+    def test_a_moved_interrupt_diverges(self):
+        mpu, console, log = self._record()
+        cycle, kind, reads = log.interrupts[1]
+        log.interrupts[1] = (cycle + 1, kind, reads)
+        replay, output = self._make_board()
+        replayer = Replayer(replay, log)
+        replayer.start()
+        self.assertRaises(Diverged, replayer.run)
+
+    def test_a_different_board_diverges_at_the_start(self):
+        mpu, console, log = self._record()
+        replay, output = self._make_board()
+        replay.memory[0x0400] = 0xff
+        self.assertRaises(Diverged, Replayer(replay, log).start)
+
+    def test_stop_restores_the_mpu(self):
+        mpu, output = self._make_board()
+        memory = mpu.memory
+        recorder = Recorder(mpu, (GETC,))
+        recorder.start()
+        self.assertTrue('irq' in vars(mpu))
+        recorder.stop()
+        self.assertTrue(mpu.memory is memory)
+        self.assertFalse('irq' in vars(mpu) or 'nmi' in vars(mpu))
+
+    # Test Helpers
+
+    def _make_board(self, console=None):
+        # a board with the console on it, or only its output without one
+        memory = 0x10000 * [0x00]
+        memory[0x0200:0x0200 + len(PROGRAM)] = PROGRAM
+        memory[0x0300:0x0300 + len(IRQ)] = IRQ
+        memory[0x0310:0x0310 + len(NMI)] = NMI
+        memory[0xfffa:0xfffc] = [0x10, 0x03]
+        memory[0xfffc:0xfffe] = [0x00, 0x02]
+        memory[0xfffe:0x10000] = [0x00, 0x03]
+        observable = ObservableMemory(subject=memory)
+        output = []
+        if console is None:
+            observable.subscribe_to_write([PUTC], lambda address, value: output.append(value))
+        else:
+            observable.subscribe_to_read([GETC], console.getc)
+            observable.subscribe_to_write([PUTC], console.putc)
+        mpu = self._get_target_class()(memory=observable)
+        mpu.reset()
+        return mpu, output
+
+    def _record(self):
+        # the console typing TEXT, a timer asserting an IRQ every 97
+        # cycles and an NMI between every third run
+        console = Console(1)
+        mpu, output = self._make_board(console)
+
+        def timer(mpu):
+            mpu.irq()
+            mpu.schedule(mpu.processorCycles // 97 * 97 + 97, timer)
+        mpu.schedule(97, timer)
+        recorder = Recorder(mpu, (GETC,), interval=200)
+        recorder.start()
+        runs = 0
+        while not mpu.stopped and runs < 1000:
+            mpu.run(count=40)
+            runs += 1
+            if runs % 3 == 0:
+                mpu.nmi()
+        return mpu, console, recorder.stop()
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+class SlottedTests(MPUTests):
+    """CMOS 65C816 Tests - Record and Replay - Slotted"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,128 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.slotted import SlottedMPU, REGISTERS
+from tests.devices import test_mpu65c816_emulation
+from tests.devices import test_mpu65c816_native_8
+from tests.devices import test_mpu65c816_native_16
+from tests.devices import test_mpu65c816_cycles
+from tests.devices import test_mpu65c816_bustrace
+
+# the same program stepped by MPU and SlottedMPU: a 16 bit copy loop, a
+# subroutine with stack traffic and an 8 bit store loop
+PROGRAM = [
+    0x18, 0xfb,             # 0200 CLC, XCE
+    0xc2, 0x30,             # 0202 REP #$30
+    0xa2, 0x00, 0x00,       # 0204 LDX #$0000
+    0xbd, 0x00, 0x04,       # 0207 LDA $0400,X
+    0x9d, 0x00, 0x05,       # 020a STA $0500,X
+    0xe8, 0xe8,             # 020d INX, INX
+    0xe0, 0x20, 0x00,       # 020f CPX #$0020
+    0xd0, 0xf3,             # 0212 BNE $0207
+    0x20, 0xfa, 0x02,       # 0214 JSR $02fa
+    0xe2, 0x30,             # 0217 SEP #$30
+    0xa0, 0x05,             # 0219 LDY #$05
+    0x84, 0x10,             # 021b STY $10
+    0x88,                   # 021d DEY
+    0x10, 0xfb,             # 021e BPL $021b
+    0x38, 0xfb,             # 0220 SEC, XCE
+    0xdb,                   # 0222 STP
+]
+
+SUBROUTINE = [
+    0x48,                   # 02fa PHA
+    0xa4, 0x10,             # 02fb LDY $10
+    0x68,                   # 02fd PLA
+    0x60,                   # 02fe RTS
+]
+
+
+# the MPU suites again, run against SlottedMPU
+
+class EmulationTests(test_mpu65c816_emulation.MPUTests):
+    """CMOS 65C816 Tests - Slotted - Emulation Mode"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+class Native8Tests(test_mpu65c816_native_8.MPUTests):
+    """CMOS 65C816 Tests - Slotted - Native Mode - 8 Bit"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+class Native16Tests(test_mpu65c816_native_16.MPUTests):
+    """CMOS 65C816 Tests - Slotted - Native Mode - 16 Bit"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+class CycleTests(test_mpu65c816_cycles.MPUTests):
+    """CMOS 65C816 Tests - Slotted - Cycles"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+class BusTraceTests(test_mpu65c816_bustrace.MPUTests):
+    """CMOS 65C816 Tests - Slotted - Bus Trace"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Slotted"""
+
+    def test_registers_are_slots(self):
+        mpu = self._make_mpu()
+        self.assertEqual({}, vars(mpu))
+        for name in REGISTERS:
+            getattr(mpu, name)
+
+    def test_step_can_still_be_replaced(self):
+        mpu = self._make_mpu()
+        mpu.setCycleAccurate()
+        self.assertEqual(mpu.stepAccurate, mpu.step)
+        mpu.setCycleAccurate(False)
+        self.assertEqual({}, vars(mpu))
+
+    def test_program_matches_mpu(self):
+        mpus = [self._make_mpu(klass) for klass in
+                (devices.mpu65c816.MPU, self._get_target_class())]
+        for i in range(200):
+            states = []
+            for mpu in mpus:
+                mpu.step()
+                states.append([getattr(mpu, name) for name in REGISTERS
+                               if name not in ('name', 'memory')])
+            self.assertEqual(states[0], states[1])
+            if mpus[0].stopped:
+                break
+        self.assertTrue(mpus[1].stopped)
+        self.assertEqual(mpus[0].memory, mpus[1].memory)
+
+    # Test Helpers
+
+    def _make_mpu(self, klass=None):
+        if klass is None:
+            klass = self._get_target_class()
+        memory = 0x10000 * [0x00]
+        memory[0x0200:0x0200 + len(PROGRAM)] = PROGRAM
+        memory[0x02fa:0x02fa + len(SUBROUTINE)] = SUBROUTINE
+        memory[0x0400:0x0420] = range(0x80, 0xa0)
+        memory[0xfffc:0xfffe] = [0x00, 0x02]
+        return klass(memory=memory)
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
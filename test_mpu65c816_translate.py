@@ -0,0 +1,193 @@
+import unittest
+import os
+import sys
+import tempfile
+import io
+import devices.mpu65c816
+from devices.translate import Translator, main
+
+# A ROM at $8000 that sums 5 down to 1 into $10 with 16 bit registers:
+#   8000 CLC
+#   8001 XCE
+#   8002 REP #$30
+#   8004 LDX #$0005
+#   8007 TXA
+#   8008 JSR $8020
+#   800B DEX
+#   800C BNE $8007
+#   800E SEP #$20
+#   8010 STP
+#   8020 CLC
+#   8021 ADC $10
+#   8023 STA $10
+#   8025 RTS
+ROM = {0x8000: [0x18, 0xfb, 0xc2, 0x30, 0xa2, 0x05, 0x00, 0x8a, 0x20, 0x20,
+                0x80, 0xca, 0xd0, 0xf9, 0xe2, 0x20, 0xdb],
+       0x8020: [0x18, 0x65, 0x10, 0x85, 0x10, 0x60],
+       0xfffc: [0x00, 0x80]}
+
+# A ROM at $8000 copying 4 bytes from $0100 to $0200:
+#   8000 CLC
+#   8001 XCE
+#   8002 REP #$30
+#   8004 LDA #$0003
+#   8007 LDX #$0100
+#   800A LDY #$0200
+#   800D MVN $00,$00
+#   8010 STP
+MOVE = {0x8000: [0x18, 0xfb, 0xc2, 0x30, 0xa9, 0x03, 0x00, 0xa2, 0x00, 0x01,
+                 0xa0, 0x00, 0x02, 0x54, 0x00, 0x00, 0xdb],
+        0x0100: [0x01, 0x02, 0x03, 0x04],
+        0xfffc: [0x00, 0x80]}
+
+# A ROM at $8000 storing to bank 1:
+#   8000 CLC
+#   8001 XCE
+#   8002 LDA #$42
+#   8004 STA $012345
+#   8008 STP
+LONG = {0x8000: [0x18, 0xfb, 0xa9, 0x42, 0x8f, 0x45, 0x23, 0x01, 0xdb],
+        0xfffc: [0x00, 0x80]}
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Translation"""
+
+    def test_translated_run_matches_step(self):
+        mpu = self._make_mpu()
+        self.assertEqual(mpu.RUN_STOP, mpu.run())
+        translated = self._make_mpu()
+        translator = self._make_translator(translated)
+        self.assertEqual(mpu.RUN_STOP, translator.run())
+        self.assertEqual(self._state(mpu), self._state(translated))
+        self.assertEqual(15, translated.memory[0x10])
+        self.assertEqual(mpu.memory, translated.memory)
+
+    def test_blocks_end_where_the_mode_may_change(self):
+        translator = self._make_translator(self._make_mpu())
+        function, count = translator.translate((0x8000, 1, 1, 1))
+        self.assertEqual(2, count) # CLC XCE
+        function, count = translator.translate((0x8002, 1, 1, 0))
+        self.assertEqual(4, count) # REP LDX TXA JSR
+        self.assertEqual(None, translator.translate((0x7ffe, 1, 1, 1)))
+
+    def test_block_move_matches_step(self):
+        # MVN repeats by leaving pc on itself, it ends a block
+        mpu = self._make_mpu(MOVE)
+        self.assertEqual(mpu.RUN_STOP, mpu.run())
+        translated = self._make_mpu(MOVE)
+        translator = self._make_translator(translated)
+        self.assertEqual(mpu.RUN_STOP, translator.run())
+        self.assertEqual([1, 2, 3, 4], translated.memory[0x0200:0x0204])
+        self.assertEqual(self._state(mpu), self._state(translated))
+        function, count = translator.translate((0x8002, 1, 1, 0))
+        self.assertEqual(5, count) # REP LDA LDX LDY MVN
+
+    def test_count_is_exact(self):
+        for count in (1, 5, 13, 30):
+            mpu = self._make_mpu()
+            mpu.run(count=count)
+            translated = self._make_mpu()
+            self._make_translator(translated).run(count=count)
+            self.assertEqual(self._state(mpu), self._state(translated))
+
+    def test_code_outside_the_image_is_stepped(self):
+        # JMP $8000 from RAM
+        mpu = self._make_mpu()
+        mpu.memory[0x0200:0x0203] = [0x4c, 0x00, 0x80]
+        mpu.pc = 0x0200
+        translator = self._make_translator(mpu)
+        self.assertEqual(mpu.RUN_STOP, translator.run())
+        self.assertEqual(15, mpu.memory[0x10])
+        self.assertFalse(any(key[0] < 0x8000 for key in translator.blocks))
+
+    def test_events_are_dispatched_between_blocks(self):
+        fired = []
+        mpu = self._make_mpu()
+        mpu.schedule(10, lambda mpu: fired.append(mpu.processorCycles))
+        self._make_translator(mpu).run()
+        self.assertEqual(1, len(fired))
+        self.assertTrue(fired[0] >= 10)
+
+    def test_translations_are_saved_and_loaded(self):
+        with tempfile.TemporaryDirectory() as folder:
+            first = self._make_translator(self._make_mpu(), folder)
+            first.run()
+            self.assertTrue(first.save())
+            self.assertFalse(first.save())
+            mpu = self._make_mpu()
+            second = self._make_translator(mpu, folder)
+            self.assertEqual(first.path, second.path)
+            self.assertEqual(sorted(first.blocks), sorted(second.blocks))
+            second.run()
+            self.assertEqual(0, second.translated)
+            self.assertEqual(15, mpu.memory[0x10])
+            # another image is another file
+            mpu = self._make_mpu()
+            mpu.memory[0x8005] = 0x06
+            third = self._make_translator(mpu, folder)
+            self.assertNotEqual(first.path, third.path)
+            self.assertEqual({}, third.blocks)
+
+    def test_a_damaged_cache_file_is_ignored(self):
+        with tempfile.TemporaryDirectory() as folder:
+            translator = self._make_translator(self._make_mpu(), folder)
+            with open(translator.path, 'wb') as f:
+                f.write(b'\x00\x01')
+            mpu = self._make_mpu()
+            translator = self._make_translator(mpu, folder)
+            self.assertEqual({}, translator.blocks)
+            translator.run()
+            self.assertEqual(15, mpu.memory[0x10])
+
+    def test_prewarm_translates_from_the_vectors(self):
+        translator = self._make_translator(self._make_mpu())
+        self.assertTrue(translator.prewarm() > 0)
+        self.assertTrue((0x8000, 1, 1, 1) in translator.blocks)
+        self.assertTrue((0x8020, 0, 0, 0) in translator.blocks)
+
+    def test_main_saves_the_translations(self):
+        image = bytearray(0x8000)
+        for address, values in LONG.items():
+            image[address - 0x8000:address - 0x8000 + len(values)] = values
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'rom.bin')
+            with open(path, 'wb') as f:
+                f.write(image)
+            translations = os.path.join(folder, 'translations')
+            out = io.StringIO()
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                self.assertEqual(0, main([path, '--load', '0x8000', '--folder', translations]))
+            finally:
+                sys.stdout = stdout
+            files = os.listdir(translations)
+            self.assertEqual(1, len(files))
+            self.assertTrue(files[0].endswith('.blocks'))
+            self.assertTrue(os.path.join(translations, files[0]) in out.getvalue())
+
+    # Test Helpers
+
+    def _make_mpu(self, rom=ROM):
+        mpu = self._get_target_class()()
+        for address, values in rom.items():
+            mpu.memory[address:address + len(values)] = values
+        mpu.reset()
+        return mpu
+
+    def _make_translator(self, mpu, folder=None):
+        return Translator(mpu, mpu.memory[0x8000:0x10000], 0x8000, folder)
+
+    def _state(self, mpu):
+        return (mpu.pc, mpu.pbr, mpu.a, mpu.b, mpu.x, mpu.y, mpu.p, mpu.sp,
+                mpu.dbr, mpu.dpr, mpu.mode, mpu.processorCycles)
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
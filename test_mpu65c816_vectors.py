@@ -0,0 +1,107 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+import devices.mpu65c816
+from devices.vectors import Runner, SparseMemory, run_files
+
+
+def state(ram, pc=0x1000, s=0x01fd, p=0x34, a=0x0000, x=0x00, y=0x00,
+          dbr=0x00, d=0x0000, pbr=0x00, e=1):
+    return {'pc': pc, 's': s, 'p': p, 'a': a, 'x': x, 'y': y, 'dbr': dbr,
+            'd': d, 'pbr': pbr, 'e': e, 'ram': ram}
+
+
+# $1000 LDA #$42 in emulation mode, B is kept
+LDA_IMMEDIATE = {
+    'name': 'a9 e 1',
+    'initial': state([[0x1000, 0xa9], [0x1001, 0x42]], a=0x1200),
+    'final': state([[0x1000, 0xa9], [0x1001, 0x42]], pc=0x1002, a=0x1242),
+    'cycles': [[0x1000, 0xa9, 'dp'], [0x1001, 0x42, 'p']],
+}
+
+# $1000 STA $2000 in native mode with a 16 bit accumulator, DBR $03
+STA_ABSOLUTE = {
+    'name': '8d n 1',
+    'initial': state([[0x1000, 0x8d], [0x1001, 0x00], [0x1002, 0x20]],
+                     s=0x1234, p=0x10, a=0xbeef, dbr=0x03, e=0),
+    'final': state([[0x1000, 0x8d], [0x1001, 0x00], [0x1002, 0x20],
+                    [0x032000, 0xef], [0x032001, 0xbe]],
+                   pc=0x1003, s=0x1234, p=0x10, a=0xbeef, dbr=0x03,
+                   e=0),
+    'cycles': [[0, 0, ''], [0, 0, ''], [0, 0, ''], [0, 0, ''], [0, 0, '']],
+}
+
+# $1000 INX expecting the wrong result
+WRONG = {
+    'name': 'e8 e 1',
+    'initial': state([[0x1000, 0xe8]], x=0x10),
+    'final': state([[0x1000, 0xe8]], pc=0x1001, x=0x12),
+    'cycles': [[0, 0, ''], [0, 0, '']],
+}
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Single Step Test Vectors"""
+
+    def test_sparse_memory_reads_unwritten_addresses_as_zero(self):
+        memory = SparseMemory()
+        memory[0xfffffe] = 0x12
+        self.assertEqual(0x12, memory[0xfffffe])
+        self.assertEqual(0x00, memory[0xffffff])
+        self.assertEqual(1, len(memory))
+
+    def test_emulation_mode_vector_passes(self):
+        self.assertEqual([], Runner().run(LDA_IMMEDIATE))
+
+    def test_native_mode_vector_passes(self):
+        self.assertEqual([], Runner().run(STA_ABSOLUTE))
+
+    def test_differences_are_reported(self):
+        self.assertEqual([('x', 0x12, 0x11)], Runner().run(WRONG))
+
+    def test_cycle_counts_are_compared_in_cycle_accurate_mode(self):
+        runner = Runner(cycles=True)
+        self.assertEqual([], runner.run(LDA_IMMEDIATE))
+        self.assertEqual([], runner.run(STA_ABSOLUTE))
+
+    def test_memory_is_only_what_the_test_touched(self):
+        runner = Runner()
+        runner.run(STA_ABSOLUTE)
+        runner.run(LDA_IMMEDIATE)
+        self.assertEqual({0x1000: 0xa9, 0x1001: 0x42}, dict(runner.memory))
+
+    def test_files_run_in_parallel(self):
+        folder = tempfile.mkdtemp()
+        try:
+            paths = []
+            for name, tests in (('a9.e.json', [LDA_IMMEDIATE] * 50),
+                                ('8d.n.json', [STA_ABSOLUTE] * 50),
+                                ('e8.e.json', [LDA_IMMEDIATE, WRONG, WRONG])):
+                path = os.path.join(folder, name)
+                with open(path, 'w') as f:
+                    json.dump(tests, f)
+                paths.append(path)
+
+            results = {}
+            for path, tests, failed, failures in run_files(paths, 2, limit=1):
+                results[os.path.basename(path)] = (tests, failed, len(failures))
+            self.assertEqual({'a9.e.json': (50, 0, 0),
+                              '8d.n.json': (50, 0, 0),
+                              'e8.e.json': (3, 2, 1)}, results)
+        finally:
+            shutil.rmtree(folder)
+
+    # Test Helpers
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,156 @@
+import unittest
+import sys
+import devices.mpu65c816
+from devices.slotted import SlottedMPU
+from devices.watchpoints import Watcher, Break, RUN_BREAK
+
+# a 16 bit loop storing X at $1000,X down from $0010, then a subroutine
+# pushing the stack down
+PROGRAM = [
+    0x18, 0xfb,             # 0200 CLC, XCE
+    0xc2, 0x30,             # 0202 REP #$30
+    0xa2, 0x10, 0x00,       # 0204 LDX #$0010
+    0x8a,                   # 0207 TXA
+    0x9d, 0x00, 0x10,       # 0208 STA $1000,X
+    0xca, 0xca,             # 020b DEX, DEX
+    0xd0, 0xf8,             # 020d BNE $0207
+    0xad, 0x02, 0x10,       # 020f LDA $1002
+    0x20, 0x00, 0x03,       # 0212 JSR $0300
+    0xdb,                   # 0215 STP
+]
+
+SUBROUTINE = [
+    0x48, 0x48, 0x48,       # 0300 PHA, PHA, PHA
+    0x68, 0x68, 0x68,       # 0303 PLA, PLA, PLA
+    0x60,                   # 0306 RTS
+]
+
+
+class MPUTests(unittest.TestCase):
+    """CMOS 65C816 Tests - Watchpoints"""
+
+    def test_nothing_installed_without_watches(self):
+        mpu = self._make_mpu()
+        memory = mpu.memory
+        watcher = Watcher(mpu)
+        self.assertFalse('step' in vars(mpu))
+        i = watcher.watch(0x1000, 0x1010, 'rw')
+        self.assertTrue('step' in vars(mpu))
+        self.assertFalse(mpu.memory is memory)
+        watcher.remove(i)
+        self.assertFalse('step' in vars(mpu))
+        self.assertTrue(mpu.memory is memory)
+
+    def test_execute_only_leaves_the_memory(self):
+        mpu = self._make_mpu()
+        memory = mpu.memory
+        watcher = Watcher(mpu)
+        watcher.watch(0x0300, 0x0307, 'x')
+        self.assertTrue(mpu.memory is memory)
+
+    def test_write_watch_stops_after_the_instruction(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.watch(0x1008, 0x1009, 'w')
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        # STA $1000,X with X = 8 wrote $1008 and $1009
+        self.assertEqual(('w', 0x1008, 0x0208), watcher.hit)
+        self.assertEqual(0x020b, mpu.pc)
+        self.assertEqual([0x08, 0x00], [mpu.memory[0x1008], mpu.memory[0x1009]])
+
+    def test_read_watch(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.watch(0x1003, 0x1004, 'r')
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        self.assertEqual(('r', 0x1003, 0x020f), watcher.hit)
+        self.assertEqual(0x0002, mpu.a)
+
+    def test_execute_watch_stops_before_the_instruction_and_resumes(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.watch(0x0303, 0x0304, 'x')
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        self.assertEqual(('x', 0x0303, 0x0303), watcher.hit)
+        self.assertEqual(0x0303, mpu.pc)
+        self.assertEqual(mpu.RUN_STOP, watcher.run(count=1000))
+        self.assertEqual(None, watcher.hit)
+
+    def test_conditional_breakpoint(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.breakpoint(0x0208, 'x == 4')
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        self.assertEqual(('b', 0x0208, 0x0208), watcher.hit)
+        self.assertEqual(4, mpu.x)
+        self.assertEqual(0, mpu.memory[0x1004])
+
+    def test_condition_stops_when_it_becomes_true(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.condition('not e and sp < 0x1fc')
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        # the JSR pushed 2 bytes from $01ff, the first PHA 2 more
+        self.assertEqual(('c', 'not e and sp < 0x1fc', 0x0300), watcher.hit)
+        self.assertEqual(0x1fb, mpu.sp)
+        # true until the PLAs, it doesn't stop again
+        self.assertEqual(mpu.RUN_STOP, watcher.run(count=1000))
+
+    def test_break_out_of_step(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        watcher.breakpoint(0x0202)
+        mpu.step()
+        mpu.step()
+        self.assertRaises(Break, mpu.step)
+        self.assertEqual(('b', 0x0202, 0x0202), watcher.hit)
+
+    def test_watches_on_the_same_page(self):
+        mpu = self._make_mpu()
+        watcher = Watcher(mpu)
+        ids = watcher.watch(0x1000, 0x1002, 'rw')
+        watcher.watch(0x100c, 0x100e, 'w')
+        watcher.remove(ids)
+        self.assertEqual(RUN_BREAK, watcher.run(count=1000))
+        self.assertEqual(('w', 0x100c, 0x0208), watcher.hit)
+
+    def test_unknown_kind(self):
+        watcher = Watcher(self._make_mpu())
+        self.assertRaises(ValueError, watcher.watch, 0, 1, 'q')
+        self.assertEqual({}, watcher.watches)
+
+    def test_clear_restores_a_replaced_step(self):
+        mpu = self._make_mpu()
+        mpu.setCycleAccurate()
+        watcher = Watcher(mpu)
+        watcher.condition('a == 2')
+        watcher.clear()
+        self.assertEqual(mpu.stepAccurate, mpu.step)
+
+    # Test Helpers
+
+    def _make_mpu(self):
+        memory = 0x10000 * [0x00]
+        memory[0x0200:0x0200 + len(PROGRAM)] = PROGRAM
+        memory[0x0300:0x0300 + len(SUBROUTINE)] = SUBROUTINE
+        memory[0xfffc:0xfffe] = [0x00, 0x02]
+        mpu = self._get_target_class()(memory=memory)
+        mpu.sp = 0xff
+        return mpu
+
+    def _get_target_class(self):
+        return devices.mpu65c816.MPU
+
+
+class SlottedTests(MPUTests):
+    """CMOS 65C816 Tests - Watchpoints - Slotted"""
+
+    def _get_target_class(self):
+        return SlottedMPU
+
+
+def test_suite():
+    return unittest.findTestCases(sys.modules[__name__])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,267 @@
+# Translation of ROM code into Python functions, cached on disk
+#
+# A block of straight line ROM code is translated into a Python function
+# that runs its instructions one after the other: the opcode fetch, the
+# table lookups and the cycle bookkeeping step() does for each instruction
+# are done once, when the block is translated, and the function calls the
+# MPU's own instruction handlers, so the results are those of step().  A
+# block is keyed by its 24 bit address and the M, X and E flags it starts
+# with, and it ends at a branch, jump, call, return or interrupt, after
+# an instruction (XCE, PLP, WAI, STP) whose effect on the mode isn't known
+# until it runs, or after a block move (MVN, MVP), which moves a byte and
+# leaves pc on itself until the last one.
+#
+# The translations are kept in a file named for a hash of the image, its
+# load address, the Python version and the MPU's cycle tables, as the
+# sources and a marshalled code object compiled from them, so the next
+# process running the same image loads them rather than translating again:
+#
+#   translator = Translator(mpu, image, 0x8000, folder='translations')
+#   translator.prewarm()        # the blocks cfg.py finds from the vectors
+#   translator.run(count=10000000)
+#   translator.save()           # with the blocks found while running
+#
+# * Only code inside the image is translated, anything else is stepped.
+#   The image is taken to be ROM, writes into it aren't noticed.
+# * Events are dispatched and the budgets checked between blocks, and
+#   processorCycles is brought up to date at the end of each block, so an
+#   event can be late by the rest of a block.  Spin loops aren't skipped.
+# * The default cycle counts only, use step() in cycle accurate mode.
+#
+# From the py65 folder:
+#   python -m devices.translate of816_forth.bin --load 0x8000 --folder translations
+
+import argparse
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import tempfile
+import time
+
+from devices.mpu65c816 import MPU
+from devices.disasm import Disassembler, follow
+from devices import cfg
+
+VERSION = 3
+
+# opcodes after which a block ends
+ENDS = set(cfg.BRANCHES + cfg.ALWAYS + cfg.JUMPS + cfg.POINTER_JUMPS +
+           cfg.INDIRECT + cfg.CALLS + cfg.INDIRECT_CALLS + cfg.ENDS +
+           (0x02, 0x28, 0xcb, 0xfb) + # COP, PLP, WAI, XCE
+           (0x44, 0x54)) # MVP, MVN
+
+MS = 0x20
+IRS = 0x10
+
+
+class Translator:
+    def __init__(self, mpu, image, load, folder=None):
+        self.mpu = mpu
+        self.image = bytes(image)
+        self.start = load # the image is from start up to end
+        self.end = load + len(self.image)
+        self.folder = folder
+        self.disassembler = Disassembler(mpu.memory)
+        self.handlers = dict(('h%02x' % opcode, handler)
+                             for opcode, handler in enumerate(type(mpu).instruct))
+        self.blocks = {} # (address, m, x, e): (function, instructions)
+        self.sources = {} # (address, m, x, e): (source of the function, instructions)
+        self.translated = 0 # blocks translated rather than loaded
+        self.dirty = False # blocks translated since the last load or save
+        self.path = None
+        if folder is not None:
+            self.path = os.path.join(folder, self.digest() + '.blocks')
+            self.load()
+
+    def digest(self):
+        # names the cache file, anything that changes the translation
+        # changes it
+        cls = type(self.mpu)
+        h = hashlib.sha256(self.image)
+        h.update(repr((self.start, VERSION, importlib.util.MAGIC_NUMBER,
+                       cls.cycletime, cls.extracycles)).encode())
+        return h.hexdigest()[:32]
+
+    def load(self):
+        # loads the translations saved for this image, returns the number
+        # of blocks loaded
+        try:
+            with open(self.path, 'rb') as f:
+                sources, code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return 0
+        self._install(sources, code)
+        self.dirty = False
+        return len(sources)
+
+    def save(self):
+        # writes the translations to the cache file if there are new ones,
+        # replacing it in one go so processes sharing the folder only see
+        # whole files
+        if self.path is None or not self.dirty:
+            return False
+        os.makedirs(self.folder, exist_ok=True)
+        code = compile(self._module(self.sources), self.path, 'exec')
+        fd, temp = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump((self.sources, code), f)
+        os.replace(temp, self.path)
+        self.dirty = False
+        return True
+
+    def prewarm(self, entries=None):
+        # translates the blocks cfg.py finds from entries (default the
+        # vectors in the image), returns the number translated
+        analyser = cfg.Analyser(self.mpu.memory, self.disassembler,
+                                self.start, self.end)
+        analyser.analyse(analyser.vectors() if entries is None else entries)
+        translated = self.translated
+        for key in analyser.blocks:
+            if key[3] is not None and key not in self.blocks:
+                self.translate(key)
+        return self.translated - translated
+
+    def translate(self, key):
+        # translates the block at key, returns (function, instructions) or
+        # None if it isn't in the image
+        address, m, x, e = key
+        if not self.start <= address < self.end:
+            return None
+        source, count = self._source(key)
+        namespace = dict(self.handlers)
+        exec(compile(source, '<block>', 'exec'), namespace)
+        block = (namespace[_name(key)], count)
+        self.blocks[key] = block
+        self.sources[key] = (source, count)
+        self.translated += 1
+        self.dirty = True
+        return block
+
+    def run(self, cycles=None, count=None):
+        # MPU.run() a block at a time, returns the reason it stopped
+        mpu = self.mpu
+        blocks = self.blocks
+        outside = set() # keys that aren't in the image
+        end = mpu.NEVER if cycles is None else mpu.processorCycles + cycles
+        remaining = -1 if count is None else count
+
+        while True:
+            if mpu.processorCycles >= mpu.nextEvent:
+                mpu.dispatchEvents()
+            if mpu.processorCycles >= end:
+                return mpu.RUN_CYCLES
+            if not remaining:
+                return mpu.RUN_COUNT
+
+            if mpu.waiting:
+                if mpu.stopped:
+                    return mpu.RUN_STOP
+                target = min(mpu.nextEvent, end)
+                if target == mpu.NEVER:
+                    return mpu.RUN_IDLE
+                mpu.processorCycles = max(mpu.processorCycles, target)
+                continue
+
+            p = mpu.p
+            if mpu.mode:
+                key = ((mpu.pbr << 16) | mpu.pc, 1, 1, 1)
+            else:
+                key = ((mpu.pbr << 16) | mpu.pc, 1 if p & MS else 0,
+                       1 if p & IRS else 0, 0)
+            block = blocks.get(key)
+            if block is None and key not in outside:
+                block = self.translate(key)
+                if block is None:
+                    outside.add(key)
+            if block is None or 0 < remaining < block[1]:
+                mpu.step()
+                remaining -= 1
+            else:
+                block[0](mpu)
+                remaining -= block[1]
+
+    def _source(self, key):
+        # (source of the block's function, instructions in it)
+        address, m, x, e = key
+        bank = address & 0xff0000
+        c = None
+        cls = type(self.mpu)
+        lines = ['def %s(mpu):' % _name(key),
+                 '    mpu.excycles = 0']
+        addcycles = None
+        cycles = 0
+        count = 0
+        while True:
+            code, length, text = self.disassembler.decode(address, m, x)
+            opcode = code[0]
+            extra = cls.extracycles[opcode]
+            if extra != addcycles:
+                lines.append('    mpu.addcycles = %d' % extra)
+                addcycles = extra
+            lines.append('    mpu.pc = 0x%04x # %s' % ((address + 1) & 0xffff, text))
+            lines.append('    mpu.fetchAddr = 0x%06x' % (bank | ((address + 1) & 0xffff)))
+            lines.append('    h%02x(mpu)' % opcode)
+            cycles += cls.cycletime[opcode]
+            count += 1
+            m, x, e, c = follow(code, m, x, e, c)
+            following = (address & 0xffff) + length
+            address = bank | (following & 0xffff)
+            if opcode in ENDS or following > 0xffff or \
+               not self.start <= address < self.end:
+                break
+        lines.append('    mpu.pc &= 0xffff')
+        lines.append('    mpu.processorCycles += %d + mpu.excycles' % cycles)
+        return '\n'.join(lines) + '\n', count
+
+    def _module(self, sources):
+        # the functions and a table of them with their instruction counts
+        keys = sorted(sources)
+        blocks = ['    %r: (%s, %d),' % (key, _name(key), sources[key][1])
+                  for key in keys]
+        return '\n'.join([sources[key][0] for key in keys] +
+                         ['BLOCKS = {'] + blocks + ['}']) + '\n'
+
+    def _install(self, sources, code):
+        namespace = dict(self.handlers)
+        exec(code, namespace)
+        self.blocks.update(namespace['BLOCKS'])
+        self.sources.update(sources)
+
+
+def _name(key):
+    address, m, x, e = key
+    return 'b%06x_%d%d%d' % (address, m, x, e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='translate a ROM image')
+    parser.add_argument('image', help='binary image')
+    parser.add_argument('--load', type=lambda s: int(s, 0), default=0x8000,
+                        help='load address (default 0x%(default)x)')
+    parser.add_argument('--folder', default='translations',
+                        help='folder for the translations (default %(default)s)')
+    parser.add_argument('-n', '--count', type=int, default=1000000,
+                        help='instructions to run from reset to find more code (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    start = time.perf_counter()
+    mpu = MPU(memory=[0] * 0x1000000)
+    mpu.memory[args.load:args.load + len(image)] = image
+    translator = Translator(mpu, image, args.load, args.folder)
+    loaded = len(translator.blocks)
+    translator.prewarm()
+    mpu.reset()
+    translator.run(count=args.count)
+    translator.save()
+    print('%d blocks loaded, %d translated in %.2fs, saved to %s'
+          % (loaded, translator.translated, time.perf_counter() - start,
+             translator.path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# Single step test vector runner
+#
+# Runs JSON test vectors in the format of the community single step test
+# suites, a file per opcode (and mode) holding a list of tests:
+#
+#   {"name": "a9 e 1",
+#    "initial": {"pc": .., "s": .., "p": .., "a": .., "x": .., "y": ..,
+#                "dbr": .., "d": .., "pbr": .., "e": ..,
+#                "ram": [[address, value], ...]},
+#    "final": {... the same ...},
+#    "cycles": [[address, value, signals], ...]}
+#
+# "a" is the full 16 bit C register and "s" the full stack pointer, high
+# byte $01 in emulation mode.  The bus cycles themselves aren't compared,
+# with --cycles their count is compared with processorCycles in the cycle
+# accurate mode.
+#
+# Each process reuses one MPU on a sparse memory that only holds the
+# addresses a test touched, cleared between tests, so a test costs little
+# more than setting the registers and stepping once.  Files are spread
+# across processes.
+#
+# From the py65 folder:
+#   python -m devices.vectors path/to/v1/*.json -j 8
+#   python -m devices.vectors path/to/v1/a9.n.json --failures 10 --cycles
+#   python -m devices.vectors path/to/v1/*.json --batch 1000
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+
+from devices.mpu65c816 import MPU
+
+REGISTERS = ('pc', 's', 'p', 'a', 'x', 'y', 'dbr', 'd', 'pbr', 'e')
+
+
+class SparseMemory(dict):
+    # full 24 bit address space, unwritten addresses read as 0
+    def __missing__(self, address):
+        return 0
+
+
+def load(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return json.load(f)
+
+
+class Runner:
+    def __init__(self, cycles=False):
+        self.memory = SparseMemory()
+        self.mpu = MPU(memory=self.memory)
+        self.cycles = cycles
+        if cycles:
+            self.mpu.setCycleAccurate()
+
+    def setup(self, state):
+        mpu = self.mpu
+        self.memory.clear()
+        for address, value in state['ram']:
+            self.memory[address] = value
+
+        mpu.mode = state['e']
+        mpu.p = state['p']
+        if mpu.mode or mpu.p & mpu.MS:
+            mpu.a = state['a'] & mpu.byteMask
+            mpu.b = state['a'] >> mpu.BYTE_WIDTH
+        else:
+            mpu.a = state['a']
+            mpu.b = 0
+        mpu.x = state['x']
+        mpu.y = state['y']
+        if mpu.mode:
+            mpu.sp = state['s'] & mpu.byteMask
+        else:
+            mpu.sp = state['s']
+        mpu.pc = state['pc']
+        mpu.pbr = state['pbr']
+        mpu.dbr = state['dbr']
+        mpu.dpr = state['d']
+        mpu.waiting = False
+        mpu.stopped = False
+        mpu.processorCycles = 0
+
+    def state(self):
+        # the registers in the vector format
+        mpu = self.mpu
+        if mpu.mode or mpu.p & mpu.MS:
+            a = (mpu.b << mpu.BYTE_WIDTH) + mpu.a
+        else:
+            a = mpu.a
+        if mpu.mode:
+            s = 0x100 + mpu.sp
+        else:
+            s = mpu.sp
+        return {'pc': mpu.pc, 's': s, 'p': mpu.p, 'a': a, 'x': mpu.x,
+                'y': mpu.y, 'dbr': mpu.dbr, 'd': mpu.dpr, 'pbr': mpu.pbr,
+                'e': mpu.mode}
+
+    def run(self, test):
+        # returns [(what, expected, got)], empty if the test passed
+        self.setup(test['initial'])
+        self.mpu.step()
+
+        final = test['final']
+        state = self.state()
+        differences = [(register, final[register], state[register])
+                       for register in REGISTERS if final[register] != state[register]]
+        memory = self.memory
+        for address, value in final['ram']:
+            if memory[address] != value:
+                differences.append(('%06x' % address, value, memory[address]))
+        if self.cycles and len(test['cycles']) != self.mpu.processorCycles:
+            differences.append(('cycles', len(test['cycles']),
+                                self.mpu.processorCycles))
+        return differences
+
+    def runFile(self, path, limit=None):
+        # returns (tests, failed, [(name, differences)]) keeping up to limit
+        # failures
+        tests = load(path)
+        failures = []
+        failed = 0
+        for test, differences in zip(tests, self.runTests(tests)):
+            if differences:
+                failed += 1
+                if limit is None or len(failures) < limit:
+                    failures.append((test['name'], differences))
+        return len(tests), failed, failures
+
+    def runTests(self, tests):
+        # yields the differences for each test
+        for test in tests:
+            yield self.differences(test)
+
+    def differences(self, test):
+        try:
+            return self.run(test)
+        except Exception as e:
+            return [('exception', '', repr(e))]
+
+
+# one runner per worker process
+_runner = None
+
+
+def _init_worker(cycles, batch=None):
+    global _runner
+    if batch:
+        from devices.batch import BatchRunner
+        _runner = BatchRunner(batch, cycles=cycles)
+    else:
+        _runner = Runner(cycles)
+
+
+def _run_file(args):
+    path, limit = args
+    return (path,) + _runner.runFile(path, limit)
+
+
+def run_files(paths, processes=None, cycles=False, limit=None, batch=None):
+    # yields (path, tests, failed, failures) as the files finish, batch
+    # tests at a time run in lockstep (see batch.py)
+    jobs = [(path, limit) for path in paths]
+    if processes == 1:
+        _init_worker(cycles, batch)
+        for job in jobs:
+            yield _run_file(job)
+        return
+    with multiprocessing.Pool(processes, _init_worker, (cycles, batch)) as pool:
+        for result in pool.imap_unordered(_run_file, jobs):
+            yield result
+
+
+def expand(paths):
+    # folders stand for the .json and .json.gz files in them
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json') or name.endswith('.json.gz'):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+
+def _difference(what, expected, got):
+    if isinstance(expected, int) and isinstance(got, int):
+        return '%s %x != %x' % (what, expected, got)
+    return '%s %s != %s' % (what, expected, got)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='65C816 single step test vectors')
+    parser.add_argument('paths', nargs='+', help='vector files or folders of them')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default one per core)')
+    parser.add_argument('--cycles', action='store_true',
+                        help='also compare cycle counts (cycle accurate mode)')
+    parser.add_argument('--failures', type=int, default=3,
+                        help='failures to list per file (default %(default)s)')
+    parser.add_argument('--batch', type=int, default=None, metavar='N',
+                        help='run N tests at a time in lockstep (needs NumPy)')
+    args = parser.parse_args(argv)
+
+    total = 0
+    failed = 0
+    for path, tests, bad, failures in run_files(expand(args.paths),
+                                                args.processes, args.cycles,
+                                                args.failures, args.batch):
+        total += tests
+        failed += bad
+        print('%-24s %7d/%d' % (os.path.basename(path), tests - bad, tests))
+        for name, differences in failures:
+            print('    %s: %s' % (name, ', '.join(
+                [_difference(*difference) for difference in differences])))
+    print('passed %d/%d' % (total - failed, total))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# Watchpoints and conditional breakpoints
+#
+# Watcher stops a run when memory in a range is read, written or executed,
+# when the program reaches an address with a condition on the registers
+# true, or when a condition becomes true anywhere:
+#
+#   watcher = Watcher(mpu)
+#   watcher.watch(0x1000, 0x1100, 'w')      # a write to $1000-$10ff
+#   watcher.watch(0x8000, 0x8100, 'x')      # executing in $8000-$80ff
+#   watcher.breakpoint(0x8123, 'x == 0')    # reaching $8123 with X zero
+#   watcher.condition('sp < 0x1f00')        # the stack growing past $1f00
+#   reason = watcher.run(count=1000000)     # mpu.run(), RUN_BREAK on a hit
+#   watcher.hit                             # (kind, what, instruction address)
+#
+# The kind of a hit is r, w or x for a watch, with the address accessed, b
+# for a breakpoint, with its address, or c for a condition, with its text.
+#
+# Nothing is installed until it's needed, and it's all taken out again
+# when the last watch is removed, a run without any pays nothing.  A read
+# or write watch wraps the memory, a flag for each 256 byte page saying
+# whether to look further, and any watch replaces step() on the instance
+# with one checking around MPU's.
+#
+# * Executing watches and breakpoints stop before the instruction, and
+#   run() starts again from it without stopping there a second time.  Read
+#   and write watches and conditions stop after the instruction.
+# * Conditions are Python expressions of the MPU's attributes (a, x, y,
+#   sp, dbr, dpr, p, MS ...) and e for the emulation mode flag.  condition()
+#   stops when one goes from false to true.
+# * A hit raises Break out of step(), Watcher.run() catches it.
+# * Replace step (setCycleAccurate(), a BusTrace) before adding watches and
+#   restore it after removing them.
+
+RUN_BREAK = 'break' # a watch or breakpoint hit, see Watcher.hit
+
+PAGES = 0x10000 # 256 byte pages in 24 bits
+
+
+class Break(Exception):
+    pass
+
+
+class Registers:
+    # the names a condition can use
+    def __init__(self, mpu):
+        self.mpu = mpu
+
+    def __getitem__(self, name):
+        if name == 'e':
+            return self.mpu.mode
+        try:
+            return getattr(self.mpu, name)
+        except AttributeError:
+            raise KeyError(name)
+
+
+class WatchedMemory:
+    # wraps the mpu's memory while reads or writes are watched
+    def __init__(self, subject, watcher):
+        self.subject = subject
+        self.watcher = watcher
+        self.readPages = bytearray(PAGES)
+        self.writePages = bytearray(PAGES)
+
+    def __len__(self):
+        return len(self.subject)
+
+    def __getitem__(self, address):
+        if type(address) is int and self.readPages[address >> 8]:
+            self.watcher.access('r', address)
+        return self.subject[address]
+
+    def __setitem__(self, address, value):
+        self.subject[address] = value
+        if type(address) is int and self.writePages[address >> 8]:
+            self.watcher.access('w', address)
+
+
+class Watcher:
+    def __init__(self, mpu):
+        self.mpu = mpu
+        self.watches = {} # id: (kind, start, end)
+        self.breakpoints = {} # id: (address, condition, code)
+        self.conditions = {} # id: [condition, code, last value]
+        self.nextId = 1
+        self.hit = None # (kind, address or condition, instruction address)
+        self.pending = None # a read or write hit, stopping after the instruction
+        self.resuming = False # step over an executing stop once
+        self.memory = None
+        self.step = None # the step() replaced, installed while watching
+        self.replaced = None # the instance's own step, if it had one
+        self.at = 0 # the address of the instruction being run
+
+    def watch(self, start, end, kinds='w'):
+        # stop on reading (r), writing (w) or executing (x) addresses from
+        # start up to end, returns the id to remove() it with
+        ids = []
+        for kind in kinds:
+            if kind not in 'rwx':
+                raise ValueError('watch kind %r, not r, w or x' % kind)
+        for kind in kinds:
+            ids.append(self.add(self.watches, (kind, start, end)))
+        return ids[0] if len(ids) == 1 else tuple(ids)
+
+    def breakpoint(self, address, condition=None):
+        # stop on reaching the 24 bit address with condition true
+        code = compile(condition, '<breakpoint>', 'eval') if condition else None
+        return self.add(self.breakpoints, (address, condition, code))
+
+    def condition(self, condition):
+        # stop when condition becomes true
+        code = compile(condition, '<condition>', 'eval')
+        return self.add(self.conditions,
+                        [condition, code, bool(eval(code, {}, Registers(self.mpu)))])
+
+    def remove(self, ids):
+        if isinstance(ids, int):
+            ids = (ids,)
+        for i in ids:
+            for table in (self.watches, self.breakpoints, self.conditions):
+                table.pop(i, None)
+        self.install()
+
+    def clear(self):
+        self.remove(list(self.watches) + list(self.breakpoints) + list(self.conditions))
+
+    def run(self, cycles=None, count=None, resume=True):
+        # mpu.run() stopping on a hit with RUN_BREAK, resume to step over an
+        # executing stop at the first instruction
+        self.hit = None
+        self.resuming = resume
+        try:
+            return self.mpu.run(cycles, count)
+        except Break:
+            return RUN_BREAK
+
+    # installing
+
+    def add(self, table, entry):
+        i = self.nextId
+        self.nextId += 1
+        table[i] = entry
+        self.install()
+        return i
+
+    def install(self):
+        # the memory wrapper and step() for the watches there are
+        mpu = self.mpu
+        accesses = [watch for watch in self.watches.values() if watch[0] in 'rw']
+        if accesses:
+            if self.memory is None:
+                self.memory = WatchedMemory(mpu.memory, self)
+                mpu.memory = self.memory
+            pages = {'r': bytearray(PAGES), 'w': bytearray(PAGES)}
+            for kind, start, end in accesses:
+                for page in range(start >> 8, ((end - 1) >> 8) + 1):
+                    pages[kind][page] = 1
+            self.memory.readPages = pages['r']
+            self.memory.writePages = pages['w']
+        elif self.memory is not None:
+            mpu.memory = self.memory.subject
+            self.memory = None
+
+        watching = self.watches or self.breakpoints or self.conditions
+        if watching and self.step is None:
+            self.replaced = vars(mpu).get('step')
+            self.step = mpu.step
+            mpu.step = self.stepWatched
+        elif not watching and self.step is not None:
+            if self.replaced is None:
+                del mpu.step
+            else:
+                mpu.step = self.replaced
+            self.step = None
+            self.replaced = None
+
+    # watching
+
+    def access(self, kind, address):
+        if self.pending is None:
+            for watchKind, start, end in self.watches.values():
+                if watchKind == kind and start <= address < end:
+                    self.pending = (kind, address, self.at)
+                    return
+
+    def stepWatched(self):
+        mpu = self.mpu
+        self.at = at = (mpu.pbr << 16) + mpu.pc
+        if self.resuming:
+            self.resuming = False
+        elif not mpu.waiting:
+            self.executing(at)
+        self.pending = None
+        self.step()
+        if self.pending is not None:
+            self.stop(self.pending)
+        if self.conditions:
+            registers = Registers(mpu)
+            hit = None
+            for entry in self.conditions.values():
+                value = bool(eval(entry[1], {}, registers))
+                if value and not entry[2] and hit is None:
+                    hit = ('c', entry[0], at)
+                entry[2] = value
+            if hit is not None:
+                self.stop(hit)
+        return mpu
+
+    def executing(self, at):
+        for kind, start, end in self.watches.values():
+            if kind == 'x' and start <= at < end:
+                self.stop(('x', at, at))
+        for address, condition, code in self.breakpoints.values():
+            if address == at and (code is None or eval(code, {}, Registers(self.mpu))):
+                self.stop(('b', address, at))
+
+    def stop(self, hit):
+        self.hit = hit
+        raise Break(hit)